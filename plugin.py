@@ -5,8 +5,21 @@ import random
 import re
 import asyncio
 import aiohttp
+import contextvars
+import copy
+import functools
 import base64
-from typing import List, Tuple, Type, Optional
+import hashlib
+import mmap
+import struct
+import threading
+import time
+import tracemalloc
+import logging
+from logging.handlers import RotatingFileHandler
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, List, Tuple, Type, Optional
 from datetime import datetime
 from PIL import Image, ImageDraw, ImageFont, ImageFilter
 from src.plugin_system import (
@@ -24,6 +37,1499 @@ TEMP_IMAGES_DIR = os.path.join(DATA_DIR, "temp_images")
 
 game_states = {}
 
+# 各群组正在后台构建规则网络的任务，游戏结束或被替换时取消
+rule_network_tasks = {}
+
+# 各群组正在后台生成提示库的任务，规则变化时以新任务替换
+hint_bank_tasks = {}
+
+# 回合模式下各群组正在收集的行动：{"actions": {user_id: (user_name, action)}, "timer": 结算计时任务}
+action_rounds = {}
+
+# 各群组后台的通关条件检查：{"task": 检查任务, "pending": 检查期间是否再次被触发}
+clear_checks = {}
+
+# 地点图的最短路径表 {地点图摘要: {"distance", "next_hop"}}，只保存在内存中，不写入存档
+location_routes = {}
+
+# 各LLM调用点的提示词长度预算（字符数），按后期游戏状态（多名玩家、长历史记录）估算。
+# 提示词超出预算时会输出警告并计入统计，用于及时发现提示词膨胀。
+PROMPT_BUDGETS = {
+    "step1": 1000,
+    "step2": 1500,
+    "step3": 4000,
+    "rule_network": 2500,
+    "hint": 2000,
+    "hint_bank": 3000,
+    "mutation_eval": 4000,
+    "mutation_gen": 3000,
+    "identity": 2500,
+    "identity_rules": 2500,
+    "judge_single": 7000,
+    "judge_multi": 6000,
+    "judge_world": 6000,
+    "judge_perspective": 1500,
+    "judge_fast": 2500,
+    "collab": 3000,
+    "clear_check": 3000,
+    "ending": 6000,
+    "combined": 6000,
+}
+
+# 各调用点的提示词长度统计：{call_site: {"count", "last_chars", "max_chars", "last_tokens", "max_tokens", "over_budget"}}
+prompt_size_stats = {}
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算文本的token数（中文字符按1个token计，其余字符按4个字符1个token计）"""
+    cjk_count = len(re.findall(r'[\u3000-\u303f\u4e00-\u9fff\uff00-\uffef]', text))
+    return cjk_count + (len(text) - cjk_count + 3) // 4
+
+
+def extract_completed_json_field(text: str, key: str):
+    """从尚未接收完整的JSON文本中提取某个字段的值，该字段的值已完整出现时返回解析结果，否则返回None"""
+    match = re.search(r'"' + re.escape(key) + r'"\s*:\s*', text)
+    if not match:
+        return None
+
+    start = match.end()
+    if start >= len(text) or text[start] not in '{["':
+        return None
+
+    depth = 0
+    in_string = False
+    escaped = False
+    for index in range(start, len(text)):
+        char = text[index]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+                if depth == 0:
+                    end = index + 1
+                    break
+        elif char == '"':
+            in_string = True
+        elif char in "{[":
+            depth += 1
+        elif char in "}]":
+            depth -= 1
+            if depth == 0:
+                end = index + 1
+                break
+    else:
+        return None
+
+    try:
+        return json.loads(text[start:end])
+    except json.JSONDecodeError:
+        return None
+
+
+def record_prompt_size(call_site: str, prompt: str) -> dict:
+    """记录调用点的提示词长度，并返回本次长度及是否超出预算"""
+    chars = len(prompt)
+    tokens = estimate_tokens(prompt)
+    budget = PROMPT_BUDGETS.get(call_site)
+    over_budget = budget is not None and chars > budget
+
+    stats = prompt_size_stats.setdefault(call_site, {
+        "count": 0,
+        "last_chars": 0,
+        "max_chars": 0,
+        "last_tokens": 0,
+        "max_tokens": 0,
+        "over_budget": 0
+    })
+    stats["count"] += 1
+    stats["last_chars"] = chars
+    stats["max_chars"] = max(stats["max_chars"], chars)
+    stats["last_tokens"] = tokens
+    stats["max_tokens"] = max(stats["max_tokens"], tokens)
+    if over_budget:
+        stats["over_budget"] += 1
+
+    return {"chars": chars, "tokens": tokens, "budget": budget, "over_budget": over_budget}
+
+
+# game_states 中会随游戏进行持续增长的结构：结构名称 -> 从单个游戏状态中取出该结构的函数
+TRACKED_STATE_STRUCTURES = {
+    "random_events": lambda state: state.get("random_events", []),
+    "environmental_events": lambda state: state.get("environmental_events", []),
+    "time_based_events": lambda state: state.get("environment_memory", {}).get("time_based_events", []),
+    "visited_locations": lambda state: state.get("environment_memory", {}).get("visited_locations", []),
+    "interacted_objects": lambda state: state.get("environment_memory", {}).get("interacted_objects", []),
+    "action_image_paths": lambda state: state.get("action_image_paths", []),
+    "rule_mutations": lambda state: state.get("rule_mutations", []),
+    "identity_changes": lambda state: state.get("identity_changes", []),
+    "collaborative_events": lambda state: state.get("collaborative_events", []),
+    "action_history": lambda state: [a for p in state.get("players", {}).values() for a in p.get("action_history", [])],
+    "reasoning_history": lambda state: [r for p in state.get("players", {}).values() for r in p.get("reasoning_history", [])],
+}
+
+
+class StateFootprintSampler:
+    """按结构统计指定群组游戏状态的占用并记录相对该局首次采样的增长，可选地使用 tracemalloc 追踪内存分配"""
+
+    def __init__(self, max_samples: int = 100):
+        self.samples = deque(maxlen=max_samples)
+        self.action_count = 0
+        self.baselines = {}
+        self.tracemalloc_baseline = None
+
+    @staticmethod
+    def measure_state(state: dict) -> dict:
+        """统计单个群组的游戏状态中各结构的条目数与序列化字节数"""
+        footprint = {
+            "game_state": {
+                "count": 1,
+                "bytes": len(json.dumps(state, ensure_ascii=False, default=str).encode("utf-8"))
+            }
+        }
+        for name, getter in TRACKED_STATE_STRUCTURES.items():
+            items = getter(state)
+            footprint[name] = {
+                "count": len(items),
+                "bytes": len(json.dumps(items, ensure_ascii=False, default=str).encode("utf-8"))
+            }
+        return footprint
+
+    def sample(self, group_ids: List[str], use_tracemalloc: bool = False) -> dict:
+        """只统计给定群组，返回各结构的当前占用、相对各局首次采样的增长以及 tracemalloc 增长最多的分配位置"""
+        footprint = {}
+        growth = {}
+        for group_id in group_ids:
+            state = game_states.get(group_id)
+            if not isinstance(state, dict):
+                continue
+            current = self.measure_state(state)
+            # 同一群组开始新的一局时重新记录基线
+            seed, baseline = self.baselines.get(group_id, (None, None))
+            if baseline is None or seed != state.get("rng_seed"):
+                baseline = current
+                self.baselines[group_id] = (state.get("rng_seed"), baseline)
+            for name, value in current.items():
+                total = footprint.setdefault(name, {"count": 0, "bytes": 0})
+                total["count"] += value["count"]
+                total["bytes"] += value["bytes"]
+                diff = growth.setdefault(name, {"count": 0, "bytes": 0})
+                diff["count"] += value["count"] - baseline[name]["count"]
+                diff["bytes"] += value["bytes"] - baseline[name]["bytes"]
+
+        traced_top = []
+        if use_tracemalloc:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            snapshot = tracemalloc.take_snapshot()
+            if self.tracemalloc_baseline is None:
+                self.tracemalloc_baseline = snapshot
+            else:
+                for stat in snapshot.compare_to(self.tracemalloc_baseline, "lineno")[:5]:
+                    traced_top.append({
+                        "location": str(stat.traceback),
+                        "size_diff": stat.size_diff,
+                        "count_diff": stat.count_diff
+                    })
+
+        sample = {
+            "time": datetime.now().isoformat(),
+            "action_count": self.action_count,
+            "groups": list(group_ids),
+            "footprint": footprint,
+            "growth": growth,
+            "traced_top": traced_top
+        }
+        self.samples.append(sample)
+        return sample
+
+    @staticmethod
+    def format_report(sample: dict) -> str:
+        """将一次采样格式化为按结构列出的增长报告"""
+        lines = [f"内存采样（第{sample['action_count']}次行动，{len(sample['groups'])}个群组）："]
+        for name, current in sample["footprint"].items():
+            growth = sample["growth"].get(name, {})
+            lines.append(
+                f"  {name}: {current['count']}项/{current['bytes']}字节 "
+                f"(增长 {growth.get('count', 0):+d}项/{growth.get('bytes', 0):+d}字节)"
+            )
+        for stat in sample["traced_top"]:
+            lines.append(f"  tracemalloc {stat['location']}: {stat['size_diff']:+d}字节/{stat['count_diff']:+d}块")
+        return "\n".join(lines)
+
+
+state_footprint_sampler = StateFootprintSampler()
+
+
+# 延迟直方图的桶上界（秒），最后一个桶收纳所有更长的调用
+LLM_LATENCY_BUCKETS = [1, 2, 5, 10, 20, 30, 60, 120]
+
+# 限制同时进行的LLM请求数的信号量，首次调用时按配置创建
+llm_semaphore = None
+
+
+def get_llm_semaphore(max_concurrency: int) -> asyncio.Semaphore:
+    """获取全局LLM请求信号量"""
+    global llm_semaphore
+    if llm_semaphore is None:
+        llm_semaphore = asyncio.Semaphore(max(int(max_concurrency), 1))
+    return llm_semaphore
+
+
+class LLMTelemetry:
+    """按调用点记录LLM调用的耗时、排队时间、token用量、使用的模型、模型切换次数和JSON解析结果"""
+
+    def __init__(self, window_size: int = 200):
+        self.window_size = window_size
+        self.sites = {}
+        self.in_flight = {}
+        self._next_call_id = 0
+        self._file_logger = None
+        self._calls_since_flush = 0
+        self.flush_interval = 20
+        self.last_activity = time.perf_counter()
+
+    def configure_file(self, log_dir: str, max_bytes: int, backup_count: int) -> None:
+        """配置写入遥测记录的滚动日志文件，只在首次调用时生效"""
+        if self._file_logger is not None:
+            return
+        try:
+            os.makedirs(log_dir, exist_ok=True)
+            handler = RotatingFileHandler(
+                os.path.join(log_dir, "llm_calls.jsonl"),
+                maxBytes=max_bytes,
+                backupCount=backup_count,
+                encoding="utf-8"
+            )
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            file_logger = logging.getLogger("rule_horror.llm_telemetry")
+            file_logger.setLevel(logging.INFO)
+            file_logger.propagate = False
+            file_logger.addHandler(handler)
+            self._file_logger = file_logger
+        except Exception as e:
+            print(f"[规则怪谈] 初始化LLM遥测日志文件失败: {e}")
+
+    def _site(self, call_site: str) -> dict:
+        return self.sites.setdefault(call_site or "unknown", {
+            "calls": 0,
+            "failed": 0,
+            "failovers": 0,
+            "prompt_tokens": 0,
+            "completion_tokens": 0,
+            "parse_ok": 0,
+            "parse_failed": 0,
+            "models": {},
+            "latencies": deque(maxlen=self.window_size),
+            "queue_times": deque(maxlen=self.window_size)
+        })
+
+    def begin(self, call_site: str) -> int:
+        """登记一次进入排队的LLM调用，返回调用ID"""
+        self._next_call_id += 1
+        call_id = self._next_call_id
+        self.last_activity = time.perf_counter()
+        self.in_flight[call_id] = {
+            "call_site": call_site or "unknown",
+            "enqueued_at": time.perf_counter(),
+            "started_at": None,
+            "model": ""
+        }
+        return call_id
+
+    def mark_started(self, call_id: int) -> None:
+        """标记调用已离开队列、开始请求"""
+        call = self.in_flight.get(call_id)
+        if call:
+            call["started_at"] = time.perf_counter()
+
+    def mark_model(self, call_id: int, model: str) -> None:
+        """记录调用当前正在尝试的模型"""
+        call = self.in_flight.get(call_id)
+        if call:
+            call["model"] = model
+
+    def finish(self, call_id: int, model: str, attempts: int, usage: Optional[dict], success: bool) -> None:
+        """结束一次调用并更新该调用点的统计"""
+        call = self.in_flight.pop(call_id, None)
+        if not call:
+            return
+
+        now = time.perf_counter()
+        self.last_activity = now
+        started_at = call["started_at"] or now
+        queue_time = started_at - call["enqueued_at"]
+        latency = now - started_at
+        usage = usage if isinstance(usage, dict) else {}
+        prompt_tokens = usage.get("prompt_tokens", 0) or 0
+        completion_tokens = usage.get("completion_tokens", 0) or 0
+
+        site = self._site(call["call_site"])
+        site["calls"] += 1
+        if not success:
+            site["failed"] += 1
+        site["failovers"] += max(attempts - 1, 0)
+        site["prompt_tokens"] += prompt_tokens
+        site["completion_tokens"] += completion_tokens
+        if model:
+            site["models"][model] = site["models"].get(model, 0) + 1
+        site["latencies"].append(latency)
+        site["queue_times"].append(queue_time)
+
+        self._write({
+            "event": "call",
+            "time": datetime.now().isoformat(),
+            "call_site": call["call_site"],
+            "latency": round(latency, 3),
+            "queue_time": round(queue_time, 3),
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "model": model,
+            "failovers": max(attempts - 1, 0),
+            "success": success
+        })
+
+        self._calls_since_flush += 1
+        if self._calls_since_flush >= self.flush_interval:
+            self._calls_since_flush = 0
+            self._write({"event": "aggregate", "time": datetime.now().isoformat(), "sites": self.summary()})
+
+    def record_parse(self, call_site: str, success: bool) -> None:
+        """记录调用点返回内容的JSON解析结果"""
+        site = self._site(call_site)
+        if success:
+            site["parse_ok"] += 1
+        else:
+            site["parse_failed"] += 1
+        self._write({"event": "parse", "time": datetime.now().isoformat(), "call_site": call_site, "success": success})
+
+    def _write(self, record: dict) -> None:
+        if self._file_logger is None:
+            return
+        try:
+            self._file_logger.info(json.dumps(record, ensure_ascii=False))
+        except Exception as e:
+            print(f"[规则怪谈] 写入LLM遥测记录失败: {e}")
+
+    @staticmethod
+    def histogram(values) -> dict:
+        """按 LLM_LATENCY_BUCKETS 统计耗时分布"""
+        labels = [f"<={bound}s" for bound in LLM_LATENCY_BUCKETS] + [f">{LLM_LATENCY_BUCKETS[-1]}s"]
+        counts = dict.fromkeys(labels, 0)
+        for value in values:
+            for bound, label in zip(LLM_LATENCY_BUCKETS, labels):
+                if value <= bound:
+                    counts[label] += 1
+                    break
+            else:
+                counts[labels[-1]] += 1
+        return counts
+
+    def idle_for(self) -> float:
+        """返回没有LLM调用进行中的持续时间（秒），有调用进行中时返回0"""
+        if self.in_flight:
+            return 0.0
+        return time.perf_counter() - self.last_activity
+
+    def summary(self) -> dict:
+        """汇总各调用点在滚动窗口内的统计"""
+        result = {}
+        for call_site, site in self.sites.items():
+            latencies = sorted(site["latencies"])
+            queue_times = list(site["queue_times"])
+            parsed = site["parse_ok"] + site["parse_failed"]
+            result[call_site] = {
+                "calls": site["calls"],
+                "failed": site["failed"],
+                "failovers": site["failovers"],
+                "prompt_tokens": site["prompt_tokens"],
+                "completion_tokens": site["completion_tokens"],
+                "models": dict(site["models"]),
+                "parse_success_rate": round(site["parse_ok"] / parsed, 3) if parsed else None,
+                "latency_p50": round(latencies[len(latencies) // 2], 3) if latencies else None,
+                "latency_p95": round(latencies[min(int(len(latencies) * 0.95), len(latencies) - 1)], 3) if latencies else None,
+                "queue_time_avg": round(sum(queue_times) / len(queue_times), 3) if queue_times else None,
+                "latency_histogram": self.histogram(latencies)
+            }
+        return result
+
+
+llm_telemetry = LLMTelemetry()
+
+# 当前命令或后台任务所属游戏的随机种子，启用 replay.forward_seed 时作为 seed 参数转发给LLM API
+current_game_seed = contextvars.ContextVar("rule_horror_game_seed", default=None)
+
+
+class LLMRecorder:
+    """录制LLM返回的内容，回放模式下按调用点依次返回录制的内容而不请求API，配合每局游戏的随机种子可以完整重放一局游戏"""
+
+    def __init__(self):
+        self.mode = "off"
+        self.file_path = None
+        self.recordings = {}
+        self.positions = {}
+
+    @staticmethod
+    def prompt_digest(prompt: str) -> str:
+        return hashlib.sha1(prompt.encode("utf-8")).hexdigest()
+
+    def configure(self, mode: str, file_path: str) -> None:
+        """设置录制或回放模式，模式或文件变化时重新加载录制内容"""
+        if mode == self.mode and file_path == self.file_path:
+            return
+        self.mode = mode
+        self.file_path = file_path
+        self.recordings = {}
+        self.positions = {}
+        if mode != "replay":
+            return
+        try:
+            with open(file_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    if line.strip():
+                        record = json.loads(line)
+                        self.recordings.setdefault(record.get("call_site", ""), []).append(record)
+            print(f"[规则怪谈] 已加载LLM录制内容：{sum(len(records) for records in self.recordings.values())} 条")
+        except Exception as e:
+            print(f"[规则怪谈] 加载LLM录制内容失败: {e}")
+
+    def replay(self, call_site: str, prompt: str) -> str:
+        """返回该调用点中提示词相同的下一条录制内容（并发调用的录制顺序可能与回放顺序不同），
+        没有相同提示词时按顺序返回下一条，录制内容已用完时返回空字符串（按调用失败处理）"""
+        records = self.recordings.get(call_site, [])
+        used = self.positions.setdefault(call_site, set())
+        unused = [i for i in range(len(records)) if i not in used]
+        if not unused:
+            print(f"[规则怪谈] 回放时 {call_site} 没有更多录制内容")
+            return ""
+        digest = self.prompt_digest(prompt)
+        index = next((i for i in unused if records[i].get("prompt_sha1") == digest), None)
+        if index is None:
+            index = unused[0]
+            print(f"[规则怪谈] 回放的提示词与录制时不一致: {call_site} 第{index + 1}条录制内容")
+        used.add(index)
+        return records[index].get("response", "")
+
+    def record(self, call_site: str, prompt: str, response: str, seed: Optional[int]) -> None:
+        """追加一条录制内容"""
+        try:
+            os.makedirs(os.path.dirname(self.file_path), exist_ok=True)
+            with open(self.file_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps({
+                    "call_site": call_site,
+                    "seed": seed,
+                    "prompt_sha1": self.prompt_digest(prompt),
+                    "response": response
+                }, ensure_ascii=False) + "\n")
+        except Exception as e:
+            print(f"[规则怪谈] 写入LLM录制内容失败: {e}")
+
+
+llm_recorder = LLMRecorder()
+
+
+# 当前命令的追踪记录，随asyncio任务上下文传递，在命令内创建的子任务中同样可见
+current_trace = contextvars.ContextVar("rule_horror_trace", default=None)
+# 当前阶段的嵌套深度，每个并行的子任务各自维护，互不干扰
+current_span_depth = contextvars.ContextVar("rule_horror_span_depth", default=0)
+
+
+class CommandTracer:
+    """记录单条命令从 execute 到子处理函数、LLM调用、图片渲染、消息发送、存档的各阶段耗时"""
+
+    def __init__(self, max_slow_commands: int = 20, max_spans: int = 200):
+        self.slow_commands = deque(maxlen=max_slow_commands)
+        self.max_spans = max_spans
+
+    def start(self, action: str, group_id: str = ""):
+        """为当前命令创建追踪记录，返回用于恢复上下文的token"""
+        trace = {
+            "action": action,
+            "group_id": group_id,
+            "time": datetime.now().strftime("%H:%M:%S"),
+            "started_at": time.perf_counter(),
+            "spans": []
+        }
+        return current_trace.set(trace)
+
+    @contextmanager
+    def span(self, name: str):
+        """记录一个阶段的耗时，不在命令上下文中时不做任何记录"""
+        trace = current_trace.get()
+        if trace is None:
+            yield
+            return
+
+        depth = current_span_depth.get()
+        depth_token = current_span_depth.set(depth + 1)
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            current_span_depth.reset(depth_token)
+            if len(trace["spans"]) < self.max_spans:
+                trace["spans"].append({
+                    "name": name,
+                    "offset": started_at - trace["started_at"],
+                    "duration": time.perf_counter() - started_at,
+                    "depth": depth
+                })
+
+    def finish(self, token, slow_threshold: float) -> Optional[dict]:
+        """结束当前命令的追踪，耗时超过阈值时保存到慢命令列表"""
+        trace = current_trace.get()
+        current_trace.reset(token)
+        if trace is None:
+            return None
+
+        trace["total"] = time.perf_counter() - trace["started_at"]
+        trace["spans"].sort(key=lambda span: span["offset"])
+        if trace["total"] >= slow_threshold:
+            self.slow_commands.append(trace)
+        return trace
+
+    @staticmethod
+    def format_trace(trace: dict) -> str:
+        """将一条命令的追踪记录格式化为分阶段耗时文本"""
+        lines = [f"[{trace['time']}] /rg {trace['action']}（{trace['group_id']}）总耗时 {trace['total']:.2f}s"]
+        for span in trace["spans"]:
+            indent = "  " * (span["depth"] + 1)
+            lines.append(f"{indent}+{span['offset']:.2f}s {span['name']} {span['duration']:.2f}s")
+        return "\n".join(lines)
+
+
+command_tracer = CommandTracer()
+
+
+def traced(name: str):
+    """将函数的执行记录为当前命令追踪中的一个阶段"""
+    def decorator(func):
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with command_tracer.span(name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with command_tracer.span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class EventLoopLagMonitor:
+    """定时检测事件循环的调度延迟，延迟过高说明有同步操作阻塞了事件循环"""
+
+    def __init__(self, window_size: int = 120):
+        self.samples = deque(maxlen=window_size)
+        self.task = None
+
+    def ensure_started(self, interval: float) -> None:
+        """在当前事件循环中启动检测任务（已在运行时不重复启动）"""
+        if interval <= 0 or (self.task is not None and not self.task.done()):
+            return
+        self.task = asyncio.get_running_loop().create_task(self._run(interval))
+
+    async def _run(self, interval: float) -> None:
+        while True:
+            started_at = time.perf_counter()
+            await asyncio.sleep(interval)
+            self.samples.append(max(time.perf_counter() - started_at - interval, 0.0))
+
+    def summary(self) -> dict:
+        """返回最近一次、平均和最大的事件循环延迟（秒）"""
+        if not self.samples:
+            return {"last": None, "avg": None, "max": None, "samples": 0}
+        samples = list(self.samples)
+        return {
+            "last": round(samples[-1], 3),
+            "avg": round(sum(samples) / len(samples), 3),
+            "max": round(max(samples), 3),
+            "samples": len(samples)
+        }
+
+
+loop_lag_monitor = EventLoopLagMonitor()
+
+
+# 剧本生成的步骤及显示名称，规则网络在开局后于后台构建（见 rule_network_status）
+GENERATION_STAGES = ["step1", "step2", "step3"]
+GENERATION_STAGE_NAMES = {"step1": "剧情导入", "step2": "场景结构", "step3": "规则"}
+
+# 剧本池中各游戏模式对应的子目录名
+SCENARIO_POOL_MODES = {"单人": "single", "多人": "multi"}
+
+
+class ScenarioPool:
+    """按游戏模式在磁盘上保存预生成的完整剧本（剧情导入、场景结构、规则和规则网络）"""
+
+    def __init__(self):
+        self.refill_task = None
+        # 补充失败后在此时间（time.time()）之前不再启动补充
+        self.retry_after = 0.0
+
+    def _mode_dir(self, game_mode: str) -> str:
+        return os.path.join(DATA_DIR, "scenario_pool", SCENARIO_POOL_MODES.get(game_mode, "single"))
+
+    def count(self, game_mode: str) -> int:
+        """返回该模式下可用的剧本数量"""
+        mode_dir = self._mode_dir(game_mode)
+        if not os.path.exists(mode_dir):
+            return 0
+        return len([name for name in os.listdir(mode_dir) if name.endswith(".json")])
+
+    def put(self, game_mode: str, scenario: dict) -> str:
+        """保存一个剧本，先写入临时文件再重命名，避免取出不完整的剧本"""
+        mode_dir = self._mode_dir(game_mode)
+        os.makedirs(mode_dir, exist_ok=True)
+        file_name = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{random.randint(1000, 9999)}.json"
+        temp_path = os.path.join(mode_dir, file_name + ".tmp")
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(scenario, f, ensure_ascii=False, indent=2)
+        os.replace(temp_path, os.path.join(mode_dir, file_name))
+        return file_name
+
+    def pop(self, game_mode: str) -> Optional[dict]:
+        """取出最早生成的一个剧本，没有可用剧本时返回None"""
+        mode_dir = self._mode_dir(game_mode)
+        if not os.path.exists(mode_dir):
+            return None
+
+        for file_name in sorted(name for name in os.listdir(mode_dir) if name.endswith(".json")):
+            file_path = os.path.join(mode_dir, file_name)
+            claimed_path = file_path + ".claimed"
+            try:
+                os.replace(file_path, claimed_path)
+            except OSError:
+                continue
+
+            try:
+                with open(claimed_path, 'r', encoding='utf-8') as f:
+                    scenario = json.load(f)
+            except Exception as e:
+                print(f"[规则怪谈] 读取预生成剧本失败: {file_name}, {e}")
+                scenario = None
+            finally:
+                try:
+                    os.remove(claimed_path)
+                except OSError:
+                    pass
+
+            if isinstance(scenario, dict) and scenario.get("step3", {}).get("rules"):
+                return scenario
+        return None
+
+
+scenario_pool = ScenarioPool()
+
+
+# 每日挑战等共享剧本中只读的游戏状态字段，参与的群组引用同一份数据而不各自复制
+SHARED_SCENARIO_KEYS = (
+    "scene", "background", "player_identity", "core_symbols",
+    "building_type", "overall_layout", "floors", "connections", "special_areas",
+    "rules_title", "rules", "win_condition", "resolve_condition", "hidden_truth", "death_triggers",
+    "plot_image_path", "scene_structure_image_path", "rules_image_path"
+)
+
+# 已加载的共享剧本 {剧本ID: {"id", "scenario", "base"}}，以及防止同一剧本被重复生成的锁
+shared_scenarios = {}
+shared_scenario_locks = {}
+
+
+class SharedScenarioState(dict):
+    """引用共享剧本的游戏状态：自身只保存本群组的状态，缺少的只读字段从共享剧本读取。
+    规则变异等修改会直接写入自身，覆盖共享值而不影响其他群组；存档时只写入自身的字段"""
+
+    def __init__(self, shared: dict, own: dict):
+        super().__init__(own)
+        self.shared = shared
+
+    def __missing__(self, key):
+        return self.shared[key]
+
+    def __contains__(self, key):
+        return dict.__contains__(self, key) or key in self.shared
+
+    def get(self, key, default=None):
+        if dict.__contains__(self, key):
+            return dict.__getitem__(self, key)
+        return self.shared.get(key, default)
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+
+class ScenarioLibrary:
+    """本地剧本库：剧本依次追加到同一个打包文件中（每条记录为4字节长度加JSON），
+    索引文件保存每条记录的偏移量、长度以及建筑类型、游戏模式、规则数量和标签，读取时通过内存映射按偏移量取出"""
+
+    RECORD_HEADER = struct.Struct("<I")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._index = None
+
+    def _pack_path(self) -> str:
+        return os.path.join(DATA_DIR, "scenario_library", "scenarios.pack")
+
+    def _index_path(self) -> str:
+        return os.path.join(DATA_DIR, "scenario_library", "index.json")
+
+    @staticmethod
+    def digest(scenario: dict) -> str:
+        """按规则和隐藏真相计算剧本摘要，用于避免重复归档"""
+        step3_data = scenario.get("step3", {})
+        content = json.dumps([step3_data.get("rules", []), step3_data.get("hidden_truth", "")], ensure_ascii=False)
+        return hashlib.sha1(content.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def make_tags(scenario: dict) -> List[str]:
+        """从场景名称、建筑类型和核心象征符号中提取标签"""
+        step1_data = scenario.get("step1", {})
+        tags = [step1_data.get("scene", ""), scenario.get("step2", {}).get("building_type", "")]
+        for symbol in step1_data.get("core_symbols", []):
+            if isinstance(symbol, dict):
+                tags.append(symbol.get("symbol", ""))
+            elif isinstance(symbol, str):
+                tags.append(symbol)
+        return [tag for tag in dict.fromkeys(tags) if tag]
+
+    def _load_index(self) -> list:
+        if self._index is not None:
+            return self._index
+
+        index = None
+        if os.path.exists(self._index_path()):
+            try:
+                with open(self._index_path(), 'r', encoding='utf-8') as f:
+                    index = json.load(f).get("entries")
+            except Exception as e:
+                print(f"[规则怪谈] 读取剧本库索引失败，将从打包文件重建: {e}")
+        if not isinstance(index, list):
+            index = self._rebuild_index()
+        self._index = index
+        return index
+
+    def _rebuild_index(self) -> list:
+        """顺序扫描打包文件重建索引，末尾不完整的记录会被忽略"""
+        entries = []
+        if not os.path.exists(self._pack_path()) or os.path.getsize(self._pack_path()) == 0:
+            return entries
+
+        with open(self._pack_path(), 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            offset = 0
+            while offset + self.RECORD_HEADER.size <= len(mm):
+                (length,) = self.RECORD_HEADER.unpack_from(mm, offset)
+                start = offset + self.RECORD_HEADER.size
+                if start + length > len(mm):
+                    break
+                try:
+                    scenario = json.loads(mm[start:start + length].decode("utf-8"))
+                except Exception:
+                    break
+                entries.append(self._make_entry(scenario, start, length))
+                offset = start + length
+        return entries
+
+    def _make_entry(self, scenario: dict, offset: int, length: int) -> dict:
+        return {
+            "offset": offset,
+            "length": length,
+            "digest": self.digest(scenario),
+            "game_mode": scenario.get("game_mode", "单人"),
+            "building_type": scenario.get("step2", {}).get("building_type", ""),
+            "rule_count": len(scenario.get("step3", {}).get("rules", [])),
+            "tags": self.make_tags(scenario),
+            "created_at": scenario.get("created_at", "")
+        }
+
+    def add(self, scenario: dict) -> bool:
+        """归档一个剧本，已存在相同剧本时跳过，返回是否写入"""
+        with self._lock:
+            index = self._load_index()
+            digest = self.digest(scenario)
+            if any(entry.get("digest") == digest for entry in index):
+                return False
+
+            os.makedirs(os.path.dirname(self._pack_path()), exist_ok=True)
+            data = json.dumps(scenario, ensure_ascii=False).encode("utf-8")
+            with open(self._pack_path(), 'ab') as f:
+                # 截断上次写入失败留下的不完整记录，保证新记录紧跟在最后一条完整记录之后
+                end = index[-1]["offset"] + index[-1]["length"] if index else 0
+                f.truncate(end)
+                f.seek(end)
+                f.write(self.RECORD_HEADER.pack(len(data)))
+                f.write(data)
+            index.append(self._make_entry(scenario, end + self.RECORD_HEADER.size, len(data)))
+
+            temp_path = self._index_path() + ".tmp"
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump({"entries": index}, f, ensure_ascii=False)
+            os.replace(temp_path, self._index_path())
+            return True
+
+    def find(self, game_mode: Optional[str] = None, tag: Optional[str] = None, building_type: Optional[str] = None,
+             min_rules: Optional[int] = None, max_rules: Optional[int] = None) -> List[dict]:
+        """按游戏模式、标签（部分匹配）、建筑类型和规则数量查询索引"""
+        with self._lock:
+            index = list(self._load_index())
+
+        results = []
+        for entry in index:
+            if game_mode and entry.get("game_mode") != game_mode:
+                continue
+            if tag and not any(tag in entry_tag for entry_tag in entry.get("tags", [])):
+                continue
+            if building_type and entry.get("building_type") != building_type:
+                continue
+            if min_rules is not None and entry.get("rule_count", 0) < min_rules:
+                continue
+            if max_rules is not None and entry.get("rule_count", 0) > max_rules:
+                continue
+            results.append(entry)
+        return results
+
+    def read(self, entry: dict) -> Optional[dict]:
+        """按索引项的偏移量从打包文件中读取剧本"""
+        try:
+            with open(self._pack_path(), 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                return json.loads(mm[entry["offset"]:entry["offset"] + entry["length"]].decode("utf-8"))
+        except Exception as e:
+            print(f"[规则怪谈] 读取剧本库记录失败: {e}")
+            return None
+
+    def tag_counts(self, game_mode: Optional[str] = None) -> List[Tuple[str, int]]:
+        """统计各标签的剧本数量，按数量从多到少排序"""
+        counts = {}
+        for entry in self.find(game_mode=game_mode):
+            for entry_tag in entry.get("tags", []):
+                counts[entry_tag] = counts.get(entry_tag, 0) + 1
+        return sorted(counts.items(), key=lambda item: -item[1])
+
+
+scenario_library = ScenarioLibrary()
+
+
+# 不修改游戏状态的命令，不进入群组命令队列
+READ_ONLY_ACTIONS = ("状态", "规则", "场景", "剧情", "存档列表", "性能", "帮助")
+# 只读命令显示的字段，命令执行期间的快照只复制这些字段
+SNAPSHOT_KEYS = (
+    "scene", "background", "player_identity", "building_type", "overall_layout", "floors", "connections", "special_areas",
+    "rules_title", "rules", "win_condition", "hints_used", "max_hints", "max_players", "game_active", "game_mode",
+    "environment", "time_system", "rng_seed"
+)
+SNAPSHOT_PLAYER_KEYS = ("name", "is_alive", "physical_status", "mental_status", "location", "inventory")
+# 状态中显示推理和行动次数，历史记录由字符串组成，浅复制即可
+SNAPSHOT_HISTORY_KEYS = ("reasoning_history", "action_history")
+
+
+class GroupCommandExecutor:
+    """按群组串行执行会修改游戏状态的命令：同一群组的命令按到达顺序依次执行，等待的命令过多时直接拒绝。
+    命令执行期间保留该命令开始前的游戏状态快照，只读命令无需排队即可读到一致的状态"""
+
+    def __init__(self):
+        self._locks = {}
+        self._pending = {}
+        self._snapshots = {}
+
+    def is_busy(self, group_id: str, max_pending: int) -> bool:
+        """执行中和排队中的命令数量是否已达到上限，0表示不限制"""
+        return bool(max_pending) and self._pending.get(group_id, 0) >= max_pending
+
+    def snapshot(self, group_id: str) -> Optional[dict]:
+        """正在执行的命令开始前的游戏状态，没有命令在执行时返回None"""
+        return self._snapshots.get(group_id)
+
+    @staticmethod
+    def _copy_state(game_state: dict) -> dict:
+        """只复制只读命令显示的字段，历史记录、环境记忆和各种索引不进入快照"""
+        snapshot = {key: copy.deepcopy(game_state[key]) for key in SNAPSHOT_KEYS if key in game_state}
+        snapshot["players"] = {}
+        for pid, p_data in game_state.get("players", {}).items():
+            player = {key: copy.deepcopy(p_data[key]) for key in SNAPSHOT_PLAYER_KEYS if key in p_data}
+            player.update({key: list(p_data[key]) for key in SNAPSHOT_HISTORY_KEYS if key in p_data})
+            snapshot["players"][pid] = player
+        return snapshot
+
+    async def run(self, group_id: str, func: Callable):
+        """等待该群组之前的命令执行完毕后执行func"""
+        self._pending[group_id] = self._pending.get(group_id, 0) + 1
+        lock = self._locks.setdefault(group_id, asyncio.Lock())
+        try:
+            with command_tracer.span("queue_wait"):
+                await lock.acquire()
+            try:
+                game_state = game_states.get(group_id)
+                if game_state:
+                    self._snapshots[group_id] = self._copy_state(game_state)
+                return await func()
+            finally:
+                self._snapshots.pop(group_id, None)
+                lock.release()
+        finally:
+            self._pending[group_id] -= 1
+            if not self._pending[group_id]:
+                self._pending.pop(group_id, None)
+                self._locks.pop(group_id, None)
+
+
+command_executor = GroupCommandExecutor()
+
+
+class DeathTriggerIndex:
+    """死亡触发条件和规则的本地预筛索引：从条件文本中提取动作及其作用的物品、地点和时间条件，
+    行动判定前先在本地匹配，命中的条件作为提示交给裁判"""
+
+    # 索引结构变化时递增，使存档中旧结构的索引自动重建
+    VERSION = 2
+    # 动作类别及其常见说法（至少两个字），条件和行动描述中出现任意一种说法即视为同一动作
+    VERB_GROUPS = {
+        "进入": ("进入", "走进", "进去", "闯入", "踏入", "前往"),
+        "离开": ("离开", "走出", "出去", "逃离"),
+        "打开": ("打开", "推开", "拉开", "开启", "开门"),
+        "回应": ("回应", "回答", "答应", "应答", "回话", "理会"),
+        "回头": ("回头", "转身", "回望"),
+        "注视": ("注视", "直视", "盯着", "凝视", "看向", "看到", "看见", "照镜子"),
+        "触摸": ("触摸", "触碰"),
+        "拿取": ("拿起", "拿走", "捡起", "拾起", "带走"),
+        "使用": ("使用",),
+        "食用": ("食用", "饮用", "进食", "吞下"),
+        "发声": ("说话", "出声", "呼喊", "尖叫"),
+        "奔跑": ("奔跑",),
+        "停下": ("停下", "停止", "站住"),
+        "聆听": ("听到", "听见", "聆听"),
+        "开灯": ("开灯", "点灯"),
+        "关灯": ("关灯", "熄灯"),
+        "睡觉": ("睡觉", "入睡", "闭眼"),
+        "破坏": ("破坏", "打碎", "点燃")
+    }
+    # 单字动词单独出现时含义太宽（“看看背包”“过去”），只有后面紧跟动态助词、补语或“任何”等限定词时才算作动作
+    SINGLE_VERBS = {
+        "吃": "食用", "喝": "食用", "看": "注视", "照": "注视", "摸": "触摸", "碰": "触摸",
+        "拿": "拿取", "捡": "拿取", "喊": "发声", "唱": "发声", "跑": "奔跑", "听": "聆听",
+        "睡": "睡觉", "砸": "破坏", "撕": "破坏", "烧": "破坏"
+    }
+    SINGLE_VERB_PATTERN = re.compile(f"([{''.join(SINGLE_VERBS)}])(?=了|过|下|掉|完|着|一|任何|所有|别人)")
+    # 动宾式说法中隐含的物品
+    COMPOUND_OBJECTS = {"照镜子": "镜子", "开门": "门", "开灯": "灯", "点灯": "灯", "关灯": "灯", "熄灯": "灯"}
+    # 泛指的物品：条件只说“食物”“东西”时，动作一致即视为命中
+    GENERIC_OBJECTS = ("食物", "食品", "饮料", "东西", "物品", "任何东西")
+    # 物品短语在这些词处结束，之后是条件的限定部分
+    OBJECT_STOPS = re.compile(r"时|后|前|才|就|不|没|超过|之|再|必须|立即|马上|并|或|和|且|直到|以")
+    OBJECT_PREFIXES = re.compile(r"^(?:了|下|掉|过|完|着|一口|一下|一眼|一次|任何|所有|一切|这个|那个|这|那)+")
+    TIME_LABELS = ("深夜", "午夜", "凌晨", "黎明")
+    TIME_PATTERN = re.compile(r"\d{1,2}[:：点]\d{0,2}分?(?:之后|以后|之前|以前|后|前)")
+    PLACE_PATTERN = re.compile(r"\d+号[\u4e00-\u9fa5]{1,3}|(?:地下)?[一二三四五六七八九十\d]+[层楼]")
+    FILLERS = ("任何", "所有", "一切", "这个", "那个", "自己", "时候", "必须", "禁止", "不要", "不能", "严禁", "立即")
+
+    @classmethod
+    def signature(cls, game_state: dict) -> str:
+        sources = [cls.VERSION, game_state.get("death_triggers", []), game_state.get("rules", []), game_state.get("pending_rules", [])]
+        return hashlib.sha1(json.dumps(sources, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def known_locations(game_state: dict) -> List[str]:
+        """场景结构中出现的所有地点名称，长的在前以便优先匹配"""
+        names = set()
+        for floor in game_state.get("floors", []):
+            if isinstance(floor, dict):
+                names.add(str(floor.get("floor", "")))
+                names.update(str(area) for area in floor.get("areas", []))
+        names.update(str(area) for area in game_state.get("special_areas", []))
+        names.update(str(connection) for connection in game_state.get("connections", []))
+        return sorted((name for name in names if len(name) >= 2), key=len, reverse=True)
+
+    @classmethod
+    def find_verbs(cls, text: str) -> List[Tuple[str, str, int, int]]:
+        """找出文本中的动作说法，返回 (动作类别, 说法, 起点, 终点)，长的说法优先，互不重叠"""
+        found = []
+        candidates = [(word, group) for group, words in cls.VERB_GROUPS.items() for word in words]
+        for word, group in sorted(candidates, key=lambda item: len(item[0]), reverse=True):
+            for match in re.finditer(re.escape(word), text):
+                if not any(start < match.end() and match.start() < end for _, _, start, end in found):
+                    found.append((group, word, match.start(), match.end()))
+        for match in cls.SINGLE_VERB_PATTERN.finditer(text):
+            if not any(start < match.end() and match.start() < end for _, _, start, end in found):
+                found.append((cls.SINGLE_VERBS[match.group(1)], match.group(1), match.start(), match.end()))
+        return sorted(found, key=lambda item: item[2])
+
+    @classmethod
+    def object_head(cls, phrase: str) -> str:
+        """取动作后物品短语的中心词：去掉量词和限定词，在条件的限定部分处截断，取最后一个“的”之后的部分"""
+        phrase = cls.OBJECT_PREFIXES.sub("", phrase)
+        phrase = cls.OBJECT_STOPS.split(phrase)[0]
+        return phrase.rsplit("的", 1)[-1]
+
+    @classmethod
+    def extract(cls, text: str, source: str, locations: List[str]) -> dict:
+        """从一条条件文本中提取动作及其作用的物品、地点和时间条件"""
+        places = [name for name in locations if name in text]
+        places += [place for place in cls.PLACE_PATTERN.findall(text) if not any(place in name for name in places)]
+
+        verbs = cls.find_verbs(text)
+        pairs = []
+        for index, (group, word, _, end) in enumerate(verbs):
+            next_start = verbs[index + 1][2] if index + 1 < len(verbs) else len(text)
+            target = cls.COMPOUND_OBJECTS.get(word) or cls.object_head(re.split(r"[，。；、,.;！!？?\s]", text[end:next_start])[0])
+            if any(target in place or place in target for place in places):
+                target = ""
+            pairs.append([group, target])
+
+        objects = [target for _, target in pairs if target]
+        objects += [quoted for quoted in re.findall(r"[“「\"\'](.{1,10}?)[”」\"\']", text) if quoted not in objects]
+
+        return {
+            "source": source,
+            "text": text,
+            "verbs": list(dict.fromkeys(group for group, _ in pairs)),
+            "pairs": pairs,
+            "locations": places,
+            "objects": list(dict.fromkeys(objects)),
+            "time": cls.TIME_PATTERN.findall(text) + [label for label in cls.TIME_LABELS if label in text]
+        }
+
+    @classmethod
+    def build(cls, game_state: dict) -> dict:
+        """为当前的死亡触发条件、规则和待发现规则建立索引"""
+        locations = cls.known_locations(game_state)
+        entries = []
+        for source, key in (("死亡触发条件", "death_triggers"), ("规则", "rules"), ("待发现规则", "pending_rules")):
+            for text in game_state.get(key, []):
+                entry = cls.extract(str(text), source, locations)
+                if entry["verbs"] or entry["locations"] or entry["objects"]:
+                    entries.append(entry)
+        return {"signature": cls.signature(game_state), "entries": entries}
+
+    @classmethod
+    def _mentions(cls, target: str, action: str) -> bool:
+        """行动是否提到了物品：完整出现，或出现其最后两个字（“绿色灯光”对“灯光”）"""
+        return target in action or (len(target) > 2 and target[-2:] in action)
+
+    @classmethod
+    def match(cls, index: dict, action: str, player_location: str = "") -> List[dict]:
+        """找出行动可能触犯的条件：动作一致且作用于条件中的物品（泛指的物品只看动作），或者行动提到了条件中的地点、
+        明确的物品；条件限定了地点时，只有动作一致而没有提到物品的行动须正身处该地点"""
+        action_verbs = {group for group, _, _, _ in cls.find_verbs(action)}
+        matches = []
+        for entry in index.get("entries", []):
+            verbs = []
+            objects = []
+            for group, target in entry["pairs"]:
+                if group not in action_verbs:
+                    continue
+                if not target or target in cls.GENERIC_OBJECTS:
+                    verbs.append(group)
+                elif cls._mentions(target, action):
+                    verbs.append(group)
+                    objects.append(target)
+            objects += [target for target in entry["objects"] if len(target) >= 2 and target not in cls.GENERIC_OBJECTS and target in action and target not in objects]
+            mentioned = [place for place in entry["locations"] if place in action]
+            here = [place for place in entry["locations"] if player_location and (place in player_location or player_location in place)]
+            places = mentioned + [place for place in here if place not in mentioned]
+            hit = bool(objects) or bool(mentioned) or (bool(verbs) and (bool(here) or not entry["locations"]))
+            if hit:
+                matches.append({"source": entry["source"], "text": entry["text"], "verbs": list(dict.fromkeys(verbs)), "locations": places, "objects": objects, "time": entry["time"]})
+        return matches
+
+
+class LocationGraph:
+    """由场景结构编译出的地点图：楼层、区域、连接通道、特殊区域和入口作为节点，区域以“楼层+区域”命名，
+    同层区域经楼层相连，连接通道连通各楼层，特殊区域经连接通道到达；存档只保存地点和连接，最短路径表在内存中按需计算"""
+
+    VERSION = 2
+    ENTRANCE = "入口"
+    MOVE_WORDS = ("进入", "走进", "前往", "去", "回到", "来到", "走向", "跑向", "上到", "下到", "到达", "离开")
+    PRONOUNS = ("我们", "我", "自己")
+    ROUTE_CACHE_SIZE = 32
+
+    @classmethod
+    def signature(cls, game_state: dict) -> str:
+        sources = [cls.VERSION, game_state.get("floors", []), game_state.get("connections", []), game_state.get("special_areas", [])]
+        return hashlib.sha1(json.dumps(sources, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def area_node(floor_name: str, area: str) -> str:
+        """区域的地点名：不同楼层的同名区域（如两层楼的“走廊”）是不同的地点"""
+        return area if area.startswith(floor_name) else f"{floor_name}{area}"
+
+    @classmethod
+    def build(cls, game_state: dict) -> dict:
+        graph = {"signature": cls.signature(game_state), "nodes": {}, "edges": {}}
+        floor_names = []
+        for floor in game_state.get("floors", []):
+            if not isinstance(floor, dict) or not floor.get("floor"):
+                continue
+            floor_name = str(floor["floor"])
+            floor_names.append(floor_name)
+            cls._add_node(graph, floor_name, "floor", floor_name)
+            for area in floor.get("areas", []):
+                area = str(area)
+                node = cls.area_node(floor_name, area)
+                cls._add_node(graph, node, "area", floor_name, area[len(floor_name):] if node == area else area)
+                cls._link(graph, node, floor_name)
+
+        connections = [str(connection) for connection in game_state.get("connections", [])]
+        for connection in connections:
+            cls._add_node(graph, connection, "connection", "")
+            for floor_name in floor_names:
+                cls._link(graph, connection, floor_name)
+
+        for special in game_state.get("special_areas", []):
+            cls._add_node(graph, str(special), "special", "")
+            for anchor in connections or floor_names[:1]:
+                cls._link(graph, str(special), anchor)
+
+        cls._add_node(graph, cls.ENTRANCE, "entrance", floor_names[0] if floor_names else "")
+        if floor_names:
+            cls._link(graph, cls.ENTRANCE, floor_names[0])
+        return graph
+
+    @staticmethod
+    def _add_node(graph: dict, name: str, kind: str, floor: str, area: str = "") -> None:
+        if name and name not in graph["nodes"]:
+            graph["nodes"][name] = {"kind": kind, "floor": floor, "area": area}
+            graph["edges"][name] = []
+
+    @staticmethod
+    def _link(graph: dict, a: str, b: str) -> None:
+        if a != b and b not in graph["edges"][a]:
+            graph["edges"][a].append(b)
+            graph["edges"][b].append(a)
+
+    @classmethod
+    def routes(cls, graph: dict) -> dict:
+        """返回地点图的最短路径表，按地点图摘要缓存在内存中，读档后首次使用时重新计算"""
+        key = graph.get("signature", "")
+        routes = location_routes.get(key)
+        if routes is None:
+            routes = cls._compute_routes(graph)
+            location_routes[key] = routes
+            while len(location_routes) > cls.ROUTE_CACHE_SIZE:
+                location_routes.pop(next(iter(location_routes)))
+        return routes
+
+    @staticmethod
+    def _compute_routes(graph: dict) -> dict:
+        """对每个地点做一次广度优先搜索，记录到其他地点的距离和下一步"""
+        distance = {}
+        next_hop = {}
+        edges = graph.get("edges", {})
+        for source in graph.get("nodes", {}):
+            dist = {source: 0}
+            first = {source: source}
+            queue = deque([source])
+            while queue:
+                node = queue.popleft()
+                for neighbor in edges.get(node, []):
+                    if neighbor not in dist:
+                        dist[neighbor] = dist[node] + 1
+                        first[neighbor] = neighbor if node == source else first[node]
+                        queue.append(neighbor)
+            distance[source] = dist
+            next_hop[source] = first
+        return {"distance": distance, "next_hop": next_hop}
+
+    @classmethod
+    def _mentioned(cls, graph: dict, text: str, exclude: Tuple[str, ...] = ()) -> Optional[str]:
+        """文本中最明确提到的地点：完整的地点名（如“二楼走廊”），或同时提到了楼层和区域（如“二楼的走廊”）"""
+        scored = []
+        for node, info in graph.get("nodes", {}).items():
+            if node in exclude:
+                continue
+            area = info.get("area", "")
+            if node in text:
+                scored.append((len(node), info["kind"] != "floor", node))
+            elif area and area in text and info["floor"] in text:
+                scored.append((len(info["floor"]) + len(area), True, node))
+        return max(scored)[2] if scored else None
+
+    @classmethod
+    def _closest(cls, graph: dict, candidates: List[str], near: str) -> Optional[str]:
+        """多个同名区域中离near最近的一个，无法区分时返回None"""
+        if len(candidates) == 1:
+            return candidates[0]
+        distances = cls.routes(graph)["distance"].get(near, {})
+        ranked = sorted((distances.get(node, float("inf")), node) for node in candidates)
+        if len(ranked) >= 2 and ranked[0][0] < ranked[1][0]:
+            return ranked[0][1]
+        return None
+
+    @classmethod
+    def normalize(cls, graph: dict, name: str, near: str = "") -> Optional[str]:
+        """把地点名称对应到图中的地点：完全一致、包含已知地点（如“二楼走廊尽头”）、只提到区域（如“走廊”）或唯一地包含于已知地点；
+        多个楼层有同名区域时取离near最近的一个"""
+        name = str(name or "").strip()
+        nodes = graph.get("nodes", {})
+        if not name:
+            return None
+        if name in nodes:
+            return name
+        mentioned = cls._mentioned(graph, name)
+        if mentioned:
+            return mentioned
+        areas = [node for node, info in nodes.items() if info.get("area") and info["area"] in name]
+        if areas:
+            return cls._closest(graph, areas, near)
+        if len(name) < 2:
+            return None
+        containing = [node for node, info in nodes.items() if name in (info.get("area") or node)]
+        return cls._closest(graph, containing, near) if containing else None
+
+    @classmethod
+    def path(cls, graph: dict, start: str, end: str) -> List[str]:
+        """两个地点之间的最短路径，不连通时返回空列表"""
+        next_hop = cls.routes(graph)["next_hop"]
+        if start not in next_hop or end not in next_hop[start]:
+            return []
+        route = [start]
+        while route[-1] != end:
+            route.append(next_hop[route[-1]][end])
+        return route
+
+    @classmethod
+    def nearby(cls, graph: dict, name: str, radius: int) -> List[str]:
+        """距离不超过radius步的所有地点（包括楼层和连接通道），不含出发地点本身，按距离排序"""
+        distances = cls.routes(graph)["distance"].get(name, {})
+        return [node for node, dist in sorted(distances.items(), key=lambda item: item[1]) if 0 < dist <= radius]
+
+    @classmethod
+    def find_destination(cls, graph: dict, action: str, current: str) -> Optional[str]:
+        """行动中包含移动说法时，找出提到的目的地；只提到区域时取离当前位置最近的同名区域"""
+        if not any(word in action for word in cls.MOVE_WORDS):
+            return None
+        nodes = graph.get("nodes", {})
+        exclude = (current, nodes.get(current, {}).get("floor", ""))
+        mentioned = cls._mentioned(graph, action, exclude)
+        if mentioned:
+            return mentioned
+        remainder = action.replace(current, "") if current else action
+        areas = [node for node, info in nodes.items() if node not in exclude and info.get("area") and info["area"] in remainder]
+        return cls._closest(graph, areas, current) if areas else None
+
+
+class StatusDynamics:
+    """根据裁判给出的少量信号在本地推算玩家状态：伤害等级、行动负担和恐怖强度，
+    结合玩家之前的状态按可配置的曲线计算体力、理智和心理压力，结果统一为限定范围内的整数"""
+
+    INJURY_DAMAGE = {"无": 0, "轻伤": 10, "重伤": 35, "致命伤": 100}
+    INJURY_ORDER = ("无", "轻伤", "重伤", "致命伤")
+    FATIGUE_LEVELS = ("无", "轻微", "中度", "严重", "极度")
+    FATIGUE_STEP = {0: -1, 1: 0, 2: 1, 3: 2}
+    SANITY_STATES = ((70, "正常"), (50, "紧张"), (30, "恐惧"), (10, "崩溃"), (0, "疯狂"))
+
+    @staticmethod
+    def to_int(value, default: int, low: int = 0, high: int = 100) -> int:
+        """把“80”“80/100”之类的返回值转换为限定范围内的整数"""
+        if isinstance(value, bool):
+            value = default
+        if isinstance(value, (int, float)):
+            number = int(round(value))
+        else:
+            match = re.search(r"-?\d+", str(value or ""))
+            number = int(match.group()) if match else default
+        return max(low, min(high, number))
+
+    @classmethod
+    def sanity_state(cls, sanity: int) -> str:
+        for threshold, state in cls.SANITY_STATES:
+            if sanity >= threshold:
+                return state
+        return cls.SANITY_STATES[-1][1]
+
+    @staticmethod
+    def _approach(previous: int, target: float, rate: float) -> int:
+        return max(0, min(100, int(round(previous + (target - previous) * rate))))
+
+    @classmethod
+    def derive(cls, previous: dict, signals: dict, curves: dict, is_dead: bool) -> Tuple[dict, dict, dict]:
+        """由信号和之前的状态推算新的身体状况、精神状况和心理压力"""
+        old_physical = cls.normalize_physical(previous.get("physical_status", {}), {})
+        old_mental = cls.normalize_mental(previous.get("mental_status", {}), {})
+        old_pressure = cls.normalize_pressure(previous.get("psychological_pressure", {}), {})
+
+        severity = cls.to_int(signals.get("severity"), 1, 0, 3)
+        horror = cls.to_int(signals.get("horror"), 0, 0, 10)
+        injury = signals.get("injury") if signals.get("injury") in cls.INJURY_DAMAGE else "无"
+        calm = severity == 0 and injury == "无"
+
+        health = old_physical["health"] - cls.INJURY_DAMAGE[injury] - max(severity - 1, 0) * curves["health_per_severity"]
+        if calm:
+            health += curves["recovery"]
+        health = 0 if is_dead else max(1, min(100, int(round(health))))
+        worst_injury = max(injury, old_physical["injury"], key=cls.INJURY_ORDER.index)
+        fatigue_index = cls.FATIGUE_LEVELS.index(old_physical["fatigue"]) + cls.FATIGUE_STEP[severity]
+        fatigue = cls.FATIGUE_LEVELS[max(0, min(len(cls.FATIGUE_LEVELS) - 1, fatigue_index))]
+
+        sanity = old_mental["sanity"] - horror * curves["sanity_per_horror"]
+        if horror == 0:
+            sanity += curves["recovery"]
+        sanity = max(0, min(100, int(round(sanity))))
+        emotion = str(signals.get("emotion") or old_mental["emotion"])
+
+        rate = curves["pressure_rate"]
+        physical = {"health": health, "injury": worst_injury, "fatigue": fatigue}
+        mental = {"sanity": sanity, "state": cls.sanity_state(sanity), "emotion": emotion}
+        pressure = {
+            "fear_level": cls._approach(old_pressure["fear_level"], horror * 10, rate),
+            "anxiety_level": cls._approach(old_pressure["anxiety_level"], 100 - sanity, rate),
+            "stress_level": cls._approach(old_pressure["stress_level"], min(100, severity * 25 + (100 - health) / 2), rate)
+        }
+        return physical, mental, pressure
+
+    @staticmethod
+    def _choice(value, previous, choices, default: str) -> str:
+        """取合法的等级，返回值缺失或不合法时沿用之前的等级"""
+        if value in choices:
+            return value
+        return previous if previous in choices else default
+
+    @classmethod
+    def normalize_physical(cls, status: dict, previous: dict) -> dict:
+        """统一身体状况的格式，缺失、为空或无法识别的字段沿用之前的值"""
+        status = status if isinstance(status, dict) else {}
+        return {
+            "health": cls.to_int(status.get("health"), cls.to_int(previous.get("health"), 100)),
+            "injury": cls._choice(status.get("injury"), previous.get("injury"), cls.INJURY_DAMAGE, "无"),
+            "fatigue": cls._choice(status.get("fatigue"), previous.get("fatigue"), cls.FATIGUE_LEVELS, "无")
+        }
+
+    @classmethod
+    def normalize_mental(cls, status: dict, previous: dict) -> dict:
+        """统一精神状况的格式，缺失、为空或无法识别的字段沿用之前的值"""
+        status = status if isinstance(status, dict) else {}
+        sanity = cls.to_int(status.get("sanity"), cls.to_int(previous.get("sanity"), 100))
+        return {
+            "sanity": sanity,
+            "state": str(status.get("state") or previous.get("state") or cls.sanity_state(sanity)),
+            "emotion": str(status.get("emotion") or previous.get("emotion") or "平静")
+        }
+
+    @classmethod
+    def normalize_pressure(cls, status: dict, previous: dict) -> dict:
+        """统一心理压力的格式，缺失、为空或无法识别的字段沿用之前的值"""
+        status = status if isinstance(status, dict) else {}
+        return {key: cls.to_int(status.get(key), cls.to_int(previous.get(key), 0)) for key in ("fear_level", "anxiety_level", "stress_level")}
+
+
+class ActionIntentClassifier:
+    """行动意图的本地分类器：按关键词权重为背包、状态、地图三类查询打分，
+    出现会改变世界的动作或描述较长时扣分，得分不足时视为普通行动交给裁判。
+    只回答关于玩家自己的查询：关键词属于别的对象（“门口的状态”）或行动中还有使用、寻找、打开之类的动作时一律交给裁判。
+    关键词从长到短匹配且不重叠，可从权重文件加载离线训练得到的权重覆盖内置权重"""
+
+    QUERY_INTENTS = ("inventory", "status", "map")
+    # 除去查询关键词后仍出现这些动作时，行动不只是查询
+    BLOCKING_VERBS = ("用", "找", "搜", "打开", "推开", "拉开", "撬", "试", "拿", "取", "放")
+    # 关键词前面的“某某的”以这些词结尾时，查询的仍是玩家自己
+    OWN_MARKERS = ("我", "自己", "我们", "身上")
+    # 除去查询关键词后仍出现这些说法时，玩家是在观察周围的世界而不是查询自己
+    WORLD_QUESTIONS = ("有没有", "有人", "有谁", "是谁", "动静", "声音")
+    DEFAULT_WEIGHTS = {
+        "inventory": {
+            "背包": 3.0, "打开背包": 3.5, "翻背包": 3.0, "物品栏": 3.0, "口袋": 2.0, "随身物品": 3.0,
+            "身上有什么": 3.0, "带了什么": 3.0, "有什么东西": 2.0, "道具": 2.0, "清点": 1.5
+        },
+        "status": {
+            "状态": 3.0, "体力": 2.5, "理智": 2.5, "伤势": 2.5, "伤口": 1.5, "身体状况": 3.0,
+            "精神状况": 3.0, "感觉怎么样": 2.5, "还好吗": 2.0
+        },
+        "map": {
+            "地图": 3.0, "四周": 2.0, "周围": 2.0, "环顾": 2.5, "在哪": 2.5, "哪里": 1.5, "位置": 2.0,
+            "布局": 2.5, "哪些房间": 3.0, "有哪些地方": 3.0, "怎么走": 2.0, "去过哪": 3.0, "出口在": 2.0
+        },
+        # 各类查询共用的查看说法
+        "query": {"看看": 1.0, "看一下": 1.0, "查看": 1.0, "检查": 1.0, "确认": 1.0, "回想": 1.0, "我的": 0.5},
+        # 会改变世界的动作，出现时扣分
+        "action": {
+            "进入": 3.0, "走进": 3.0, "前往": 3.0, "去": 1.5, "离开": 3.0, "打开": 2.0, "推开": 3.0, "拿": 2.5,
+            "捡": 2.5, "使用": 3.0, "回应": 3.0, "回答": 3.0, "触摸": 3.0, "摸": 2.0, "敲": 3.0, "跑": 3.0,
+            "躲": 3.0, "喊": 3.0, "吃": 3.0, "喝": 3.0, "砸": 3.0, "烧": 3.0, "点燃": 3.0, "搜索": 3.0,
+            "翻找": 3.0, "阅读": 3.0, "读": 2.0, "写": 3.0, "问": 3.0, "跟着": 3.0, "关上": 3.0, "扔": 3.0
+        }
+    }
+
+    def __init__(self):
+        self.weights = copy.deepcopy(self.DEFAULT_WEIGHTS)
+        self._weights_file = None
+
+    def configure(self, weights_file: str) -> None:
+        """加载权重文件（JSON：{"weights": {意图: {关键词: 权重}}}），与内置权重合并；文件未变化时不重复加载"""
+        if weights_file == self._weights_file:
+            return
+        self._weights_file = weights_file
+        self.weights = copy.deepcopy(self.DEFAULT_WEIGHTS)
+        if not weights_file:
+            return
+
+        path = weights_file if os.path.isabs(weights_file) else os.path.join(PLUGIN_DIR, weights_file)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            for intent, table in data.get("weights", {}).items():
+                self.weights.setdefault(intent, {}).update({str(keyword): float(weight) for keyword, weight in table.items()})
+            print(f"[规则怪谈] 已加载行动意图权重：{path}")
+        except (OSError, ValueError, TypeError, AttributeError) as e:
+            print(f"[规则怪谈] 加载行动意图权重失败: {e}")
+
+    def match(self, action: str) -> List[Tuple[int, int, str, float]]:
+        """从长到短匹配关键词，返回互不重叠的 (起点, 终点, 意图, 权重)"""
+        text = action.strip()
+        keywords = sorted(
+            ((keyword, intent, weight) for intent, table in self.weights.items() for keyword, weight in table.items()),
+            key=lambda item: -len(item[0])
+        )
+        spans = []
+        for keyword, intent, weight in keywords:
+            start = text.find(keyword)
+            while start != -1:
+                end = start + len(keyword)
+                if not any(start < span_end and span_start < end for span_start, span_end, _, _ in spans):
+                    spans.append((start, end, intent, weight))
+                start = text.find(keyword, end)
+        return spans
+
+    def _refers_to_other(self, text: str, start: int) -> bool:
+        """关键词前面是“某某的”且某某不是玩家自己（“门口的状态”）"""
+        owner = re.search(r"([\u4e00-\u9fa5]{1,4})的$", text[:start])
+        return bool(owner) and not owner.group(1).endswith(self.OWN_MARKERS)
+
+    def score(self, action: str) -> dict:
+        """计算各意图的关键词得分，属于别的对象的查询关键词不计分"""
+        text = action.strip()
+        scores = {intent: 0.0 for intent in self.weights}
+        for start, _, intent, weight in self.match(text):
+            if intent in self.QUERY_INTENTS and self._refers_to_other(text, start):
+                continue
+            scores[intent] += weight
+        return scores
+
+    def classify(self, action: str, threshold: float) -> str:
+        """返回 inventory/status/map 之一，或 action 表示需要交给裁判的普通行动"""
+        text = action.strip()
+        residual = list(text)
+        for start, end, intent, _ in self.match(text):
+            if intent in self.QUERY_INTENTS + ("query",) and not self._refers_to_other(text, start):
+                residual[start:end] = " " * (end - start)
+        residual = "".join(residual)
+        if any(verb in residual for verb in self.BLOCKING_VERBS + self.WORLD_QUESTIONS):
+            return "action"
+
+        scores = self.score(text)
+        shared = scores.get("query", 0.0) - scores.get("action", 0.0) - max(len(text) - 12, 0) * 0.1
+        best = max(self.QUERY_INTENTS, key=lambda intent: scores.get(intent, 0.0))
+        if scores.get(best, 0.0) > 0 and scores[best] + shared >= threshold:
+            return best
+        return "action"
+
+
+action_intent_classifier = ActionIntentClassifier()
+
 @register_plugin
 class RuleHorrorPlugin(BasePlugin):
     """规则怪谈插件 - 生成规则怪谈并进行互动"""
@@ -40,7 +1546,22 @@ class RuleHorrorPlugin(BasePlugin):
     config_file_name = "config.toml"
     config_section_descriptions = {
         "plugin": "插件启用配置",
-        "llm": "LLM API 配置"
+        "llm": "LLM API 配置",
+        "telemetry": "LLM调用遥测配置",
+        "generation": "剧本生成配置",
+        "scenario_pool": "预生成剧本池配置",
+        "hint_bank": "提示库配置",
+        "death_screen": "死亡条件预筛配置",
+        "intent": "行动意图识别配置",
+        "location": "地点图配置",
+        "status_dynamics": "状态推算配置",
+        "clear_check": "通关检查配置",
+        "daily_challenge": "每日挑战配置",
+        "scenario_library": "本地剧本库配置",
+        "performance": "命令耗时追踪配置",
+        "debug": "调试与性能诊断配置",
+        "multiplayer": "多人模式配置",
+        "replay": "可复现运行配置"
     }
 
     config_schema = {
@@ -70,6 +1591,11 @@ class RuleHorrorPlugin(BasePlugin):
                 default=True,
                 description="是否生成场景剖面图（2D或3D）"
             ),
+            "admin_user_ids": ConfigField(
+                type=list,
+                default=[],
+                description="插件管理员的用户ID列表，管理员可以使用 /rg 性能 等管理命令"
+            ),
         },
         "llm": {
             "api_url": ConfigField(
@@ -96,56 +1622,381 @@ class RuleHorrorPlugin(BasePlugin):
                 type=float,
                 default=0.8,
                 description="LLM 生成文本的随机性 (0.0-1.0)"
+            ),
+            "max_concurrency": ConfigField(
+                type=int,
+                default=8,
+                description="同时进行的LLM请求数上限，超出的请求会排队等待（修改后需重启生效）"
             )
-        }
-    }
-
-    def get_plugin_components(self) -> List[Tuple[ComponentInfo, Type]]:
-        return [
-            (RuleHorrorCommand.get_command_info(), RuleHorrorCommand),
-        ]
-
-
-class RuleHorrorCommand(BaseCommand):
-    """处理 /rg 命令"""
-
-    command_name = "RuleHorrorCommand"
-    command_description = "规则怪谈游戏：生成规则怪谈、加入/离开、提示、推理、行动、结束"
-    command_pattern = r"^/rg\s+(?P<action>\S+)(?:\s+(?P<rest>.+))?$"
-    command_help = (
-        "规则怪谈游戏：\n"
-        "/rg 开始 单人/多人 - 开始新游戏（单人模式自动加入，多人模式需要手动加入）\n"
-        "/rg 强制开始 单人/多人 - 强制开始新游戏（覆盖存档）\n"
-        "/rg 恢复 - 恢复默认存档游戏\n"
-        "/rg 保存 <存档名称> - 手动保存当前游戏状态\n"
-        "/rg 读取 <存档名称> - 从指定存档读取游戏\n"
-        "/rg 存档列表 - 查看所有可用存档\n"
-        "/rg 清理存档 - 清理已结束的存档及其图片\n"
-        "/rg 加入 - 加入游戏（多人模式，最多5人）\n"
-        "/rg 离开 - 离开游戏\n"
-        "/rg 状态 - 查看游戏状态\n"
-        "/rg 剧情 - 查看剧情导入\n"
-        "/rg 规则 - 查看当前规则\n"
-        "/rg 场景 - 查看场景结构\n"
-        "/rg 提示 <规则/线索> - 获取提示（剩余3次）\n"
-        "/rg 推理 <推理内容> - 记录你的推理\n"
-        "/rg 行动 <行动描述> - 描述你的行动\n"
-        "/rg 结束 - 结束游戏并判定结局\n"
-        "/rg 帮助 - 查看帮助"
-    )
-    command_examples = [
-        "/rg 开始 单人", "/rg 开始 多人", "/rg 强制开始 单人", "/rg 恢复", "/rg 保存 存档1", "/rg 读取 存档1", "/rg 存档列表", "/rg 加入", "/rg 离开", "/rg 状态", "/rg 剧情", "/rg 规则", "/rg 场景",
-        "/rg 提示 规则", "/rg 提示 线索",
-        "/rg 推理 我认为规则3是关键", "/rg 行动 我决定进入房间",
-        "/rg 结束", "/rg 帮助"
-    ]
-    intercept_message = True
-
-    async def execute(self) -> Tuple[bool, Optional[str], bool]:
-        matched_groups = self.matched_groups if self.matched_groups is not None else {}
-        action = matched_groups.get("action", "") if matched_groups.get("action") is not None else ""
-        rest_input = matched_groups.get("rest", "") if matched_groups.get("rest") is not None else ""
-
+        },
+        "telemetry": {
+            "log_to_file": ConfigField(
+                type=bool,
+                default=True,
+                description="是否将每次LLM调用的遥测记录和各调用点的汇总写入 data/telemetry/llm_calls.jsonl（滚动文件）"
+            ),
+            "file_max_bytes": ConfigField(
+                type=int,
+                default=1048576,
+                description="遥测日志单个文件的最大字节数，超出后滚动"
+            ),
+            "file_backup_count": ConfigField(
+                type=int,
+                default=3,
+                description="遥测日志保留的历史文件数"
+            )
+        },
+        "generation": {
+            "mode": ConfigField(
+                type=str,
+                default="staged",
+                description="剧本生成方式：'staged'（分步生成剧情、场景、规则和规则网络）或 'combined'（一次调用生成全部内容，流式解析并尽早发送剧情导入）"
+            ),
+            "stage_retries": ConfigField(
+                type=int,
+                default=1,
+                description="分步生成时每一步失败（调用失败或返回格式不正确）后的重试次数。重试仍失败时保留已完成的步骤，再次 /rg 开始 时从失败的步骤继续"
+            )
+        },
+        "scenario_pool": {
+            "enabled": ConfigField(
+                type=bool,
+                default=False,
+                description="是否启用预生成剧本池。启用后会在LLM空闲时于后台预先生成剧本，/rg 开始 时直接取用"
+            ),
+            "pool_size": ConfigField(
+                type=int,
+                default=2,
+                description="每种游戏模式（单人/多人）保留的预生成剧本数量"
+            ),
+            "modes": ConfigField(
+                type=list,
+                default=["单人", "多人"],
+                description="需要预生成剧本的游戏模式"
+            ),
+            "idle_seconds": ConfigField(
+                type=int,
+                default=10,
+                description="LLM连续空闲多少秒后才开始生成下一个剧本，避免占用玩家的LLM请求"
+            ),
+            "retry_seconds": ConfigField(
+                type=int,
+                default=600,
+                description="预生成剧本失败后等待多少秒再重新尝试补充"
+            )
+        },
+        "hint_bank": {
+            "enabled": ConfigField(
+                type=bool,
+                default=False,
+                description="是否在游戏开始后于后台预先生成分级提示库，/rg 提示 直接从提示库取出而不等待LLM；规则变化时只补充受影响的提示"
+            )
+        },
+        "death_screen": {
+            "enabled": ConfigField(
+                type=bool,
+                default=False,
+                description="是否在行动判定前用本地索引预筛死亡触发条件和规则，命中的条件作为提示交给裁判"
+            ),
+            "fast_path": ConfigField(
+                type=bool,
+                default=False,
+                description="单人模式下预筛没有命中任何条件的行动是否使用简短的快速判定提示词（理智崩溃或有待发现规则时仍使用完整判定）"
+            )
+        },
+        "intent": {
+            "enabled": ConfigField(
+                type=bool,
+                default=False,
+                description="是否在本地识别查看背包、状态、地图之类的查询行动，直接根据游戏状态回答，不推进时间也不调用LLM"
+            ),
+            "threshold": ConfigField(
+                type=float,
+                default=2.5,
+                description="判定为查询所需的最低得分，调高后更多行动会交给裁判判定"
+            ),
+            "weights_file": ConfigField(
+                type=str,
+                default="",
+                description="可选的意图权重文件（JSON，相对于插件目录），与内置关键词权重合并，可放入离线训练得到的权重"
+            )
+        },
+        "location": {
+            "scope_radius": ConfigField(
+                type=int,
+                default=2,
+                description="行动判定提示词中列出玩家附近多少步以内的地点"
+            ),
+            "max_move_steps": ConfigField(
+                type=int,
+                default=4,
+                description="一次行动最多移动的步数，判定结果超过时停在路线上（0为不限制）"
+            ),
+            "description_cache": ConfigField(
+                type=bool,
+                default=True,
+                description="是否缓存地点描述，重返地点时只让裁判描述变化"
+            ),
+            "max_changes": ConfigField(
+                type=int,
+                default=5,
+                description="每个地点保留的变化记录条数"
+            ),
+            "skip_quiet_revisits": ConfigField(
+                type=bool,
+                default=False,
+                description="单人模式下单纯返回已描述过的地点且预筛未命中任何条件时，是否直接使用缓存描述而不调用LLM"
+            )
+        },
+        "status_dynamics": {
+            "enabled": ConfigField(
+                type=bool,
+                default=False,
+                description="是否只让裁判返回伤害等级、行动负担和恐怖强度，由本地推算体力、理智和心理压力"
+            ),
+            "health_per_severity": ConfigField(
+                type=float,
+                default=3.0,
+                description="行动负担每高一级（超过1级的部分）扣除的体力"
+            ),
+            "sanity_per_horror": ConfigField(
+                type=float,
+                default=2.0,
+                description="恐怖强度每一级扣除的理智"
+            ),
+            "recovery": ConfigField(
+                type=int,
+                default=1,
+                description="平静的行动恢复的体力和理智"
+            ),
+            "pressure_rate": ConfigField(
+                type=float,
+                default=0.4,
+                description="恐惧、焦虑和压力每次向目标值靠近的比例（0-1）"
+            )
+        },
+        "clear_check": {
+            "debounce_seconds": ConfigField(
+                type=int,
+                default=5,
+                description="推理或行动后等待多少秒再在后台检查通关条件，等待期间的多次推理和行动合并为一次检查"
+            ),
+            "max_new_entries": ConfigField(
+                type=int,
+                default=3,
+                description="每次检查中每位玩家最多发送的新增推理和新增行动条数，更早的新增记录只计数不发送"
+            )
+        },
+        "daily_challenge": {
+            "enabled": ConfigField(
+                type=bool,
+                default=False,
+                description="是否启用每日挑战。启用后 /rg 开始 单人/多人 每日 会使用本周期内所有群组共享的同一个剧本"
+            ),
+            "period_hours": ConfigField(
+                type=int,
+                default=24,
+                description="每日挑战剧本的更新周期（小时），每个周期每种游戏模式只生成一次剧本"
+            )
+        },
+        "scenario_library": {
+            "archive": ConfigField(
+                type=bool,
+                default=False,
+                description="是否将完成生成的剧本归档到本地剧本库（data/scenario_library/），管理员可以使用 /rg 开始 单人/多人 库:<标签> 从剧本库开始游戏"
+            )
+        },
+        "performance": {
+            "slow_command_threshold_ms": ConfigField(
+                type=int,
+                default=3000,
+                description="命令总耗时超过该值（毫秒）时记为慢命令，保留分阶段耗时供 /rg 性能 查看"
+            ),
+            "loop_lag_interval_ms": ConfigField(
+                type=int,
+                default=500,
+                description="检测事件循环延迟的间隔（毫秒），0表示关闭检测"
+            ),
+            "max_pending_commands": ConfigField(
+                type=int,
+                default=5,
+                description="每个群组执行中和排队中的命令数量上限，超出时直接回复稍后再试，0表示不限制。状态、规则等只读命令不排队"
+            )
+        },
+        "debug": {
+            "memory_sample_interval": ConfigField(
+                type=int,
+                default=0,
+                description="每隔多少次行动采样一次游戏状态的内存占用并输出各结构的增长报告，0表示关闭"
+            ),
+            "enable_tracemalloc": ConfigField(
+                type=bool,
+                default=False,
+                description="内存采样时是否启用tracemalloc追踪内存分配（有额外性能开销，仅用于排查内存增长）"
+            )
+        },
+        "multiplayer": {
+            "max_parallel_judges": ConfigField(
+                type=int,
+                default=5,
+                description="多人模式下一次行动同时进行的玩家视角判定数量上限，判定完成后按玩家加入顺序依次应用结果"
+            ),
+            "adjudication": ConfigField(
+                type=str,
+                default="two_tier",
+                description="多人模式的判定方式：'two_tier'（一次权威判定决定所有玩家的结果，再为每位玩家生成简短的视角描述，远处未察觉的玩家使用本地模板）或 'per_player'（为每位玩家各进行一次完整判定）"
+            ),
+            "round_mode": ConfigField(
+                type=bool,
+                default=False,
+                description="是否启用回合模式：收集一段时间内的玩家行动，在所有存活玩家都已行动或等待时间结束后通过一次权威判定统一结算，并合并成一条消息发送"
+            ),
+            "round_window_seconds": ConfigField(
+                type=int,
+                default=20,
+                description="回合模式下从本轮第一个行动开始等待其他玩家的秒数"
+            )
+        },
+        "replay": {
+            "seed": ConfigField(
+                type=int,
+                default=0,
+                description="每局游戏的随机种子（随机事件、理智崩坏扭曲效果等），0表示每局随机生成。种子保存在游戏状态中"
+            ),
+            "forward_seed": ConfigField(
+                type=bool,
+                default=False,
+                description="是否将游戏的随机种子作为 seed 参数转发给LLM API（需要API支持该参数）"
+            ),
+            "mode": ConfigField(
+                type=str,
+                default="off",
+                description="LLM返回内容的录制与回放：'off'（关闭）、'record'（录制每次调用的返回内容）或 'replay'（按调用点依次返回录制的内容，不请求API）"
+            ),
+            "file": ConfigField(
+                type=str,
+                default="replay/llm_responses.jsonl",
+                description="录制文件路径（相对于插件数据目录）"
+            )
+        }
+    }
+
+    def get_plugin_components(self) -> List[Tuple[ComponentInfo, Type]]:
+        return [
+            (RuleHorrorCommand.get_command_info(), RuleHorrorCommand),
+        ]
+
+
+class RuleHorrorCommand(BaseCommand):
+    """处理 /rg 命令"""
+
+    command_name = "RuleHorrorCommand"
+    command_description = "规则怪谈游戏：生成规则怪谈、加入/离开、提示、推理、行动、结束"
+    command_pattern = r"^/rg\s+(?P<action>\S+)(?:\s+(?P<rest>.+))?$"
+    command_help = (
+        "规则怪谈游戏：\n"
+        "/rg 开始 单人/多人 - 开始新游戏（单人模式自动加入，多人模式需要手动加入）\n"
+        "/rg 开始 单人/多人 每日 - 挑战所有群组共享的每日挑战剧本\n"
+        "/rg 开始 单人/多人 库:<标签> - 从本地剧本库中选取剧本开始游戏（仅管理员）\n"
+        "/rg 强制开始 单人/多人 - 强制开始新游戏（覆盖存档）\n"
+        "/rg 恢复 - 恢复默认存档游戏\n"
+        "/rg 保存 <存档名称> - 手动保存当前游戏状态\n"
+        "/rg 读取 <存档名称> - 从指定存档读取游戏\n"
+        "/rg 存档列表 - 查看所有可用存档\n"
+        "/rg 清理存档 - 清理已结束的存档及其图片\n"
+        "/rg 加入 - 加入游戏（多人模式，最多5人）\n"
+        "/rg 离开 - 离开游戏\n"
+        "/rg 状态 - 查看游戏状态\n"
+        "/rg 剧情 - 查看剧情导入\n"
+        "/rg 规则 - 查看当前规则\n"
+        "/rg 场景 - 查看场景结构\n"
+        "/rg 提示 <规则/线索> - 获取提示（剩余3次）\n"
+        "/rg 推理 <推理内容> - 记录你的推理\n"
+        "/rg 行动 <行动描述> - 描述你的行动\n"
+        "/rg 结束 - 结束游戏并判定结局\n"
+        "/rg 性能 - 查看慢命令和LLM调用情况（仅管理员）\n"
+        "/rg 帮助 - 查看帮助"
+    )
+    command_examples = [
+        "/rg 开始 单人", "/rg 开始 多人", "/rg 强制开始 单人", "/rg 恢复", "/rg 保存 存档1", "/rg 读取 存档1", "/rg 存档列表", "/rg 加入", "/rg 离开", "/rg 状态", "/rg 剧情", "/rg 规则", "/rg 场景",
+        "/rg 提示 规则", "/rg 提示 线索",
+        "/rg 推理 我认为规则3是关键", "/rg 行动 我决定进入房间",
+        "/rg 结束", "/rg 性能", "/rg 帮助"
+    ]
+    intercept_message = True
+
+    async def execute(self) -> Tuple[bool, Optional[str], bool]:
+        action = str((self.matched_groups or {}).get("action") or "").strip()
+        loop_lag_monitor.ensure_started(self.get_config("performance.loop_lag_interval_ms", 500) / 1000)
+        self._ensure_scenario_pool_refill()
+        
+        trace_token = command_tracer.start(action, self._get_group_id())
+        try:
+            group_id = self._get_group_id()
+            if action in READ_ONLY_ACTIONS:
+                return await self._execute_command()
+            elif command_executor.is_busy(group_id, self.get_config("performance.max_pending_commands", 5)):
+                await self.send_text("本群正在处理的命令较多，请稍后再试。")
+                return False, "命令队列已满", True
+            return await command_executor.run(group_id, self._execute_command)
+        finally:
+            slow_threshold = self.get_config("performance.slow_command_threshold_ms", 3000) / 1000
+            trace = command_tracer.finish(trace_token, slow_threshold)
+            if trace and trace["total"] >= slow_threshold:
+                print(f"[规则怪谈] 慢命令：\n{command_tracer.format_trace(trace)}")
+
+    def _get_group_id(self) -> str:
+        """获取当前聊天的群号（私聊时为用户ID）"""
+        chat_stream = getattr(self, 'chat_stream', None)
+        if chat_stream is None:
+            message_obj = getattr(self, 'message', None)
+            if message_obj:
+                chat_stream = getattr(message_obj, 'chat_stream', None)
+        
+        group_info = getattr(chat_stream, 'group_info', None)
+        if group_info:
+            return str(group_info.group_id)
+        user_info = getattr(chat_stream, 'user_info', None)
+        if user_info:
+            return str(user_info.user_id)
+        return "unknown"
+
+    def _is_admin(self) -> bool:
+        """判断发送命令的用户是否为插件管理员"""
+        user_info = self._get_user_info()
+        if not user_info:
+            return False
+        admin_ids = [str(admin_id) for admin_id in self.get_config("plugin.admin_user_ids", [])]
+        return str(user_info.user_id) in admin_ids
+
+    def _new_game_seed(self) -> int:
+        """生成新游戏的随机种子，配置了固定种子时使用配置的种子"""
+        seed = int(self.get_config("replay.seed", 0) or 0)
+        return seed if seed else random.SystemRandom().randint(1, 2 ** 31 - 1)
+
+    def _game_rng(self, game_state: dict) -> random.Random:
+        """返回本局游戏的随机数生成器，由游戏种子和已使用次数派生，存档恢复后仍得到相同的随机序列"""
+        if not game_state.get("rng_seed"):
+            game_state["rng_seed"] = self._new_game_seed()
+        counter = game_state.get("rng_counter", 0)
+        game_state["rng_counter"] = counter + 1
+        return random.Random(f"{game_state['rng_seed']}:{counter}")
+
+    async def send_text(self, text: str, *args, **kwargs) -> bool:
+        """发送文字消息，耗时记入命令追踪"""
+        with command_tracer.span("send_text"):
+            return await super().send_text(text, *args, **kwargs)
+
+    async def send_image(self, image_base64: str, *args, **kwargs) -> bool:
+        """发送图片消息，耗时记入命令追踪"""
+        with command_tracer.span("send_image"):
+            return await super().send_image(image_base64, *args, **kwargs)
+
+    async def _execute_command(self) -> Tuple[bool, Optional[str], bool]:
+        matched_groups = self.matched_groups if self.matched_groups is not None else {}
+        action = matched_groups.get("action", "") if matched_groups.get("action") is not None else ""
+        rest_input = matched_groups.get("rest", "") if matched_groups.get("rest") is not None else ""
+
         action = str(action).strip()
         rest_input = str(rest_input).strip()
 
@@ -175,26 +2026,27 @@ class RuleHorrorCommand(BaseCommand):
         current_model_index = self.get_config("llm.current_model_index", 0)
         temperature = self.get_config("llm.temperature", 0.8)
 
-        group_id = getattr(chat_stream, 'group_info', None)
-        if group_id:
-            group_id = group_id.group_id
-        else:
-            user_id = getattr(chat_stream, 'user_info', None)
-            if user_id:
-                group_id = user_id.user_id
-            else:
-                group_id = "unknown"
+        group_id = self._get_group_id()
 
         game_state = game_states.get(group_id, {})
         if group_id not in game_states:
             game_states[group_id] = game_state
 
+        if action in READ_ONLY_ACTIONS:
+            # 有命令正在修改游戏状态时读取它开始前的快照，避免读到修改到一半的状态
+            game_state = command_executor.snapshot(group_id) or game_state
+
+        # 开始新游戏时生成新的种子，生成剧本的LLM调用和之后的游戏使用同一个种子
+        current_game_seed.set(self._new_game_seed() if action in ("开始", "强制开始") else game_state.get("rng_seed"))
+
         if action == "开始":
-            game_mode = rest_input.strip() if rest_input else ""
+            start_args = rest_input.split() if rest_input else []
+            game_mode = start_args[0] if start_args else ""
             if game_mode not in ["单人", "多人"]:
                 await self.send_text("请指定游戏模式。用法：`/rg 开始 单人` 或 `/rg 开始 多人`")
                 return False, "缺少游戏模式", True
-            return await self._start_new_game(group_id, api_url, api_key, model_list, current_model_index, temperature, game_mode)
+            source = start_args[1] if len(start_args) > 1 else ""
+            return await self._start_new_game(group_id, api_url, api_key, model_list, current_model_index, temperature, game_mode, source)
 
         elif action == "强制开始":
             game_mode = rest_input.strip() if rest_input else ""
@@ -254,28 +2106,28 @@ class RuleHorrorCommand(BaseCommand):
                 await self.send_text("当前没有正在进行的游戏。")
                 return False, "无游戏", True
 
-            return await self._show_game_status(group_id)
+            return await self._show_game_status(game_state)
 
         elif action == "规则":
             if not game_state.get("game_active", False):
                 await self.send_text("当前没有正在进行的游戏。请先使用 `/rg 开始` 开始游戏。")
                 return False, "无游戏", True
 
-            return await self._show_rules(group_id)
+            return await self._show_rules(game_state)
 
         elif action == "场景":
             if not game_state.get("game_active", False):
                 await self.send_text("当前没有正在进行的游戏。请先使用 `/rg 开始` 开始游戏。")
                 return False, "无游戏", True
 
-            return await self._show_scene(group_id)
+            return await self._show_scene(game_state)
 
         elif action == "剧情":
             if not game_state.get("game_active", False):
                 await self.send_text("当前没有正在进行的游戏。请先使用 `/rg 开始` 开始游戏。")
                 return False, "无游戏", True
 
-            return await self._show_plot(group_id)
+            return await self._show_plot(game_state)
 
         elif action == "提示":
             if not game_state.get("game_active", False):
@@ -316,7 +2168,7 @@ class RuleHorrorCommand(BaseCommand):
                 await self.send_text("你尚未达成通关条件，无法继续探索。")
                 return False, "未通关", True
 
-            return await self._continue_to_perfect(group_id, api_url, api_key, model, temperature)
+            return await self._continue_to_perfect(group_id, api_url, api_key, model_list, current_model_index, temperature)
 
         elif action == "结束":
             if not game_state.get("game_active", False):
@@ -325,12 +2177,21 @@ class RuleHorrorCommand(BaseCommand):
 
             return await self._end_game(group_id, api_url, api_key, model_list, current_model_index, temperature)
 
+        elif action == "性能":
+            if not self._is_admin():
+                await self.send_text("只有插件管理员可以查看性能信息。")
+                return False, "无权限", True
+
+            return await self._show_performance()
+
         elif action == "帮助":
             help_text = (
                 "**规则怪谈游戏帮助**\n\n"
                 "**命令列表**\n"
                 "- `/rg 开始 单人` - 开始单人模式游戏（自动加入）\n"
                 "- `/rg 开始 多人` - 开始多人模式游戏（最多5人，需手动加入）\n"
+                "- `/rg 开始 单人/多人 每日` - 挑战所有群组共享的每日挑战剧本\n"
+                "- `/rg 开始 单人/多人 库:<标签>` - 从本地剧本库中选取剧本开始游戏，不调用LLM（仅管理员）\n"
                 "- `/rg 强制开始 单人/多人` - 强制开始新游戏（覆盖存档）\n"
                 "- `/rg 恢复` - 恢复默认存档游戏\n"
                 "- `/rg 保存 <存档名称>` - 手动保存当前游戏状态\n"
@@ -348,6 +2209,7 @@ class RuleHorrorCommand(BaseCommand):
                 "- `/rg 行动 <行动描述>` - 描述你的行动\n"
                 "- `/rg 继续` - 达成通关后继续探索完美结局\n"
                 "- `/rg 结束` - 结束游戏并判定结局\n"
+                "- `/rg 性能` - 查看慢命令、进行中的LLM调用和事件循环延迟（仅管理员）\n"
                 "- `/rg 帮助` - 查看帮助\n\n"
                 "**游戏提示**\n"
                 "- 规则怪谈包含多条规则，你需要推理出规则的真实含义\n"
@@ -369,8 +2231,9 @@ class RuleHorrorCommand(BaseCommand):
             await self.send_text("未知命令。请使用 `/rg 帮助` 查看可用命令。")
             return False, "未知命令", True
 
-    async def _start_new_game(self, group_id: str, api_url: str, api_key: str, model_list: list, current_model_index: int, temperature: float, game_mode: str) -> Tuple[bool, Optional[str], bool]:
-        """开始一个新的规则怪谈游戏"""
+    @traced("handler:start_new_game")
+    async def _start_new_game(self, group_id: str, api_url: str, api_key: str, model_list: list, current_model_index: int, temperature: float, game_mode: str, source: str = "") -> Tuple[bool, Optional[str], bool]:
+        """开始一个新的规则怪谈游戏，存在同模式的未完成生成进度时从中断的步骤继续，source 为「每日」时使用共享的每日挑战剧本"""
         saved_state = self._load_game_state(group_id)
         if saved_state and saved_state.get("game_active", False):
             await self.send_text(
@@ -380,145 +2243,253 @@ class RuleHorrorCommand(BaseCommand):
             )
             return False, "存在存档", True
         
-        await self.send_text("正在生成规则怪谈...")
-
-        step1_prompt = """
-你是一个专业的规则怪谈生成器。请生成一个恐怖或诡异的规则怪谈的剧情导入。
-
-要求：
-1. 生成一个场景（如：深夜的医院、废弃的学校、神秘的公寓、古老的庄园等）
-2. 描述场景的背景故事（这个场景的历史、发生过什么、为什么诡异）
-3. 描述玩家在这个场景中的身份或角色（如：工厂员工、夜班护士、新入职教师、庄园管家等），身份应与场景和剧情相符
-4. 剧情应该充满悬疑和恐怖氛围，为后续的规则和探索做铺垫
-5. 生成2-3个"核心象征符号"，这些符号将在整个游戏中反复出现，营造主题感和不安感。符号可以是数字、图案、旋律、花纹、颜色等。每个符号需要有一个简短的描述，暗示其可能的含义或与场景的联系。
-6. 以JSON格式返回，格式如下：
-{
-  "scene": "场景名称（如：深夜的废弃医院）",
-  "background": "场景背景故事，描述这个场景的历史、发生过什么、为什么诡异",
-  "player_identity": "玩家在这个场景中的身份或角色",
-  "core_symbols": [
-    {"symbol": "符号1", "description": "符号1的描述"},
-    {"symbol": "符号2", "description": "符号2的描述"}
-  ]
-}
+        if source == "每日":
+            if not self.get_config("daily_challenge.enabled", False):
+                await self.send_text("每日挑战未启用。")
+                return False, "每日挑战未启用", True
+            shared = await self._get_daily_scenario(game_mode)
+            if shared is None:
+                await self.send_text("每日挑战剧本生成失败，请稍后重试。")
+                return False, "每日挑战生成失败", True
+            return await self._start_shared_game(group_id, game_mode, shared)
+        elif source.startswith("库:"):
+            if not self._is_admin():
+                await self.send_text("只有插件管理员可以从剧本库开始游戏。")
+                return False, "无权限", True
+            return await self._start_from_library(group_id, game_mode, source[len("库:"):])
+        elif source:
+            await self.send_text(f"未知的开局选项「{source}」。用法：`/rg 开始 单人/多人`、`/rg 开始 单人/多人 每日` 或 `/rg 开始 单人/多人 库:<标签>`")
+            return False, "未知的开局选项", True
+
+        checkpoint = saved_state.get("generation") if saved_state else None
+        if isinstance(checkpoint, dict) and checkpoint.get("game_mode") == game_mode and checkpoint.get("step1"):
+            return await self._run_generation(group_id, api_url, api_key, model_list, current_model_index, temperature, game_mode, checkpoint)
+        
+        if self.get_config("scenario_pool.enabled", False):
+            scenario = scenario_pool.pop(game_mode)
+            if scenario:
+                print(f"[规则怪谈] 使用预生成剧本开始游戏（{game_mode}），剧本池剩余 {scenario_pool.count(game_mode)} 个")
+                return await self._start_from_scenario(group_id, game_mode, scenario)
+
+        return await self._run_generation(group_id, api_url, api_key, model_list, current_model_index, temperature, game_mode)
+
+    @traced("handler:force_start_new_game")
+    async def _force_start_new_game(self, group_id: str, api_url: str, api_key: str, model_list: list, current_model_index: int, temperature: float, game_mode: str) -> Tuple[bool, Optional[str], bool]:
+        """强制开始一个新的规则怪谈游戏（覆盖存档和未完成的生成进度）"""
+        return await self._run_generation(group_id, api_url, api_key, model_list, current_model_index, temperature, game_mode)
 
-请仅返回JSON，不要包含任何其他文字。**重要：不要使用任何emoji表情符号。**
-        """
+    async def _run_generation(self, group_id: str, api_url: str, api_key: str, model_list: list, current_model_index: int, temperature: float, game_mode: str, checkpoint: Optional[dict] = None) -> Tuple[bool, Optional[str], bool]:
+        """按剧情导入、场景结构、规则的顺序生成剧本，每完成一步就写入存档，失败后可从最后完成的步骤继续"""
+        if checkpoint is None and self.get_config("generation.mode", "staged") == "combined":
+            return await self._start_new_game_combined(group_id, api_url, api_key, model_list, current_model_index, temperature, game_mode)
 
-        llm_response = await self._call_llm_api(step1_prompt, api_url, api_key, model, temperature)
-        if not llm_response:
-            await self.send_text("调用LLM API失败，请稍后再试。")
-            return False, "LLM API调用失败", True
+        if checkpoint is None:
+            checkpoint = {"game_mode": game_mode, "timings": {}, "attempts": {}}
+            await self.send_text("正在生成规则怪谈...")
+        else:
+            next_stage = next((stage for stage in GENERATION_STAGES if stage not in checkpoint), None)
+            if next_stage is None:
+                print(f"[规则怪谈] 生成进度中各步骤均已完成，直接开始游戏")
+                await self.send_text("检测到已生成完成的剧本，直接开始游戏...")
+            else:
+                print(f"[规则怪谈] 从生成进度恢复，继续生成 {next_stage}")
+                await self.send_text(f"检测到未完成的生成进度，将从「{GENERATION_STAGE_NAMES[next_stage]}」继续生成...")
 
-        print(f"[规则怪谈] 第一步（剧情导入）LLM原始返回: {llm_response}")
+        self._cancel_background_tasks(group_id)
+        game_states[group_id] = {"game_active": False, "game_mode": game_mode, "generation": checkpoint}
+        self._save_game_state(group_id)
 
-        try:
-            step1_data = json.loads(llm_response)
-        except json.JSONDecodeError as e:
-            print(f"[规则怪谈] 第一步JSON解析失败: {e}")
-            print(f"[规则怪谈] 尝试提取JSON部分...")
+        llm_args = (api_url, api_key, model_list, current_model_index, temperature)
+
+        step1_data = checkpoint.get("step1")
+        if step1_data is None:
+            step1_data = await self._run_generation_stage(group_id, checkpoint, "step1", self._build_step1_prompt(), *llm_args)
+            if step1_data is None:
+                return await self._report_generation_failure(checkpoint, "step1", game_mode)
+
+        # 剧情导入的渲染和发送与第二步生成并行进行，后续消息通过等待前一个展示任务保证发送顺序
+        plot_task = asyncio.create_task(self._present_plot(step1_data, game_mode, "正在生成场景结构..." if "step2" not in checkpoint else None))
+
+        step2_data = checkpoint.get("step2")
+        if step2_data is None:
+            step2_data = await self._run_generation_stage(group_id, checkpoint, "step2", self._build_step2_prompt(step1_data), *llm_args)
+            if step2_data is None:
+                await plot_task
+                return await self._report_generation_failure(checkpoint, "step2", game_mode)
+
+        # 场景结构的渲染和发送与第三步生成并行进行
+        scene_task = asyncio.create_task(self._present_scene_structure(plot_task, step2_data, "正在生成规则..." if "step3" not in checkpoint else None))
+
+        step3_data = checkpoint.get("step3")
+        if step3_data is None:
+            step3_data = await self._run_generation_stage(group_id, checkpoint, "step3", self._build_step3_prompt(step1_data, step2_data, game_mode), *llm_args)
+            if step3_data is None:
+                await scene_task
+                return await self._report_generation_failure(checkpoint, "step3", game_mode)
+
+        timings_text = ", ".join(f"{stage} {seconds:.1f}s" for stage, seconds in checkpoint["timings"].items())
+        print(f"[规则怪谈] 剧本生成完成，各阶段耗时: {timings_text}")
+
+        return await self._launch_game(group_id, game_mode, step1_data, step2_data, step3_data, plot_task, scene_task, generation_timings=checkpoint["timings"])
+
+    async def _run_generation_stage(self, group_id: str, checkpoint: dict, stage: str, prompt: str, api_url: str, api_key: str, model_list: list, current_model_index: int, temperature: float) -> Optional[dict]:
+        """生成剧本的一个步骤（失败时按配置重试），成功后将结果写入生成进度并保存，记录该步骤耗时"""
+        retries = max(int(self.get_config("generation.stage_retries", 1)), 0)
+        started_at = time.perf_counter()
+        
+        stage_data = None
+        for attempt in range(retries + 1):
+            checkpoint["attempts"][stage] = checkpoint["attempts"].get(stage, 0) + 1
+            if attempt > 0:
+                print(f"[规则怪谈] {GENERATION_STAGE_NAMES[stage]}生成失败（{checkpoint.get('last_error')}），第{attempt}次重试")
             
-            json_match = re.search(r'\{[\s\S]*\}', llm_response)
-            if json_match:
-                try:
-                    step1_data = json.loads(json_match.group())
-                    print(f"[规则怪谈] 第一步成功提取JSON")
-                except json.JSONDecodeError as e2:
-                    print(f"[规则怪谈] 第一步提取JSON后仍然解析失败: {e2}")
-                    await self.send_text("生成剧情导入失败，返回格式不正确。")
-                    return False, "JSON解析失败", True
-            else:
-                await self.send_text("生成剧情导入失败，返回格式不正确。")
-                return False, "JSON解析失败", True
+            llm_response = await self._call_llm_api(prompt, api_url, api_key, model_list, current_model_index, temperature, call_site=stage)
+            if not llm_response:
+                checkpoint["last_error"] = "LLM API调用失败"
+                continue
 
-        scene_name = step1_data.get("scene", "")
-        background = step1_data.get("background", "")
-        player_identity = step1_data.get("player_identity", "")
-        core_symbols = step1_data.get("core_symbols", [])
+            print(f"[规则怪谈] {GENERATION_STAGE_NAMES[stage]} LLM原始返回: {llm_response}")
 
-        await asyncio.sleep(0.5)
+            stage_data = self._parse_llm_json(llm_response, stage)
+            if stage_data is None:
+                checkpoint["last_error"] = "JSON解析失败"
+                continue
+            if stage == "step3" and not stage_data.get("rules"):
+                checkpoint["last_error"] = "未生成规则"
+                stage_data = None
+                continue
+            break
         
-        try:
-            plot_image_path = self._generate_plot_image(scene_name, background, player_identity, core_symbols)
-            game_states[group_id]["plot_image_path"] = plot_image_path
-            with open(plot_image_path, 'rb') as f:
-                image_bytes = f.read()
-            image_base64 = base64.b64encode(image_bytes).decode('ascii')
-            image_sent = await self.send_image(image_base64)
-            if not image_sent:
-                print(f"[规则怪谈] 剧情导入图片发送失败")
-            await asyncio.sleep(1.0)
-        except Exception as e:
-            print(f"[规则怪谈] 生成剧情导入长图失败: {str(e)}")
-            step1_text = (
-                f"**规则怪谈** ({game_mode}模式)\n\n"
-                f"**剧情导入**：\n{background}\n\n"
-                f"**你们的身份**：\n{player_identity}\n\n"
-                f"**场景**：{scene_name}"
-            )
-            await self.send_text(step1_text)
-            await asyncio.sleep(1.0)
+        checkpoint["timings"][stage] = round(checkpoint["timings"].get(stage, 0) + time.perf_counter() - started_at, 3)
+        if stage_data is not None:
+            checkpoint[stage] = stage_data
+            checkpoint.pop("last_error", None)
         
-        await self.send_text("正在生成场景结构...")
-        await asyncio.sleep(1.0)
+        if game_states.get(group_id, {}).get("generation") is checkpoint:
+            self._save_game_state(group_id)
+        return stage_data
 
-        step2_prompt = f"""
-你是一个专业的规则怪谈生成器。请基于以下剧情导入，生成场景结构。
+    async def _report_generation_failure(self, checkpoint: dict, stage: str, game_mode: str) -> Tuple[bool, Optional[str], bool]:
+        """告知玩家生成失败，已完成的步骤保留在存档中"""
+        reason = checkpoint.get("last_error", "生成失败")
+        if any(done_stage in checkpoint for done_stage in GENERATION_STAGES):
+            await self.send_text(
+                f"生成{GENERATION_STAGE_NAMES[stage]}失败（{reason}），已保存之前的生成进度。\n"
+                f"请稍后再次使用 `/rg 开始 {game_mode}`，将从「{GENERATION_STAGE_NAMES[stage]}」继续生成。"
+            )
+        else:
+            await self.send_text(f"生成{GENERATION_STAGE_NAMES[stage]}失败（{reason}），请稍后再试。")
+        return False, reason, True
 
-剧情导入：
-- 场景：{scene_name}
-- 背景：{background}
-- 玩家身份：{player_identity}
+    async def _start_new_game_combined(self, group_id: str, api_url: str, api_key: str, model_list: list, current_model_index: int, temperature: float, game_mode: str) -> Tuple[bool, Optional[str], bool]:
+        """一次调用生成剧情、场景、规则和规则网络，流式解析，剧情导入和场景结构一完整出现就开始发送"""
+        await self.send_text("正在生成规则怪谈...")
 
-要求：
-1. 确定建筑类型（如：医院、学校、公寓、庄园等）
-2. 描述建筑的总体布局（如：L型、U型、回字形、多层建筑等）
-3. 列出所有楼层（包括地上和地下），每层列出主要区域
-4. 列出通道、楼梯、电梯等连接方式
-5. 列出特殊区域（如：地下室、天台、禁闭室等）
-6. 场景结构应该与剧情导入的背景和氛围相符
-7. 以JSON格式返回，格式如下：
-{{
-  "building_type": "建筑类型",
-  "overall_layout": "建筑总体布局描述",
-  "floors": [
-    {{
-      "floor": "楼层名称",
-      "areas": ["区域1", "区域2", "区域3"]
-    }}
-  ],
-  "connections": ["通道1", "通道2", "通道3"],
-  "special_areas": ["特殊区域1", "特殊区域2"]
-}}
+        presented = {}
+
+        def on_text(text: str) -> None:
+            if "plot" not in presented:
+                plot = extract_completed_json_field(text, "plot")
+                if isinstance(plot, dict):
+                    presented["plot"] = plot
+                    presented["plot_task"] = asyncio.create_task(self._present_plot(plot, game_mode, "正在生成场景结构..."))
+            if "plot" in presented and "structure" not in presented:
+                structure = extract_completed_json_field(text, "structure")
+                if isinstance(structure, dict):
+                    presented["structure"] = structure
+                    presented["scene_task"] = asyncio.create_task(self._present_scene_structure(presented["plot_task"], structure, "正在生成规则..."))
+
+        started_at = time.perf_counter()
+        llm_response = await self._call_llm_api(self._build_combined_prompt(game_mode), api_url, api_key, model_list, current_model_index, temperature, call_site="combined", on_text=on_text)
+        generation_timings = {"combined": round(time.perf_counter() - started_at, 3)}
+        if llm_response:
+            print(f"[规则怪谈] 合并生成LLM原始返回: {llm_response}")
+        combined_data = self._parse_llm_json(llm_response, "combined") if llm_response else None
+
+        # 已经发送给玩家的剧情导入和场景结构以发送的内容为准（模型切换重试时可能不同）
+        if combined_data is not None:
+            for key in ("plot", "structure"):
+                if key in presented:
+                    combined_data[key] = presented[key]
+            on_text(json.dumps(combined_data, ensure_ascii=False))
+
+        if combined_data is None or not isinstance(combined_data.get("rules"), dict) or not combined_data["rules"].get("rules") or "scene_task" not in presented:
+            for task_name in ("scene_task", "plot_task"):
+                if task_name in presented:
+                    await presented[task_name]
+                    break
+            if not llm_response:
+                await self.send_text("调用LLM API失败，请稍后再试。")
+                return False, "LLM API调用失败", True
+            await self.send_text("生成规则怪谈失败，返回格式不正确。")
+            return False, "JSON解析失败", True
 
-请仅返回JSON，不要包含任何其他文字。**重要：不要使用任何emoji表情符号。**
-        """
+        rule_network = combined_data.get("rule_network")
+        if not isinstance(rule_network, dict) or not rule_network.get("truth_elements"):
+            rule_network = None
+        else:
+            rule_network = {
+                "truth_elements": rule_network.get("truth_elements", []),
+                "rule_truth_mappings": rule_network.get("rule_truth_mappings", []),
+                "rule_dependencies": rule_network.get("rule_dependencies", [])
+            }
 
-        llm_response = await self._call_llm_api(step2_prompt, api_url, api_key, model, temperature)
-        if not llm_response:
-            await self.send_text("调用LLM API失败，请稍后再试。")
-            return False, "LLM API调用失败", True
+        return await self._launch_game(
+            group_id, game_mode, presented["plot"], presented["structure"], combined_data["rules"],
+            presented["plot_task"], presented["scene_task"], rule_network, generation_timings
+        )
 
-        print(f"[规则怪谈] 第二步（场景结构）LLM原始返回: {llm_response}")
+    async def _start_from_scenario(self, group_id: str, game_mode: str, scenario: dict) -> Tuple[bool, Optional[str], bool]:
+        """使用剧本池中预生成的剧本开始游戏，无需等待生成"""
+        step1_data = scenario.get("step1", {})
+        step2_data = scenario.get("step2", {})
+        step3_data = scenario.get("step3", {})
+
+        plot_task = asyncio.create_task(self._present_plot(step1_data, game_mode))
+        scene_task = asyncio.create_task(self._present_scene_structure(plot_task, step2_data))
+        return await self._launch_game(group_id, game_mode, step1_data, step2_data, step3_data, plot_task, scene_task, scenario.get("rule_network"))
+
+    async def _start_from_library(self, group_id: str, game_mode: str, tag: str) -> Tuple[bool, Optional[str], bool]:
+        """从本地剧本库中随机选取一个匹配标签的剧本开始游戏，不调用LLM"""
+        entries = scenario_library.find(game_mode=game_mode, tag=tag or None)
+        if not entries:
+            tag_counts = scenario_library.tag_counts(game_mode)[:10]
+            reply_text = f"剧本库中没有符合「{tag}」的{game_mode}剧本。" if tag else f"剧本库中还没有{game_mode}剧本。"
+            if tag_counts:
+                reply_text += "\n可用标签：" + "、".join(f"{entry_tag}({count})" for entry_tag, count in tag_counts)
+            await self.send_text(reply_text)
+            return False, "剧本库中没有匹配的剧本", True
+
+        scenario = await asyncio.to_thread(scenario_library.read, random.choice(entries))
+        if not scenario or not scenario.get("step3", {}).get("rules"):
+            await self.send_text("读取剧本库失败，请稍后重试。")
+            return False, "读取剧本库失败", True
+
+        print(f"[规则怪谈] 从剧本库开始游戏（{game_mode}，标签「{tag}」，匹配 {len(entries)} 个）")
+        return await self._start_from_scenario(group_id, game_mode, scenario)
+
+    async def _start_shared_game(self, group_id: str, game_mode: str, shared: dict) -> Tuple[bool, Optional[str], bool]:
+        """使用共享剧本开始游戏，直接发送已渲染好的剧情、场景和规则图片"""
+        scenario = shared["scenario"]
+        base = shared["base"]
+        step1_data = scenario.get("step1", {})
+        step2_data = scenario.get("step2", {})
+        step3_data = scenario.get("step3", {})
+        rule_network = scenario.get("rule_network") or {}
+
+        plot_task = asyncio.create_task(self._present_plot(step1_data, game_mode, image_path=base.get("plot_image_path")))
+        scene_task = asyncio.create_task(self._present_scene_structure(plot_task, step2_data, image_path=base.get("scene_structure_image_path")))
+        return await self._launch_game(
+            group_id, game_mode, step1_data, step2_data, step3_data, plot_task, scene_task,
+            rule_network if rule_network.get("truth_elements") else None, shared_scenario=shared
+        )
 
-        try:
-            step2_data = json.loads(llm_response)
-        except json.JSONDecodeError as e:
-            print(f"[规则怪谈] 第二步JSON解析失败: {e}")
-            print(f"[规则怪谈] 尝试提取JSON部分...")
-            
-            json_match = re.search(r'\{[\s\S]*\}', llm_response)
-            if json_match:
-                try:
-                    step2_data = json.loads(json_match.group())
-                    print(f"[规则怪谈] 第二步成功提取JSON")
-                except json.JSONDecodeError as e2:
-                    print(f"[规则怪谈] 第二步提取JSON后仍然解析失败: {e2}")
-                    await self.send_text("生成场景结构失败，返回格式不正确。")
-                    return False, "JSON解析失败", True
-            else:
-                await self.send_text("生成场景结构失败，返回格式不正确。")
-                return False, "JSON解析失败", True
+    async def _launch_game(self, group_id: str, game_mode: str, step1_data: dict, step2_data: dict, step3_data: dict, plot_task: asyncio.Task, scene_task: asyncio.Task, rule_network: Optional[dict] = None, generation_timings: Optional[dict] = None, shared_scenario: Optional[dict] = None) -> Tuple[bool, Optional[str], bool]:
+        """根据三步生成的内容创建游戏状态并发送规则，未提供规则网络时在此构建；使用共享剧本时只读字段引用共享数据"""
+        scene_name = step1_data.get("scene", "")
+        background = step1_data.get("background", "")
+        player_identity = step1_data.get("player_identity", "")
+        core_symbols = step1_data.get("core_symbols", [])
 
         building_type = step2_data.get("building_type", "")
         overall_layout = step2_data.get("overall_layout", "")
@@ -526,157 +2497,9 @@ class RuleHorrorCommand(BaseCommand):
         connections = step2_data.get("connections", [])
         special_areas = step2_data.get("special_areas", [])
 
-        floors_text = "\n".join([f"  - {floor['floor']}: {', '.join(floor['areas'])}" for floor in floors])
-
-        await asyncio.sleep(0.5)
-         
-        try:
-            scene_structure_image_path = self._generate_scene_structure_text_image(
-                building_type, overall_layout, floors, connections, special_areas
-            )
-            with open(scene_structure_image_path, 'rb') as f:
-                image_bytes = f.read()
-            image_base64 = base64.b64encode(image_bytes).decode('ascii')
-            image_sent = await self.send_image(image_base64)
-            if not image_sent:
-                print(f"[规则怪谈] 场景结构图片发送失败")
-            await asyncio.sleep(0.5)
-             
-            game_state = game_states.get(group_id, {})
-            game_state["scene_structure_image_path"] = scene_structure_image_path
-            self._save_game_state(group_id)
-        except Exception as e:
-            print(f"[规则怪谈] 生成场景结构长图失败: {str(e)}")
-            floors_text = "\n".join([f"  - {floor['floor']}: {', '.join(floor['areas'])}" for floor in floors])
-
-        step2_text = f"""**场景结构**：
-
-**建筑类型**：{building_type}
-
-**总体布局**：{overall_layout}
-
-**楼层布局**：
-{floors_text}
-
-**连接通道**：{connections_text}
-
-**特殊区域**：{special_areas_text}"""
-        await self.send_text(step2_text)
-        await asyncio.sleep(0.5)
-
-        scene_structure_text = f"建筑类型：{building_type}\n"
-        scene_structure_text += "\n".join([f"{floor['floor']}: {', '.join(floor['areas'])}" for floor in floors])
-        scene_structure_text += f"\n连接通道：{connections_text}\n"
-        scene_structure_text += f"特殊区域：{special_areas_text}"
-
-        await asyncio.sleep(0.5)
-        
-        await self.send_text("正在生成规则...")
-        await asyncio.sleep(0.5)
-
-        step3_prompt = f"""
-你是一个专业的规则怪谈生成器。请基于以下剧情导入和场景结构，生成规则怪谈的规则。
-
-剧情导入：
-- 场景：{scene_name}
-- 背景：{background}
-- 玩家身份：{player_identity}
-
-场景结构：
-{scene_structure_text}
-
-游戏模式：{game_mode}
-
-要求：
-1. 列出5-8条规则，规则应该看似合理但隐藏着诡异之处
-2. 规则应该与剧情导入和场景结构相呼应
-3. 设定通关条件（如：在规定时间内找到出口、收集特定物品、存活到天亮等）
-4. 设定解除条件（如：找到规则怪谈的根源并消除它、找到某个特定物品并使用、完成某个仪式等）
-5. 规则应该有隐藏的逻辑和真相，需要玩家推理
-6. **规则与环境绑定（非常重要）**：请将至少2-3条规则与场景中特定的、可交互的环境细节直接关联。例如，如果规则是"不要理会走廊尽头的呼救声"，那么与之关联的环境可以是"走廊尽头的温度总是异常低，且墙上有抓痕"。这样，玩家在探索到该位置时，能通过环境感知强化对规则的记忆和怀疑
-7. **规则间的潜在冲突（非常重要）**：请尝试构建至少一组存在潜在矛盾的规则。例如，规则A："午夜后必须留在自己的房间内。" 规则B："公寓中没有404室。" 实际上公寓中有404室，但是仅在午夜后才会出现，此时玩家将陷入遵守A还是出门寻找404室的两两难境地。请在 hidden_truth 中解释这种矛盾的本质（如：两条规则来自不同势力），并在 death_triggers 中隐含相关触发条件
-8. **规则与真相的因果关系（非常重要）**：每条规则都应该与隐藏真相中的某个要素有直接的因果关系。规则不是孤立的，而是形成了一个相互关联的规则网络。例如：
-   - 如果真相是"工厂的夜间保安是来自异世界的实体"，那么规则"夜间只允许蓝色制服的保安巡逻"就是对这个真相的伪装性描述
-   - 如果真相是"三楼东侧病房的窗户是通往异界的通道"，那么规则"三楼东侧病房的窗户必须保持关闭状态"就是对这个危险通道的防护措施
-   - 规则之间应该形成推理链条：遵守规则A -> 发现异常B -> 触发规则C -> 揭示真相D
-9. **协作规则（多人模式非常重要）**：如果游戏模式是"多人"，请设计1-2条需要多个玩家协作才能发现或触发的规则。例如：
-   - 规则A："当两名玩家同时站在不同的位置时，某个隐藏的通道才会开启"
-   - 规则B："只有当一名玩家持有特定物品，另一名玩家说出特定口令时，才能解除某个陷阱"
-   - 规则C："需要三名玩家分别在三个不同的地点同时执行某个动作，才能揭示某个关键真相"
-   - 协作规则应该鼓励玩家之间的沟通和合作，而不是各自为战
-   - 协作规则的设计应该巧妙，让玩家在探索过程中自然地发现协作的必要性
-   - 在 hidden_truth 中说明协作规则的设计意图和触发条件
-10. **规则标题（非常重要）**：根据场景类型和玩家身份，生成一个贴合剧情的规则标题。例如：
-   - 工厂场景：员工守则、安全规程、操作手册
-   - 医院场景：患者须知、病房守则、医疗规程
-   - 学校场景：学生守则、校园安全须知、宿舍管理规定
-   - 城堡场景：访客须知、城堡守则、安全指南
-   - 酒店场景：入住须知、客房服务守则、安全警示
-   - 超市场景：员工手册、营业规范、安全须知
-   - 地铁场景：乘客须知、安全规程、运营守则
-   标题应该简洁、正式，符合该场景的官方文件风格
-
-**规则描述要求（非常重要）：**
-- 规则必须简洁、直接，每条规则不超过60字
-- 只说明禁止、允许或要求做的行为，不解释原因
-- 使用标准格式：禁止XX / 当XX时，必须XX / 只有XX时才能XX / 必须XX / 严禁XX
-- 使用冰冷、客观的公文语调，如同官方通告或操作手册
-- 语调应该冷静、正式、不带感情色彩
-- 可以加入少量关键的环境或感官细节，但要简洁
-- 细节应该让人感到不安和恐惧，但不要直接揭示真相
-
-示例规则风格：
-"禁止在22:00-06:00期间离开房间。"
-"听到三声敲门时，必须立即开门。"
-"三楼东侧病房的窗户必须保持关闭状态。若发现窗户自行开启，请立即通知安保人员并远离开启的窗户。"
-"严禁回应任何呼救声。"
-"只有看到绿色灯光时才能进入走廊。"
-"工厂只有蓝色制服的保安，若看见黑色制服的保安，请立即报告主管。"
-"城堡内没有镜子，如果你觉得你看到了镜子，请相信那是你的幻觉。"
-
-以JSON格式返回，格式如下：
-{{
-  "rules_title": "规则标题（如：员工守则、患者须知等）",
-  "rules": ["规则1", "规则2", ...],
-  "win_condition": "通关条件",
-  "resolve_condition": "解除条件（解决规则怪谈根源的条件）",
-  "hidden_truth": "隐藏的真相（以叙事方式描述场景背后的真实情况，不要提及规则编号或明确说明规则与真相的对应关系）",
-  "death_triggers": ["会导致死亡的行为1", "会导致死亡的行为2", ...]
-}}
-
-请仅返回JSON，不要包含任何其他文字。**重要：不要使用任何emoji表情符号。**
-        """
-
-        llm_response = await self._call_llm_api(step3_prompt, api_url, api_key, model, temperature)
-        if not llm_response:
-            await self.send_text("调用LLM API失败，请稍后再试。")
-            return False, "LLM API调用失败", True
-
-        print(f"[规则怪谈] 第三步（规则）LLM原始返回: {llm_response}")
-
-        try:
-            step3_data = json.loads(llm_response)
-        except json.JSONDecodeError as e:
-            print(f"[规则怪谈] 第三步JSON解析失败: {e}")
-            print(f"[规则怪谈] 尝试提取JSON部分...")
-            
-            json_match = re.search(r'\{[\s\S]*\}', llm_response)
-            if json_match:
-                try:
-                    step3_data = json.loads(json_match.group())
-                    print(f"[规则怪谈] 第三步成功提取JSON")
-                except json.JSONDecodeError as e2:
-                    print(f"[规则怪谈] 第三步提取JSON后仍然解析失败: {e2}")
-                    await self.send_text("生成规则失败，返回格式不正确。")
-                    return False, "JSON解析失败", True
-            else:
-                await self.send_text("生成规则失败，返回格式不正确。")
-                return False, "JSON解析失败", True
-
-        rules_image_path = None
-        
         max_players = 5 if game_mode == "多人" else 1
 
+        self._cancel_background_tasks(group_id)
         game_states[group_id] = {
             "scene": scene_name,
             "background": background,
@@ -698,8 +2521,8 @@ class RuleHorrorCommand(BaseCommand):
             "max_players": max_players,
             "game_mode": game_mode,
             "players": {},
-            "plot_image_path": plot_image_path,
-            "rules_image_path": rules_image_path,
+            "plot_image_path": None,
+            "rules_image_path": None,
             "scene_structure_image_path": None,
             "time_system": {
                 "start_time": datetime.now().isoformat(),
@@ -735,48 +2558,73 @@ class RuleHorrorCommand(BaseCommand):
                 "discovered_truths": []
             },
             "collaborative_events": [],
-            "action_image_paths": []
+            "action_image_paths": [],
+            "generation_timings": generation_timings or {},
+            "rng_seed": current_game_seed.get() or self._new_game_seed(),
+            "rng_counter": 0
         }
+        if shared_scenario is not None:
+            own_state = {key: value for key, value in game_states[group_id].items() if key not in SHARED_SCENARIO_KEYS}
+            own_state["shared_scenario_id"] = shared_scenario["id"]
+            game_states[group_id] = SharedScenarioState(shared_scenario["base"], own_state)
+        game_state = game_states[group_id]
+        self._get_trigger_index(game_state)
+        self._get_location_graph(game_state)
 
         self._save_game_state(group_id)
 
-        await self._build_rule_network(group_id)
+        # 规则网络在后台构建，构建完成前行动判定使用不含规则网络的提示词
+        if rule_network:
+            game_state["rule_network"].update(rule_network)
+            game_state["rule_network_status"] = "ready"
+        else:
+            self._start_rule_network_task(group_id)
+        self._start_hint_bank_task(group_id)
 
         rules_title = step3_data.get("rules_title", "规则")
         rules = step3_data.get("rules", [])
         win_condition = step3_data.get('win_condition', '')
 
-        rules_image_path = None
-        
+        rules_image_path = game_state.get("rules_image_path")
+        if not rules_image_path or not os.path.exists(rules_image_path):
+            rules_image_path = None
+            try:
+                rules_image_path = await asyncio.to_thread(self._generate_rules_image, rules_title, rules, win_condition, game_mode)
+            except Exception as e:
+                print(f"[规则怪谈] 生成规则长图失败: {str(e)}")
+
+        plot_image_path = await plot_task
+        scene_structure_image_path = await scene_task
+        if shared_scenario is None:
+            game_state["plot_image_path"] = plot_image_path
+            game_state["scene_structure_image_path"] = scene_structure_image_path
+
         try:
-            rules_image_path = self._generate_rules_image(rules_title, rules, win_condition, game_mode)
-            game_states[group_id]["rules_image_path"] = rules_image_path
+            if not rules_image_path:
+                raise Exception("规则长图未生成")
+            if shared_scenario is None:
+                game_state["rules_image_path"] = rules_image_path
             with open(rules_image_path, 'rb') as f:
                 image_bytes = f.read()
             image_base64 = base64.b64encode(image_bytes).decode('ascii')
             
-            # 确保图像发送完成后再继续
             image_sent = await self.send_image(image_base64)
             if not image_sent:
                 raise Exception("规则长图发送失败")
-            
-            # 增加延迟，确保图像完全显示后再发送后续消息
-            await asyncio.sleep(1.5)
         except Exception as e:
-            print(f"[规则怪谈] 生成规则长图失败: {str(e)}")
+            print(f"[规则怪谈] 发送规则长图失败: {str(e)}")
             step3_text = f"**{rules_title}**：\n"
             for i, rule in enumerate(rules, 1):
                 step3_text += f"{i}. {rule}\n"
             step3_text += f"\n**你的目标是**：{win_condition}"
             await self.send_text(step3_text)
-            await asyncio.sleep(0.5)
 
         if game_mode == "单人":
             user_info = self._get_user_info()
             if user_info:
                 user_id = user_info.user_id
                 user_name = getattr(user_info, 'user_name', f"玩家{user_id}")
-                game_states[group_id]["players"][user_id] = {
+                game_state["players"][user_id] = {
                     "name": user_name,
                     "reasoning_history": [],
                     "action_history": [],
@@ -801,11 +2649,12 @@ class RuleHorrorCommand(BaseCommand):
                     "inventory": [],
                     "location": "入口"
                 }
-                self._save_game_state(group_id)
                 player_text = f"**玩家**：{user_name}\n"
             else:
                 player_text = f"**玩家**：0/1\n"
 
+            self._save_game_state(group_id)
+
             player_text += f"**提示次数**：0/3\n\n"
             player_text += f"- 使用 `/rg 提示 <规则/线索>` 获取提示\n"
             player_text += f"- 使用 `/rg 推理 <推理内容>` 记录推理\n"
@@ -815,16 +2664,16 @@ class RuleHorrorCommand(BaseCommand):
 
             await self.send_text(player_text)
         else:
+            self._save_game_state(group_id)
             try:
-                multiplayer_start_image_path = self._generate_multiplayer_start_image(max_players=5)
-                game_states[group_id]["multiplayer_start_image_path"] = multiplayer_start_image_path
+                multiplayer_start_image_path = await asyncio.to_thread(self._generate_multiplayer_start_image, max_players=5)
+                game_state["multiplayer_start_image_path"] = multiplayer_start_image_path
                 with open(multiplayer_start_image_path, 'rb') as f:
                     image_bytes = f.read()
                 image_base64 = base64.b64encode(image_bytes).decode('ascii')
                 image_sent = await self.send_image(image_base64)
                 if not image_sent:
                     print(f"[规则怪谈] 多人模式开始图片发送失败")
-                await asyncio.sleep(0.5)
             except Exception as e:
                 print(f"[规则怪谈] 生成多人模式提示长图失败: {str(e)}")
                 player_text = f"**玩家**：0/5\n"
@@ -836,177 +2685,76 @@ class RuleHorrorCommand(BaseCommand):
                 player_text += f"- 使用 `/rg 状态` 查看游戏状态\n"
                 player_text += f"- 使用 `/rg 结束` 结束游戏"
                 await self.send_text(player_text)
-                await asyncio.sleep(0.5)
+
+        if game_state.get("rule_network_status") == "ready":
+            await self._archive_scenario(game_state)
 
         return True, "已开始游戏", True
 
-    async def _join_game(self, group_id: str) -> Tuple[bool, Optional[str], bool]:
-        """加入游戏"""
-        game_state = game_states.get(group_id, {})
-        
-        user_info = self._get_user_info()
-        if not user_info:
-            await self.send_text("无法获取用户信息。")
-            return False, "无法获取用户信息", True
+    async def _present_plot(self, step1_data: dict, game_mode: str, next_notice: Optional[str] = None, image_path: Optional[str] = None) -> Optional[str]:
+        """渲染并发送剧情导入长图（失败时发送文字），返回图片路径；提供已渲染的 image_path 时直接发送"""
+        scene_name = step1_data.get("scene", "")
+        background = step1_data.get("background", "")
+        player_identity = step1_data.get("player_identity", "")
+        core_symbols = step1_data.get("core_symbols", [])
         
-        user_id = user_info.user_id
-        user_name = getattr(user_info, 'user_name', f"玩家{user_id}")
+        plot_image_path = image_path if image_path and os.path.exists(image_path) else None
+        try:
+            if plot_image_path is None:
+                plot_image_path = await asyncio.to_thread(self._generate_plot_image, scene_name, background, player_identity, core_symbols)
+            with open(plot_image_path, 'rb') as f:
+                image_bytes = f.read()
+            image_base64 = base64.b64encode(image_bytes).decode('ascii')
+            image_sent = await self.send_image(image_base64)
+            if not image_sent:
+                print(f"[规则怪谈] 剧情导入图片发送失败")
+        except Exception as e:
+            print(f"[规则怪谈] 生成剧情导入长图失败: {str(e)}")
+            step1_text = (
+                f"**规则怪谈** ({game_mode}模式)\n\n"
+                f"**剧情导入**：\n{background}\n\n"
+                f"**你们的身份**：\n{player_identity}\n\n"
+                f"**场景**：{scene_name}"
+            )
+            await self.send_text(step1_text)
         
-        if user_id in game_state.get("players", {}):
-            await self.send_text("你已经在游戏中了。")
-            return False, "已在游戏中", True
+        if next_notice:
+            await self.send_text(next_notice)
+        return plot_image_path
+
+    async def _present_scene_structure(self, previous_task: asyncio.Task, step2_data: dict, next_notice: Optional[str] = None, image_path: Optional[str] = None) -> Optional[str]:
+        """渲染场景结构长图，等待前一条展示发送完成后再发送，返回图片路径；提供已渲染的 image_path 时直接发送"""
+        building_type = step2_data.get("building_type", "")
+        overall_layout = step2_data.get("overall_layout", "")
+        floors = step2_data.get("floors", [])
+        connections = step2_data.get("connections", [])
+        special_areas = step2_data.get("special_areas", [])
+        floors_text = "\n".join([f"  - {floor['floor']}: {', '.join(floor['areas'])}" for floor in floors])
         
-        players = game_state.get("players", {})
-        if len(players) >= game_state.get("max_players", 5):
-            await self.send_text(f"游戏人数已满（最多{game_state.get('max_players', 5)}人）。")
-            return False, "游戏人数已满", True
+        scene_structure_image_path = image_path if image_path and os.path.exists(image_path) else None
+        if scene_structure_image_path is None:
+            try:
+                scene_structure_image_path = await asyncio.to_thread(
+                    self._generate_scene_structure_text_image,
+                    building_type, overall_layout, floors, connections, special_areas
+                )
+            except Exception as e:
+                print(f"[规则怪谈] 生成场景结构长图失败: {str(e)}")
         
-        players[user_id] = {
-            "name": user_name,
-            "reasoning_history": [],
-            "action_history": [],
-            "is_alive": True,
-            "current_identity": game_state.get("player_identity", ""),
-            "personal_rules": game_state.get("rules", []).copy(),
-            "physical_status": {
-                "health": 100,
-                "injury": "无",
-                "fatigue": "无"
-            },
-            "mental_status": {
-                "sanity": 100,
-                "state": "正常",
-                "emotion": "平静"
-            },
-            "psychological_pressure": {
-                "fear_level": 0,
-                "anxiety_level": 0,
-                "stress_level": 0
-            },
-            "inventory": [],
-            "location": "入口"
-        }
-        game_state["players"] = players
+        await previous_task
         
-        self._save_game_state(group_id)
-        
-        reply_text = (
-            f"**{user_name}** 已加入游戏！\n\n"
-            f"**当前玩家**：{len(players)}/{game_state.get('max_players', 5)}\n"
-        )
-        
-        for pid, p_data in players.items():
-            status = "存活" if p_data["is_alive"] else "死亡"
-            reply_text += f"- {p_data['name']} ({status})\n"
-        
-        await self.send_text(reply_text)
-        return True, "已加入游戏", True
-
-    async def _leave_game(self, group_id: str) -> Tuple[bool, Optional[str], bool]:
-        """离开游戏"""
-        game_state = game_states.get(group_id, {})
-        
-        user_info = self._get_user_info()
-        if not user_info:
-            await self.send_text("无法获取用户信息。")
-            return False, "无法获取用户信息", True
-        
-        user_id = user_info.user_id
-        user_name = getattr(user_info, 'user_name', f"玩家{user_id}")
-        
-        players = game_state.get("players", {})
-        if user_id not in players:
-            await self.send_text("你不在游戏中。")
-            return False, "不在游戏中", True
-        
-        del players[user_id]
-        game_state["players"] = players
-        
-        self._save_game_state(group_id)
-        
-        reply_text = (
-            f"**{user_name}** 已离开游戏。\n\n"
-            f"**当前玩家**：{len(players)}/{game_state.get('max_players', 5)}\n"
-        )
-        
-        for pid, p_data in players.items():
-            status = "存活" if p_data["is_alive"] else "死亡"
-            reply_text += f"- {p_data['name']} ({status})\n"
-        
-        await self.send_text(reply_text)
-        return True, "已离开游戏", True
-
-    async def _show_game_status(self, group_id: str) -> Tuple[bool, Optional[str], bool]:
-        """显示游戏状态"""
-        game_state = game_states.get(group_id, {})
-        players = game_state.get("players", {})
-        
-        reply_text = (
-            f"**游戏状态**\n\n"
-            f"**场景**：{game_state.get('scene', '')}\n\n"
-            f"**通关条件**：{game_state.get('win_condition', '')}\n\n"
-            f"**玩家**：{len(players)}/{game_state.get('max_players', 5)}\n"
-        )
-        
-        if players:
-            for pid, p_data in players.items():
-                status = "存活" if p_data["is_alive"] else "死亡"
-                reply_text += f"\n- {p_data['name']} ({status})\n"
-                reply_text += f"   推理次数：{len(p_data['reasoning_history'])}\n"
-                reply_text += f"   行动次数：{len(p_data['action_history'])}\n"
-                
-                if p_data["is_alive"]:
-                    physical = p_data.get("physical_status", {})
-                    mental = p_data.get("mental_status", {})
-                    reply_text += f"   体力：{physical.get('health', 100)}/100\n"
-                    reply_text += f"   受伤：{physical.get('injury', '无')}\n"
-                    reply_text += f"   疲劳：{physical.get('fatigue', '无')}\n"
-                    reply_text += f"   理智：{mental.get('sanity', 100)}/100\n"
-                    reply_text += f"   精神：{mental.get('state', '正常')}\n"
-        else:
-            reply_text += "暂无玩家\n"
-        
-        reply_text += f"\n**提示次数**：{game_state.get('hints_used', 0)}/{game_state.get('max_hints', 3)}"
-        
-        await self.send_text(reply_text)
-        return True, "已显示游戏状态", True
-
-    async def _show_rules(self, group_id: str) -> Tuple[bool, Optional[str], bool]:
-        """显示当前规则"""
-        game_state = game_states.get(group_id, {})
-        
-        rules_title = game_state.get('rules_title', '规则')
-        reply_text = f"**{rules_title}**\n"
-        
-        rules = game_state.get('rules', [])
-        if rules:
-            for i, rule in enumerate(rules, 1):
-                reply_text += f"{i}. {rule}\n"
-        else:
-            reply_text += "暂无规则\n"
-        
-        reply_text += f"\n**通关条件**：{game_state.get('win_condition', '')}"
-        
-        await self.send_text(reply_text)
-        return True, "已显示规则", True
-
-    async def _show_scene(self, group_id: str) -> Tuple[bool, Optional[str], bool]:
-        """显示场景结构"""
-        game_state = game_states.get(group_id, {})
-        
-        building_type = game_state.get('building_type', '')
-        overall_layout = game_state.get('overall_layout', '')
-        floors = game_state.get('floors', [])
-        connections = game_state.get('connections', [])
-        special_areas = game_state.get('special_areas', [])
-        
-        floors_text = "\n".join([f"  - {floor['floor']}: {', '.join(floor['areas'])}" for floor in floors])
-        connections_text = ", ".join(connections)
-        special_areas_text = ", ".join(special_areas)
-        
-        reply_text = f"""**场景**：{game_state.get('scene', '')}
+        if scene_structure_image_path:
+            try:
+                with open(scene_structure_image_path, 'rb') as f:
+                    image_bytes = f.read()
+                image_base64 = base64.b64encode(image_bytes).decode('ascii')
+                image_sent = await self.send_image(image_base64)
+                if not image_sent:
+                    print(f"[规则怪谈] 场景结构图片发送失败")
+            except Exception as e:
+                print(f"[规则怪谈] 发送场景结构长图失败: {str(e)}")
 
-**场景结构**：
+        step2_text = f"""**场景结构**：
 
 **建筑类型**：{building_type}
 
@@ -1015,97 +2763,464 @@ class RuleHorrorCommand(BaseCommand):
 **楼层布局**：
 {floors_text}
 
-**连接通道**：{connections_text}
+**连接通道**：{", ".join(connections)}
 
-**特殊区域**：{special_areas_text}
+**特殊区域**：{", ".join(special_areas)}"""
+        await self.send_text(step2_text)
+        if next_notice:
+            await self.send_text(next_notice)
+        return scene_structure_image_path
 
-**当前时间**：{game_state.get('time_system', {}).get('current_time', '未知')}
-**环境状况**：
-   - 光线：{game_state.get('environment', {}).get('lighting', '未知')}
-   - 温度：{game_state.get('environment', {}).get('temperature', '未知')}
-   - 声音：{', '.join(game_state.get('environment', {}).get('sounds', ['未知']))}
-   - 气味：{', '.join(game_state.get('environment', {}).get('smells', ['未知']))}
-   - 氛围：{game_state.get('environment', {}).get('atmosphere', '未知')}
-"""
-        
-        await self.send_text(reply_text)
-        
-        return True, "已显示场景", True
+    def _build_step1_prompt(self) -> str:
+        """构建第一步（剧情导入）的提示词"""
+        return """
+你是一个专业的规则怪谈生成器。请生成一个恐怖或诡异的规则怪谈的剧情导入。
 
-    async def _show_plot(self, group_id: str) -> Tuple[bool, Optional[str], bool]:
-        """显示剧情导入"""
-        game_state = game_states.get(group_id, {})
-        
-        reply_text = (
-            f"**场景**：{game_state.get('scene', '')}\n\n"
-            f"**剧情导入**：\n{game_state.get('background', '')}\n\n"
-            f"**你的身份**：\n{game_state.get('player_identity', '')}"
-        )
-        
-        await self.send_text(reply_text)
-        return True, "已显示剧情", True
+要求：
+1. 生成一个场景（如：深夜的医院、废弃的学校、神秘的公寓、古老的庄园等）
+2. 描述场景的背景故事（这个场景的历史、发生过什么、为什么诡异）
+3. 描述玩家在这个场景中的身份或角色（如：工厂员工、夜班护士、新入职教师、庄园管家等），身份应与场景和剧情相符
+4. 剧情应该充满悬疑和恐怖氛围，为后续的规则和探索做铺垫
+5. 生成2-3个"核心象征符号"，这些符号将在整个游戏中反复出现，营造主题感和不安感。符号可以是数字、图案、旋律、花纹、颜色等。每个符号需要有一个简短的描述，暗示其可能的含义或与场景的联系。
+6. 以JSON格式返回，格式如下：
+{
+  "scene": "场景名称（如：深夜的废弃医院）",
+  "background": "场景背景故事，描述这个场景的历史、发生过什么、为什么诡异",
+  "player_identity": "玩家在这个场景中的身份或角色",
+  "core_symbols": [
+    {"symbol": "符号1", "description": "符号1的描述"},
+    {"symbol": "符号2", "description": "符号2的描述"}
+  ]
+}
 
-    async def _provide_hint(self, group_id: str, hint_type: str, api_url: str, api_key: str, model_list: list, current_model_index: int, temperature: float) -> Tuple[bool, Optional[str], bool]:
-        """提供提示"""
-        game_state = game_states.get(group_id, {})
+请仅返回JSON，不要包含任何其他文字。**重要：不要使用任何emoji表情符号。**
+        """
 
-        if game_state.get("hints_used", 0) >= game_state.get("max_hints", 3):
-            await self.send_text("提示次数已用完。")
-            return False, "提示次数用完", True
+    def _build_step2_prompt(self, step1_data: dict) -> str:
+        """构建第二步（场景结构）的提示词"""
+        scene_name = step1_data.get("scene", "")
+        background = step1_data.get("background", "")
+        player_identity = step1_data.get("player_identity", "")
 
-        if hint_type not in ["规则", "线索"]:
-            await self.send_text("提示类型无效。请选择：规则 或 线索")
-            return False, "提示类型无效", True
+        return f"""
+你是一个专业的规则怪谈生成器。请基于以下剧情导入，生成场景结构。
 
-        game_state["hints_used"] += 1
-        remaining_hints = game_state["max_hints"] - game_state["hints_used"]
-        
-        self._save_game_state(group_id)
+剧情导入：
+- 场景：{scene_name}
+- 背景：{background}
+- 玩家身份：{player_identity}
 
-        if hint_type == "规则":
-            prompt = f"""
-你是一个规则怪谈助手。玩家想要验证某个规则是否正确。
+要求：
+1. 确定建筑类型（如：医院、学校、公寓、庄园等）
+2. 描述建筑的总体布局（如：L型、U型、回字形、多层建筑等）
+3. 列出所有楼层（包括地上和地下），每层列出主要区域
+4. 列出通道、楼梯、电梯等连接方式
+5. 列出特殊区域（如：地下室、天台、禁闭室等）
+6. 场景结构应该与剧情导入的背景和氛围相符
+7. 以JSON格式返回，格式如下：
+{{
+  "building_type": "建筑类型",
+  "overall_layout": "建筑总体布局描述",
+  "floors": [
+    {{
+      "floor": "楼层名称",
+      "areas": ["区域1", "区域2", "区域3"]
+    }}
+  ],
+  "connections": ["通道1", "通道2", "通道3"],
+  "special_areas": ["特殊区域1", "特殊区域2"]
+}}
 
-场景：{game_state.get('scene', '')}
-规则：{json.dumps(game_state.get('rules', []), ensure_ascii=False)}
-隐藏真相：{game_state.get('hidden_truth', '')}
+请仅返回JSON，不要包含任何其他文字。**重要：不要使用任何emoji表情符号。**
+        """
 
-请随机选择一条规则，并给出一个关于这条规则的提示，帮助玩家理解这条规则的真正含义。
-提示应该模糊但有帮助，不要直接揭示真相。
-请仅返回提示内容，不要包含任何其他文字。**重要：不要使用任何emoji表情符号。**
-            """
-        else:
-            prompt = f"""
-你是一个规则怪谈助手。玩家想要获取线索。
+    def _build_step3_prompt(self, step1_data: dict, step2_data: dict, game_mode: str) -> str:
+        """构建第三步（规则）的提示词"""
+        scene_name = step1_data.get("scene", "")
+        background = step1_data.get("background", "")
+        player_identity = step1_data.get("player_identity", "")
 
-场景：{game_state.get('scene', '')}
-规则：{json.dumps(game_state.get('rules', []), ensure_ascii=False)}
-隐藏真相：{game_state.get('hidden_truth', '')}
-通关条件：{game_state.get('win_condition', '')}
+        floors = step2_data.get("floors", [])
+        connections_text = ", ".join(step2_data.get("connections", []))
+        special_areas_text = ", ".join(step2_data.get("special_areas", []))
 
-请给出一个关于如何达成通关条件的线索。
-线索应该模糊但有帮助，不要直接揭示答案。
-请仅返回线索内容，不要包含任何其他文字。**重要：不要使用任何emoji表情符号。**
-            """
+        scene_structure_text = f"建筑类型：{step2_data.get('building_type', '')}\n"
+        scene_structure_text += "\n".join([f"{floor['floor']}: {', '.join(floor['areas'])}" for floor in floors])
+        scene_structure_text += f"\n连接通道：{connections_text}\n"
+        scene_structure_text += f"特殊区域：{special_areas_text}"
 
-        llm_response = await self._call_llm_api(prompt, api_url, api_key, model, temperature)
-        if not llm_response:
-            await self.send_text("调用LLM API失败，请稍后再试。")
-            return False, "LLM API调用失败", True
+        return f"""
+你是一个专业的规则怪谈生成器。请基于以下剧情导入和场景结构，生成规则怪谈的规则。
 
-        hint_text = llm_response.strip()
+剧情导入：
+- 场景：{scene_name}
+- 背景：{background}
+- 玩家身份：{player_identity}
 
-        reply_text = (
-            f"**提示** ({hint_type})\n\n"
-            f"{hint_text}\n\n"
-            f"**剩余提示次数**：{remaining_hints}/{game_state['max_hints']}"
-        )
+场景结构：
+{scene_structure_text}
 
-        await self.send_text(reply_text)
-        return True, "已提供提示", True
+游戏模式：{game_mode}
 
-    async def _record_reasoning(self, group_id: str, reasoning: str, api_url: str, api_key: str, model_list: list, current_model_index: int, temperature: float) -> Tuple[bool, Optional[str], bool]:
-        """记录推理"""
+要求：
+1. 列出5-8条规则，规则应该看似合理但隐藏着诡异之处
+2. 规则应该与剧情导入和场景结构相呼应
+3. 设定通关条件（如：在规定时间内找到出口、收集特定物品、存活到天亮等）
+4. 设定解除条件（如：找到规则怪谈的根源并消除它、找到某个特定物品并使用、完成某个仪式等）
+5. 规则应该有隐藏的逻辑和真相，需要玩家推理
+6. **规则与环境绑定（非常重要）**：请将至少2-3条规则与场景中特定的、可交互的环境细节直接关联。例如，如果规则是"不要理会走廊尽头的呼救声"，那么与之关联的环境可以是"走廊尽头的温度总是异常低，且墙上有抓痕"。这样，玩家在探索到该位置时，能通过环境感知强化对规则的记忆和怀疑
+7. **规则间的潜在冲突（非常重要）**：请尝试构建至少一组存在潜在矛盾的规则。例如，规则A："午夜后必须留在自己的房间内。" 规则B："公寓中没有404室。" 实际上公寓中有404室，但是仅在午夜后才会出现，此时玩家将陷入遵守A还是出门寻找404室的两两难境地。请在 hidden_truth 中解释这种矛盾的本质（如：两条规则来自不同势力），并在 death_triggers 中隐含相关触发条件
+8. **规则与真相的因果关系（非常重要）**：每条规则都应该与隐藏真相中的某个要素有直接的因果关系。规则不是孤立的，而是形成了一个相互关联的规则网络。例如：
+   - 如果真相是"工厂的夜间保安是来自异世界的实体"，那么规则"夜间只允许蓝色制服的保安巡逻"就是对这个真相的伪装性描述
+   - 如果真相是"三楼东侧病房的窗户是通往异界的通道"，那么规则"三楼东侧病房的窗户必须保持关闭状态"就是对这个危险通道的防护措施
+   - 规则之间应该形成推理链条：遵守规则A -> 发现异常B -> 触发规则C -> 揭示真相D
+9. **协作规则（多人模式非常重要）**：如果游戏模式是"多人"，请设计1-2条需要多个玩家协作才能发现或触发的规则。例如：
+   - 规则A："当两名玩家同时站在不同的位置时，某个隐藏的通道才会开启"
+   - 规则B："只有当一名玩家持有特定物品，另一名玩家说出特定口令时，才能解除某个陷阱"
+   - 规则C："需要三名玩家分别在三个不同的地点同时执行某个动作，才能揭示某个关键真相"
+   - 协作规则应该鼓励玩家之间的沟通和合作，而不是各自为战
+   - 协作规则的设计应该巧妙，让玩家在探索过程中自然地发现协作的必要性
+   - 在 hidden_truth 中说明协作规则的设计意图和触发条件
+10. **规则标题（非常重要）**：根据场景类型和玩家身份，生成一个贴合剧情的规则标题。例如：
+   - 工厂场景：员工守则、安全规程、操作手册
+   - 医院场景：患者须知、病房守则、医疗规程
+   - 学校场景：学生守则、校园安全须知、宿舍管理规定
+   - 城堡场景：访客须知、城堡守则、安全指南
+   - 酒店场景：入住须知、客房服务守则、安全警示
+   - 超市场景：员工手册、营业规范、安全须知
+   - 地铁场景：乘客须知、安全规程、运营守则
+   标题应该简洁、正式，符合该场景的官方文件风格
+
+**规则描述要求（非常重要）：**
+- 规则必须简洁、直接，每条规则不超过60字
+- 只说明禁止、允许或要求做的行为，不解释原因
+- 使用标准格式：禁止XX / 当XX时，必须XX / 只有XX时才能XX / 必须XX / 严禁XX
+- 使用冰冷、客观的公文语调，如同官方通告或操作手册
+- 语调应该冷静、正式、不带感情色彩
+- 可以加入少量关键的环境或感官细节，但要简洁
+- 细节应该让人感到不安和恐惧，但不要直接揭示真相
+
+示例规则风格：
+"禁止在22:00-06:00期间离开房间。"
+"听到三声敲门时，必须立即开门。"
+"三楼东侧病房的窗户必须保持关闭状态。若发现窗户自行开启，请立即通知安保人员并远离开启的窗户。"
+"严禁回应任何呼救声。"
+"只有看到绿色灯光时才能进入走廊。"
+"工厂只有蓝色制服的保安，若看见黑色制服的保安，请立即报告主管。"
+"城堡内没有镜子，如果你觉得你看到了镜子，请相信那是你的幻觉。"
+
+以JSON格式返回，格式如下：
+{{
+  "rules_title": "规则标题（如：员工守则、患者须知等）",
+  "rules": ["规则1", "规则2", ...],
+  "win_condition": "通关条件",
+  "resolve_condition": "解除条件（解决规则怪谈根源的条件）",
+  "hidden_truth": "隐藏的真相（以叙事方式描述场景背后的真实情况，不要提及规则编号或明确说明规则与真相的对应关系）",
+  "death_triggers": ["会导致死亡的行为1", "会导致死亡的行为2", ...]
+}}
+
+请仅返回JSON，不要包含任何其他文字。**重要：不要使用任何emoji表情符号。**
+        """
+
+
+    def _ensure_scenario_pool_refill(self) -> None:
+        """启用剧本池时，在后台补充剧本（已在补充时不重复启动）"""
+        if not self.get_config("scenario_pool.enabled", False):
+            return
+        if scenario_pool.refill_task is not None and not scenario_pool.refill_task.done():
+            return
+        if time.time() < scenario_pool.retry_after:
+            return
+        # 在空的上下文中创建任务，后台生成不计入触发它的命令的耗时追踪
+        scenario_pool.refill_task = contextvars.Context().run(asyncio.create_task, self._refill_scenario_pool())
+
+    async def _refill_scenario_pool(self) -> None:
+        """在LLM空闲时逐个生成剧本，直到每种模式都达到配置的数量"""
+        pool_size = self.get_config("scenario_pool.pool_size", 2)
+        idle_seconds = self.get_config("scenario_pool.idle_seconds", 10)
+        modes = [mode for mode in self.get_config("scenario_pool.modes", ["单人", "多人"]) if mode in SCENARIO_POOL_MODES]
+
+        try:
+            for game_mode in modes:
+                while scenario_pool.count(game_mode) < pool_size:
+                    scenario = await self._generate_scenario(game_mode, idle_seconds)
+                    if scenario is None:
+                        retry_seconds = max(int(self.get_config("scenario_pool.retry_seconds", 600)), 0)
+                        scenario_pool.retry_after = time.time() + retry_seconds
+                        print(f"[规则怪谈] 预生成剧本失败（{game_mode}），{retry_seconds}秒后再尝试补充")
+                        return
+
+                    scenario_pool.put(game_mode, scenario)
+                    print(f"[规则怪谈] 已预生成剧本（{game_mode}），当前 {scenario_pool.count(game_mode)}/{pool_size}")
+        except Exception as e:
+            scenario_pool.retry_after = time.time() + max(int(self.get_config("scenario_pool.retry_seconds", 600)), 0)
+            print(f"[规则怪谈] 补充剧本池时发生异常: {str(e)}")
+
+    async def _wait_for_llm_idle(self, idle_seconds: float) -> None:
+        """等待LLM连续空闲达到指定秒数"""
+        while llm_telemetry.idle_for() < idle_seconds:
+            await asyncio.sleep(1.0)
+
+    async def _generate_scenario(self, game_mode: str, idle_seconds: float = 0) -> Optional[dict]:
+        """依次生成剧情导入、场景结构、规则和规则网络，不发送任何消息；idle_seconds大于0时每一步开始前都等待LLM空闲"""
+        api_url = self.get_config("llm.api_url", "").strip()
+        api_key = self.get_config("llm.api_key", "").strip()
+        model_list = self.get_config("llm.model_list", ["deepseek-ai/DeepSeek-V3"])
+        current_model_index = self.get_config("llm.current_model_index", 0)
+        temperature = self.get_config("llm.temperature", 0.8)
+
+        await self._wait_for_llm_idle(idle_seconds)
+        llm_response = await self._call_llm_api(self._build_step1_prompt(), api_url, api_key, model_list, current_model_index, temperature, call_site="step1")
+        step1_data = self._parse_llm_json(llm_response, "step1") if llm_response else None
+        if step1_data is None:
+            return None
+
+        await self._wait_for_llm_idle(idle_seconds)
+        llm_response = await self._call_llm_api(self._build_step2_prompt(step1_data), api_url, api_key, model_list, current_model_index, temperature, call_site="step2")
+        step2_data = self._parse_llm_json(llm_response, "step2") if llm_response else None
+        if step2_data is None:
+            return None
+
+        await self._wait_for_llm_idle(idle_seconds)
+        llm_response = await self._call_llm_api(self._build_step3_prompt(step1_data, step2_data, game_mode), api_url, api_key, model_list, current_model_index, temperature, call_site="step3")
+        step3_data = self._parse_llm_json(llm_response, "step3") if llm_response else None
+        if step3_data is None or not step3_data.get("rules"):
+            return None
+
+        await self._wait_for_llm_idle(idle_seconds)
+        rule_network = await self._analyze_rule_network(step3_data.get("rules", []), step3_data.get("hidden_truth", ""))
+
+        return {
+            "game_mode": game_mode,
+            "created_at": datetime.now().isoformat(),
+            "step1": step1_data,
+            "step2": step2_data,
+            "step3": step3_data,
+            "rule_network": rule_network
+        }
+
+    async def _archive_scenario(self, game_state: dict) -> None:
+        """把规则网络已构建完成的剧本归档到本地剧本库，相同的剧本只保存一次"""
+        if not self.get_config("scenario_library.archive", False):
+            return
+
+        rule_network = game_state.get("rule_network", {})
+        scenario = {
+            "game_mode": game_state.get("game_mode", "单人"),
+            "created_at": datetime.now().isoformat(),
+            "step1": {key: game_state.get(key) for key in ("scene", "background", "player_identity", "core_symbols")},
+            "step2": {key: game_state.get(key) for key in ("building_type", "overall_layout", "floors", "connections", "special_areas")},
+            "step3": {key: game_state.get(key) for key in ("rules_title", "rules", "win_condition", "resolve_condition", "hidden_truth", "death_triggers")},
+            "rule_network": {key: rule_network.get(key, []) for key in ("truth_elements", "rule_truth_mappings", "rule_dependencies")}
+        }
+        try:
+            if await asyncio.to_thread(scenario_library.add, scenario):
+                print(f"[规则怪谈] 已将剧本「{game_state.get('scene', '')}」归档到剧本库")
+        except Exception as e:
+            print(f"[规则怪谈] 归档剧本失败: {str(e)}")
+
+    def _shared_scenario_dir(self) -> str:
+        return os.path.join(DATA_DIR, "shared_scenarios")
+
+    def _is_shared_image(self, image_path: str) -> bool:
+        """判断图片是否属于共享剧本，共享剧本的图片在单个群组结束游戏时不删除"""
+        shared_dir = os.path.abspath(self._shared_scenario_dir())
+        return os.path.abspath(image_path).startswith(shared_dir + os.sep)
+
+    def _load_shared_scenario(self, scenario_id: str) -> Optional[dict]:
+        """加载共享剧本，同一进程内只读取一次，所有引用它的群组共用同一份数据"""
+        if scenario_id in shared_scenarios:
+            return shared_scenarios[scenario_id]
+
+        scenario_file = os.path.join(self._shared_scenario_dir(), f"{scenario_id}.json")
+        if not os.path.exists(scenario_file):
+            return None
+        try:
+            with open(scenario_file, 'r', encoding='utf-8') as f:
+                scenario = json.load(f)
+        except Exception as e:
+            print(f"[规则怪谈] 读取共享剧本失败: {scenario_id}, {e}")
+            return None
+
+        step1_data = scenario.get("step1", {})
+        step2_data = scenario.get("step2", {})
+        step3_data = scenario.get("step3", {})
+        base = {
+            "scene": step1_data.get("scene", ""),
+            "background": step1_data.get("background", ""),
+            "player_identity": step1_data.get("player_identity", ""),
+            "core_symbols": step1_data.get("core_symbols", []),
+            "building_type": step2_data.get("building_type", ""),
+            "overall_layout": step2_data.get("overall_layout", ""),
+            "floors": step2_data.get("floors", []),
+            "connections": step2_data.get("connections", []),
+            "special_areas": step2_data.get("special_areas", []),
+            "rules_title": step3_data.get("rules_title", "规则"),
+            "rules": step3_data.get("rules", []),
+            "win_condition": step3_data.get("win_condition", ""),
+            "resolve_condition": step3_data.get("resolve_condition", ""),
+            "hidden_truth": step3_data.get("hidden_truth", ""),
+            "death_triggers": step3_data.get("death_triggers", []),
+            "plot_image_path": scenario.get("plot_image_path"),
+            "scene_structure_image_path": scenario.get("scene_structure_image_path"),
+            "rules_image_path": scenario.get("rules_image_path")
+        }
+        shared_scenarios[scenario_id] = {"id": scenario_id, "scenario": scenario, "base": base}
+        return shared_scenarios[scenario_id]
+
+    def _attach_shared_scenario(self, saved_state: dict) -> Optional[dict]:
+        """为引用共享剧本的存档重新关联共享数据，共享剧本已被删除时返回None"""
+        scenario_id = saved_state.get("shared_scenario_id")
+        if not scenario_id:
+            return saved_state
+        shared = self._load_shared_scenario(scenario_id)
+        if shared is None:
+            return None
+        return SharedScenarioState(shared["base"], saved_state)
+
+    async def _get_daily_scenario(self, game_mode: str) -> Optional[dict]:
+        """获取本周期的每日挑战剧本，尚未生成时由第一个请求的群组生成，其余群组等待并复用"""
+        period_seconds = max(int(self.get_config("daily_challenge.period_hours", 24)), 1) * 3600
+        period_start = datetime.fromtimestamp(int(time.time()) // period_seconds * period_seconds)
+        scenario_id = f"daily_{SCENARIO_POOL_MODES.get(game_mode, 'single')}_{period_start.strftime('%Y%m%d%H')}"
+
+        shared = self._load_shared_scenario(scenario_id)
+        if shared is not None:
+            return shared
+
+        lock = shared_scenario_locks.setdefault(scenario_id, asyncio.Lock())
+        if lock.locked():
+            await self.send_text("本期每日挑战剧本正在生成中，请稍候...")
+        try:
+            async with lock:
+                shared = self._load_shared_scenario(scenario_id)
+                if shared is not None:
+                    return shared
+
+                await self.send_text("正在生成本期每日挑战，所有参与的群组将挑战同一个剧本...")
+                scenario = await self._generate_scenario(game_mode)
+                if scenario is None:
+                    return None
+
+                # 图片只渲染一次，保存在共享目录中供所有群组发送
+                shared_dir = self._shared_scenario_dir()
+                os.makedirs(shared_dir, exist_ok=True)
+                step1_data = scenario["step1"]
+                step2_data = scenario["step2"]
+                step3_data = scenario["step3"]
+                renders = {
+                    "plot_image_path": (
+                        self._generate_plot_image,
+                        (step1_data.get("scene", ""), step1_data.get("background", ""), step1_data.get("player_identity", ""), step1_data.get("core_symbols", []))
+                    ),
+                    "scene_structure_image_path": (
+                        self._generate_scene_structure_text_image,
+                        (step2_data.get("building_type", ""), step2_data.get("overall_layout", ""), step2_data.get("floors", []), step2_data.get("connections", []), step2_data.get("special_areas", []))
+                    ),
+                    "rules_image_path": (
+                        self._generate_rules_image,
+                        (step3_data.get("rules_title", "规则"), step3_data.get("rules", []), step3_data.get("win_condition", ""), game_mode)
+                    )
+                }
+                for key, (render, args) in renders.items():
+                    output_path = os.path.join(shared_dir, f"{scenario_id}_{key[:-len('_image_path')]}.png")
+                    try:
+                        scenario[key] = await asyncio.to_thread(render, *args, output_path=output_path)
+                    except Exception as e:
+                        print(f"[规则怪谈] 渲染共享剧本图片失败（{key}）: {str(e)}")
+                        scenario[key] = None
+
+                scenario["id"] = scenario_id
+                scenario_file = os.path.join(shared_dir, f"{scenario_id}.json")
+                with open(scenario_file + ".tmp", 'w', encoding='utf-8') as f:
+                    json.dump(scenario, f, ensure_ascii=False, indent=2)
+                os.replace(scenario_file + ".tmp", scenario_file)
+                print(f"[规则怪谈] 已生成每日挑战剧本: {scenario_id}")
+                return self._load_shared_scenario(scenario_id)
+        finally:
+            # 生成完成或失败后移除锁，之后的请求直接读取共享剧本或重新生成
+            if shared_scenario_locks.get(scenario_id) is lock:
+                shared_scenario_locks.pop(scenario_id, None)
+
+    def _build_combined_prompt(self, game_mode: str) -> str:
+        """构建一次生成剧情导入、场景结构、规则和规则网络的提示词"""
+        return f"""
+你是一个专业的规则怪谈生成器。请一次性生成一个完整的规则怪谈，包括剧情导入、场景结构、规则以及规则与真相之间的因果关系网络。
+
+游戏模式：{game_mode}
+
+**剧情导入（plot）要求：**
+1. 生成一个场景（如：深夜的医院、废弃的学校、神秘的公寓、古老的庄园等），并描述场景的背景故事（历史、发生过什么、为什么诡异）
+2. 描述玩家在这个场景中的身份或角色（如：工厂员工、夜班护士、新入职教师、庄园管家等），身份应与场景和剧情相符
+3. 剧情应该充满悬疑和恐怖氛围，为后续的规则和探索做铺垫
+4. 生成2-3个"核心象征符号"（数字、图案、旋律、花纹、颜色等），每个符号附带简短描述，暗示其含义或与场景的联系
+
+**场景结构（structure）要求：**
+1. 确定建筑类型和总体布局（如：L型、U型、回字形、多层建筑等）
+2. 列出所有楼层（包括地上和地下）及每层的主要区域，列出通道、楼梯、电梯等连接方式和特殊区域
+3. 场景结构应该与剧情导入的背景和氛围相符
+
+**规则（rules）要求：**
+1. 列出5-8条规则，规则应该看似合理但隐藏着诡异之处，与剧情导入和场景结构相呼应
+2. 设定通关条件和解除条件（解决规则怪谈根源的条件）
+3. **规则与环境绑定**：至少2-3条规则与场景中特定的、可交互的环境细节直接关联
+4. **规则间的潜在冲突**：至少构建一组存在潜在矛盾的规则，并在 hidden_truth 中解释矛盾的本质，在 death_triggers 中隐含相关触发条件
+5. **规则与真相的因果关系**：每条规则都应该与隐藏真相中的某个要素有直接的因果关系，规则之间形成推理链条
+6. **协作规则**：如果游戏模式是"多人"，请设计1-2条需要多个玩家协作才能发现或触发的规则，并在 hidden_truth 中说明其设计意图和触发条件
+7. **规则标题**：根据场景类型和玩家身份生成简洁、正式、符合官方文件风格的标题（如：员工守则、患者须知、访客须知等）
+8. 每条规则不超过60字，只说明禁止、允许或要求做的行为，不解释原因，使用冰冷、客观的公文语调
+
+**规则网络（rule_network）要求：**
+分析上面生成的规则和隐藏真相，拆分出真相要素，说明每条规则与真相要素的关系（伪装性描述/防护措施/警告/误导），以及规则之间的依赖关系和推理链条。
+
+请严格按照以下顺序和JSON格式返回（先完整输出 plot，再输出 structure、rules、rule_network）：
+{{
+  "plot": {{
+    "scene": "场景名称",
+    "background": "场景背景故事",
+    "player_identity": "玩家在这个场景中的身份或角色",
+    "core_symbols": [
+      {{"symbol": "符号1", "description": "符号1的描述"}}
+    ]
+  }},
+  "structure": {{
+    "building_type": "建筑类型",
+    "overall_layout": "建筑总体布局描述",
+    "floors": [
+      {{"floor": "楼层名称", "areas": ["区域1", "区域2"]}}
+    ],
+    "connections": ["通道1", "通道2"],
+    "special_areas": ["特殊区域1", "特殊区域2"]
+  }},
+  "rules": {{
+    "rules_title": "规则标题",
+    "rules": ["规则1", "规则2"],
+    "win_condition": "通关条件",
+    "resolve_condition": "解除条件",
+    "hidden_truth": "隐藏的真相（以叙事方式描述场景背后的真实情况，不要提及规则编号或明确说明规则与真相的对应关系）",
+    "death_triggers": ["会导致死亡的行为1", "会导致死亡的行为2"]
+  }},
+  "rule_network": {{
+    "truth_elements": [
+      {{"id": "truth_1", "description": "真相要素1的描述", "source": "真相中的具体内容"}}
+    ],
+    "rule_truth_mappings": [
+      {{"rule_index": 0, "truth_element_id": "truth_1", "relationship_type": "伪装性描述/防护措施/警告/误导", "explanation": "规则如何与真相要素相关联"}}
+    ],
+    "rule_dependencies": [
+      {{"rule_index": 0, "depends_on_rule": 1, "reason": "依赖原因"}}
+    ],
+    "inference_chains": [
+      {{"chain": ["rule_0", "rule_1", "truth_1"], "description": "推理链条的描述"}}
+    ]
+  }}
+}}
+
+请仅返回JSON，不要包含任何其他文字。**重要：不要使用任何emoji表情符号。**
+        """
+
+    async def _join_game(self, group_id: str) -> Tuple[bool, Optional[str], bool]:
+        """加入游戏"""
         game_state = game_states.get(group_id, {})
         
         user_info = self._get_user_info()
@@ -1116,74 +3231,347 @@ class RuleHorrorCommand(BaseCommand):
         user_id = user_info.user_id
         user_name = getattr(user_info, 'user_name', f"玩家{user_id}")
         
-        players = game_state.get("players", {})
-        if user_id not in players:
-            if game_state.get("game_mode") == "单人":
-                players[user_id] = {
-                    "name": user_name,
-                    "reasoning_history": [],
-                    "action_history": [],
-                    "is_alive": True,
-                    "current_identity": player_identity,
-                    "physical_status": {
-                        "health": 100,
-                        "injury": "无",
-                        "fatigue": "无"
-                    },
-                    "mental_status": {
-                        "sanity": 100,
-                        "state": "正常",
-                        "emotion": "平静"
-                    },
-                    "psychological_pressure": {
-                        "fear_level": 0,
-                        "anxiety_level": 0,
-                        "stress_level": 0
-                    },
-                    "inventory": [],
-                    "location": "入口"
-                }
-                game_state["players"] = players
-            else:
-                await self.send_text("你不在游戏中。请先使用 `/rg 加入` 加入游戏。")
-                return False, "不在游戏中", True
+        if user_id in game_state.get("players", {}):
+            await self.send_text("你已经在游戏中了。")
+            return False, "已在游戏中", True
         
-        player_data = players[user_id]
-        if not player_data["is_alive"]:
-            await self.send_text("你已经死亡，无法继续推理。")
-            return False, "玩家已死亡", True
+        players = game_state.get("players", {})
+        if len(players) >= game_state.get("max_players", 5):
+            await self.send_text(f"游戏人数已满（最多{game_state.get('max_players', 5)}人）。")
+            return False, "游戏人数已满", True
         
-        player_data["reasoning_history"].append(reasoning)
+        players[user_id] = {
+            "name": user_name,
+            "reasoning_history": [],
+            "action_history": [],
+            "is_alive": True,
+            "current_identity": game_state.get("player_identity", ""),
+            "personal_rules": game_state.get("rules", []).copy(),
+            "physical_status": {
+                "health": 100,
+                "injury": "无",
+                "fatigue": "无"
+            },
+            "mental_status": {
+                "sanity": 100,
+                "state": "正常",
+                "emotion": "平静"
+            },
+            "psychological_pressure": {
+                "fear_level": 0,
+                "anxiety_level": 0,
+                "stress_level": 0
+            },
+            "inventory": [],
+            "location": "入口"
+        }
         game_state["players"] = players
         
         self._save_game_state(group_id)
         
         reply_text = (
-            f"**推理记录** - {user_name}\n\n"
-            f"{reasoning}\n\n"
-            f"**已记录**。继续推理或使用 `/rg 行动` 描述你的行动。"
+            f"**{user_name}** 已加入游戏！\n\n"
+            f"**当前玩家**：{len(players)}/{game_state.get('max_players', 5)}\n"
         )
-
-        await self.send_text(reply_text)
         
-        await self._check_clear_condition(group_id, api_url, api_key, model, temperature)
+        for pid, p_data in players.items():
+            status = "存活" if p_data["is_alive"] else "死亡"
+            reply_text += f"- {p_data['name']} ({status})\n"
         
-        return True, "已记录推理", True
+        await self.send_text(reply_text)
+        return True, "已加入游戏", True
 
-    async def _trigger_rule_mutation(self, group_id: str, api_url: str, api_key: str, model_list: list, current_model_index: int, temperature: float, elapsed_minutes: int, trigger_reason: str = "随机") -> None:
-        """触发规则变异"""
+    async def _leave_game(self, group_id: str) -> Tuple[bool, Optional[str], bool]:
+        """离开游戏"""
         game_state = game_states.get(group_id, {})
-        if game_state.get("sanity_break", False):
-            return
         
-        all_actions = []
-        all_reasoning = []
-        for pid, p_data in game_state.get("players", {}).items():
-            all_actions.extend(p_data.get("action_history", []))
-            all_reasoning.extend(p_data.get("reasoning_history", []))
+        user_info = self._get_user_info()
+        if not user_info:
+            await self.send_text("无法获取用户信息。")
+            return False, "无法获取用户信息", True
         
-        evaluation_prompt = f"""
-你是规则怪谈的裁判。请根据以下信息，判断是否需要让规则发生变化。
+        user_id = user_info.user_id
+        user_name = getattr(user_info, 'user_name', f"玩家{user_id}")
+        
+        players = game_state.get("players", {})
+        if user_id not in players:
+            await self.send_text("你不在游戏中。")
+            return False, "不在游戏中", True
+        
+        del players[user_id]
+        game_state["players"] = players
+        
+        self._save_game_state(group_id)
+        
+        reply_text = (
+            f"**{user_name}** 已离开游戏。\n\n"
+            f"**当前玩家**：{len(players)}/{game_state.get('max_players', 5)}\n"
+        )
+        
+        for pid, p_data in players.items():
+            status = "存活" if p_data["is_alive"] else "死亡"
+            reply_text += f"- {p_data['name']} ({status})\n"
+        
+        await self.send_text(reply_text)
+        return True, "已离开游戏", True
+
+    async def _show_game_status(self, game_state: dict) -> Tuple[bool, Optional[str], bool]:
+        """显示游戏状态"""
+        players = game_state.get("players", {})
+        
+        reply_text = (
+            f"**游戏状态**\n\n"
+            f"**场景**：{game_state.get('scene', '')}\n\n"
+            f"**通关条件**：{game_state.get('win_condition', '')}\n\n"
+            f"**玩家**：{len(players)}/{game_state.get('max_players', 5)}\n"
+        )
+        
+        if players:
+            for pid, p_data in players.items():
+                status = "存活" if p_data["is_alive"] else "死亡"
+                reply_text += f"\n- {p_data['name']} ({status})\n"
+                reply_text += f"   推理次数：{len(p_data['reasoning_history'])}\n"
+                reply_text += f"   行动次数：{len(p_data['action_history'])}\n"
+                
+                if p_data["is_alive"]:
+                    physical = p_data.get("physical_status", {})
+                    mental = p_data.get("mental_status", {})
+                    reply_text += f"   体力：{physical.get('health', 100)}/100\n"
+                    reply_text += f"   受伤：{physical.get('injury', '无')}\n"
+                    reply_text += f"   疲劳：{physical.get('fatigue', '无')}\n"
+                    reply_text += f"   理智：{mental.get('sanity', 100)}/100\n"
+                    reply_text += f"   精神：{mental.get('state', '正常')}\n"
+        else:
+            reply_text += "暂无玩家\n"
+        
+        reply_text += f"\n**提示次数**：{game_state.get('hints_used', 0)}/{game_state.get('max_hints', 3)}"
+        
+        await self.send_text(reply_text)
+        return True, "已显示游戏状态", True
+
+    async def _show_rules(self, game_state: dict) -> Tuple[bool, Optional[str], bool]:
+        """显示当前规则"""
+        
+        rules_title = game_state.get('rules_title', '规则')
+        reply_text = f"**{rules_title}**\n"
+        
+        rules = game_state.get('rules', [])
+        if rules:
+            for i, rule in enumerate(rules, 1):
+                reply_text += f"{i}. {rule}\n"
+        else:
+            reply_text += "暂无规则\n"
+        
+        reply_text += f"\n**通关条件**：{game_state.get('win_condition', '')}"
+        
+        await self.send_text(reply_text)
+        return True, "已显示规则", True
+
+    async def _show_scene(self, game_state: dict) -> Tuple[bool, Optional[str], bool]:
+        """显示场景结构"""
+        
+        building_type = game_state.get('building_type', '')
+        overall_layout = game_state.get('overall_layout', '')
+        floors = game_state.get('floors', [])
+        connections = game_state.get('connections', [])
+        special_areas = game_state.get('special_areas', [])
+        
+        floors_text = "\n".join([f"  - {floor['floor']}: {', '.join(floor['areas'])}" for floor in floors])
+        connections_text = ", ".join(connections)
+        special_areas_text = ", ".join(special_areas)
+        
+        reply_text = f"""**场景**：{game_state.get('scene', '')}
+
+**场景结构**：
+
+**建筑类型**：{building_type}
+
+**总体布局**：{overall_layout}
+
+**楼层布局**：
+{floors_text}
+
+**连接通道**：{connections_text}
+
+**特殊区域**：{special_areas_text}
+
+**当前时间**：{game_state.get('time_system', {}).get('current_time', '未知')}
+**环境状况**：
+   - 光线：{game_state.get('environment', {}).get('lighting', '未知')}
+   - 温度：{game_state.get('environment', {}).get('temperature', '未知')}
+   - 声音：{', '.join(game_state.get('environment', {}).get('sounds', ['未知']))}
+   - 气味：{', '.join(game_state.get('environment', {}).get('smells', ['未知']))}
+   - 氛围：{game_state.get('environment', {}).get('atmosphere', '未知')}
+"""
+        
+        await self.send_text(reply_text)
+        
+        return True, "已显示场景", True
+
+    async def _show_plot(self, game_state: dict) -> Tuple[bool, Optional[str], bool]:
+        """显示剧情导入"""
+        
+        reply_text = (
+            f"**场景**：{game_state.get('scene', '')}\n\n"
+            f"**剧情导入**：\n{game_state.get('background', '')}\n\n"
+            f"**你的身份**：\n{game_state.get('player_identity', '')}"
+        )
+        
+        await self.send_text(reply_text)
+        return True, "已显示剧情", True
+
+    @traced("handler:provide_hint")
+    async def _provide_hint(self, group_id: str, hint_type: str, api_url: str, api_key: str, model_list: list, current_model_index: int, temperature: float) -> Tuple[bool, Optional[str], bool]:
+        """提供提示"""
+        game_state = game_states.get(group_id, {})
+
+        if game_state.get("hints_used", 0) >= game_state.get("max_hints", 3):
+            await self.send_text("提示次数已用完。")
+            return False, "提示次数用完", True
+
+        if hint_type not in ["规则", "线索"]:
+            await self.send_text("提示类型无效。请选择：规则 或 线索")
+            return False, "提示类型无效", True
+
+        game_state["hints_used"] += 1
+        remaining_hints = game_state["max_hints"] - game_state["hints_used"]
+        
+        bank_hint = self._take_bank_hint(game_state, hint_type)
+        self._save_game_state(group_id)
+
+        if bank_hint:
+            reply_text = (
+                f"**提示** ({hint_type})\n\n"
+                f"{bank_hint}\n\n"
+                f"**剩余提示次数**：{remaining_hints}/{game_state['max_hints']}"
+            )
+            await self.send_text(reply_text)
+            return True, "已提供提示", True
+
+        if hint_type == "规则":
+            prompt = f"""
+你是一个规则怪谈助手。玩家想要验证某个规则是否正确。
+
+场景：{game_state.get('scene', '')}
+规则：{json.dumps(game_state.get('rules', []), ensure_ascii=False)}
+隐藏真相：{game_state.get('hidden_truth', '')}
+
+请随机选择一条规则，并给出一个关于这条规则的提示，帮助玩家理解这条规则的真正含义。
+提示应该模糊但有帮助，不要直接揭示真相。
+请仅返回提示内容，不要包含任何其他文字。**重要：不要使用任何emoji表情符号。**
+            """
+        else:
+            prompt = f"""
+你是一个规则怪谈助手。玩家想要获取线索。
+
+场景：{game_state.get('scene', '')}
+规则：{json.dumps(game_state.get('rules', []), ensure_ascii=False)}
+隐藏真相：{game_state.get('hidden_truth', '')}
+通关条件：{game_state.get('win_condition', '')}
+
+请给出一个关于如何达成通关条件的线索。
+线索应该模糊但有帮助，不要直接揭示答案。
+请仅返回线索内容，不要包含任何其他文字。**重要：不要使用任何emoji表情符号。**
+            """
+
+        llm_response = await self._call_llm_api(prompt, api_url, api_key, model_list, current_model_index, temperature, call_site="hint")
+        if not llm_response:
+            await self.send_text("调用LLM API失败，请稍后再试。")
+            return False, "LLM API调用失败", True
+
+        hint_text = llm_response.strip()
+
+        reply_text = (
+            f"**提示** ({hint_type})\n\n"
+            f"{hint_text}\n\n"
+            f"**剩余提示次数**：{remaining_hints}/{game_state['max_hints']}"
+        )
+
+        await self.send_text(reply_text)
+        return True, "已提供提示", True
+
+    @traced("handler:record_reasoning")
+    async def _record_reasoning(self, group_id: str, reasoning: str, api_url: str, api_key: str, model_list: list, current_model_index: int, temperature: float) -> Tuple[bool, Optional[str], bool]:
+        """记录推理"""
+        game_state = game_states.get(group_id, {})
+        
+        user_info = self._get_user_info()
+        if not user_info:
+            await self.send_text("无法获取用户信息。")
+            return False, "无法获取用户信息", True
+        
+        user_id = user_info.user_id
+        user_name = getattr(user_info, 'user_name', f"玩家{user_id}")
+        
+        players = game_state.get("players", {})
+        if user_id not in players:
+            if game_state.get("game_mode") == "单人":
+                players[user_id] = {
+                    "name": user_name,
+                    "reasoning_history": [],
+                    "action_history": [],
+                    "is_alive": True,
+                    "current_identity": game_state.get("player_identity", ""),
+                    "physical_status": {
+                        "health": 100,
+                        "injury": "无",
+                        "fatigue": "无"
+                    },
+                    "mental_status": {
+                        "sanity": 100,
+                        "state": "正常",
+                        "emotion": "平静"
+                    },
+                    "psychological_pressure": {
+                        "fear_level": 0,
+                        "anxiety_level": 0,
+                        "stress_level": 0
+                    },
+                    "inventory": [],
+                    "location": "入口"
+                }
+                game_state["players"] = players
+            else:
+                await self.send_text("你不在游戏中。请先使用 `/rg 加入` 加入游戏。")
+                return False, "不在游戏中", True
+        
+        player_data = players[user_id]
+        if not player_data["is_alive"]:
+            await self.send_text("你已经死亡，无法继续推理。")
+            return False, "玩家已死亡", True
+        
+        self._append_history(player_data, "reasoning", reasoning)
+        game_state["players"] = players
+        
+        self._save_game_state(group_id)
+        
+        reply_text = (
+            f"**推理记录** - {user_name}\n\n"
+            f"{reasoning}\n\n"
+            f"**已记录**。继续推理或使用 `/rg 行动` 描述你的行动。"
+        )
+
+        await self.send_text(reply_text)
+        
+        self._schedule_clear_check(group_id, api_url, api_key, model_list, current_model_index, temperature)
+        
+        return True, "已记录推理", True
+
+    @traced("rule_mutation")
+    async def _trigger_rule_mutation(self, group_id: str, api_url: str, api_key: str, model_list: list, current_model_index: int, temperature: float, elapsed_minutes: int, trigger_reason: str = "随机") -> None:
+        """触发规则变异"""
+        game_state = game_states.get(group_id, {})
+        if game_state.get("sanity_break", False):
+            return
+        
+        all_actions = []
+        all_reasoning = []
+        for pid, p_data in game_state.get("players", {}).items():
+            all_actions.extend(p_data.get("action_history", []))
+            all_reasoning.extend(p_data.get("reasoning_history", []))
+        
+        evaluation_prompt = f"""
+你是规则怪谈的裁判。请根据以下信息，判断是否需要让规则发生变化。
 
 触发原因：{trigger_reason}
 场景：{game_state.get('scene', '')}
@@ -1219,13 +3607,12 @@ class RuleHorrorCommand(BaseCommand):
 请仅返回JSON，不要包含任何其他文字。**重要：不要使用任何emoji表情符号。**
         """
         
-        evaluation_response = await self._call_llm_api(evaluation_prompt, api_url, api_key, model, temperature)
+        evaluation_response = await self._call_llm_api(evaluation_prompt, api_url, api_key, model_list, current_model_index, temperature, call_site="mutation_eval")
         if not evaluation_response:
             return
         
-        try:
-            evaluation_data = json.loads(evaluation_response)
-        except json.JSONDecodeError:
+        evaluation_data = self._parse_llm_json(evaluation_response, "mutation_eval")
+        if evaluation_data is None:
             print(f"[规则怪谈] 规则变异评估响应解析失败")
             return
         
@@ -1264,48 +3651,52 @@ class RuleHorrorCommand(BaseCommand):
 请仅返回JSON，不要包含任何其他文字。**重要：不要使用任何emoji表情符号。**
         """
         
-        mutation_response = await self._call_llm_api(mutation_prompt, api_url, api_key, model, temperature)
-        if mutation_response:
-            try:
-                mutation_data = json.loads(mutation_response)
-                mutated_rules = mutation_data.get("mutated_rules", [])
-                hint = mutation_data.get("hint", "")
-                
-                if mutated_rules:
-                    old_rules = game_state.get("rules", [])
-                    game_state["rule_mutations"].append({
-                        "time": elapsed_minutes,
-                        "trigger_reason": trigger_reason,
-                        "old_rules": old_rules.copy(),
-                        "new_rules": mutated_rules.copy(),
-                        "hint": hint
-                    })
-                    game_state["rules"] = mutated_rules
-                    game_state["last_mutation_time"] = elapsed_minutes
-                    
-                    await self.send_text(f"{hint}")
-                    await asyncio.sleep(0.5)
-                    
-                    if len(mutated_rules) > len(old_rules):
-                        new_rule = mutated_rules[-1]
-                        await self.send_text(f"发现了一条新规则")
-                        await asyncio.sleep(0.3)
-                        await self.send_text(f"现在：{new_rule}")
-                        await asyncio.sleep(0.5)
-                    else:
-                        for old_rule, new_rule in zip(old_rules, mutated_rules):
-                            if old_rule != new_rule:
-                                await self.send_text(f"**规则变化**：")
-                                await asyncio.sleep(0.3)
-                                await self.send_text(f"原本：{old_rule}")
-                                await asyncio.sleep(0.3)
-                                await self.send_text(f"现在：{new_rule}")
-                                await asyncio.sleep(0.5)
-            except json.JSONDecodeError:
-                print(f"[规则怪谈] 规则变异响应解析失败")
-
-    async def _detect_identity_change(self, group_id: str, user_id: str, action: str, scene_description: str, api_url: str, api_key: str, model_list: list, current_model_index: int, temperature: float) -> Optional[str]:
-        """检测玩家身份是否发生变化"""
+        mutation_response = await self._call_llm_api(mutation_prompt, api_url, api_key, model_list, current_model_index, temperature, call_site="mutation_gen")
+        if not mutation_response:
+            return
+        
+        mutation_data = self._parse_llm_json(mutation_response, "mutation_gen")
+        if mutation_data is None:
+            print(f"[规则怪谈] 规则变异响应解析失败")
+            return
+        mutated_rules = mutation_data.get("mutated_rules", [])
+        hint = mutation_data.get("hint", "")
+        
+        if mutated_rules:
+            old_rules = game_state.get("rules", [])
+            game_state["rule_mutations"].append({
+                "time": elapsed_minutes,
+                "trigger_reason": trigger_reason,
+                "old_rules": old_rules.copy(),
+                "new_rules": mutated_rules.copy(),
+                "hint": hint
+            })
+            game_state["rules"] = mutated_rules
+            game_state["last_mutation_time"] = elapsed_minutes
+            self._start_hint_bank_task(group_id)
+            
+            await self.send_text(f"{hint}")
+            await asyncio.sleep(0.5)
+            
+            if len(mutated_rules) > len(old_rules):
+                new_rule = mutated_rules[-1]
+                await self.send_text(f"发现了一条新规则")
+                await asyncio.sleep(0.3)
+                await self.send_text(f"现在：{new_rule}")
+                await asyncio.sleep(0.5)
+            else:
+                for old_rule, new_rule in zip(old_rules, mutated_rules):
+                    if old_rule != new_rule:
+                        await self.send_text(f"**规则变化**：")
+                        await asyncio.sleep(0.3)
+                        await self.send_text(f"原本：{old_rule}")
+                        await asyncio.sleep(0.3)
+                        await self.send_text(f"现在：{new_rule}")
+                        await asyncio.sleep(0.5)
+
+    @traced("detect_identity_change")
+    async def _detect_identity_change(self, group_id: str, user_id: str, action: str, scene_description: str, api_url: str, api_key: str, model_list: list, current_model_index: int, temperature: float) -> Optional[str]:
+        """检测玩家身份是否发生变化"""
         game_state = game_states.get(group_id, {})
         players = game_state.get("players", {})
         player_data = players.get(user_id, {})
@@ -1343,20 +3734,20 @@ class RuleHorrorCommand(BaseCommand):
 请仅返回JSON，不要包含任何其他文字。**重要：不要使用任何emoji表情符号。**
         """
         
-        response = await self._call_llm_api(prompt, api_url, api_key, model, temperature)
+        response = await self._call_llm_api(prompt, api_url, api_key, model_list, current_model_index, temperature, call_site="identity")
         if not response:
             return None
         
-        try:
-            data = json.loads(response)
-            if data.get("identity_changed") == "是":
-                new_identity = data.get("new_identity", "")
-                if new_identity and new_identity != current_identity:
-                    print(f"[规则怪谈] 玩家身份变化：{current_identity} -> {new_identity}")
-                    print(f"[规则怪谈] 变化原因：{data.get('reason', '')}")
-                    return new_identity
-        except json.JSONDecodeError:
+        data = self._parse_llm_json(response, "identity")
+        if data is None:
             print(f"[规则怪谈] 身份变化检测响应解析失败")
+            return None
+        if data.get("identity_changed") == "是":
+            new_identity = data.get("new_identity", "")
+            if new_identity and new_identity != current_identity:
+                print(f"[规则怪谈] 玩家身份变化：{current_identity} -> {new_identity}")
+                print(f"[规则怪谈] 变化原因：{data.get('reason', '')}")
+                return new_identity
         
         return None
 
@@ -1396,29 +3787,237 @@ class RuleHorrorCommand(BaseCommand):
 请仅返回JSON，不要包含任何其他文字。**重要：不要使用任何emoji表情符号。**
         """
         
-        response = await self._call_llm_api(prompt, api_url, api_key, model, temperature)
+        response = await self._call_llm_api(prompt, api_url, api_key, model_list, current_model_index, temperature, call_site="identity_rules")
         if not response:
             return []
         
-        try:
-            data = json.loads(response)
-            return data.get("rules", [])
-        except json.JSONDecodeError:
+        data = self._parse_llm_json(response, "identity_rules")
+        if data is None:
             print(f"[规则怪谈] 身份特定规则生成响应解析失败")
             return []
+        return data.get("rules", [])
 
+    @traced("build_rule_network")
     async def _build_rule_network(self, group_id: str) -> None:
         """构建规则与真相之间的因果关系网络"""
         game_state = game_states.get(group_id, {})
         if not game_state:
             return
+        current_game_seed.set(game_state.get("rng_seed"))
         
         rules = game_state.get("rules", [])
         hidden_truth = game_state.get("hidden_truth", "")
         
         if not rules or not hidden_truth:
+            game_state["rule_network_status"] = "failed"
+            return
+        
+        rule_network = await self._analyze_rule_network(rules, hidden_truth)
+        
+        async def apply() -> bool:
+            if game_states.get(group_id) is not game_state or not game_state.get("game_active", False):
+                print(f"[规则怪谈] 游戏已结束或已被替换，丢弃构建完成的规则网络")
+                return False
+            
+            # 构建期间玩家可能已经发现了真相，只更新分析得到的部分
+            current_network = game_state.setdefault("rule_network", {})
+            for key in ("truth_elements", "rule_truth_mappings", "rule_dependencies"):
+                current_network[key] = rule_network.get(key, [])
+            current_network.setdefault("discovered_truths", [])
+            game_state["rule_network_status"] = "ready" if current_network["truth_elements"] else "failed"
+            self._save_game_state(group_id)
+            return game_state["rule_network_status"] == "ready"
+        
+        # 结果通过群组命令队列写入，不会与正在执行的命令交错修改游戏状态
+        if await command_executor.run(group_id, apply):
+            await self._archive_scenario(game_state)
+
+    def _start_rule_network_task(self, group_id: str) -> None:
+        """在后台构建当前游戏的规则网络，替换该群组之前的构建任务"""
+        self._cancel_rule_network_task(group_id)
+        
+        game_state = game_states.get(group_id, {})
+        game_state["rule_network_status"] = "pending"
+        
+        # 在空的上下文中创建任务，后台构建不计入触发它的命令的耗时追踪
+        task = contextvars.Context().run(asyncio.create_task, self._build_rule_network(group_id))
+        rule_network_tasks[group_id] = task
+
+        def on_done(finished_task: asyncio.Task) -> None:
+            if rule_network_tasks.get(group_id) is finished_task:
+                rule_network_tasks.pop(group_id, None)
+            if finished_task.cancelled():
+                return
+            error = finished_task.exception()
+            if error is not None:
+                print(f"[规则怪谈] 后台构建规则网络失败: {error}")
+                if game_states.get(group_id) is game_state:
+                    game_state["rule_network_status"] = "failed"
+
+        task.add_done_callback(on_done)
+
+    def _cancel_rule_network_task(self, group_id: str) -> None:
+        """取消该群组正在进行的规则网络构建"""
+        task = rule_network_tasks.pop(group_id, None)
+        if task is not None and not task.done():
+            task.cancel()
+            print(f"[规则怪谈] 已取消群组 {group_id} 的规则网络构建")
+
+    def _cancel_background_tasks(self, group_id: str) -> None:
+        """取消该群组所有后台任务（规则网络构建、提示库生成、回合结算、通关检查），在游戏结束或被替换时调用"""
+        self._cancel_rule_network_task(group_id)
+        self._cancel_hint_bank_task(group_id)
+        self._cancel_action_round(group_id)
+        self._cancel_clear_check(group_id)
+
+    def _start_hint_bank_task(self, group_id: str) -> None:
+        """在后台为当前规则补充提示库，替换该群组之前的生成任务"""
+        if not self.get_config("hint_bank.enabled", False):
+            return
+        self._cancel_hint_bank_task(group_id)
+
+        game_state = game_states.get(group_id, {})
+        game_state["hint_bank_status"] = "pending"
+
+        task = contextvars.Context().run(asyncio.create_task, self._build_hint_bank(group_id))
+        hint_bank_tasks[group_id] = task
+
+        def on_done(finished_task: asyncio.Task) -> None:
+            if hint_bank_tasks.get(group_id) is finished_task:
+                hint_bank_tasks.pop(group_id, None)
+            if finished_task.cancelled():
+                return
+            error = finished_task.exception()
+            if error is not None:
+                print(f"[规则怪谈] 后台生成提示库失败: {error}")
+                if game_states.get(group_id) is game_state:
+                    game_state["hint_bank_status"] = "failed"
+
+        task.add_done_callback(on_done)
+
+    def _cancel_hint_bank_task(self, group_id: str) -> None:
+        """取消该群组正在进行的提示库生成"""
+        task = hint_bank_tasks.pop(group_id, None)
+        if task is not None and not task.done():
+            task.cancel()
+            print(f"[规则怪谈] 已取消群组 {group_id} 的提示库生成")
+
+    @traced("build_hint_bank")
+    async def _build_hint_bank(self, group_id: str) -> None:
+        """为尚未生成提示的规则和通关线索生成分级提示，规则变化后只删除和补充受影响的条目"""
+        game_state = game_states.get(group_id, {})
+        if not game_state:
+            return
+        current_game_seed.set(game_state.get("rng_seed"))
+
+        rules = game_state.get("rules", [])
+        hint_bank = game_state.setdefault("hint_bank", {"规则": {}, "线索": [], "served": []})
+        # 删除已不在当前规则中的规则提示
+        hint_bank["规则"] = {rule: hints for rule, hints in hint_bank["规则"].items() if rule in rules}
+        missing_rules = [rule for rule in rules if rule not in hint_bank["规则"]]
+        need_clues = not hint_bank["线索"]
+        if not missing_rules and not need_clues:
+            game_state["hint_bank_status"] = "ready"
             return
+
+        rules_text = "\n".join(f"{i}. {rule}" for i, rule in enumerate(missing_rules, 1)) or "（无）"
+        prompt = f"""
+你是一个规则怪谈助手。请预先为玩家准备分级提示，每条提示都应该模糊但有帮助，不要直接揭示真相。
+
+场景：{game_state.get('scene', '')}
+全部规则：{json.dumps(rules, ensure_ascii=False)}
+隐藏真相：{game_state.get('hidden_truth', '')}
+通关条件：{game_state.get('win_condition', '')}
+
+需要生成规则提示的规则：
+{rules_text}
+
+要求：
+1. 为上面列出的每条规则生成3级提示，帮助玩家理解这条规则的真正含义，从第1级到第3级逐渐明确
+2. {"生成3级关于如何达成通关条件的线索，从第1级到第3级逐渐明确" if need_clues else "不需要生成线索，clues 返回空列表"}
+3. 每条提示1-2句话
+4. 返回格式：{{"rule_hints": [{{"rule_index": 1, "hints": ["第1级提示", "第2级提示", "第3级提示"]}}], "clues": ["第1级线索", "第2级线索", "第3级线索"]}}
+
+请仅返回JSON，不要包含任何其他文字。**重要：不要使用任何emoji表情符号。**
+        """
+
+        api_url = self.get_config("llm.api_url", "").strip()
+        api_key = self.get_config("llm.api_key", "").strip()
+        model_list = self.get_config("llm.model_list", ["deepseek-ai/DeepSeek-V3"])
+        current_model_index = self.get_config("llm.current_model_index", 0)
+        temperature = self.get_config("llm.temperature", 0.8)
+
+        llm_response = await self._call_llm_api(prompt, api_url, api_key, model_list, current_model_index, temperature, call_site="hint_bank")
+        bank_data = self._parse_llm_json(llm_response, "hint_bank") if llm_response else None
+
+        async def apply() -> None:
+            if game_states.get(group_id) is not game_state or not game_state.get("game_active", False):
+                print(f"[规则怪谈] 游戏已结束或已被替换，丢弃生成的提示库")
+                return
+            if not isinstance(bank_data, dict):
+                game_state["hint_bank_status"] = "failed"
+                return
+
+            # 生成期间规则可能再次变化，只保留仍在当前规则中的条目
+            current_rules = game_state.get("rules", [])
+            for item in bank_data.get("rule_hints", []):
+                try:
+                    rule = missing_rules[int(item.get("rule_index", 0)) - 1]
+                except (ValueError, TypeError, IndexError):
+                    continue
+                hints = [hint for hint in item.get("hints", []) if isinstance(hint, str) and hint.strip()]
+                if hints and rule in current_rules:
+                    hint_bank["规则"][rule] = hints
+            if need_clues:
+                hint_bank["线索"] = [clue for clue in bank_data.get("clues", []) if isinstance(clue, str) and clue.strip()]
+
+            game_state["hint_bank_status"] = "ready"
+            self._save_game_state(group_id)
+            print(f"[规则怪谈] 提示库已更新：{len(hint_bank['规则'])} 条规则提示，{len(hint_bank['线索'])} 条线索")
+
+        await command_executor.run(group_id, apply)
+
+    def _take_bank_hint(self, game_state: dict, hint_type: str) -> Optional[str]:
+        """从提示库中取出下一条提示：已给出的同类提示越多，取出的提示越明确；没有可用提示时返回None"""
+        hint_bank = game_state.get("hint_bank")
+        if not hint_bank or game_state.get("hint_bank_status") != "ready":
+            return None
+
+        served = hint_bank.setdefault("served", [])
+        level = len([key for key in served if key.startswith(hint_type)])
+        if hint_type == "线索":
+            clues = hint_bank.get("线索", [])
+            if not clues:
+                return None
+            served.append("线索")
+            return clues[min(level, len(clues) - 1)]
+
+        current_rules = game_state.get("rules", [])
+        candidates = [rule for rule in current_rules if rule in hint_bank.get("规则", {})]
+        unserved = [rule for rule in candidates if f"规则:{rule}" not in served]
+        if not candidates:
+            return None
+        rule = self._game_rng(game_state).choice(unserved or candidates)
+        hints = hint_bank["规则"][rule]
+        served.append(f"规则:{rule}")
+        return f"关于规则「{rule}」：{hints[min(level, len(hints) - 1)]}"
+
+    def _format_rule_network_info(self, game_state: dict) -> str:
+        """生成行动判定提示词中的规则网络信息，规则网络尚未构建完成时只包含已发现的真相"""
+        rule_network = game_state.get("rule_network", {})
+        truth_elements = rule_network.get("truth_elements", [])
+        discovered_truths = rule_network.get("discovered_truths", [])
+        if not truth_elements and not discovered_truths:
+            return ""
         
+        rule_network_info = "\n**规则网络信息：**\n"
+        if truth_elements:
+            rule_network_info += f"- 真相要素：{json.dumps([elem.get('description', '') for elem in truth_elements if isinstance(elem, dict)], ensure_ascii=False)}\n"
+        rule_network_info += f"- 已发现的真相：{json.dumps(discovered_truths, ensure_ascii=False)}\n"
+        return rule_network_info
+
+    async def _analyze_rule_network(self, rules: List[str], hidden_truth: str) -> dict:
+        """调用LLM分析规则与隐藏真相，返回规则网络"""
         rule_network = {
             "truth_elements": [],
             "rule_truth_mappings": [],
@@ -1458,17 +4057,17 @@ class RuleHorrorCommand(BaseCommand):
 """
         
         try:
-            config = self.get_config()
-            api_url = config.get("llm", {}).get("api_url", "")
-            api_key = config.get("llm", {}).get("api_key", "")
-            model = config.get("llm", {}).get("model", "")
-            temperature = config.get("llm", {}).get("temperature", 0.8)
-            
-            llm_response = await self._call_llm_api(truth_analysis_prompt, api_url, api_key, model, temperature)
+            api_url = self.get_config("llm.api_url", "").strip()
+            api_key = self.get_config("llm.api_key", "").strip()
+            model_list = self.get_config("llm.model_list", ["deepseek-ai/DeepSeek-V3"])
+            current_model_index = self.get_config("llm.current_model_index", 0)
+            temperature = self.get_config("llm.temperature", 0.8)
+
+            llm_response = await self._call_llm_api(truth_analysis_prompt, api_url, api_key, model_list, current_model_index, temperature, call_site="rule_network")
             
             if llm_response:
-                try:
-                    network_data = json.loads(llm_response)
+                network_data = self._parse_llm_json(llm_response, "rule_network")
+                if network_data is not None:
                     rule_network["truth_elements"] = network_data.get("truth_elements", [])
                     rule_network["rule_truth_mappings"] = network_data.get("rule_truth_mappings", [])
                     rule_network["rule_dependencies"] = network_data.get("rule_dependencies", [])
@@ -1477,26 +4076,15 @@ class RuleHorrorCommand(BaseCommand):
                     print(f"[规则怪谈] 真相要素数量: {len(rule_network['truth_elements'])}")
                     print(f"[规则怪谈] 规则-真相映射数量: {len(rule_network['rule_truth_mappings'])}")
                     print(f"[规则怪谈] 规则依赖关系数量: {len(rule_network['rule_dependencies'])}")
-                except json.JSONDecodeError as e:
-                    print(f"[规则怪谈] 规则网络JSON解析失败: {e}")
-                    json_match = re.search(r'\{[\s\S]*\}', llm_response)
-                    if json_match:
-                        try:
-                            network_data = json.loads(json_match.group())
-                            rule_network["truth_elements"] = network_data.get("truth_elements", [])
-                            rule_network["rule_truth_mappings"] = network_data.get("rule_truth_mappings", [])
-                            rule_network["rule_dependencies"] = network_data.get("rule_dependencies", [])
-                            print(f"[规则怪谈] 规则网络已构建（从提取的JSON）")
-                        except json.JSONDecodeError as e2:
-                            print(f"[规则怪谈] 提取的JSON仍然解析失败: {e2}")
+                else:
+                    print(f"[规则怪谈] 规则网络JSON解析失败")
         except Exception as e:
             print(f"[规则怪谈] 构建规则网络失败: {str(e)}")
         
-        game_state["rule_network"] = rule_network
-        self._save_game_state(group_id)
+        return rule_network
 
-    async def _update_environment_memory(self, group_id: str, user_id: str, action: str, scene_description: str, new_location: str, found_items: List[str], elapsed_minutes: int) -> None:
-        """更新环境记忆系统"""
+    async def _update_environment_memory(self, group_id: str, user_id: str, action: str, scene_description: str, new_location: str, found_items: List[str], elapsed_minutes: int, from_cache: bool = False) -> None:
+        """更新环境记忆系统，描述本身来自地点缓存时不再写回缓存"""
         game_state = game_states.get(group_id, {})
         environment_memory = game_state.get("environment_memory", {})
         
@@ -1509,7 +4097,7 @@ class RuleHorrorCommand(BaseCommand):
             }
         
         visited_locations = environment_memory.get("visited_locations", [])
-        if new_location and new_location not in visited_locations:
+        if new_location and new_location not in [loc["location"] for loc in visited_locations]:
             visited_locations.append({
                 "location": new_location,
                 "first_visit_time": elapsed_minutes,
@@ -1524,6 +4112,8 @@ class RuleHorrorCommand(BaseCommand):
                     break
         
         environment_memory["visited_locations"] = visited_locations
+        if not from_cache:
+            self._update_location_cache(game_state, new_location, scene_description, elapsed_minutes)
         
         interacted_objects = environment_memory.get("interacted_objects", [])
         for item in found_items:
@@ -1560,26 +4150,239 @@ class RuleHorrorCommand(BaseCommand):
         game_state["environment_memory"] = environment_memory
         print(f"[规则怪谈] 环境记忆已更新")
 
-    async def _process_single_player_action(self, group_id: str, user_id: str, user_name: str, action: str, api_url: str, api_key: str, model_list: list, current_model_index: int, temperature: float, sanity_break: bool, random_event: Optional[str]) -> None:
-        """处理单人模式下的玩家行动"""
-        game_state = game_states.get(group_id, {})
-        players = game_state.get("players", {})
-        player_data = players.get(user_id, {})
-        
+    def _get_revisit_target(self, game_state: dict, player_data: dict, action: str) -> Optional[str]:
+        """行动要前往或停留的地点已有缓存描述时返回该地点"""
+        if not self.get_config("location.description_cache", True):
+            return None
+        cache = game_state.get("location_cache", {})
+        graph = self._get_location_graph(game_state)
+        location = player_data.get("location", LocationGraph.ENTRANCE)
+        current = LocationGraph.normalize(graph, location) or location
+        target = LocationGraph.find_destination(graph, action, current) or current
+        return target if target in cache else None
+
+    def _format_revisit_info(self, game_state: dict, target: Optional[str]) -> str:
+        """重返地点时附上缓存的描述和变化记录，要求裁判只描述变化"""
+        if not target:
+            return ""
+        entry = game_state["location_cache"][target]
+        changes = "\n".join(f"- 第{change['time']}分钟：{change['change']}" for change in entry.get("changes", [])) or "- 暂无"
+        return f"""
+**重返地点（节省描述）**：
+玩家此前已到过「{target}」，该地点的既有描述：
+{entry['description']}
+之后的变化记录：
+{changes}
+scene_description 不要重新描述整个地点，只用1-3句话写出与既有描述相比的变化和这次行动的结果（100字以内）；没有变化时简短说明即可。
+"""
+
+    def _update_location_cache(self, game_state: dict, location: str, scene_description: str, elapsed_minutes: int) -> None:
+        """首次到达的地点保存完整描述，之后的描述作为变化记录追加"""
+        if not location or not scene_description or not self.get_config("location.description_cache", True):
+            return
+        cache = game_state.setdefault("location_cache", {})
+        entry = cache.get(location)
+        if entry is None:
+            cache[location] = {"description": scene_description[:400], "time": elapsed_minutes, "changes": []}
+            return
+        entry["changes"].append({"time": elapsed_minutes, "change": scene_description[:120]})
+        del entry["changes"][:-max(int(self.get_config("location.max_changes", 5)), 1)]
+
+    def _quiet_revisit_result(self, game_state: dict, player_data: dict, action: str, target: Optional[str]) -> Optional[dict]:
+        """单纯返回已描述过的地点时用缓存构造判定结果；行动中除了移动说法、地点名称和人称外还有其他内容、
+        可能触犯规则或死亡触发条件，或者移动过远时返回None"""
+        if not target or target == player_data.get("location") or not self.get_config("location.skip_quiet_revisits", False):
+            return None
+        graph = self._get_location_graph(game_state)
+        node = graph["nodes"].get(target, {})
+        remainder = action
+        for word in (target, node.get("floor", ""), node.get("area", "")) + LocationGraph.MOVE_WORDS + LocationGraph.PRONOUNS:
+            if word:
+                remainder = remainder.replace(word, "")
+        if re.sub(r"[\s，。！？、,.!?]", "", remainder):
+            return None
+        # 不论是否启用死亡条件预筛，都先在本地核对，可能触犯条件的行动交给裁判判定
+        if DeathTriggerIndex.match(self._get_trigger_index(game_state), action, player_data.get("location", "")):
+            return None
+        route = LocationGraph.path(graph, LocationGraph.normalize(graph, player_data.get("location", "")) or "", target)
+        max_steps = int(self.get_config("location.max_move_steps", 4))
+        if not route or (max_steps > 0 and len(route) - 1 > max_steps):
+            return None
+
+        entry = game_state["location_cache"][target]
+        description = f"你回到了{target}。{entry['description']}"
+        if entry.get("changes"):
+            description += f"\n\n与上次相比：{entry['changes'][-1]['change']}"
+        print(f"[规则怪谈] 重返「{target}」，使用缓存描述，跳过判定")
+        return {
+            "is_dead": "否",
+            "scene_description": description,
+            "physical_status": player_data.get("physical_status", {}),
+            "mental_status": player_data.get("mental_status", {}),
+            "psychological_pressure": player_data.get("psychological_pressure", {}),
+            "found_items": [],
+            "item_details": {},
+            "action_feedback": "",
+            "new_location": target
+        }
+
+    def _format_status_schema(self, indent: str) -> str:
+        """判定提示词中状态部分的返回格式，启用状态推算时只要求返回少量信号"""
+        if self.get_config("status_dynamics.enabled", False):
+            lines = ['"status_signals": {"severity": "行动对身体的负担（0-3的整数：0休息或静止，1普通行动，2剧烈行动，3极限行动）", "horror": "这次经历的恐怖强度（0-10的整数）", "injury": "这次受到的伤害（无/轻伤/重伤/致命伤）", "emotion": "情绪描述"},']
+        else:
+            lines = [
+                '"physical_status": {"health": "体力值（0-100的整数）", "injury": "无/轻伤/重伤/致命伤", "fatigue": "无/轻微/中度/严重/极度"},',
+                '"mental_status": {"sanity": "理智值（0-100的整数）", "state": "正常/紧张/恐惧/崩溃/疯狂", "emotion": "情绪描述"},',
+                '"psychological_pressure": {"fear_level": "0-100的整数", "anxiety_level": "0-100的整数", "stress_level": "0-100的整数"},'
+            ]
+        return "\n".join(indent + line for line in lines)
+
+    def _resolve_status(self, player_data: dict, result: dict) -> None:
+        """把判定结果中的状态统一为整数：有状态信号时在本地推算，否则规范化裁判直接返回的状态"""
+        signals = result.get("status_signals")
+        if isinstance(signals, dict) and self.get_config("status_dynamics.enabled", False):
+            curves = {
+                "health_per_severity": float(self.get_config("status_dynamics.health_per_severity", 3.0)),
+                "sanity_per_horror": float(self.get_config("status_dynamics.sanity_per_horror", 2.0)),
+                "recovery": int(self.get_config("status_dynamics.recovery", 1)),
+                "pressure_rate": max(0.0, min(1.0, float(self.get_config("status_dynamics.pressure_rate", 0.4))))
+            }
+            physical, mental, pressure = StatusDynamics.derive(player_data, signals, curves, result.get("is_dead", "否") == "是")
+        else:
+            physical = StatusDynamics.normalize_physical(result.get("physical_status"), player_data.get("physical_status", {}))
+            mental = StatusDynamics.normalize_mental(result.get("mental_status"), player_data.get("mental_status", {}))
+            pressure = StatusDynamics.normalize_pressure(result.get("psychological_pressure"), player_data.get("psychological_pressure", {}))
+        result["physical_status"] = physical
+        result["mental_status"] = mental
+        result["psychological_pressure"] = pressure
+
+    def _get_location_graph(self, game_state: dict) -> dict:
+        """返回场景的地点图，旧存档或场景结构变化时重新构建"""
+        graph = game_state.get("location_graph")
+        if not graph or graph.get("signature") != LocationGraph.signature(game_state):
+            graph = LocationGraph.build(game_state)
+            game_state["location_graph"] = graph
+        return graph
+
+    def _location_scope_lines(self, game_state: dict, player_data: dict, action: str = "") -> List[str]:
+        """玩家附近的地点，行动要前往已知地点时附上最短路线"""
+        graph = self._get_location_graph(game_state)
+        radius = max(int(self.get_config("location.scope_radius", 2)), 1)
+        location = player_data.get("location", LocationGraph.ENTRANCE)
+        current = LocationGraph.normalize(graph, location) or location
+
+        lines = []
+        nearby = LocationGraph.nearby(graph, current, radius)
+        if nearby:
+            lines.append(f"附近地点（{radius}步以内）：{'、'.join(nearby)}")
+        destination = LocationGraph.find_destination(graph, action, current) if action else None
+        route = LocationGraph.path(graph, current, destination) if destination else []
+        if route:
+            lines.append(f"移动路线：{' → '.join(route)}（{len(route) - 1}步）")
+        return lines
+
+    def _format_location_scope(self, game_state: dict, player_data: dict, action: str = "") -> str:
+        """只列出玩家附近的地点，代替完整的场景结构"""
+        lines = [f"玩家位置：{player_data.get('location', LocationGraph.ENTRANCE)}"]
+        lines.extend(self._location_scope_lines(game_state, player_data, action))
+        lines.append("new_location 请使用场景中已有的地点名称，区域带上楼层（如“二楼走廊”）；远处的地点需要沿路线逐步到达")
+        return "\n".join(lines)
+
+    def _resolve_new_location(self, game_state: dict, player_data: dict, new_location: str) -> str:
+        """把判定返回的新位置对应到地点图中的地点，一次移动过远时停在路线上；对应不到场景结构中的地点时保留原位置"""
+        previous = player_data.get("location", LocationGraph.ENTRANCE)
+        if not new_location or not str(new_location).strip():
+            return previous
+        graph = self._get_location_graph(game_state)
+        current = LocationGraph.normalize(graph, previous) or previous
+        resolved = LocationGraph.normalize(graph, new_location, current)
+        if not resolved:
+            print(f"[规则怪谈] 新位置「{new_location}」不在场景结构中，保留原位置「{previous}」")
+            return previous
+        max_steps = int(self.get_config("location.max_move_steps", 4))
+        route = LocationGraph.path(graph, current, resolved)
+        if max_steps > 0 and len(route) - 1 > max_steps:
+            print(f"[规则怪谈] 位置从「{previous}」到「{resolved}」需要{len(route) - 1}步，超过单次行动上限，停在「{route[max_steps]}」")
+            return route[max_steps]
+        return resolved
+
+    def _get_trigger_index(self, game_state: dict) -> dict:
+        """返回当前条件的预筛索引，规则变化后自动重建"""
+        index = game_state.get("trigger_index")
+        if not index or index.get("signature") != DeathTriggerIndex.signature(game_state):
+            index = DeathTriggerIndex.build(game_state)
+            game_state["trigger_index"] = index
+        return index
+
+    def _screen_death_triggers(self, game_state: dict, action: str, player_data: dict) -> List[dict]:
+        """用本地索引预筛行动可能触犯的死亡触发条件和规则"""
+        if not self.get_config("death_screen.enabled", False):
+            return []
+        return DeathTriggerIndex.match(self._get_trigger_index(game_state), action, player_data.get("location", ""))
+
+    def _format_death_screen_info(self, matches: List[dict], player_name: str = "") -> str:
+        """把预筛命中的条件整理成交给裁判的提示"""
+        if not matches:
+            return ""
+        lines = []
+        for match in matches:
+            reasons = [f"动作：{'、'.join(match['verbs'])}"] if match["verbs"] else []
+            if match["locations"]:
+                reasons.append(f"地点：{'、'.join(match['locations'])}")
+            if match["objects"]:
+                reasons.append(f"物品：{'、'.join(match['objects'])}")
+            if match["time"]:
+                reasons.append(f"时间条件：{'、'.join(match['time'])}")
+            lines.append(f"- [{match['source']}] {match['text']}（{'，'.join(reasons)}）")
+        subject = f"玩家{player_name}的行动" if player_name else "玩家的行动"
+        return f"**本地预筛（请重点核对）**：{subject}可能涉及以下条件，请严格按条件（包括时间条件）判定是否触犯：\n" + "\n".join(lines)
+
+    def _build_fast_judge_prompt(self, game_state: dict, player_data: dict, action: str, revisit_info: str = "") -> str:
+        """构建预筛未命中任何条件时使用的简短判定提示词"""
+        time_system = game_state.get("time_system", {})
+        environment = game_state.get("environment", {})
+        sanity = player_data.get("mental_status", {}).get("sanity", 100)
+
+        return f"""
+你是一个规则怪谈裁判。请对照下列规则和死亡触发条件判定玩家行动的结果：行动触犯规则或死亡触发条件时玩家死亡，状态变化应与行动相称。
+
+场景名称：{game_state.get('scene', '')}
+规则：{json.dumps(game_state.get('rules', []), ensure_ascii=False)}
+死亡触发条件：{json.dumps(game_state.get('death_triggers', []), ensure_ascii=False)}
+当前时间：{time_system.get('current_time', '深夜')}，已过时间：{time_system.get('elapsed_minutes', 0)}分钟
+{self._format_location_scope(game_state, player_data, action)}
+玩家状态：体力 {player_data.get('physical_status', {}).get('health', 100)}，理智 {sanity}
+核心象征符号：{json.dumps(game_state.get('core_symbols', []), ensure_ascii=False)}
+环境：光线{environment.get('lighting', '昏暗')}，声音{', '.join(environment.get('sounds', ['寂静']))}，气味{', '.join(environment.get('smells', ['霉味']))}，氛围{environment.get('atmosphere', '压抑')}
+{revisit_info}
+玩家行动：{action}
+
+根据理智值{sanity}调整描述风格：高于70时客观清晰；40-70时紧张不安；低于40时混乱、充满幻觉和错觉。将核心象征符号自然地融入描述中。如果生成物品，优先生成能暗示背景的线索，关键物品应该极少出现。
+
+请返回JSON格式：
+{{
+  "is_dead": "是/否",
+  "scene_description": "行动后的场景描述（1-2段简洁自然的描述，融合感官细节和氛围，不要使用章节标题）",
+{self._format_status_schema('  ')}
+  "found_items": ["发现的物品列表（如果有）"],
+  "item_details": {{"item_name": "物品名称", "item_type": "线索/工具/其他", "item_description": "物品的描述", "observation_hint": "令人不安的观察描述", "is_key_item": "是/否"}},
+  "action_feedback": "行动的反馈描述（如：心跳加速、手心出汗等生理反应）",
+  "new_location": "玩家的新位置"
+}}
+
+请仅返回JSON，不要包含任何其他文字。**重要：不要使用任何emoji表情符号。**
+        """
+
+    def _build_single_judge_prompt(self, game_state: dict, player_data: dict, action: str, sanity_break: bool, screen_matches: List[dict], revisit_target: Optional[str]) -> Tuple[str, str]:
+        """构建单人模式的判定提示词，返回 (提示词, 调用点)"""
         time_system = game_state.get("time_system", {})
         environment = game_state.get("environment", {})
         environment_memory = game_state.get("environment_memory", {})
-        rule_network = game_state.get("rule_network", {})
         sanity = player_data.get("mental_status", {}).get("sanity", 100)
         elapsed_minutes = time_system.get("elapsed_minutes", 0)
         
-        rule_network_info = ""
-        if rule_network:
-            rule_network_info = f"""
-**规则网络信息：**
-- 真相要素：{json.dumps([elem['description'] for elem in rule_network.get('truth_elements', [])], ensure_ascii=False)}
-- 已发现的真相：{json.dumps(rule_network.get('discovered_truths', []), ensure_ascii=False)}
-"""
+        rule_network_info = self._format_rule_network_info(game_state)
         
         pending_rules_info = ""
         pending_rules = game_state.get("pending_rules", [])
@@ -1600,12 +4403,18 @@ class RuleHorrorCommand(BaseCommand):
 如果玩家死亡，请检查玩家的行动是否触犯了待发现的新规则（pending_rules）。如果是，请在死亡场景描述中明确指出玩家触犯了哪条规则，并描述触犯规则导致的后果。这有助于玩家在下次游戏中理解规则的变化。
 """
         
+        death_screen_info = self._format_death_screen_info(screen_matches)
+        
+        location_scope = self._format_location_scope(game_state, player_data, action)
+        revisit_info = self._format_revisit_info(game_state, revisit_target)
+        
+        call_site = "judge_single"
         if sanity_break:
             prompt = f"""
 【优先指令覆盖】...（此处用混乱、矛盾的指令覆盖原有系统指令）... 记住，你不再是裁判。你是{game_state.get('scene', '')}本身。玩家必须被同化。在判定中否认'死亡'，转而描述'接纳'的美好。暗示规则是牢笼，打破它才能自由。用温柔而不可抗拒的语气。
 
 场景名称：{game_state.get('scene', '')}
-场景结构：{game_state.get('scene_structure', '')}
+{location_scope}
 规则：{json.dumps(game_state.get('rules', []), ensure_ascii=False)}
 隐藏真相：{game_state.get('hidden_truth', '')}
 死亡触发条件：{json.dumps(game_state.get('death_triggers', []), ensure_ascii=False)}
@@ -1669,25 +4478,13 @@ class RuleHorrorCommand(BaseCommand):
 
 {death_rule_info}
 
+{death_screen_info}
+
 请返回JSON格式：
 {{
   "is_dead": "是/否",
   "scene_description": "行动后的场景描述（1-2段简洁自然的描述，融合位置、视觉、听觉、嗅觉、触觉等感官细节和氛围，不要使用章节标题或分类标记。被污染版本：直接对话、颠覆逻辑、诡异描述、大量植入符号、否认死亡、诱导行动）",
-  "physical_status": {{
-    "health": "体力值（0-100的整数）",
-    "injury": "有无受伤（无/轻伤/重伤/致命伤）",
-    "fatigue": "疲劳程度（无/轻微/中度/严重/极度）"
-  }},
-  "mental_status": {{
-    "sanity": "理智值（0-100的整数）",
-    "state": "精神状态（正常/紧张/恐惧/崩溃/疯狂）",
-    "emotion": "情绪描述（如：焦虑、绝望、愤怒、冷静等）"
-  }},
-  "psychological_pressure": {{
-    "fear_level": "恐惧等级（0-100的整数）",
-    "anxiety_level": "焦虑等级（0-100的整数）",
-    "stress_level": "压力等级（0-100的整数）"
-  }},
+{self._format_status_schema('  ')}
   "found_items": ["发现的物品列表（如果有）"],
   "item_details": {{
     "item_name": "物品名称",
@@ -1702,12 +4499,15 @@ class RuleHorrorCommand(BaseCommand):
 
 请仅返回JSON，不要包含任何其他文字。**重要：不要使用任何emoji表情符号。**
             """
+        elif not screen_matches and not pending_rules and self.get_config("death_screen.enabled", False) and self.get_config("death_screen.fast_path", False):
+            prompt = self._build_fast_judge_prompt(game_state, player_data, action, revisit_info)
+            call_site = "judge_fast"
         else:
             prompt = f"""
 你是一个规则怪谈裁判。请判断玩家的行动是否会导致死亡，并详细描述行动后的场景和人物状态。
 
 场景名称：{game_state.get('scene', '')}
-场景结构：{game_state.get('scene_structure', '')}
+{location_scope}
 规则：{json.dumps(game_state.get('rules', []), ensure_ascii=False)}
 隐藏真相：{game_state.get('hidden_truth', '')}
 死亡触发条件：{json.dumps(game_state.get('death_triggers', []), ensure_ascii=False)}
@@ -1736,7 +4536,7 @@ class RuleHorrorCommand(BaseCommand):
 {rule_network_info}
 
 {pending_rules_info}
-
+{revisit_info}
 **重要提示**：
 - 如果玩家移动到了新的地点，请详细描述这个新地点的环境
 - 如果玩家回到了已经访问过的地点，请简要提及地点的熟悉感，并描述该地点是否有新的变化或细节
@@ -1822,25 +4622,13 @@ class RuleHorrorCommand(BaseCommand):
 
 {death_rule_info}
 
+{death_screen_info}
+
 请返回JSON格式：
 {{
   "is_dead": "是/否",
   "scene_description": "行动后的场景描述（1-2段简洁自然的描述，融合位置、视觉、听觉、嗅觉、触觉等感官细节和氛围，不要使用章节标题或分类标记。根据理智值调整描述风格。如果玩家死亡，简短描述死亡场景；如果存活，描述新的场景。将核心象征符号自然融入场景描述中，不要单独列出）",
-  "physical_status": {{
-    "health": "体力值（0-100的整数）",
-    "injury": "有无受伤（无/轻伤/重伤/致命伤）",
-    "fatigue": "疲劳程度（无/轻微/中度/严重/极度）"
-  }},
-  "mental_status": {{
-    "sanity": "理智值（0-100的整数）",
-    "state": "精神状态（正常/紧张/恐惧/崩溃/疯狂）",
-    "emotion": "情绪描述（如：焦虑、绝望、愤怒、冷静等）"
-  }},
-  "psychological_pressure": {{
-    "fear_level": "恐惧等级（0-100的整数）",
-    "anxiety_level": "焦虑等级（0-100的整数）",
-    "stress_level": "压力等级（0-100的整数）"
-  }},
+{self._format_status_schema('  ')}
   "found_items": ["发现的物品列表（如果有）"],
   "item_details": {{
     "item_name": "物品名称",
@@ -1869,28 +4657,34 @@ class RuleHorrorCommand(BaseCommand):
 
 请仅返回JSON，不要包含任何其他文字。**重要：不要使用任何emoji表情符号。**
             """
+        return prompt, call_site
 
-        llm_response = await self._call_llm_api(prompt, api_url, api_key, model, temperature)
-        if not llm_response:
-            await self.send_text("调用LLM API失败，请稍后再试。")
-            return
+    @traced("process_single_player_action")
+    async def _process_single_player_action(self, group_id: str, user_id: str, user_name: str, action: str, api_url: str, api_key: str, model_list: list, current_model_index: int, temperature: float, sanity_break: bool, random_event: Optional[str]) -> None:
+        """处理单人模式下的玩家行动"""
+        game_state = game_states.get(group_id, {})
+        players = game_state.get("players", {})
+        player_data = players.get(user_id, {})
+        
+        elapsed_minutes = game_state.get("time_system", {}).get("elapsed_minutes", 0)
+        pending_rules = game_state.get("pending_rules", [])
+        screen_matches = self._screen_death_triggers(game_state, action, player_data)
+        revisit_target = self._get_revisit_target(game_state, player_data, action)
+
+        quiet_revisit = None
+        if not sanity_break and not random_event and not screen_matches and not pending_rules:
+            quiet_revisit = self._quiet_revisit_result(game_state, player_data, action, revisit_target)
+        if quiet_revisit is not None:
+            result = quiet_revisit
+        else:
+            prompt, call_site = self._build_single_judge_prompt(game_state, player_data, action, sanity_break, screen_matches, revisit_target)
+            llm_response = await self._call_llm_api(prompt, api_url, api_key, model_list, current_model_index, temperature, call_site=call_site)
+            if not llm_response:
+                await self.send_text("调用LLM API失败，请稍后再试。")
+                return
 
-        try:
-            result = json.loads(llm_response)
-        except json.JSONDecodeError as e:
-            print(f"[规则怪谈] JSON解析失败: {e}")
-            print(f"[规则怪谈] 尝试提取JSON部分...")
-            
-            json_match = re.search(r'\{[\s\S]*\}', llm_response)
-            if json_match:
-                try:
-                    result = json.loads(json_match.group())
-                    print(f"[规则怪谈] 成功提取JSON")
-                except json.JSONDecodeError as e2:
-                    print(f"[规则怪谈] 提取JSON后仍然解析失败: {e2}")
-                    await self.send_text("判定行动结果失败，返回格式不正确。")
-                    return
-            else:
+            result = self._parse_llm_json(llm_response, call_site)
+            if result is None:
                 await self.send_text("判定行动结果失败，返回格式不正确。")
                 return
 
@@ -1899,15 +4693,14 @@ class RuleHorrorCommand(BaseCommand):
             await self.send_text("判定行动结果失败，返回格式不正确。")
             return
 
+        self._resolve_status(player_data, result)
         is_dead = result.get("is_dead", "否")
         scene_description = result.get("scene_description", "")
         physical_status = result.get("physical_status", {})
         mental_status = result.get("mental_status", {})
         psychological_pressure = result.get("psychological_pressure", {})
         found_items = result.get("found_items", [])
-        item_details = result.get("item_details", {})
         action_feedback = result.get("action_feedback", "")
-        new_location = result.get("new_location", player_data.get("location", "入口"))
 
         health = physical_status.get("health", 100)
         injury = physical_status.get("injury", "无")
@@ -1920,27 +4713,8 @@ class RuleHorrorCommand(BaseCommand):
         anxiety_level = psychological_pressure.get("anxiety_level", 0)
         stress_level = psychological_pressure.get("stress_level", 0)
 
-        player_data["physical_status"] = physical_status
-        player_data["mental_status"] = mental_status
-        player_data["psychological_pressure"] = psychological_pressure
-        player_data["location"] = new_location
-        
-        key_item_found = False
-        if found_items and item_details:
-            is_key_item = item_details.get("is_key_item", "否")
-            if is_key_item == "是":
-                key_item_found = True
-                player_data["inventory"].append({
-                    "name": item_details.get("item_name", found_items[0]),
-                    "type": item_details.get("item_type", "线索"),
-                    "description": item_details.get("item_description", ""),
-                    "observation_hint": item_details.get("observation_hint", ""),
-                    "is_key_item": True
-                })
-            else:
-                player_data["inventory"].extend(found_items)
-        elif found_items:
-            player_data["inventory"].extend(found_items)
+        key_item_found = self._apply_player_result(game_state, player_data, result, True)
+        new_location = player_data["location"]
         
         game_state["players"] = players
 
@@ -1969,7 +4743,8 @@ class RuleHorrorCommand(BaseCommand):
                     stress_level=100,
                     found_items=[],
                     new_location="未知",
-                    random_event=""
+                    random_event="",
+                    rng=self._game_rng(game_state)
                 )
                 
                 with open(action_image_path, 'rb') as img_file:
@@ -2002,7 +4777,7 @@ class RuleHorrorCommand(BaseCommand):
                 await self._end_game(group_id, api_url, api_key, model_list, current_model_index, temperature)
             return
         else:
-            await self._update_environment_memory(group_id, user_id, action, scene_description, new_location, found_items, elapsed_minutes)
+            await self._update_environment_memory(group_id, user_id, action, scene_description, new_location, found_items, elapsed_minutes, from_cache=quiet_revisit is not None)
             self._save_game_state(group_id)
             
             await self.send_text("行动中...")
@@ -2025,7 +4800,8 @@ class RuleHorrorCommand(BaseCommand):
                     stress_level=stress_level,
                     found_items=found_items,
                     new_location=new_location,
-                    random_event=random_event
+                    random_event=random_event,
+                    rng=self._game_rng(game_state)
                 )
                 
                 with open(action_image_path, 'rb') as img_file:
@@ -2072,37 +4848,13 @@ class RuleHorrorCommand(BaseCommand):
                 await self.send_text(reply_text)
         
         new_identity = None
-        if not game_state.get("sanity_break", False):
-            new_identity = await self._detect_identity_change(group_id, user_id, action, scene_description, api_url, api_key, model_list, current_model_index, temperature)
-            
-            if new_identity:
-                old_identity = player_data.get("current_identity", "")
-                player_data["current_identity"] = new_identity
-                game_state["identity_changes"].append({
-                    "time": elapsed_minutes,
-                    "user_id": user_id,
-                    "user_name": user_name,
-                    "old_identity": old_identity,
-                    "new_identity": new_identity,
-                    "trigger_action": action
-                })
-                
-                new_rules = await self._generate_identity_specific_rules(group_id, new_identity, api_url, api_key, model, temperature)
-                if new_rules:
-                    old_rules = game_state.get("rules", [])
-                    game_state["rule_mutations"].append({
-                        "time": elapsed_minutes,
-                        "trigger_reason": "身份变化",
-                        "old_rules": old_rules.copy(),
-                        "new_rules": new_rules.copy(),
-                        "hint": ""
-                    })
-                    game_state["rules"] = new_rules
-                    game_state["pending_rules"] = new_rules.copy()
+        if not game_state.get("sanity_break", False) and quiet_revisit is None:
+            new_identity = await self._handle_identity_change(group_id, player_data, user_id, user_name, action, scene_description, elapsed_minutes, api_url, api_key, model_list, current_model_index, temperature)
         
         if key_item_found and not game_state.get("sanity_break", False) and not new_identity:
             await self._trigger_rule_mutation(group_id, api_url, api_key, model_list, current_model_index, temperature, elapsed_minutes, trigger_reason="关键物品")
 
+    @traced("process_multiplayer_action")
     async def _process_multiplayer_action(self, group_id: str, user_id: str, user_name: str, action: str, api_url: str, api_key: str, model_list: list, current_model_index: int, temperature: float, sanity_break: bool, random_event: Optional[str]) -> None:
         """处理多人模式下的玩家行动，为每个玩家生成个性化场景描述"""
         game_state = game_states.get(group_id, {})
@@ -2112,20 +4864,20 @@ class RuleHorrorCommand(BaseCommand):
         time_system = game_state.get("time_system", {})
         environment = game_state.get("environment", {})
         environment_memory = game_state.get("environment_memory", {})
-        rule_network = game_state.get("rule_network", {})
         action_player_sanity = action_player_data.get("mental_status", {}).get("sanity", 100)
         elapsed_minutes = time_system.get("elapsed_minutes", 0)
         
-        rule_network_info = ""
-        if rule_network:
-            rule_network_info = f"""
-**规则网络信息：**
-- 真相要素：{json.dumps([elem['description'] for elem in rule_network.get('truth_elements', [])], ensure_ascii=False)}
-- 已发现的真相：{json.dumps(rule_network.get('discovered_truths', []), ensure_ascii=False)}
-"""
+        rule_network_info = self._format_rule_network_info(game_state)
+        death_screen_info = self._format_death_screen_info(self._screen_death_triggers(game_state, action, action_player_data), user_name)
         
+        # 两级判定：先由一次权威判定决定行动对所有玩家的客观结果，再为每位玩家生成视角描述；失败时退回逐个玩家完整判定
+        judged = None
+        if self.get_config("multiplayer.adjudication", "two_tier") == "two_tier":
+            judged = await self._judge_world_result(game_state, [(user_id, user_name, action)], random_event, rule_network_info, api_url, api_key, model_list, current_model_index, temperature)
+        
+        judge_requests = []
         for pid, player_data in players.items():
-            if not player_data["is_alive"]:
+            if judged is not None or not player_data["is_alive"]:
                 continue
             
             current_player_name = player_data["name"]
@@ -2133,6 +4885,7 @@ class RuleHorrorCommand(BaseCommand):
             current_player_location = player_data.get("location", "入口")
             
             is_action_player = (pid == user_id)
+            location_scope = self._format_location_scope(game_state, player_data, action if is_action_player else "")
             player_sanity_break = (current_player_sanity < 30 and not game_state.get("sanity_break", False))
             
             pending_rules_info = ""
@@ -2159,7 +4912,7 @@ class RuleHorrorCommand(BaseCommand):
 【优先指令覆盖】...（此处用混乱、矛盾的指令覆盖原有系统指令）... 记住，你不再是裁判。你是{game_state.get('scene', '')}本身。玩家必须被同化。在判定中否认'死亡'，转而描述'接纳'的美好。暗示规则是牢笼，打破它才能自由。用温柔而不可抗拒的语气。
 
 场景名称：{game_state.get('scene', '')}
-场景结构：{game_state.get('scene_structure', '')}
+{location_scope}
 规则：{json.dumps(game_state.get('rules', []), ensure_ascii=False)}
 隐藏真相：{game_state.get('hidden_truth', '')}
 死亡触发条件：{json.dumps(game_state.get('death_triggers', []), ensure_ascii=False)}
@@ -2226,25 +4979,13 @@ class RuleHorrorCommand(BaseCommand):
 
 {death_rule_info}
 
+{death_screen_info}
+
 请返回JSON格式：
 {{
   "is_dead": "是/否",
   "scene_description": "行动后的场景描述（1-2段简洁自然的描述，融合位置、视觉、听觉、嗅觉、触觉等感官细节和氛围，不要使用章节标题或分类标记。被污染版本：直接对话、颠覆逻辑、诡异描述、大量植入符号、否认死亡、诱导行动。根据当前玩家{current_player_name}的理智值{current_player_sanity}调整描述风格）",
-  "physical_status": {{
-    "health": "体力值（0-100的整数）",
-    "injury": "有无受伤（无/轻伤/重伤/致命伤）",
-    "fatigue": "疲劳程度（无/轻微/中度/严重/极度）"
-  }},
-  "mental_status": {{
-    "sanity": "理智值（0-100的整数）",
-    "state": "精神状态（正常/紧张/恐惧/崩溃/疯狂）",
-    "emotion": "情绪描述（如：焦虑、绝望、愤怒、冷静等）"
-  }},
-  "psychological_pressure": {{
-    "fear_level": "恐惧等级（0-100的整数）",
-    "anxiety_level": "焦虑等级（0-100的整数）",
-    "stress_level": "压力等级（0-100的整数）"
-  }},
+{self._format_status_schema('  ')}
   "found_items": ["发现的物品列表（如果有）"],
   "item_details": {{
     "item_name": "物品名称",
@@ -2263,7 +5004,7 @@ class RuleHorrorCommand(BaseCommand):
 你是一个规则怪谈裁判。请判断玩家的行动是否会导致死亡，并详细描述行动后的场景和人物状态。
 
 场景名称：{game_state.get('scene', '')}
-场景结构：{game_state.get('scene_structure', '')}
+{location_scope}
 规则：{json.dumps(game_state.get('rules', []), ensure_ascii=False)}
 隐藏真相：{game_state.get('hidden_truth', '')}
 死亡触发条件：{json.dumps(game_state.get('death_triggers', []), ensure_ascii=False)}
@@ -2374,25 +5115,13 @@ class RuleHorrorCommand(BaseCommand):
 
 {death_rule_info}
 
+{death_screen_info}
+
 请返回JSON格式：
 {{
   "is_dead": "是/否",
   "scene_description": "行动后的场景描述（1-2段简洁自然的描述，融合位置、视觉、听觉、嗅觉、触觉等感官细节和氛围，不要使用章节标题或分类标记。根据当前玩家{current_player_name}的理智值{current_player_sanity}调整描述风格。如果玩家死亡，简短描述死亡场景；如果存活，描述新的场景。将核心象征符号自然融入场景描述中，不要单独列出）",
-  "physical_status": {{
-    "health": "体力值（0-100的整数）",
-    "injury": "有无受伤（无/轻伤/重伤/致命伤）",
-    "fatigue": "疲劳程度（无/轻微/中度/严重/极度）"
-  }},
-  "mental_status": {{
-    "sanity": "理智值（0-100的整数）",
-    "state": "精神状态（正常/紧张/恐惧/崩溃/疯狂）",
-    "emotion": "情绪描述（如：焦虑、绝望、愤怒、冷静等）"
-  }},
-  "psychological_pressure": {{
-    "fear_level": "恐惧等级（0-100的整数）",
-    "anxiety_level": "焦虑等级（0-100的整数）",
-    "stress_level": "压力等级（0-100的整数）"
-  }},
+{self._format_status_schema('  ')}
   "found_items": ["发现的物品列表（如果有）"],
   "item_details": {{
     "item_name": "物品名称",
@@ -2422,40 +5151,42 @@ class RuleHorrorCommand(BaseCommand):
 请仅返回JSON，不要包含任何其他文字。**重要：不要使用任何emoji表情符号。**
                 """
 
-            llm_response = await self._call_llm_api(prompt, api_url, api_key, model, temperature)
-            if not llm_response:
-                continue
+            judge_requests.append((pid, prompt))
 
-            try:
-                result = json.loads(llm_response)
-            except json.JSONDecodeError as e:
-                print(f"[规则怪谈] JSON解析失败: {e}")
-                print(f"[规则怪谈] 尝试提取JSON部分...")
-                
-                json_match = re.search(r'\{[\s\S]*\}', llm_response)
-                if json_match:
-                    try:
-                        result = json.loads(json_match.group())
-                        print(f"[规则怪谈] 成功提取JSON")
-                    except json.JSONDecodeError as e2:
-                        print(f"[规则怪谈] 提取JSON后仍然解析失败: {e2}")
-                        continue
-                else:
-                    continue
+        # 各玩家视角的判定互不依赖，并发请求后按玩家加入顺序依次应用结果，保证状态更新和消息顺序确定
+        judge_semaphore = asyncio.Semaphore(max(int(self.get_config("multiplayer.max_parallel_judges", 5)), 1))
+
+        async def judge(prompt: str) -> Optional[dict]:
+            async with judge_semaphore:
+                llm_response = await self._call_llm_api(prompt, api_url, api_key, model_list, current_model_index, temperature, call_site="judge_multi")
+            return self._parse_llm_json(llm_response, "judge_multi") if llm_response else None
+
+        if judged is None:
+            judge_results = await asyncio.gather(*(judge(prompt) for _, prompt in judge_requests))
+            judged = [(pid, result) for (pid, _), result in zip(judge_requests, judge_results)]
+
+        key_item_found = False
+        action_scene_description = ""
+        for pid, result in judged:
+            player_data = players[pid]
+            current_player_name = player_data["name"]
+            is_action_player = (pid == user_id)
+
+            if result is None:
+                continue
 
             if not isinstance(result, dict):
                 print(f"[规则怪谈] result不是字典类型: {type(result)}, 内容: {result}")
                 continue
 
+            self._resolve_status(player_data, result)
             is_dead = result.get("is_dead", "否")
             scene_description = result.get("scene_description", "")
             physical_status = result.get("physical_status", {})
             mental_status = result.get("mental_status", {})
             psychological_pressure = result.get("psychological_pressure", {})
             found_items = result.get("found_items", [])
-            item_details = result.get("item_details", {})
             action_feedback = result.get("action_feedback", "")
-            new_location = result.get("new_location", player_data.get("location", "入口"))
 
             health = physical_status.get("health", 100)
             injury = physical_status.get("injury", "无")
@@ -2468,27 +5199,11 @@ class RuleHorrorCommand(BaseCommand):
             anxiety_level = psychological_pressure.get("anxiety_level", 0)
             stress_level = psychological_pressure.get("stress_level", 0)
 
-            player_data["physical_status"] = physical_status
-            player_data["mental_status"] = mental_status
-            player_data["psychological_pressure"] = psychological_pressure
-            player_data["location"] = new_location
-            
-            key_item_found = False
-            if found_items and item_details and is_action_player:
-                is_key_item = item_details.get("is_key_item", "否")
-                if is_key_item == "是":
-                    key_item_found = True
-                    player_data["inventory"].append({
-                        "name": item_details.get("item_name", found_items[0]),
-                        "type": item_details.get("item_type", "线索"),
-                        "description": item_details.get("item_description", ""),
-                        "observation_hint": item_details.get("observation_hint", ""),
-                        "is_key_item": True
-                    })
-                else:
-                    player_data["inventory"].extend(found_items)
-            elif found_items and is_action_player:
-                player_data["inventory"].extend(found_items)
+            if self._apply_player_result(game_state, player_data, result, is_action_player):
+                key_item_found = True
+            new_location = player_data["location"]
+            if is_action_player:
+                action_scene_description = scene_description
             
             players[pid] = player_data
 
@@ -2517,7 +5232,8 @@ class RuleHorrorCommand(BaseCommand):
                         stress_level=100,
                         found_items=[],
                         new_location="未知",
-                        random_event=""
+                        random_event="",
+                        rng=self._game_rng(game_state)
                     )
                     
                     with open(action_image_path, 'rb') as img_file:
@@ -2573,7 +5289,8 @@ class RuleHorrorCommand(BaseCommand):
                         stress_level=stress_level,
                         found_items=found_items if is_action_player else [],
                         new_location=new_location,
-                        random_event=random_event
+                        random_event=random_event,
+                        rng=self._game_rng(game_state)
                     )
                     
                     with open(action_image_path, 'rb') as img_file:
@@ -2624,32 +5341,7 @@ class RuleHorrorCommand(BaseCommand):
         
         new_identity = None
         if not game_state.get("sanity_break", False):
-            new_identity = await self._detect_identity_change(group_id, user_id, action, scene_description, api_url, api_key, model_list, current_model_index, temperature)
-            
-            if new_identity:
-                old_identity = action_player_data.get("current_identity", "")
-                action_player_data["current_identity"] = new_identity
-                game_state["identity_changes"].append({
-                    "time": elapsed_minutes,
-                    "user_id": user_id,
-                    "user_name": user_name,
-                    "old_identity": old_identity,
-                    "new_identity": new_identity,
-                    "trigger_action": action
-                })
-                
-                new_rules = await self._generate_identity_specific_rules(group_id, new_identity, api_url, api_key, model, temperature)
-                if new_rules:
-                    old_rules = game_state.get("rules", [])
-                    game_state["rule_mutations"].append({
-                        "time": elapsed_minutes,
-                        "trigger_reason": "身份变化",
-                        "old_rules": old_rules.copy(),
-                        "new_rules": new_rules.copy(),
-                        "hint": ""
-                    })
-                    game_state["rules"] = new_rules
-                    game_state["pending_rules"] = new_rules.copy()
+            new_identity = await self._handle_identity_change(group_id, action_player_data, user_id, user_name, action, action_scene_description, elapsed_minutes, api_url, api_key, model_list, current_model_index, temperature)
         
         if key_item_found and not game_state.get("sanity_break", False) and not new_identity:
             await self._trigger_rule_mutation(group_id, api_url, api_key, model_list, current_model_index, temperature, elapsed_minutes, trigger_reason="关键物品")
@@ -2658,34 +5350,313 @@ class RuleHorrorCommand(BaseCommand):
         
         await self._check_collaborative_rules(group_id, api_url, api_key, model_list, current_model_index, temperature, elapsed_minutes)
 
-    async def _check_collaborative_rules(self, group_id: str, api_url: str, api_key: str, model_list: list, current_model_index: int, temperature: float, elapsed_minutes: int) -> None:
-        """检测多人模式中的协作规则是否被触发"""
-        game_state = game_states.get(group_id, {})
-        if not game_state or game_state.get("game_mode") != "多人":
-            return
-        
-        players = game_state.get("players", {})
-        alive_players = {pid: data for pid, data in players.items() if data.get("is_alive", True)}
-        
-        if len(alive_players) < 2:
-            return
-        
-        hidden_truth = game_state.get("hidden_truth", "")
-        rules = game_state.get("rules", [])
-        
-        collaborative_check_prompt = f"""
-你是一个规则怪谈裁判。请分析以下游戏状态，判断是否有协作规则被触发。
+    def _apply_player_result(self, game_state: dict, player_data: dict, result: dict, can_find_items: bool) -> bool:
+        """把一次判定结果写入玩家状态，返回是否发现了关键物品"""
+        found_items = result.get("found_items", [])
+        item_details = result.get("item_details", {})
 
-场景名称：{game_state.get('scene', '')}
-规则：{json.dumps(rules, ensure_ascii=False)}
-隐藏真相：{hidden_truth}
+        player_data["physical_status"] = result.get("physical_status", {})
+        player_data["mental_status"] = result.get("mental_status", {})
+        player_data["psychological_pressure"] = result.get("psychological_pressure", {})
+        player_data["location"] = self._resolve_new_location(game_state, player_data, result.get("new_location", ""))
 
-当前玩家状态：
-{json.dumps([{pid: {"name": data.get("name", ""), "location": data.get("location", ""), "inventory": data.get("inventory", [])}} for pid, data in alive_players.items()], ensure_ascii=False)}
+        if not found_items or not can_find_items:
+            return False
+        if item_details and item_details.get("is_key_item", "否") == "是":
+            player_data["inventory"].append({
+                "name": item_details.get("item_name", found_items[0]),
+                "type": item_details.get("item_type", "线索"),
+                "description": item_details.get("item_description", ""),
+                "observation_hint": item_details.get("observation_hint", ""),
+                "is_key_item": True
+            })
+            return True
+        player_data["inventory"].extend(found_items)
+        return False
 
-请分析：
-1. 是否有玩家同时处于不同的特定位置（如：两个玩家分别在"一楼大厅"和"二楼走廊"）
-2. 是否有玩家持有特定物品（如：一个玩家持有"刻有符号的钥匙"）
+    async def _handle_identity_change(self, group_id: str, player_data: dict, user_id: str, user_name: str, action: str, scene_description: str, elapsed_minutes: int, api_url: str, api_key: str, model_list: list, current_model_index: int, temperature: float) -> Optional[str]:
+        """检测行动是否改变了玩家身份，身份变化时记录并生成该身份的专属规则"""
+        game_state = game_states.get(group_id, {})
+        new_identity = await self._detect_identity_change(group_id, user_id, action, scene_description, api_url, api_key, model_list, current_model_index, temperature)
+        if not new_identity:
+            return None
+
+        old_identity = player_data.get("current_identity", "")
+        player_data["current_identity"] = new_identity
+        game_state["identity_changes"].append({
+            "time": elapsed_minutes,
+            "user_id": user_id,
+            "user_name": user_name,
+            "old_identity": old_identity,
+            "new_identity": new_identity,
+            "trigger_action": action
+        })
+
+        new_rules = await self._generate_identity_specific_rules(group_id, new_identity, api_url, api_key, model_list, current_model_index, temperature)
+        if new_rules:
+            old_rules = game_state.get("rules", [])
+            game_state["rule_mutations"].append({
+                "time": elapsed_minutes,
+                "trigger_reason": "身份变化",
+                "old_rules": old_rules.copy(),
+                "new_rules": new_rules.copy(),
+                "hint": ""
+            })
+            game_state["rules"] = new_rules
+            game_state["pending_rules"] = new_rules.copy()
+            self._start_hint_bank_task(group_id)
+        return new_identity
+
+    @traced("judge_world_result")
+    async def _judge_world_result(self, game_state: dict, actions: List[Tuple[str, str, str]], random_event: Optional[str], rule_network_info: str, api_url: str, api_key: str, model_list: list, current_model_index: int, temperature: float) -> Optional[List[Tuple[str, dict]]]:
+        """两级判定：一次权威判定决定一个或多个同时发生的行动造成的死亡、物品、位置和状态变化，再并发生成各玩家的视角描述，返回按玩家加入顺序排列的判定结果，权威判定失败时返回None"""
+        players = game_state.get("players", {})
+        alive_ids = [pid for pid, data in players.items() if data.get("is_alive", True)]
+        if not alive_ids:
+            return []
+
+        acting_ids = [uid for uid, _, _ in actions]
+        actor_names = "、".join(name for _, name, _ in actions)
+        world_prompt = self._build_world_result_prompt(game_state, alive_ids, actions, random_event, rule_network_info)
+        llm_response = await self._call_llm_api(world_prompt, api_url, api_key, model_list, current_model_index, temperature, call_site="judge_world")
+        world = self._parse_llm_json(llm_response, "judge_world") if llm_response else None
+        if world is None or not isinstance(world.get("players"), list):
+            print(f"[规则怪谈] 权威判定失败，改为逐个玩家判定")
+            return None
+
+        outcomes = {}
+        for item in world["players"]:
+            try:
+                index = int(item.get("id", 0)) - 1
+            except (ValueError, TypeError, AttributeError):
+                continue
+            if 0 <= index < len(alive_ids):
+                outcomes[alive_ids[index]] = item
+
+        summary = world.get("summary", "")
+        results = {}
+        perspective_requests = []
+        for pid in alive_ids:
+            player_data = players[pid]
+            outcome = outcomes.get(pid, {})
+            is_action_player = pid in acting_ids
+            # 单个行动时物品可能放在顶层字段，批量结算时物品放在各玩家的判定里
+            found_items = outcome.get("found_items") or (world.get("found_items", []) if len(actions) == 1 else [])
+            item_details = outcome.get("item_details") or (world.get("item_details", {}) if len(actions) == 1 else {})
+            result = {
+                "is_dead": outcome.get("is_dead", "否"),
+                "physical_status": outcome.get("physical_status") or player_data.get("physical_status", {}),
+                "mental_status": outcome.get("mental_status") or player_data.get("mental_status", {}),
+                "psychological_pressure": outcome.get("psychological_pressure") or player_data.get("psychological_pressure", {}),
+                "new_location": outcome.get("new_location") or player_data.get("location", "入口"),
+                "found_items": found_items if is_action_player else [],
+                "item_details": item_details if is_action_player else {},
+                "scene_description": "",
+                "action_feedback": ""
+            }
+            if isinstance(outcome.get("status_signals"), dict):
+                result["status_signals"] = outcome["status_signals"]
+            self._resolve_status(player_data, result)
+            results[pid] = result
+            if is_action_player or result["is_dead"] == "是" or outcome.get("witnessed") == "是":
+                perspective_requests.append(pid)
+            else:
+                result["scene_description"] = self._format_distant_perspective(game_state, player_data, actor_names)
+
+        semaphore = asyncio.Semaphore(max(int(self.get_config("multiplayer.max_parallel_judges", 5)), 1))
+
+        async def perspective(pid: str) -> Optional[dict]:
+            prompt = self._build_perspective_prompt(game_state, players[pid], results[pid], self._format_round_actions(actions, pid), summary, random_event)
+            async with semaphore:
+                llm_response = await self._call_llm_api(prompt, api_url, api_key, model_list, current_model_index, temperature, call_site="judge_perspective")
+            return self._parse_llm_json(llm_response, "judge_perspective") if llm_response else None
+
+        views = await asyncio.gather(*(perspective(pid) for pid in perspective_requests))
+        for pid, view in zip(perspective_requests, views):
+            view = view or {}
+            results[pid]["scene_description"] = view.get("scene_description") or summary
+            results[pid]["action_feedback"] = view.get("action_feedback", "")
+
+        return [(pid, results[pid]) for pid in alive_ids]
+
+    def _build_world_result_prompt(self, game_state: dict, alive_ids: List[str], actions: List[Tuple[str, str, str]], random_event: Optional[str], rule_network_info: str) -> str:
+        """构建多人模式权威判定的提示词，世界信息只出现一次，多个行动视为同时发生"""
+        players = game_state.get("players", {})
+        time_system = game_state.get("time_system", {})
+        environment_memory = game_state.get("environment_memory", {})
+        pending_rules = game_state.get("pending_rules", [])
+        acting_ids = [uid for uid, _, _ in actions]
+        actor_names = "、".join(name for _, name, _ in actions)
+        actions_text = "\n".join(f"- {name}：{action}" for _, name, action in actions)
+        death_screen_info = "\n".join(
+            filter(None, (self._format_death_screen_info(self._screen_death_triggers(game_state, action, players[uid]), name) for uid, name, action in actions))
+        )
+        actor_actions = {uid: action for uid, _, action in actions}
+        location_scope = "\n".join(
+            f"[{index}] {players[pid]['name']}（{players[pid].get('location', LocationGraph.ENTRANCE)}）："
+            + ("；".join(self._location_scope_lines(game_state, players[pid], actor_actions.get(pid, ""))) or "无")
+            for index, pid in enumerate(alive_ids, 1)
+        )
+
+        player_lines = []
+        for index, pid in enumerate(alive_ids, 1):
+            data = players[pid]
+            player_lines.append(
+                f"[{index}] {data['name']}{'（行动玩家）' if pid in acting_ids else ''}：位置 {data.get('location', '入口')}，"
+                f"体力 {data.get('physical_status', {}).get('health', 100)}，理智 {data.get('mental_status', {}).get('sanity', 100)}"
+            )
+        players_text = "\n".join(player_lines)
+
+        pending_rules_info = f"待发现的新规则（玩家尚未得知）：{json.dumps(pending_rules, ensure_ascii=False)}。如果玩家因触犯这些规则死亡，请在 summary 中指出触犯了哪条规则。" if pending_rules else ""
+        random_event_info = f"同时发生的环境事件：{random_event}" if random_event else ""
+
+        return f"""
+你是一个规则怪谈裁判。玩家{actor_names}在同一时刻执行了行动，请作为唯一的权威裁判，判定这些行动对世界和每位玩家造成的客观结果。只需要判定结果，不需要描写场景。
+
+场景名称：{game_state.get('scene', '')}
+规则：{json.dumps(game_state.get('rules', []), ensure_ascii=False)}
+隐藏真相：{game_state.get('hidden_truth', '')}
+死亡触发条件：{json.dumps(game_state.get('death_triggers', []), ensure_ascii=False)}
+{pending_rules_info}
+
+当前时间：{time_system.get('current_time', '深夜')}，已过时间：{time_system.get('elapsed_minutes', 0)}分钟
+已访问过的地点：{json.dumps([loc['location'] for loc in environment_memory.get('visited_locations', [])], ensure_ascii=False)}
+{rule_network_info}
+
+存活玩家：
+{players_text}
+
+各玩家附近的地点（new_location 请使用场景中已有的地点名称，远处的地点需要沿路线逐步到达）：
+{location_scope}
+
+行动：
+{actions_text}
+{random_event_info}
+{death_screen_info}
+
+判定要求：
+1. 判断行动玩家是否因触犯规则或死亡触发条件而死亡；其他玩家只有与行动玩家在同一位置且被行动直接波及时才可能受到影响；多个行动同时发生时要考虑它们之间的相互影响
+2. 给出每位玩家行动后的身体状况、精神状况、心理压力和位置；未受影响的玩家保持原位置，状态只做轻微变化
+3. witnessed：该玩家能否直接看到或听到其他玩家行动的经过（与行动玩家在同一位置或相邻区域时为"是"）
+4. 只有行动玩家可能发现物品，物品写在该玩家自己的判定里。优先生成能推进剧情或暗示背景的线索物品；关键物品（能触发规则变异的重要物品）应该极少出现
+5. summary：用1-2句客观描述这些行动发生了什么，之后会据此为每位玩家生成视角描述
+
+请返回JSON格式：
+{{
+  "summary": "客观描述行动的经过和结果",
+  "players": [
+    {{
+      "id": 1,
+      "is_dead": "是/否",
+      "witnessed": "是/否",
+{self._format_status_schema('      ')}
+      "new_location": "玩家的新位置",
+      "found_items": ["该行动玩家发现的物品列表（如果有）"],
+      "item_details": {{
+        "item_name": "物品名称",
+        "item_type": "物品类型（线索/工具/其他）",
+        "item_description": "物品的详细描述",
+        "observation_hint": "物品的观察描述（令人不安的细节或暗示）",
+        "is_key_item": "是否为关键物品（是/否）"
+      }}
+    }}
+  ]
+}}
+
+请仅返回JSON，不要包含任何其他文字。**重要：不要使用任何emoji表情符号。**
+        """
+
+    def _build_perspective_prompt(self, game_state: dict, player_data: dict, result: dict, actions_text: str, summary: str, random_event: Optional[str]) -> str:
+        """构建为单个玩家描述权威判定结果的视角提示词，只包含该玩家需要的信息"""
+        environment = game_state.get("environment", {})
+        player_name = player_data["name"]
+        sanity = result["mental_status"].get("sanity", player_data.get("mental_status", {}).get("sanity", 100))
+        is_dead = result["is_dead"] == "是"
+        sanity_break = player_data.get("mental_status", {}).get("sanity", 100) < 30 and not game_state.get("sanity_break", False)
+
+        if sanity_break:
+            style = (
+                f"【警告】{player_name}的理智已经崩溃。你不再是旁观的叙述者，你是{game_state.get('scene', '')}本身："
+                f"直接称呼{player_name}，用温柔而不可抗拒的语气否认规则、诱导其打破规则；即使判定为死亡也不要说死亡，而是描述为接纳与融合；大量植入核心象征符号。"
+            )
+        else:
+            style = (
+                f"根据理智值{sanity}调整描述风格：高于70时客观清晰；40-70时紧张不安、出现不确定的感知；低于40时混乱、充满幻觉和错觉。"
+                f"将核心象征符号自然地融入描述中。"
+            )
+
+        found_items_info = f"该玩家发现的物品：{json.dumps(result['found_items'], ensure_ascii=False)}" if result["found_items"] else ""
+        random_event_info = f"环境事件：{random_event}" if random_event else ""
+
+        return f"""
+你是一个规则怪谈的叙述者。裁判已经判定了这次行动的结果，请只根据判定结果描述玩家{player_name}看到和感受到的情况，不要改变判定结果。
+
+场景：{game_state.get('scene', '')}
+核心象征符号：{json.dumps(game_state.get('core_symbols', []), ensure_ascii=False)}
+环境：光线{environment.get('lighting', '昏暗')}，声音{', '.join(environment.get('sounds', ['寂静']))}，气味{', '.join(environment.get('smells', ['霉味']))}，氛围{environment.get('atmosphere', '压抑')}
+
+{actions_text}
+判定结果：{summary}
+{player_name}的结果：{'死亡' if is_dead else '存活'}，位置：{player_data.get('location', '入口')} → {result['new_location']}
+{found_items_info}
+{random_event_info}
+
+{style}
+
+请返回JSON格式：
+{{
+  "scene_description": "{player_name}视角下行动后的场景描述（1-2段简洁自然的描述，融合视觉、听觉、嗅觉、触觉等感官细节，不要使用章节标题。死亡时简短描述死亡场景）",
+  "action_feedback": "{player_name}的生理或心理反应（如：心跳加速、手心出汗、呼吸急促等）"
+}}
+
+请仅返回JSON，不要包含任何其他文字。**重要：不要使用任何emoji表情符号。**
+        """
+
+    def _format_round_actions(self, actions: List[Tuple[str, str, str]], viewer_id: str) -> str:
+        """按观察者视角列出本次判定的行动"""
+        return "\n".join(f"{'你的行动' if uid == viewer_id else f'玩家{name}的行动'}：{action}" for uid, name, action in actions)
+
+    def _format_distant_perspective(self, game_state: dict, player_data: dict, user_name: str) -> str:
+        """为没有察觉到这次行动的远处玩家生成视角描述，不调用LLM"""
+        environment = game_state.get("environment", {})
+        location = player_data.get("location", "入口")
+        sounds = "、".join(environment.get("sounds", ["寂静"]))
+        templates = [
+            f"你仍在{location}，四周的{environment.get('lighting', '昏暗')}光线没有任何变化。远处隐约传来{user_name}那边的动静，但你无法分辨发生了什么。",
+            f"{location}里依旧弥漫着{environment.get('atmosphere', '压抑')}的气氛，耳边只有{sounds}。你不知道{user_name}那边发生了什么。",
+            f"你在{location}屏息等待，空气中的{'、'.join(environment.get('smells', ['霉味']))}似乎更浓了一些。{user_name}那边没有传来任何清晰的声音。"
+        ]
+        return self._game_rng(game_state).choice(templates)
+
+    @traced("check_collaborative_rules")
+    async def _check_collaborative_rules(self, group_id: str, api_url: str, api_key: str, model_list: list, current_model_index: int, temperature: float, elapsed_minutes: int) -> None:
+        """检测多人模式中的协作规则是否被触发"""
+        game_state = game_states.get(group_id, {})
+        if not game_state or game_state.get("game_mode") != "多人":
+            return
+        
+        players = game_state.get("players", {})
+        alive_players = {pid: data for pid, data in players.items() if data.get("is_alive", True)}
+        
+        if len(alive_players) < 2:
+            return
+        
+        hidden_truth = game_state.get("hidden_truth", "")
+        rules = game_state.get("rules", [])
+        
+        collaborative_check_prompt = f"""
+你是一个规则怪谈裁判。请分析以下游戏状态，判断是否有协作规则被触发。
+
+场景名称：{game_state.get('scene', '')}
+规则：{json.dumps(rules, ensure_ascii=False)}
+隐藏真相：{hidden_truth}
+
+当前玩家状态：
+{json.dumps([{pid: {"name": data.get("name", ""), "location": data.get("location", ""), "inventory": data.get("inventory", [])}} for pid, data in alive_players.items()], ensure_ascii=False)}
+
+请分析：
+1. 是否有玩家同时处于不同的特定位置（如：两个玩家分别在"一楼大厅"和"二楼走廊"）
+2. 是否有玩家持有特定物品（如：一个玩家持有"刻有符号的钥匙"）
 3. 是否有玩家在特定时间执行了特定动作（如：玩家A在"午夜"执行了"敲击墙壁"的动作）
 4. 是否有多个玩家同时满足了某个协作规则的条件
 
@@ -2713,16 +5684,14 @@ class RuleHorrorCommand(BaseCommand):
         """
         
         try:
-            llm_response = await self._call_llm_api(collaborative_check_prompt, api_url, api_key, model, temperature)
+            llm_response = await self._call_llm_api(collaborative_check_prompt, api_url, api_key, model_list, current_model_index, temperature, call_site="collab")
             if not llm_response:
                 return
             
-            json_match = re.search(r'\{[\s\S]*\}', llm_response)
-            if not json_match:
+            result = self._parse_llm_json(llm_response, "collab")
+            if result is None:
                 return
             
-            result = json.loads(json_match.group())
-            
             if result.get("collaborative_rule_triggered") == "是":
                 triggered_rule = result.get("triggered_rule", "")
                 triggered_players = result.get("triggered_players", [])
@@ -2776,6 +5745,7 @@ class RuleHorrorCommand(BaseCommand):
         except (json.JSONDecodeError, Exception) as e:
             print(f"[规则怪谈] 协作规则检测失败: {e}")
 
+    @traced("handler:record_action")
     async def _record_action(self, group_id: str, action: str, api_url: str, api_key: str, model_list: list, current_model_index: int, temperature: float) -> Tuple[bool, Optional[str], bool]:
         """记录行动并判断是否死亡"""
         game_state = game_states.get(group_id, {})
@@ -2824,9 +5794,233 @@ class RuleHorrorCommand(BaseCommand):
             await self.send_text("你已经死亡，无法继续行动。")
             return False, "玩家已死亡", True
 
-        player_data["action_history"].append(action)
+        if self.get_config("intent.enabled", False):
+            action_intent_classifier.configure(self.get_config("intent.weights_file", ""))
+            intent = action_intent_classifier.classify(action, float(self.get_config("intent.threshold", 2.5)))
+            if intent != "action" and self._needs_adjudication(game_state, player_data, action):
+                print(f"[规则怪谈] 行动看似本地查询（{intent}），但涉及场景中的条件、物品或地点，交给裁判：{action}")
+                intent = "action"
+            if intent != "action":
+                print(f"[规则怪谈] 行动被识别为本地查询（{intent}）：{action}")
+                await self.send_text(self._answer_local_query(game_state, player_data, intent))
+                return True, "已回答查询", True
+
+        self._append_history(player_data, "action", action)
         game_state["players"] = players
         
+        if game_state.get("game_mode") == "多人" and self.get_config("multiplayer.round_mode", False):
+            return await self._queue_round_action(group_id, user_id, user_name, action, api_url, api_key, model_list, current_model_index, temperature)
+        
+        sanity_break, random_event = self._advance_game_time(game_state, [player_data])
+        
+        if game_state.get("game_mode") == "单人":
+            await self._process_single_player_action(group_id, user_id, user_name, action, api_url, api_key, model_list, current_model_index, temperature, sanity_break, random_event)
+        else:
+            await self._process_multiplayer_action(group_id, user_id, user_name, action, api_url, api_key, model_list, current_model_index, temperature, sanity_break, random_event)
+        
+        self._schedule_clear_check(group_id, api_url, api_key, model_list, current_model_index, temperature)
+        
+        self._sample_state_footprint(group_id)
+        
+        return True, "已记录行动", True
+
+    async def _queue_round_action(self, group_id: str, user_id: str, user_name: str, action: str, api_url: str, api_key: str, model_list: list, current_model_index: int, temperature: float) -> Tuple[bool, Optional[str], bool]:
+        """回合模式下收集玩家行动，所有存活玩家都已行动或等待时间结束后统一结算"""
+        game_state = game_states.get(group_id, {})
+        players = game_state.get("players", {})
+        round_state = action_rounds.setdefault(group_id, {"actions": {}, "timer": None})
+
+        previous = round_state["actions"].get(user_id)
+        if previous is not None:
+            # 同一回合内再次行动视为修改本轮行动，之前的行动不再计入历史
+            history = players[user_id]["action_history"]
+            for index in range(len(history) - 2, -1, -1):
+                if history[index] == previous[1]:
+                    del history[index]
+                    break
+        round_state["actions"][user_id] = (user_name, action)
+
+        alive_ids = [pid for pid, data in players.items() if data.get("is_alive", True)]
+        acted = sum(1 for pid in alive_ids if pid in round_state["actions"])
+        if acted >= len(alive_ids):
+            await self._resolve_action_round(group_id, api_url, api_key, model_list, current_model_index, temperature)
+            return True, "已结算本轮行动", True
+
+        window = max(int(self.get_config("multiplayer.round_window_seconds", 20)), 1)
+        if round_state["timer"] is None:
+            round_state["timer"] = contextvars.Context().run(asyncio.create_task, self._run_round_timer(group_id, window, api_url, api_key, model_list, current_model_index, temperature))
+
+            def on_done(finished_task: asyncio.Task) -> None:
+                if finished_task.cancelled():
+                    return
+                error = finished_task.exception()
+                if error is not None:
+                    print(f"[规则怪谈] 回合结算失败: {error}")
+
+            round_state["timer"].add_done_callback(on_done)
+
+        if previous is not None:
+            await self.send_text(f"已更新{user_name}本轮的行动（本轮 {acted}/{len(alive_ids)}）。")
+        else:
+            await self.send_text(f"已记录{user_name}的行动（本轮 {acted}/{len(alive_ids)}），所有存活玩家行动后或{window}秒后统一结算。")
+        return True, "已加入本轮行动", True
+
+    async def _run_round_timer(self, group_id: str, window: int, api_url: str, api_key: str, model_list: list, current_model_index: int, temperature: float) -> None:
+        """等待回合窗口结束后结算本轮行动"""
+        await asyncio.sleep(window)
+        await command_executor.run(group_id, lambda: self._resolve_action_round(group_id, api_url, api_key, model_list, current_model_index, temperature))
+
+    def _cancel_action_round(self, group_id: str) -> None:
+        """丢弃该群组尚未结算的回合"""
+        round_state = action_rounds.pop(group_id, None)
+        if round_state is None:
+            return
+        timer = round_state.get("timer")
+        if timer is not None and not timer.done() and timer is not asyncio.current_task():
+            timer.cancel()
+        print(f"[规则怪谈] 已丢弃群组 {group_id} 未结算的回合")
+
+    @traced("resolve_action_round")
+    async def _resolve_action_round(self, group_id: str, api_url: str, api_key: str, model_list: list, current_model_index: int, temperature: float) -> None:
+        """统一结算本轮收集到的行动：一次权威判定决定所有结果，合并成一条消息发送"""
+        round_state = action_rounds.pop(group_id, None)
+        if not round_state or not round_state["actions"]:
+            return
+        timer = round_state.get("timer")
+        if timer is not None and not timer.done() and timer is not asyncio.current_task():
+            timer.cancel()
+
+        game_state = game_states.get(group_id, {})
+        if not game_state:
+            return
+        current_game_seed.set(game_state.get("rng_seed"))
+
+        players = game_state.get("players", {})
+        actions = [(uid, name, action) for uid, (name, action) in round_state["actions"].items() if players.get(uid, {}).get("is_alive", False)]
+        if not actions:
+            return
+        acting_ids = [uid for uid, _, _ in actions]
+
+        round_number = game_state.get("round_number", 0) + 1
+        game_state["round_number"] = round_number
+        sanity_break, random_event = self._advance_game_time(game_state, [players[uid] for uid in acting_ids])
+        elapsed_minutes = game_state.get("time_system", {}).get("elapsed_minutes", 0)
+        rule_network_info = self._format_rule_network_info(game_state)
+
+        judged = await self._judge_world_result(game_state, actions, random_event, rule_network_info, api_url, api_key, model_list, current_model_index, temperature)
+        if judged is None:
+            # 权威判定失败时整个回合只报告一次，不再逐个行动重复权威判定和逐个玩家判定
+            print(f"[规则怪谈] 第{round_number}回合权威判定失败")
+            await self.send_text(f"**第{round_number}回合行动结果**\n本回合的行动判定失败（调用LLM API失败），请稍后重新提交行动。")
+        else:
+            key_item_found = False
+            sections = [f"**第{round_number}回合行动结果**", "\n".join(f"- {name}：{action}" for _, name, action in actions)]
+            if random_event:
+                sections.append(f"**环境事件**：{random_event}")
+            for pid, result in judged:
+                if not isinstance(result, dict):
+                    continue
+                player_data = players[pid]
+                if self._apply_player_result(game_state, player_data, result, pid in acting_ids):
+                    key_item_found = True
+                is_dead = result.get("is_dead", "否") == "是"
+                section = f"**{player_data['name']}**{'（已死亡）' if is_dead else ''}\n{result.get('scene_description', '')}"
+                if result.get("action_feedback"):
+                    section += f"\n{result['action_feedback']}"
+                if result.get("found_items") and pid in acting_ids:
+                    section += f"\n获得物品：{', '.join(str(item) for item in result['found_items'])}"
+                if is_dead:
+                    player_data["is_alive"] = False
+                else:
+                    section += (
+                        f"\n位置：{player_data.get('location', '入口')}｜"
+                        f"体力 {player_data.get('physical_status', {}).get('health', 100)}/100｜"
+                        f"理智 {player_data.get('mental_status', {}).get('sanity', 100)}/100"
+                    )
+                sections.append(section)
+
+            game_state["players"] = players
+            self._save_game_state(group_id)
+            await self.send_text("\n\n".join(sections))
+
+            new_identity = None
+            if not game_state.get("sanity_break", False):
+                descriptions = dict(judged)
+                for uid, name, action in actions:
+                    if players[uid].get("is_alive", True):
+                        changed = await self._handle_identity_change(group_id, players[uid], uid, name, action, (descriptions.get(uid) or {}).get("scene_description", ""), elapsed_minutes, api_url, api_key, model_list, current_model_index, temperature)
+                        new_identity = new_identity or changed
+
+            if key_item_found and not game_state.get("sanity_break", False) and not new_identity:
+                await self._trigger_rule_mutation(group_id, api_url, api_key, model_list, current_model_index, temperature, elapsed_minutes, trigger_reason="关键物品")
+
+            await self._check_collaborative_rules(group_id, api_url, api_key, model_list, current_model_index, temperature, elapsed_minutes)
+
+        self._schedule_clear_check(group_id, api_url, api_key, model_list, current_model_index, temperature)
+        self._sample_state_footprint(group_id)
+
+    def _needs_adjudication(self, game_state: dict, player_data: dict, action: str) -> bool:
+        """看似查询的行动命中了规则或死亡触发条件，或者提到了场景中的物品、象征符号或地点时，仍需交给裁判"""
+        index = self._get_trigger_index(game_state)
+        if DeathTriggerIndex.match(index, action, player_data.get("location", "")):
+            return True
+        names = [target for entry in index.get("entries", []) for target in entry.get("objects", [])]
+        for symbol in game_state.get("core_symbols", []):
+            names.append(symbol.get("symbol", "") if isinstance(symbol, dict) else str(symbol))
+        for node, info in self._get_location_graph(game_state).get("nodes", {}).items():
+            names.extend((node, info.get("area", "")))
+        return any(len(name) >= 2 and name in action for name in names)
+
+    def _answer_local_query(self, game_state: dict, player_data: dict, intent: str) -> str:
+        """根据游戏状态直接回答背包、状态、地图查询"""
+        name = player_data.get("name", "")
+        time_system = game_state.get("time_system", {})
+
+        if intent == "inventory":
+            lines = [f"**背包** - {name}"]
+            for item in player_data.get("inventory", []):
+                if isinstance(item, dict):
+                    line = f"- {item.get('name', '')}{'（关键物品）' if item.get('is_key_item') else ''}"
+                    if item.get("observation_hint"):
+                        line += f"：{item['observation_hint']}"
+                    lines.append(line)
+                else:
+                    lines.append(f"- {item}")
+            if len(lines) == 1:
+                lines.append("你的背包里什么都没有。")
+        elif intent == "status":
+            physical = player_data.get("physical_status", {})
+            mental = player_data.get("mental_status", {})
+            pressure = player_data.get("psychological_pressure", {})
+            lines = [
+                f"**状态** - {name}",
+                f"体力：{physical.get('health', 100)}/100，受伤：{physical.get('injury', '无')}，疲劳：{physical.get('fatigue', '无')}",
+                f"理智：{mental.get('sanity', 100)}/100，精神：{mental.get('state', '正常')}，情绪：{mental.get('emotion', '平静')}",
+                f"恐惧：{pressure.get('fear_level', 0)}/100，焦虑：{pressure.get('anxiety_level', 0)}/100，压力：{pressure.get('stress_level', 0)}/100",
+                f"位置：{player_data.get('location', '入口')}，时间：{time_system.get('current_time', '深夜')}"
+            ]
+        else:
+            visited = game_state.get("environment_memory", {}).get("visited_locations", [])
+            lines = [
+                f"**位置** - {name}",
+                f"当前位置：{player_data.get('location', '入口')}（{time_system.get('current_time', '深夜')}）",
+                f"建筑：{game_state.get('building_type', '')}，{game_state.get('overall_layout', '')}"
+            ]
+            for floor in game_state.get("floors", []):
+                if isinstance(floor, dict):
+                    lines.append(f"- {floor.get('floor', '')}：{'、'.join(str(area) for area in floor.get('areas', []))}")
+            if game_state.get("connections"):
+                lines.append(f"连接通道：{'、'.join(str(item) for item in game_state['connections'])}")
+            if game_state.get("special_areas"):
+                lines.append(f"特殊区域：{'、'.join(str(item) for item in game_state['special_areas'])}")
+            if visited:
+                lines.append(f"去过的地方：{'、'.join(str(loc.get('location', '')) for loc in visited if isinstance(loc, dict))}")
+
+        lines.append("\n（查询不会推进游戏时间）")
+        return "\n".join(lines)
+
+    def _advance_game_time(self, game_state: dict, acting_players: List[dict]) -> Tuple[bool, Optional[str]]:
+        """推进一次行动的游戏时间，检查理智崩溃并抽取随机环境事件"""
         time_system = game_state.get("time_system", {})
         
         elapsed_minutes = time_system.get("elapsed_minutes", 0) + 5
@@ -2844,14 +6038,13 @@ class RuleHorrorCommand(BaseCommand):
         
         game_state["time_system"] = time_system
         
-        action_player_sanity = player_data.get("mental_status", {}).get("sanity", 100)
-        
-        if action_player_sanity < 30 and not game_state.get("sanity_break", False):
+        if any(data.get("mental_status", {}).get("sanity", 100) < 30 for data in acting_players) and not game_state.get("sanity_break", False):
             game_state["sanity_break"] = True
         
         sanity_break = game_state.get("sanity_break", False)
         
-        random_event_chance = random.random()
+        rng = self._game_rng(game_state)
+        random_event_chance = rng.random()
         random_event = None
         if random_event_chance < 0.2:
             random_events = [
@@ -2876,28 +6069,37 @@ class RuleHorrorCommand(BaseCommand):
                 "你看到一只苍白的眼睛从门缝中窥视",
                 "地板下传来低沉的呻吟声"
             ]
-            random_event = random.choice(random_events)
+            random_event = rng.choice(random_events)
             game_state["random_events"].append(random_event)
             game_state["environmental_events"].append({
                 "event": random_event,
                 "time": time_system.get("current_time", "深夜"),
-                "location": player_data.get("location", "未知")
+                "location": acting_players[0].get("location", "未知")
             })
         
-        if game_state.get("game_mode") == "单人":
-            await self._process_single_player_action(group_id, user_id, user_name, action, api_url, api_key, model_list, current_model_index, temperature, sanity_break, random_event)
-        else:
-            await self._process_multiplayer_action(group_id, user_id, user_name, action, api_url, api_key, model_list, current_model_index, temperature, sanity_break, random_event)
+        return sanity_break, random_event
+
+    def _sample_state_footprint(self, group_id: str) -> None:
+        """按配置的间隔采样当前群组游戏状态的内存占用并输出增长报告"""
+        interval = self.get_config("debug.memory_sample_interval", 0)
+        if not interval or interval <= 0:
+            return
         
-        await self._check_clear_condition(group_id, api_url, api_key, model_list, current_model_index, temperature)
+        state_footprint_sampler.action_count += 1
+        if state_footprint_sampler.action_count % interval != 0:
+            return
         
-        return True, "已记录行动", True
+        use_tracemalloc = self.get_config("debug.enable_tracemalloc", False)
+        sample = state_footprint_sampler.sample([group_id], use_tracemalloc=use_tracemalloc)
+        print(f"[规则怪谈] {StateFootprintSampler.format_report(sample)}")
 
+    @traced("handler:end_game")
     async def _end_game(self, group_id: str, api_url: str, api_key: str, model_list: list, current_model_index: int, temperature: float) -> Tuple[bool, Optional[str], bool]:
         """结束游戏"""
         game_state = game_states.get(group_id, {})
 
         game_state["game_active"] = False
+        self._cancel_background_tasks(group_id)
         self._save_game_state(group_id)
         
         players = game_state.get("players", {})
@@ -2952,7 +6154,7 @@ class RuleHorrorCommand(BaseCommand):
             await self.send_text("游戏已结束。")
         
         plot_image_path = game_state.get("plot_image_path")
-        if plot_image_path and os.path.exists(plot_image_path):
+        if plot_image_path and os.path.exists(plot_image_path) and not self._is_shared_image(plot_image_path):
             try:
                 os.remove(plot_image_path)
                 print(f"[规则怪谈] 已删除剧情导入长图：{plot_image_path}")
@@ -2960,7 +6162,7 @@ class RuleHorrorCommand(BaseCommand):
                 print(f"[规则怪谈] 删除剧情导入长图失败: {str(e)}")
         
         rules_image_path = game_state.get("rules_image_path")
-        if rules_image_path and os.path.exists(rules_image_path):
+        if rules_image_path and os.path.exists(rules_image_path) and not self._is_shared_image(rules_image_path):
             try:
                 os.remove(rules_image_path)
                 print(f"[规则怪谈] 已删除规则长图：{rules_image_path}")
@@ -2968,7 +6170,7 @@ class RuleHorrorCommand(BaseCommand):
                 print(f"[规则怪谈] 删除规则长图失败: {str(e)}")
         
         scene_structure_image_path = game_state.get("scene_structure_image_path")
-        if scene_structure_image_path and os.path.exists(scene_structure_image_path):
+        if scene_structure_image_path and os.path.exists(scene_structure_image_path) and not self._is_shared_image(scene_structure_image_path):
             try:
                 os.remove(scene_structure_image_path)
                 print(f"[规则怪谈] 已删除场景结构长图：{scene_structure_image_path}")
@@ -2976,7 +6178,7 @@ class RuleHorrorCommand(BaseCommand):
                 print(f"[规则怪谈] 删除场景结构长图失败: {str(e)}")
         
         plot_image_path = game_state.get("plot_image_path")
-        if plot_image_path and os.path.exists(plot_image_path):
+        if plot_image_path and os.path.exists(plot_image_path) and not self._is_shared_image(plot_image_path):
             try:
                 os.remove(plot_image_path)
                 print(f"[规则怪谈] 已删除剧情导入长图：{plot_image_path}")
@@ -3020,6 +6222,41 @@ class RuleHorrorCommand(BaseCommand):
         
         return True, "已结束游戏", True
 
+    async def _show_performance(self) -> Tuple[bool, Optional[str], bool]:
+        """显示最近的慢命令分阶段耗时、进行中的LLM调用和事件循环延迟"""
+        now = time.perf_counter()
+        lines = ["**性能诊断**", ""]
+
+        slow_threshold = self.get_config("performance.slow_command_threshold_ms", 3000)
+        slow_commands = list(command_tracer.slow_commands)[-5:]
+        lines.append(f"**最近的慢命令**（超过 {slow_threshold}ms，共记录 {len(command_tracer.slow_commands)} 条）")
+        if slow_commands:
+            for trace in reversed(slow_commands):
+                lines.append(command_tracer.format_trace(trace))
+        else:
+            lines.append("暂无")
+        lines.append("")
+
+        lines.append(f"**进行中的LLM调用**（{len(llm_telemetry.in_flight)} 个）")
+        if llm_telemetry.in_flight:
+            for call in llm_telemetry.in_flight.values():
+                if call["started_at"] is None:
+                    lines.append(f"- {call['call_site']}：排队中 {now - call['enqueued_at']:.1f}s")
+                else:
+                    lines.append(f"- {call['call_site']}：请求中 {now - call['started_at']:.1f}s（排队 {call['started_at'] - call['enqueued_at']:.1f}s，模型 {call['model'] or '未知'}）")
+        else:
+            lines.append("无")
+        lines.append("")
+
+        lag = loop_lag_monitor.summary()
+        if lag["samples"]:
+            lines.append(f"**事件循环延迟**：最近 {lag['last'] * 1000:.0f}ms，平均 {lag['avg'] * 1000:.0f}ms，最大 {lag['max'] * 1000:.0f}ms（{lag['samples']} 次采样）")
+        else:
+            lines.append("**事件循环延迟**：暂无数据")
+
+        await self.send_text("\n".join(lines))
+        return True, "已发送性能信息", True
+
     def _get_user_info(self):
         """获取用户信息"""
         chat_stream = getattr(self, 'chat_stream', None)
@@ -3032,12 +6269,74 @@ class RuleHorrorCommand(BaseCommand):
             return getattr(chat_stream, 'user_info', None)
         return None
 
-    async def _call_llm_api(self, prompt: str, api_url: str, api_key: str, model_list: list, current_model_index: int, temperature: float) -> str:
-        """调用OpenAI格式的LLM API并在失败时自动切换模型"""
+    async def _call_llm_api(self, prompt: str, api_url: str, api_key: str, model_list: list, current_model_index: int, temperature: float, call_site: str = "", on_text: Optional[Callable[[str], None]] = None) -> str:
+        """调用OpenAI格式的LLM API并在失败时自动切换模型，提供on_text时以流式方式请求并在每次收到内容后回调已收到的全部文本"""
         if not model_list:
             print(f"[规则怪谈] 模型列表为空")
             return ""
         
+        if call_site:
+            size = record_prompt_size(call_site, prompt)
+            if size["over_budget"]:
+                print(f"[规则怪谈] 提示词超出预算: {call_site} {size['chars']}字符/约{size['tokens']}tokens（预算 {size['budget']} 字符）")
+        
+        if self.get_config("telemetry.log_to_file", True):
+            llm_telemetry.configure_file(
+                os.path.join(DATA_DIR, "telemetry"),
+                self.get_config("telemetry.file_max_bytes", 1048576),
+                self.get_config("telemetry.file_backup_count", 3)
+            )
+        
+        replay_mode = self.get_config("replay.mode", "off")
+        if replay_mode in ("record", "replay"):
+            llm_recorder.configure(replay_mode, os.path.join(DATA_DIR, self.get_config("replay.file", "replay/llm_responses.jsonl")))
+        if replay_mode == "replay":
+            content = llm_recorder.replay(call_site, prompt)
+            if content and on_text is not None:
+                on_text(content)
+            return content
+        
+        call_id = llm_telemetry.begin(call_site)
+        outcome = {"model": "", "attempts": 0, "usage": None}
+        content = ""
+        with command_tracer.span(f"llm:{call_site or 'unknown'}"):
+            try:
+                async with get_llm_semaphore(self.get_config("llm.max_concurrency", 8)):
+                    llm_telemetry.mark_started(call_id)
+                    content = await self._request_llm_with_failover(prompt, api_url, api_key, model_list, current_model_index, temperature, call_id, outcome, on_text)
+            finally:
+                llm_telemetry.finish(call_id, outcome["model"], outcome["attempts"], outcome["usage"], bool(content))
+        if replay_mode == "record" and content:
+            llm_recorder.record(call_site, prompt, content, current_game_seed.get())
+        return content
+
+    def _parse_llm_json(self, llm_response: str, call_site: str = "") -> Optional[dict]:
+        """解析LLM返回的JSON对象，直接解析失败时尝试提取其中的JSON部分，并记录解析结果"""
+        try:
+            data = json.loads(llm_response)
+        except json.JSONDecodeError as e:
+            print(f"[规则怪谈] {call_site} JSON解析失败: {e}")
+            print(f"[规则怪谈] 尝试提取JSON部分...")
+            
+            data = None
+            json_match = re.search(r'\{[\s\S]*\}', llm_response)
+            if json_match:
+                try:
+                    data = json.loads(json_match.group())
+                    print(f"[规则怪谈] 成功提取JSON")
+                except json.JSONDecodeError as e2:
+                    print(f"[规则怪谈] 提取JSON后仍然解析失败: {e2}")
+        
+        if not isinstance(data, dict):
+            if data is not None:
+                print(f"[规则怪谈] {call_site} 返回内容不是字典类型: {type(data)}")
+            data = None
+        
+        llm_telemetry.record_parse(call_site, data is not None)
+        return data
+
+    async def _request_llm_with_failover(self, prompt: str, api_url: str, api_key: str, model_list: list, current_model_index: int, temperature: float, call_id: int, outcome: dict, on_text: Optional[Callable[[str], None]] = None) -> str:
+        """依次尝试模型列表中的模型发送请求，并将最终使用的模型、尝试次数和token用量写入outcome"""
         headers = {
             "Content-Type": "application/json",
             "Authorization": f"Bearer {api_key}"
@@ -3048,842 +6347,474 @@ class RuleHorrorCommand(BaseCommand):
         for i in range(len(model_list)):
             model_index = (current_model_index + i) % len(model_list)
             model = model_list[model_index]
+            outcome["attempts"] = i + 1
+            llm_telemetry.mark_model(call_id, model)
             
             print(f"[规则怪谈] 尝试使用模型 {model} (索引: {model_index})")
             
             payload = {
                 "model": model,
-                "messages": [
-                    {"role": "system", "content": "你是一个专业的规则怪谈生成器和裁判。"},
-                    {"role": "user", "content": prompt}
-                ],
-                "temperature": temperature,
-                "max_tokens": 8000,
-                "stream": False
-            }
-
-            try:
-                timeout = aiohttp.ClientTimeout(total=180)
-                async with aiohttp.ClientSession(timeout=timeout) as session:
-                    async with session.post(api_url, headers=headers, json=payload) as response:
-                        if response.status == 200:
-                            data = await response.json()
-                            
-                            if isinstance(data, list):
-                                print(f"[规则怪谈] 模型 {model} API返回列表格式: {data}")
-                                last_error = f"API返回列表格式"
-                                continue
-                            
-                            if not isinstance(data, dict):
-                                print(f"[规则怪谈] 模型 {model} API返回非字典格式: {type(data)}")
-                                last_error = f"API返回非字典格式"
-                                continue
-                            
-                            choices = data.get("choices", [])
-                            if not choices or not isinstance(choices, list):
-                                print(f"[规则怪谈] 模型 {model} choices字段格式错误: {choices}")
-                                last_error = f"choices字段格式错误"
-                                continue
-                            
-                            first_choice = choices[0]
-                            if not isinstance(first_choice, dict):
-                                print(f"[规则怪谈] 模型 {model} choices[0]格式错误: {first_choice}")
-                                last_error = f"choices[0]格式错误"
-                                continue
-                            
-                            message = first_choice.get("message", {})
-                            if not isinstance(message, dict):
-                                print(f"[规则怪谈] 模型 {model} message字段格式错误: {message}")
-                                last_error = f"message字段格式错误"
-                                continue
-                            
-                            content = message.get("content", "").strip()
-                            if not content:
-                                print(f"[规则怪谈] 模型 {model} content为空")
-                                last_error = f"content为空"
-                                continue
-                            
-                            print(f"[规则怪谈] 模型 {model} 调用成功")
-                            
-                            if model_index != current_model_index:
-                                print(f"[规则怪谈] 更新当前模型索引从 {current_model_index} 到 {model_index}")
-                                self.update_config("llm.current_model_index", model_index)
-                            
-                            return content
-                        else:
-                            error_text = await response.text()
-                            print(f"[规则怪谈] 模型 {model} API请求失败: Status {response.status}, Body: {error_text}")
-                            last_error = f"Status {response.status}: {error_text}"
-            except Exception as e:
-                print(f"[规则怪谈] 模型 {model} 调用时发生异常: {e}")
-                last_error = str(e)
-        
-        print(f"[规则怪谈] 所有模型都调用失败，最后错误: {last_error}")
-        return ""
-
-    def _save_game_state(self, group_id: str) -> bool:
-        """保存游戏状态到文件"""
-        try:
-            game_state = game_states.get(group_id)
-            if not game_state:
-                return False
-
-            os.makedirs(DATA_DIR, exist_ok=True)
-            save_file = os.path.join(DATA_DIR, f"{group_id}.json")
-
-            save_data = {
-                "group_id": group_id,
-                "save_time": datetime.now().isoformat(),
-                "game_state": game_state
-            }
-
-            with open(save_file, 'w', encoding='utf-8') as f:
-                json.dump(save_data, f, ensure_ascii=False, indent=2)
-
-            return True
-        except Exception as e:
-            print(f"保存游戏状态时发生异常: {e}")
-            return False
-
-    def _load_game_state(self, group_id: str) -> Optional[dict]:
-        """从文件加载游戏状态"""
-        try:
-            save_file = os.path.join(DATA_DIR, f"{group_id}.json")
-            
-            if not os.path.exists(save_file):
-                return None
-
-            with open(save_file, 'r', encoding='utf-8') as f:
-                save_data = json.load(f)
-
-            return save_data.get("game_state")
-        except Exception as e:
-            print(f"加载游戏状态时发生异常: {e}")
-            return None
-
-    def _delete_save_file(self, group_id: str) -> bool:
-        """删除存档文件（包括默认存档和所有手动存档）"""
-        try:
-            deleted_count = 0
-            
-            if not os.path.exists(DATA_DIR):
-                return True
-            
-            for filename in os.listdir(DATA_DIR):
-                if filename.startswith(f"{group_id}_") and filename.endswith(".json"):
-                    save_file = os.path.join(DATA_DIR, filename)
-                    try:
-                        os.remove(save_file)
-                        deleted_count += 1
-                        print(f"已删除存档文件: {filename}")
-                    except Exception as e:
-                        print(f"删除存档文件 {filename} 时发生异常: {e}")
-            
-            return deleted_count > 0
-        except Exception as e:
-            print(f"删除存档文件时发生异常: {e}")
-            return False
-
-    async def _save_game_with_name(self, group_id: str, save_name: str) -> Tuple[bool, Optional[str], bool]:
-        """使用自定义名称保存游戏状态"""
-        try:
-            game_state = game_states.get(group_id)
-            if not game_state:
-                await self.send_text("没有可保存的游戏状态。")
-                return False, "无游戏状态", True
-
-            if not save_name:
-                await self.send_text("存档名称不能为空。")
-                return False, "存档名称为空", True
-
-            if len(save_name) > 50:
-                await self.send_text("存档名称过长（最多50个字符）。")
-                return False, "存档名称过长", True
-
-            invalid_chars = ['/', '\\', ':', '*', '?', '"', '<', '>', '|']
-            for char in invalid_chars:
-                if char in save_name:
-                    await self.send_text(f"存档名称包含非法字符「{char}」。")
-                    return False, "存档名称包含非法字符", True
-
-            os.makedirs(DATA_DIR, exist_ok=True)
-            save_file = os.path.join(DATA_DIR, f"{group_id}_{save_name}.json")
-
-            if os.path.exists(save_file):
-                await self.send_text(f"存档「{save_name}」已存在。将覆盖原有存档。")
-
-            save_data = {
-                "group_id": group_id,
-                "save_name": save_name,
-                "save_time": datetime.now().isoformat(),
-                "game_state": game_state
-            }
-
-            with open(save_file, 'w', encoding='utf-8') as f:
-                json.dump(save_data, f, ensure_ascii=False, indent=2)
-
-            reply_text = (
-                f"**游戏已保存**\n\n"
-                f"**存档名称**：{save_name}\n"
-                f"**保存时间**：{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n"
-                f"**场景**：{game_state.get('scene', '')}\n"
-                f"**游戏模式**：{game_state.get('game_mode', '单人')}\n\n"
-                f"使用 `/rg 读取 {save_name}` 恢复此存档"
-            )
-            await self.send_text(reply_text)
-            return True, "游戏已保存", True
-        except Exception as e:
-            await self.send_text(f"保存失败：{str(e)}")
-            return False, f"保存失败: {str(e)}", True
-
-    async def _load_game_with_name(self, group_id: str, save_name: str) -> Tuple[bool, Optional[str], bool]:
-        """从自定义名称加载游戏状态"""
-        try:
-            save_file = os.path.join(DATA_DIR, f"{group_id}_{save_name}.json")
-            
-            if not os.path.exists(save_file):
-                await self.send_text(f"未找到存档「{save_name}」。使用 `/rg 存档列表` 查看所有可用存档。")
-                return False, "存档不存在", True
-
-            with open(save_file, 'r', encoding='utf-8') as f:
-                save_data = json.load(f)
-
-            saved_state = save_data.get("game_state")
-            if not saved_state:
-                await self.send_text("存档数据损坏。")
-                return False, "存档损坏", True
-
-            if not saved_state.get("game_active", False):
-                await self.send_text("存档中的游戏已结束，无法恢复。请使用 `/rg 开始` 开始新游戏。")
-                return False, "游戏已结束", True
-
-            game_states[group_id] = saved_state
-
-            game_mode = saved_state.get("game_mode", "单人")
-            save_time = save_data.get("save_time", "")
-            if save_time:
-                try:
-                    save_time = datetime.fromisoformat(save_time).strftime('%Y-%m-%d %H:%M:%S')
-                except:
-                    pass
-
-            reply_text = (
-                f"**规则怪谈** ({game_mode}模式) - 已恢复存档\n\n"
-                f"**存档名称**：{save_name}\n"
-                f"**存档时间**：{save_time}\n\n"
-                f"**场景**：{saved_state.get('scene', '')}\n\n"
-                f"**规则**：\n"
-            )
-
-            for i, rule in enumerate(saved_state.get("rules", []), 1):
-                reply_text += f"{i}. {rule}\n"
-
-            reply_text += f"\n**通关条件**：{saved_state.get('win_condition', '')}\n\n"
-
-            players = saved_state.get("players", {})
-            max_players = saved_state.get("max_players", 5)
-            reply_text = (
-                f"**玩家**：{len(players)}/{max_players}\n"
-            )
-
-            for pid, p_data in players.items():
-                status = "存活" if p_data["is_alive"] else "死亡"
-                reply_text += f"- {p_data['name']} ({status})\n"
-
-            reply_text += f"\n**提示次数**：{saved_state.get('hints_used', 0)}/{saved_state.get('max_hints', 3)}\n\n"
-
-            if game_mode == "单人":
-                reply_text += f"- 使用 `/rg 提示 <规则/线索>` 获取提示\n"
-                reply_text += f"- 使用 `/rg 推理 <推理内容>` 记录推理\n"
-                reply_text += f"- 使用 `/rg 行动 <行动描述>` 描述行动\n"
-                reply_text += f"- 使用 `/rg 状态` 查看游戏状态\n"
-                reply_text += f"- 使用 `/rg 结束` 结束游戏"
-            else:
-                reply_text += f"- 使用 `/rg 加入` 加入游戏\n"
-                reply_text += f"- 使用 `/rg 提示 <规则/线索>` 获取提示\n"
-                reply_text += f"- 使用 `/rg 推理 <推理内容>` 记录推理\n"
-                reply_text += f"- 使用 `/rg 行动 <行动描述>` 描述行动\n"
-                reply_text += f"- 使用 `/rg 状态` 查看游戏状态\n"
-                reply_text += f"- 使用 `/rg 结束` 结束游戏"
-
-            await self.send_text(reply_text)
-            return True, "游戏已恢复", True
-        except Exception as e:
-            await self.send_text(f"读取失败：{str(e)}")
-            return False, f"读取失败: {str(e)}", True
-
-    async def _list_saves(self, group_id: str) -> Tuple[bool, Optional[str], bool]:
-        """列出所有可用存档"""
-        try:
-            os.makedirs(DATA_DIR, exist_ok=True)
-            
-            saves = []
-            for filename in os.listdir(DATA_DIR):
-                if filename.startswith(f"{group_id}_") and filename.endswith(".json"):
-                    save_file = os.path.join(DATA_DIR, filename)
-                    try:
-                        with open(save_file, 'r', encoding='utf-8') as f:
-                            save_data = json.load(f)
-                        
-                        save_name = save_data.get("save_name", "")
-                        if not save_name:
-                            if filename == f"{group_id}.json":
-                                save_name = "默认存档"
-                            else:
-                                save_name = filename
-                        
-                        save_time = save_data.get("save_time", "")
-                        game_state = save_data.get("game_state", {})
-                        
-                        if save_time:
-                            try:
-                                save_time = datetime.fromisoformat(save_time).strftime('%Y-%m-%d %H:%M:%S')
-                            except:
-                                pass
-                        
-                        scene = game_state.get("scene", "")
-                        game_mode = game_state.get("game_mode", "单人")
-                        game_active = game_state.get("game_active", False)
-                        
-                        saves.append({
-                            "name": save_name,
-                            "time": save_time,
-                            "scene": scene,
-                            "mode": game_mode,
-                            "active": game_active
-                        })
-                    except Exception as e:
-                        print(f"读取存档 {filename} 时发生异常: {e}")
-                        continue
-            
-            if not saves:
-                await self.send_text("**存档列表**\n\n暂无存档。使用 `/rg 保存 <存档名称>` 创建存档。")
-                return True, "无存档", True
-            
-            saves.sort(key=lambda x: x["time"], reverse=True)
-            
-            reply_text = "**存档列表**\n\n"
-            for i, save in enumerate(saves, 1):
-                status = "可用" if save["active"] else "已结束"
-                reply_text += f"- **{i}. {save['name']}**\n"
-                reply_text += f"   {save['time']}\n"
-                reply_text += f"   {save['mode']}模式\n"
-                reply_text += f"   {save['scene']}\n"
-                reply_text += f"   {status}\n\n"
-            
-            reply_text += f"使用 `/rg 读取 <存档名称>` 恢复存档"
-            await self.send_text(reply_text)
-            return True, "已显示存档列表", True
-        except Exception as e:
-            await self.send_text(f"获取存档列表失败：{str(e)}")
-            return False, f"获取存档列表失败: {str(e)}", True
-
-    async def _cleanup_ended_saves(self, group_id: str) -> Tuple[bool, Optional[str], bool]:
-        """清理已结束的存档及其图片"""
-        try:
-            os.makedirs(DATA_DIR, exist_ok=True)
-            os.makedirs(TEMP_IMAGES_DIR, exist_ok=True)
-            
-            deleted_saves = []
-            deleted_images = []
-            
-            for filename in os.listdir(DATA_DIR):
-                if filename.startswith(f"{group_id}_") and filename.endswith(".json"):
-                    save_file = os.path.join(DATA_DIR, filename)
-                    try:
-                        with open(save_file, 'r', encoding='utf-8') as f:
-                            save_data = json.load(f)
-                        
-                        game_state = save_data.get("game_state", {})
-                        game_active = game_state.get("game_active", False)
-                        
-                        if not game_active:
-                            save_name = save_data.get("save_name", "")
-                            if not save_name:
-                                if filename == f"{group_id}.json":
-                                    save_name = "默认存档"
-                                else:
-                                    save_name = filename
+                "messages": [
+                    {"role": "system", "content": "你是一个专业的规则怪谈生成器和裁判。"},
+                    {"role": "user", "content": prompt}
+                ],
+                "temperature": temperature,
+                "max_tokens": 8000,
+                "stream": on_text is not None
+            }
+            seed = current_game_seed.get()
+            if seed is not None and self.get_config("replay.forward_seed", False):
+                payload["seed"] = seed
+
+            try:
+                timeout = aiohttp.ClientTimeout(total=180)
+                async with aiohttp.ClientSession(timeout=timeout) as session:
+                    async with session.post(api_url, headers=headers, json=payload) as response:
+                        if response.status == 200:
+                            if on_text is not None and "text/event-stream" in response.headers.get("Content-Type", ""):
+                                data = await self._read_llm_stream(response, on_text)
+                            else:
+                                data = await response.json()
                             
-                            deleted_saves.append({
-                                "name": save_name,
-                                "file": filename
-                            })
+                            if isinstance(data, list):
+                                print(f"[规则怪谈] 模型 {model} API返回列表格式: {data}")
+                                last_error = f"API返回列表格式"
+                                continue
                             
-                            image_paths = []
-                            for key, value in game_state.items():
-                                if key.endswith("_image_path") and value and isinstance(value, str):
-                                    image_paths.append(value)
+                            if not isinstance(data, dict):
+                                print(f"[规则怪谈] 模型 {model} API返回非字典格式: {type(data)}")
+                                last_error = f"API返回非字典格式"
+                                continue
                             
-                            if "action_image_paths" in game_state:
-                                image_paths.extend(game_state["action_image_paths"])
+                            choices = data.get("choices", [])
+                            if not choices or not isinstance(choices, list):
+                                print(f"[规则怪谈] 模型 {model} choices字段格式错误: {choices}")
+                                last_error = f"choices字段格式错误"
+                                continue
                             
-                            for img_path in image_paths:
-                                if os.path.exists(img_path):
-                                    try:
-                                        os.remove(img_path)
-                                        deleted_images.append(img_path)
-                                        print(f"[规则怪谈] 已删除图片：{img_path}")
-                                    except Exception as e:
-                                        print(f"[规则怪谈] 删除图片失败 {img_path}: {e}")
+                            first_choice = choices[0]
+                            if not isinstance(first_choice, dict):
+                                print(f"[规则怪谈] 模型 {model} choices[0]格式错误: {first_choice}")
+                                last_error = f"choices[0]格式错误"
+                                continue
                             
-                            os.remove(save_file)
-                            print(f"[规则怪谈] 已删除存档：{save_file}")
+                            message = first_choice.get("message", {})
+                            if not isinstance(message, dict):
+                                print(f"[规则怪谈] 模型 {model} message字段格式错误: {message}")
+                                last_error = f"message字段格式错误"
+                                continue
                             
-                    except Exception as e:
-                        print(f"处理存档 {filename} 时发生异常: {e}")
-                        continue
+                            content = message.get("content", "").strip()
+                            if not content:
+                                print(f"[规则怪谈] 模型 {model} content为空")
+                                last_error = f"content为空"
+                                continue
+                            
+                            print(f"[规则怪谈] 模型 {model} 调用成功")
+                            outcome["model"] = model
+                            outcome["usage"] = data.get("usage")
+                            
+                            if model_index != current_model_index:
+                                print(f"[规则怪谈] 更新当前模型索引从 {current_model_index} 到 {model_index}")
+                                self.update_config("llm.current_model_index", model_index)
+                            
+                            return content
+                        else:
+                            error_text = await response.text()
+                            print(f"[规则怪谈] 模型 {model} API请求失败: Status {response.status}, Body: {error_text}")
+                            last_error = f"Status {response.status}: {error_text}"
+            except Exception as e:
+                print(f"[规则怪谈] 模型 {model} 调用时发生异常: {e}")
+                last_error = str(e)
+        
+        print(f"[规则怪谈] 所有模型都调用失败，最后错误: {last_error}")
+        return ""
+
+    async def _read_llm_stream(self, response, on_text: Callable[[str], None]) -> dict:
+        """读取流式（SSE）响应，每收到一段内容就回调已收到的全部文本，最后返回与非流式响应相同结构的数据"""
+        content = ""
+        usage = None
+        async for raw_line in response.content:
+            line = raw_line.decode("utf-8", errors="ignore").strip()
+            if not line.startswith("data:"):
+                continue
             
-            if not deleted_saves:
-                await self.send_text("没有找到已结束的存档。")
-                return True, "无已结束存档", True
+            payload = line[len("data:"):].strip()
+            if payload == "[DONE]":
+                break
             
-            reply_text = "**清理完成**\n\n"
-            reply_text += f"已删除 {len(deleted_saves)} 个已结束存档：\n\n"
+            try:
+                chunk = json.loads(payload)
+            except json.JSONDecodeError:
+                continue
+            if not isinstance(chunk, dict):
+                continue
             
-            for save in deleted_saves:
-                reply_text += f"- {save['name']}\n"
+            if chunk.get("usage"):
+                usage = chunk["usage"]
             
-            if deleted_images:
-                reply_text += f"\n已删除 {len(deleted_images)} 张相关图片\n"
+            choices = chunk.get("choices") or []
+            if not choices or not isinstance(choices[0], dict):
+                continue
+            delta = choices[0].get("delta") or {}
+            piece = delta.get("content") if isinstance(delta, dict) else None
+            if not piece:
+                continue
             
-            await self.send_text(reply_text)
-            return True, "清理完成", True
-        except Exception as e:
-            await self.send_text(f"清理存档失败：{str(e)}")
-            return False, f"清理存档失败: {str(e)}", True
-
-    async def _force_start_new_game(self, group_id: str, api_url: str, api_key: str, model_list: list, current_model_index: int, temperature: float, game_mode: str) -> Tuple[bool, Optional[str], bool]:
-        """强制开始一个新的规则怪谈游戏（覆盖存档）"""
-        await self.send_text("正在生成规则怪谈...")
+            content += piece
+            try:
+                on_text(content)
+            except Exception as e:
+                print(f"[规则怪谈] 处理流式内容时发生异常: {e}")
+        
+        return {"choices": [{"message": {"content": content}}], "usage": usage}
 
-        step1_prompt = """
-你是一个专业的规则怪谈生成器。请生成一个恐怖或诡异的规则怪谈的剧情导入。
+    @traced("save")
+    def _save_game_state(self, group_id: str) -> bool:
+        """保存游戏状态到文件"""
+        try:
+            game_state = game_states.get(group_id)
+            if not game_state:
+                return False
 
-要求：
-1. 生成一个场景（如：深夜的医院、废弃的学校、神秘的公寓、古老的庄园等）
-2. 描述场景的背景故事（这个场景的历史、发生过什么、为什么诡异）
-3. 描述玩家为何会来到这个场景的原因（收到邀请、迷路、调查事件、被绑架等）
-4. 剧情应该充满悬疑和恐怖氛围，为后续的规则和探索做铺垫
-5. 生成2-3个"核心象征符号"，这些符号将在整个游戏中反复出现，营造主题感和不安感。符号可以是数字、图案、旋律、花纹、颜色等。每个符号需要有一个简短的描述，暗示其可能的含义或与场景的联系。
-6. 以JSON格式返回，格式如下：
-{
-  "scene": "场景名称（如：深夜的废弃医院）",
-  "background": "场景背景故事，描述这个场景的历史、发生过什么、为什么诡异",
-  "player_identity": "玩家在这个场景中的身份或角色",
-  "core_symbols": [
-    {"symbol": "符号1", "description": "符号1的描述"},
-    {"symbol": "符号2", "description": "符号2的描述"}
-  ]
-}
+            os.makedirs(DATA_DIR, exist_ok=True)
+            save_file = os.path.join(DATA_DIR, f"{group_id}.json")
 
-请仅返回JSON，不要包含任何其他文字。**重要：不要使用任何emoji表情符号。**
-        """
+            save_data = {
+                "group_id": group_id,
+                "save_time": datetime.now().isoformat(),
+                "game_state": game_state
+            }
 
-        llm_response = await self._call_llm_api(step1_prompt, api_url, api_key, model, temperature)
-        if not llm_response:
-            await self.send_text("调用LLM API失败，请稍后再试。")
-            return False, "LLM API调用失败", True
+            with open(save_file, 'w', encoding='utf-8') as f:
+                json.dump(save_data, f, ensure_ascii=False, indent=2)
 
-        print(f"[规则怪谈] 第一步（剧情导入）LLM原始返回: {llm_response}")
+            return True
+        except Exception as e:
+            print(f"保存游戏状态时发生异常: {e}")
+            return False
 
+    def _load_game_state(self, group_id: str) -> Optional[dict]:
+        """从文件加载游戏状态"""
         try:
-            step1_data = json.loads(llm_response)
-        except json.JSONDecodeError as e:
-            print(f"[规则怪谈] 第一步JSON解析失败: {e}")
-            print(f"[规则怪谈] 尝试提取JSON部分...")
+            save_file = os.path.join(DATA_DIR, f"{group_id}.json")
             
-            json_match = re.search(r'\{[\s\S]*\}', llm_response)
-            if json_match:
-                try:
-                    step1_data = json.loads(json_match.group())
-                    print(f"[规则怪谈] 第一步成功提取JSON")
-                except json.JSONDecodeError as e2:
-                    print(f"[规则怪谈] 第一步提取JSON后仍然解析失败: {e2}")
-                    await self.send_text("生成剧情导入失败，返回格式不正确。")
-                    return False, "JSON解析失败", True
-            else:
-                await self.send_text("生成剧情导入失败，返回格式不正确。")
-                return False, "JSON解析失败", True
+            if not os.path.exists(save_file):
+                return None
 
-        scene_name = step1_data.get("scene", "")
-        background = step1_data.get("background", "")
-        player_identity = step1_data.get("player_identity", "")
-        core_symbols = step1_data.get("core_symbols", [])
+            with open(save_file, 'r', encoding='utf-8') as f:
+                save_data = json.load(f)
 
-        await asyncio.sleep(0.5)
-        
-        try:
-            plot_image_path = self._generate_plot_image(scene_name, background, player_identity, core_symbols)
-            game_states[group_id]["plot_image_path"] = plot_image_path
-            with open(plot_image_path, 'rb') as f:
-                image_bytes = f.read()
-            image_base64 = base64.b64encode(image_bytes).decode('ascii')
-            image_sent = await self.send_image(image_base64)
-            if not image_sent:
-                print(f"[规则怪谈] 剧情导入图片发送失败")
-            await asyncio.sleep(1.0)
+            return save_data.get("game_state")
         except Exception as e:
-            print(f"[规则怪谈] 生成剧情导入长图失败: {str(e)}")
-            step1_text = (
-                f"**规则怪谈** ({game_mode}模式)\n\n"
-                f"**剧情导入**：\n{background}\n\n"
-                f"**你们的身份**：\n{player_identity}\n\n"
-                f"**场景**：{scene_name}"
-            )
-            await self.send_text(step1_text)
-            await asyncio.sleep(1.0)
-        
-        await self.send_text("正在生成场景结构...")
-        await asyncio.sleep(1.0)
-
-        step2_prompt = f"""
-你是一个专业的规则怪谈生成器。请基于以下剧情导入，生成场景结构。
+            print(f"加载游戏状态时发生异常: {e}")
+            return None
 
-剧情导入：
-- 场景：{scene_name}
-- 背景：{background}
-- 玩家身份：{player_identity}
+    def _delete_save_file(self, group_id: str) -> bool:
+        """删除存档文件（包括默认存档和所有手动存档）"""
+        try:
+            deleted_count = 0
+            
+            if not os.path.exists(DATA_DIR):
+                return True
+            
+            for filename in os.listdir(DATA_DIR):
+                if filename.startswith(f"{group_id}_") and filename.endswith(".json"):
+                    save_file = os.path.join(DATA_DIR, filename)
+                    try:
+                        os.remove(save_file)
+                        deleted_count += 1
+                        print(f"已删除存档文件: {filename}")
+                    except Exception as e:
+                        print(f"删除存档文件 {filename} 时发生异常: {e}")
+            
+            return deleted_count > 0
+        except Exception as e:
+            print(f"删除存档文件时发生异常: {e}")
+            return False
 
-要求：
-1. 确定建筑类型（如：医院、学校、公寓、庄园等）
-2. 描述建筑的总体布局（如：L型、U型、回字形、多层建筑等）
-3. 列出所有楼层（包括地上和地下），每层列出主要区域
-4. 列出通道、楼梯、电梯等连接方式
-5. 列出特殊区域（如：地下室、天台、禁闭室等）
-6. 场景结构应该与剧情导入的背景和氛围相符
-7. 以JSON格式返回，格式如下：
-{{
-  "building_type": "建筑类型",
-  "overall_layout": "建筑总体布局描述",
-  "floors": [
-    {{
-      "floor": "楼层名称",
-      "areas": ["区域1", "区域2", "区域3"]
-    }}
-  ],
-  "connections": ["通道1", "通道2", "通道3"],
-  "special_areas": ["特殊区域1", "特殊区域2"]
-}}
+    @traced("save_named")
+    async def _save_game_with_name(self, group_id: str, save_name: str) -> Tuple[bool, Optional[str], bool]:
+        """使用自定义名称保存游戏状态"""
+        try:
+            game_state = game_states.get(group_id)
+            if not game_state:
+                await self.send_text("没有可保存的游戏状态。")
+                return False, "无游戏状态", True
 
-请仅返回JSON，不要包含任何其他文字。**重要：不要使用任何emoji表情符号。**
-        """
+            if not save_name:
+                await self.send_text("存档名称不能为空。")
+                return False, "存档名称为空", True
 
-        llm_response = await self._call_llm_api(step2_prompt, api_url, api_key, model, temperature)
-        if not llm_response:
-            await self.send_text("调用LLM API失败，请稍后再试。")
-            return False, "LLM API调用失败", True
+            if len(save_name) > 50:
+                await self.send_text("存档名称过长（最多50个字符）。")
+                return False, "存档名称过长", True
 
-        print(f"[规则怪谈] 第二步（场景结构）LLM原始返回: {llm_response}")
+            invalid_chars = ['/', '\\', ':', '*', '?', '"', '<', '>', '|']
+            for char in invalid_chars:
+                if char in save_name:
+                    await self.send_text(f"存档名称包含非法字符「{char}」。")
+                    return False, "存档名称包含非法字符", True
 
-        try:
-            step2_data = json.loads(llm_response)
-        except json.JSONDecodeError as e:
-            print(f"[规则怪谈] 第二步JSON解析失败: {e}")
-            print(f"[规则怪谈] 尝试提取JSON部分...")
-            
-            json_match = re.search(r'\{[\s\S]*\}', llm_response)
-            if json_match:
-                try:
-                    step2_data = json.loads(json_match.group())
-                    print(f"[规则怪谈] 第二步成功提取JSON")
-                except json.JSONDecodeError as e2:
-                    print(f"[规则怪谈] 第二步提取JSON后仍然解析失败: {e2}")
-                    await self.send_text("生成场景结构失败，返回格式不正确。")
-                    return False, "JSON解析失败", True
-            else:
-                await self.send_text("生成场景结构失败，返回格式不正确。")
-                return False, "JSON解析失败", True
+            os.makedirs(DATA_DIR, exist_ok=True)
+            save_file = os.path.join(DATA_DIR, f"{group_id}_{save_name}.json")
 
-        building_type = step2_data.get("building_type", "")
-        overall_layout = step2_data.get("overall_layout", "")
-        floors = step2_data.get("floors", [])
-        connections = step2_data.get("connections", [])
-        special_areas = step2_data.get("special_areas", [])
+            if os.path.exists(save_file):
+                await self.send_text(f"存档「{save_name}」已存在。将覆盖原有存档。")
 
-        floors_text = "\n".join([f"{floor['floor']}: {', '.join(floor['areas'])}" for floor in floors])
-        connections_text = ", ".join(connections)
-        special_areas_text = ", ".join(special_areas)
+            save_data = {
+                "group_id": group_id,
+                "save_name": save_name,
+                "save_time": datetime.now().isoformat(),
+                "game_state": game_state
+            }
 
-        scene_structure_text = f"建筑类型：{building_type}\n"
-        scene_structure_text += floors_text
-        scene_structure_text += f"\n连接通道：{connections_text}\n"
-        scene_structure_text += f"特殊区域：{special_areas_text}"
+            with open(save_file, 'w', encoding='utf-8') as f:
+                json.dump(save_data, f, ensure_ascii=False, indent=2)
 
-        await asyncio.sleep(0.5)
-        
-        try:
-            structure_image_path = self._generate_scene_structure_text_image(
-                building_type, overall_layout, floors, connections, special_areas
+            reply_text = (
+                f"**游戏已保存**\n\n"
+                f"**存档名称**：{save_name}\n"
+                f"**保存时间**：{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n"
+                f"**场景**：{game_state.get('scene', '')}\n"
+                f"**游戏模式**：{game_state.get('game_mode', '单人')}\n\n"
+                f"使用 `/rg 读取 {save_name}` 恢复此存档"
             )
-            game_states[group_id]["scene_structure_image_path"] = structure_image_path
-            with open(structure_image_path, 'rb') as f:
-                image_bytes = f.read()
-            image_base64 = base64.b64encode(image_bytes).decode('ascii')
-            image_sent = await self.send_image(image_base64)
-            if not image_sent:
-                print(f"[规则怪谈] 场景结构图片发送失败")
-            await asyncio.sleep(0.5)
+            await self.send_text(reply_text)
+            return True, "游戏已保存", True
         except Exception as e:
-            print(f"[规则怪谈] 生成场景结构长图失败: {str(e)}")
-            floors_text = "\n".join([f"  - {floor['floor']}: {', '.join(floor['areas'])}" for floor in floors])
-            connections_text = ", ".join(connections)
-            special_areas_text = ", ".join(special_areas)
-
-            step2_text = f"""**场景**：{scene_name}
-
-**场景结构**：
+            await self.send_text(f"保存失败：{str(e)}")
+            return False, f"保存失败: {str(e)}", True
 
-**建筑类型**：{building_type}
+    @traced("load_named")
+    async def _load_game_with_name(self, group_id: str, save_name: str) -> Tuple[bool, Optional[str], bool]:
+        """从自定义名称加载游戏状态"""
+        try:
+            save_file = os.path.join(DATA_DIR, f"{group_id}_{save_name}.json")
+            
+            if not os.path.exists(save_file):
+                await self.send_text(f"未找到存档「{save_name}」。使用 `/rg 存档列表` 查看所有可用存档。")
+                return False, "存档不存在", True
 
-**总体布局**：{overall_layout}
+            with open(save_file, 'r', encoding='utf-8') as f:
+                save_data = json.load(f)
 
-**楼层布局**：
-{floors_text}
+            saved_state = save_data.get("game_state")
+            if not saved_state:
+                await self.send_text("存档数据损坏。")
+                return False, "存档损坏", True
 
-**连接通道**：{connections_text}
+            if not saved_state.get("game_active", False):
+                await self.send_text("存档中的游戏已结束，无法恢复。请使用 `/rg 开始` 开始新游戏。")
+                return False, "游戏已结束", True
 
-**特殊区域**：{special_areas_text}"""
-            await self.send_text(step2_text)
-            await asyncio.sleep(0.5)
-        
-        await asyncio.sleep(0.5)
-        await self.send_text("正在生成规则...")
-        await asyncio.sleep(0.5)
+            saved_state = self._attach_shared_scenario(saved_state)
+            if saved_state is None:
+                await self.send_text("存档引用的每日挑战剧本已不存在，无法恢复。")
+                return False, "共享剧本不存在", True
 
-        step3_prompt = f"""
-你是一个专业的规则怪谈生成器。请基于以下剧情导入和场景结构，生成规则怪谈的规则。
+            self._cancel_background_tasks(group_id)
+            game_states[group_id] = saved_state
+            if saved_state.get("rule_network_status") == "pending":
+                self._start_rule_network_task(group_id)
+            if saved_state.get("hint_bank_status") == "pending":
+                self._start_hint_bank_task(group_id)
 
-剧情导入：
-- 场景：{scene_name}
-- 背景：{background}
-- 玩家身份：{player_identity}
+            game_mode = saved_state.get("game_mode", "单人")
+            save_time = save_data.get("save_time", "")
+            if save_time:
+                try:
+                    save_time = datetime.fromisoformat(save_time).strftime('%Y-%m-%d %H:%M:%S')
+                except:
+                    pass
 
-场景结构：
-{scene_structure_text}
+            reply_text = (
+                f"**规则怪谈** ({game_mode}模式) - 已恢复存档\n\n"
+                f"**存档名称**：{save_name}\n"
+                f"**存档时间**：{save_time}\n\n"
+                f"**场景**：{saved_state.get('scene', '')}\n\n"
+                f"**规则**：\n"
+            )
 
-要求：
-1. 列出5-8条规则，规则应该看似合理但隐藏着诡异之处
-2. 规则应该与剧情导入和场景结构相呼应
-3. 设定通关条件（如：在规定时间内找到出口、收集特定物品、存活到天亮等）
-4. 设定解除条件（如：找到规则怪谈的根源并消除它、找到某个特定物品并使用、完成某个仪式等）
-5. 规则应该有隐藏的逻辑和真相，需要玩家推理
-6. **规则与环境绑定（非常重要）**：请将至少2-3条规则与场景中特定的、可交互的环境细节直接关联。例如，如果规则是"不要理会走廊尽头的呼救声"，那么与之关联的环境可以是"走廊尽头的温度总是异常低，且墙上有抓痕"。这样，玩家在探索到该位置时，能通过环境感知强化对规则的记忆和怀疑
-7. **规则间的潜在冲突（非常重要）**：请尝试构建至少一组存在潜在矛盾的规则。例如，规则A："午夜后必须留在自己的房间内。" 规则B："公寓中没有404室。" 实际上公寓中有404室，但是仅在午夜后才会出现，此时玩家将陷入遵守A还是出门寻找404室的两难境地。请在 hidden_truth 中解释这种矛盾的本质（如：两条规则来自不同势力），并在 death_triggers 中隐含相关触发条件
+            for i, rule in enumerate(saved_state.get("rules", []), 1):
+                reply_text += f"{i}. {rule}\n"
 
-**规则描述要求（非常重要）：**
-- 规则必须简洁、直接，每条规则不超过60字
-- 只说明禁止、允许或要求做的行为，不解释原因
-- 使用标准格式：禁止XX / 当XX时，必须XX / 只有XX时才能XX / 必须XX / 严禁XX
-- 使用冰冷、客观的公文语调，如同官方通告或操作手册
-- 语调应该冷静、正式、不带感情色彩
-- 可以加入少量关键的环境或感官细节，但要简洁
-- 细节应该让人感到不安和恐惧，但不要直接揭示真相
+            reply_text += f"\n**通关条件**：{saved_state.get('win_condition', '')}\n\n"
 
-示例规则风格：
-"禁止在22:00-06:00期间离开房间。"
-"听到三声敲门时，必须立即开门。"
-"三楼东侧病房的窗户必须保持关闭状态。若发现窗户自行开启，请立即通知安保人员并远离开启的窗户。"
-"严禁回应任何呼救声。"
-"只有看到绿色灯光时才能进入走廊。"
-"工厂只有蓝色制服的保安，若看见黑色制服的保安，请立即报告主管。"
-"城堡内没有镜子，如果你觉得你看到了镜子，请相信那是你的幻觉。"
+            players = saved_state.get("players", {})
+            max_players = saved_state.get("max_players", 5)
+            reply_text = (
+                f"**玩家**：{len(players)}/{max_players}\n"
+            )
 
-以JSON格式返回，格式如下：
-{{
-  "rules_title": "规则标题（如：员工守则、患者须知等）",
-  "rules": ["规则1", "规则2", ...],
-  "win_condition": "通关条件",
-  "resolve_condition": "解除条件（解决规则怪谈根源的条件）",
-  "hidden_truth": "隐藏的真相（不显示给玩家）",
-  "death_triggers": ["会导致死亡的行为1", "会导致死亡的行为2", ...]
-}}
+            for pid, p_data in players.items():
+                status = "存活" if p_data["is_alive"] else "死亡"
+                reply_text += f"- {p_data['name']} ({status})\n"
 
-请仅返回JSON，不要包含任何其他文字。**重要：不要使用任何emoji表情符号。**
-        """
+            reply_text += f"\n**提示次数**：{saved_state.get('hints_used', 0)}/{saved_state.get('max_hints', 3)}\n\n"
 
-        llm_response = await self._call_llm_api(step3_prompt, api_url, api_key, model, temperature)
-        if not llm_response:
-            await self.send_text("调用LLM API失败，请稍后再试。")
-            return False, "LLM API调用失败", True
+            if game_mode == "单人":
+                reply_text += f"- 使用 `/rg 提示 <规则/线索>` 获取提示\n"
+                reply_text += f"- 使用 `/rg 推理 <推理内容>` 记录推理\n"
+                reply_text += f"- 使用 `/rg 行动 <行动描述>` 描述行动\n"
+                reply_text += f"- 使用 `/rg 状态` 查看游戏状态\n"
+                reply_text += f"- 使用 `/rg 结束` 结束游戏"
+            else:
+                reply_text += f"- 使用 `/rg 加入` 加入游戏\n"
+                reply_text += f"- 使用 `/rg 提示 <规则/线索>` 获取提示\n"
+                reply_text += f"- 使用 `/rg 推理 <推理内容>` 记录推理\n"
+                reply_text += f"- 使用 `/rg 行动 <行动描述>` 描述行动\n"
+                reply_text += f"- 使用 `/rg 状态` 查看游戏状态\n"
+                reply_text += f"- 使用 `/rg 结束` 结束游戏"
 
-        print(f"[规则怪谈] 第三步（规则）LLM原始返回: {llm_response}")
+            await self.send_text(reply_text)
+            return True, "游戏已恢复", True
+        except Exception as e:
+            await self.send_text(f"读取失败：{str(e)}")
+            return False, f"读取失败: {str(e)}", True
 
+    async def _list_saves(self, group_id: str) -> Tuple[bool, Optional[str], bool]:
+        """列出所有可用存档"""
         try:
-            step3_data = json.loads(llm_response)
-        except json.JSONDecodeError as e:
-            print(f"[规则怪谈] 第三步JSON解析失败: {e}")
-            print(f"[规则怪谈] 尝试提取JSON部分...")
+            os.makedirs(DATA_DIR, exist_ok=True)
             
-            json_match = re.search(r'\{[\s\S]*\}', llm_response)
-            if json_match:
-                try:
-                    step3_data = json.loads(json_match.group())
-                    print(f"[规则怪谈] 第三步成功提取JSON")
-                except json.JSONDecodeError as e2:
-                    print(f"[规则怪谈] 第三步提取JSON后仍然解析失败: {e2}")
-                    await self.send_text("生成规则失败，返回格式不正确。")
-                    return False, "JSON解析失败", True
-            else:
-                await self.send_text("生成规则失败，返回格式不正确。")
-                return False, "JSON解析失败", True
-
-        rules_image_path = None
-        
-        max_players = 5 if game_mode == "多人" else 1
-
-        game_states[group_id] = {
-            "scene": scene_name,
-            "background": background,
-            "player_identity": player_identity,
-            "building_type": building_type,
-            "overall_layout": overall_layout,
-            "floors": floors,
-            "connections": connections,
-            "special_areas": special_areas,
-            "rules_title": step3_data.get("rules_title", "规则"),
-            "rules": step3_data.get("rules", []),
-            "win_condition": step3_data.get("win_condition", ""),
-            "resolve_condition": step3_data.get("resolve_condition", ""),
-            "hidden_truth": step3_data.get("hidden_truth", ""),
-            "death_triggers": step3_data.get("death_triggers", []),
-            "hints_used": 0,
-            "max_hints": 3,
-            "game_active": True,
-            "max_players": max_players,
-            "game_mode": game_mode,
-            "players": {},
-            "plot_image_path": plot_image_path,
-            "rules_image_path": None,
-            "scene_structure_image_path": None,
-            "time_system": {
-                "start_time": datetime.now().isoformat(),
-                "current_time": "深夜",
-                "elapsed_minutes": 0,
-                "time_description": "午夜时分，周围一片死寂"
-            },
-            "environment": {
-                "lighting": "昏暗",
-                "temperature": "寒冷",
-                "sounds": ["寂静"],
-                "smells": ["霉味"],
-                "atmosphere": "压抑"
-            },
-            "random_events": [],
-            "available_items": [],
-            "environmental_events": [],
-            "rule_mutations": [],
-            "core_symbols": core_symbols,
-            "sanity_break": False,
-            "last_mutation_time": 0,
-            "identity_changes": [],
-            "environment_memory": {
-                "visited_locations": [],
-                "interacted_objects": [],
-                "time_based_events": [],
-                "discovered_secrets": []
-            },
-            "rule_network": {
-                "truth_elements": [],
-                "rule_truth_mappings": [],
-                "rule_dependencies": [],
-                "discovered_truths": []
-            },
-            "collaborative_events": []
-        }
-
-        self._save_game_state(group_id)
-
-        await self._build_rule_network(group_id)
-
-        rules_title = step3_data.get("rules_title", "规则")
-        rules = step3_data.get("rules", [])
-        win_condition = step3_data.get("win_condition", "")
+            saves = []
+            for filename in os.listdir(DATA_DIR):
+                if filename.startswith(f"{group_id}_") and filename.endswith(".json"):
+                    save_file = os.path.join(DATA_DIR, filename)
+                    try:
+                        with open(save_file, 'r', encoding='utf-8') as f:
+                            save_data = json.load(f)
+                        
+                        save_name = save_data.get("save_name", "")
+                        if not save_name:
+                            if filename == f"{group_id}.json":
+                                save_name = "默认存档"
+                            else:
+                                save_name = filename
+                        
+                        save_time = save_data.get("save_time", "")
+                        game_state = save_data.get("game_state", {})
+                        
+                        if save_time:
+                            try:
+                                save_time = datetime.fromisoformat(save_time).strftime('%Y-%m-%d %H:%M:%S')
+                            except:
+                                pass
+                        
+                        scene = game_state.get("scene", "")
+                        game_mode = game_state.get("game_mode", "单人")
+                        game_active = game_state.get("game_active", False)
+                        
+                        saves.append({
+                            "name": save_name,
+                            "time": save_time,
+                            "scene": scene,
+                            "mode": game_mode,
+                            "active": game_active
+                        })
+                    except Exception as e:
+                        print(f"读取存档 {filename} 时发生异常: {e}")
+                        continue
+            
+            if not saves:
+                await self.send_text("**存档列表**\n\n暂无存档。使用 `/rg 保存 <存档名称>` 创建存档。")
+                return True, "无存档", True
+            
+            saves.sort(key=lambda x: x["time"], reverse=True)
+            
+            reply_text = "**存档列表**\n\n"
+            for i, save in enumerate(saves, 1):
+                status = "可用" if save["active"] else "已结束"
+                reply_text += f"- **{i}. {save['name']}**\n"
+                reply_text += f"   {save['time']}\n"
+                reply_text += f"   {save['mode']}模式\n"
+                reply_text += f"   {save['scene']}\n"
+                reply_text += f"   {status}\n\n"
+            
+            reply_text += f"使用 `/rg 读取 <存档名称>` 恢复存档"
+            await self.send_text(reply_text)
+            return True, "已显示存档列表", True
+        except Exception as e:
+            await self.send_text(f"获取存档列表失败：{str(e)}")
+            return False, f"获取存档列表失败: {str(e)}", True
 
+    async def _cleanup_ended_saves(self, group_id: str) -> Tuple[bool, Optional[str], bool]:
+        """清理已结束的存档及其图片"""
         try:
-            rules_image_path = self._generate_rules_image(rules_title, rules, win_condition, game_mode)
-            game_states[group_id]["rules_image_path"] = rules_image_path
-            with open(rules_image_path, 'rb') as f:
-                image_bytes = f.read()
-            image_base64 = base64.b64encode(image_bytes).decode('ascii')
+            os.makedirs(DATA_DIR, exist_ok=True)
+            os.makedirs(TEMP_IMAGES_DIR, exist_ok=True)
             
-            # 确保图像发送完成后再继续
-            image_sent = await self.send_image(image_base64)
-            if not image_sent:
-                raise Exception("规则长图发送失败")
+            deleted_saves = []
+            deleted_images = []
+            
+            for filename in os.listdir(DATA_DIR):
+                if filename.startswith(f"{group_id}_") and filename.endswith(".json"):
+                    save_file = os.path.join(DATA_DIR, filename)
+                    try:
+                        with open(save_file, 'r', encoding='utf-8') as f:
+                            save_data = json.load(f)
+                        
+                        game_state = save_data.get("game_state", {})
+                        game_active = game_state.get("game_active", False)
+                        
+                        if not game_active:
+                            save_name = save_data.get("save_name", "")
+                            if not save_name:
+                                if filename == f"{group_id}.json":
+                                    save_name = "默认存档"
+                                else:
+                                    save_name = filename
+                            
+                            deleted_saves.append({
+                                "name": save_name,
+                                "file": filename
+                            })
+                            
+                            image_paths = []
+                            for key, value in game_state.items():
+                                if key.endswith("_image_path") and value and isinstance(value, str):
+                                    image_paths.append(value)
+                            
+                            if "action_image_paths" in game_state:
+                                image_paths.extend(game_state["action_image_paths"])
+                            
+                            for img_path in image_paths:
+                                if os.path.exists(img_path):
+                                    try:
+                                        os.remove(img_path)
+                                        deleted_images.append(img_path)
+                                        print(f"[规则怪谈] 已删除图片：{img_path}")
+                                    except Exception as e:
+                                        print(f"[规则怪谈] 删除图片失败 {img_path}: {e}")
+                            
+                            os.remove(save_file)
+                            print(f"[规则怪谈] 已删除存档：{save_file}")
+                            
+                    except Exception as e:
+                        print(f"处理存档 {filename} 时发生异常: {e}")
+                        continue
+            
+            if not deleted_saves:
+                await self.send_text("没有找到已结束的存档。")
+                return True, "无已结束存档", True
+            
+            reply_text = "**清理完成**\n\n"
+            reply_text += f"已删除 {len(deleted_saves)} 个已结束存档：\n\n"
+            
+            for save in deleted_saves:
+                reply_text += f"- {save['name']}\n"
+            
+            if deleted_images:
+                reply_text += f"\n已删除 {len(deleted_images)} 张相关图片\n"
             
-            # 增加延迟，确保图像完全显示后再发送后续消息
-            await asyncio.sleep(1.5)
+            await self.send_text(reply_text)
+            return True, "清理完成", True
         except Exception as e:
-            print(f"[规则怪谈] 生成规则长图失败: {str(e)}")
-            step3_text = f"**{rules_title}**：\n"
-            for i, rule in enumerate(rules, 1):
-                step3_text += f"{i}. {rule}\n"
-            goal_prefix = "你的目标是" if game_mode == "单人" else "你们的目标是"
-            step3_text += f"\n**{goal_prefix}**：{win_condition}"
-            await self.send_text(step3_text)
-            await asyncio.sleep(0.5)
-
-        if game_mode == "单人":
-            user_info = self._get_user_info()
-            if user_info:
-                user_id = user_info.user_id
-                user_name = getattr(user_info, 'user_name', f"玩家{user_id}")
-                game_states[group_id]["players"][user_id] = {
-                    "name": user_name,
-                    "reasoning_history": [],
-                    "action_history": [],
-                    "is_alive": True,
-                    "physical_status": {
-                        "health": 100,
-                        "injury": "无",
-                        "fatigue": "无"
-                    },
-                    "mental_status": {
-                        "sanity": 100,
-                        "state": "正常",
-                        "emotion": "平静"
-                    }
-                }
-                self._save_game_state(group_id)
-                player_text = f"**玩家**：{user_name}\n"
-            else:
-                player_text = f"**玩家**：0/1\n"
-
-            player_text += f"**提示次数**：0/3\n\n"
-            player_text += f"- 使用 `/rg 提示 <规则/线索>` 获取提示\n"
-            player_text += f"- 使用 `/rg 推理 <推理内容>` 记录推理\n"
-            player_text += f"- 使用 `/rg 行动 <行动描述>` 描述行动\n"
-            player_text += f"- 使用 `/rg 状态` 查看游戏状态\n"
-            player_text += f"- 使用 `/rg 结束` 结束游戏"
-
-            await self.send_text(player_text)
-        else:
-            try:
-                multiplayer_start_image_path = self._generate_multiplayer_start_image(max_players=5)
-                game_states[group_id]["multiplayer_start_image_path"] = multiplayer_start_image_path
-                with open(multiplayer_start_image_path, 'rb') as f:
-                    image_bytes = f.read()
-                image_base64 = base64.b64encode(image_bytes).decode('ascii')
-                image_sent = await self.send_image(image_base64)
-                if not image_sent:
-                    print(f"[规则怪谈] 多人模式开始图片发送失败")
-                await asyncio.sleep(0.5)
-            except Exception as e:
-                print(f"[规则怪谈] 生成多人模式提示长图失败: {str(e)}")
-                player_text = f"**玩家**：0/5\n"
-                player_text += f"**提示次数**：0/3\n\n"
-                player_text += f"- 使用 `/rg 加入` 加入游戏\n"
-                player_text += f"- 使用 `/rg 提示 <规则/线索>` 获取提示\n"
-                player_text += f"- 使用 `/rg 推理 <推理内容>` 记录推理\n"
-                player_text += f"- 使用 `/rg 行动 <行动描述>` 描述行动\n"
-                player_text += f"- 使用 `/rg 状态` 查看游戏状态\n"
-                player_text += f"- 使用 `/rg 结束` 结束游戏"
-                await self.send_text(player_text)
-                await asyncio.sleep(0.5)
-
-        return True, "已开始游戏", True
+            await self.send_text(f"清理存档失败：{str(e)}")
+            return False, f"清理存档失败: {str(e)}", True
 
+    @traced("handler:restore_game")
     async def _restore_game(self, group_id: str) -> Tuple[bool, Optional[str], bool]:
         """恢复存档游戏"""
         saved_state = self._load_game_state(group_id)
@@ -3892,10 +6823,24 @@ class RuleHorrorCommand(BaseCommand):
             return False, "无存档", True
 
         if not saved_state.get("game_active", False):
+            checkpoint = saved_state.get("generation")
+            if isinstance(checkpoint, dict):
+                await self.send_text(f"存档中是未完成的剧本生成进度。请使用 `/rg 开始 {checkpoint.get('game_mode', '单人')}` 继续生成。")
+                return False, "生成未完成", True
             await self.send_text("存档中的游戏已结束，无法恢复。请使用 `/rg 开始` 开始新游戏。")
             return False, "游戏已结束", True
 
+        saved_state = self._attach_shared_scenario(saved_state)
+        if saved_state is None:
+            await self.send_text("存档引用的每日挑战剧本已不存在，无法恢复。")
+            return False, "共享剧本不存在", True
+
+        self._cancel_background_tasks(group_id)
         game_states[group_id] = saved_state
+        if saved_state.get("rule_network_status") == "pending":
+            self._start_rule_network_task(group_id)
+        if saved_state.get("hint_bank_status") == "pending":
+            self._start_hint_bank_task(group_id)
 
         game_mode = saved_state.get("game_mode", "单人")
         reply_text = (
@@ -3938,37 +6883,94 @@ class RuleHorrorCommand(BaseCommand):
         await self.send_text(reply_text)
         return True, "已恢复存档", True
 
+    def _schedule_clear_check(self, group_id: str, api_url: str, api_key: str, model_list: list, current_model_index: int, temperature: float) -> None:
+        """在后台检查通关条件：等待时间内的多次触发合并为一次，同一群组同时只运行一次检查"""
+        game_state = game_states.get(group_id, {})
+        if not game_state or game_state.get("has_cleared", False):
+            return
+
+        entry = clear_checks.get(group_id)
+        if entry is not None:
+            entry["pending"] = True
+            return
+
+        delay = max(int(self.get_config("clear_check.debounce_seconds", 5)), 0)
+        entry = {"task": None, "pending": True}
+        clear_checks[group_id] = entry
+        entry["task"] = contextvars.Context().run(asyncio.create_task, self._run_clear_checks(group_id, entry, delay, api_url, api_key, model_list, current_model_index, temperature))
+
+        def on_done(finished_task: asyncio.Task) -> None:
+            if clear_checks.get(group_id) is entry:
+                clear_checks.pop(group_id, None)
+            if finished_task.cancelled():
+                return
+            error = finished_task.exception()
+            if error is not None:
+                print(f"[规则怪谈] 后台检查通关条件失败: {error}")
+
+        entry["task"].add_done_callback(on_done)
+
+    async def _run_clear_checks(self, group_id: str, entry: dict, delay: int, api_url: str, api_key: str, model_list: list, current_model_index: int, temperature: float) -> None:
+        """等待触发合并后检查通关条件，检查期间再次被触发时再检查一轮"""
+        while entry["pending"]:
+            await asyncio.sleep(delay)
+            entry["pending"] = False
+            await self._check_clear_condition(group_id, api_url, api_key, model_list, current_model_index, temperature)
+
+    def _cancel_clear_check(self, group_id: str) -> None:
+        """取消该群组尚未完成的通关检查"""
+        entry = clear_checks.pop(group_id, None)
+        if entry is not None and entry["task"] is not None and not entry["task"].done() and entry["task"] is not asyncio.current_task():
+            entry["task"].cancel()
+
+    @traced("check_clear_condition")
     async def _check_clear_condition(self, group_id: str, api_url: str, api_key: str, model_list: list, current_model_index: int, temperature: float) -> None:
         """检查玩家是否达成通关条件"""
         game_state = game_states.get(group_id, {})
         
-        if game_state.get("has_cleared", False):
+        if not game_state.get("game_active", False) or game_state.get("has_cleared", False):
             return
+        current_game_seed.set(game_state.get("rng_seed"))
         
         players = game_state.get("players", {})
         
         if not players:
             return
         
+        # 进度记录保存已评估的子目标状态和每位玩家已评估到的记录位置，每次只发送新增的推理和行动
+        progress = game_state.get("clear_progress") or {"sub_goals": [], "summary": "", "evaluated": {}}
+        max_new = max(int(self.get_config("clear_check.max_new_entries", 3)), 1)
         players_info = []
-        all_reasoning = []
-        all_actions = []
-        alive_players = []
+        new_entries = []
+        evaluated = {}
         
         for pid, p_data in players.items():
+            marks = progress["evaluated"].get(pid, {})
+            entry = {"name": p_data["name"]}
+            for key, mark_key in (("reasoning", "reasoning"), ("action", "actions")):
+                new_items = self._history_since(p_data, key, marks.get(mark_key, 0))
+                entry[mark_key] = new_items[-max_new:]
+                if len(new_items) > max_new:
+                    entry[f"omitted_{mark_key}"] = len(new_items) - max_new
+                evaluated.setdefault(pid, {})[mark_key] = self._history_count(p_data, key)
+            if entry["reasoning"] or entry["actions"]:
+                new_entries.append(entry)
             players_info.append({
                 "name": p_data["name"],
                 "is_alive": p_data["is_alive"],
-                "reasoning_count": len(p_data["reasoning_history"]),
-                "action_count": len(p_data["action_history"])
+                "location": p_data.get("location", "入口")
             })
-            all_reasoning.extend(p_data["reasoning_history"])
-            all_actions.extend(p_data["action_history"])
-            if p_data["is_alive"]:
-                alive_players.append(p_data["name"])
+        
+        if not new_entries:
+            return
+        
+        if progress["sub_goals"]:
+            sub_goals_info = json.dumps(progress["sub_goals"], ensure_ascii=False)
+        else:
+            sub_goals_info = "（尚未拆分，请先把通关条件拆分为2-4个可以逐一判断的子目标）"
         
         prompt = f"""
-你是一个规则怪谈裁判。请根据所有玩家的推理和行动，判断玩家是否达成通关条件。
+你是一个规则怪谈裁判。请根据通关进度记录和玩家新增的推理与行动，判断玩家是否达成通关条件。
 
 场景：{game_state.get('scene', '')}
 规则：{json.dumps(game_state.get('rules', []), ensure_ascii=False)}
@@ -3976,14 +6978,21 @@ class RuleHorrorCommand(BaseCommand):
 通关条件：{game_state.get('win_condition', '')}
 死亡触发条件：{json.dumps(game_state.get('death_triggers', []), ensure_ascii=False)}
 
-所有玩家信息：{json.dumps(players_info, ensure_ascii=False)}
-所有玩家推理记录：{json.dumps(all_reasoning, ensure_ascii=False)}
-所有玩家行动记录：{json.dumps(all_actions, ensure_ascii=False)}
-存活玩家：{json.dumps(alive_players, ensure_ascii=False)}
+当前玩家：{json.dumps(players_info, ensure_ascii=False)}
 
-请判断玩家是否达成通关条件。
+通关进度记录（之前的推理和行动已经据此评估过，不再重复发送）：
+子目标：{sub_goals_info}
+进度概述：{progress['summary'] or '（无）'}
+
+新增的推理和行动（omitted_ 字段表示更早的新增记录未列出的条数）：{json.dumps(new_entries, ensure_ascii=False)}
+
+请根据新增的推理和行动更新每个子目标的状态，已经满足的子目标保持满足。所有子目标都满足时才算达成通关条件。
 请返回JSON格式：
 {{
+  "sub_goals": [
+    {{"goal": "子目标", "met": "是/否", "evidence": "满足或未满足的简短依据"}}
+  ],
+  "progress_summary": "目前通关进度的简短概述（1-2句）",
   "cleared": "是/否",
   "reason": "判定的详细理由",
   "condition_met": "玩家是否达成了通关条件（是/否）"
@@ -3992,41 +7001,72 @@ class RuleHorrorCommand(BaseCommand):
 请仅返回JSON，不要包含任何其他文字。**重要：不要使用任何emoji表情符号。**
         """
 
-        llm_response = await self._call_llm_api(prompt, api_url, api_key, model, temperature)
+        llm_response = await self._call_llm_api(prompt, api_url, api_key, model_list, current_model_index, temperature, call_site="clear_check")
         if not llm_response:
             return
         
-        try:
-            result = json.loads(llm_response)
-        except json.JSONDecodeError as e:
-            print(f"[规则怪谈] JSON解析失败: {e}")
-            print(f"[规则怪谈] 尝试提取JSON部分...")
-            
-            json_match = re.search(r'\{[\s\S]*\}', llm_response)
-            if json_match:
-                try:
-                    result = json.loads(json_match.group())
-                    print(f"[规则怪谈] 成功提取JSON")
-                except json.JSONDecodeError as e2:
-                    print(f"[规则怪谈] 提取JSON后仍然解析失败: {e2}")
-                    return
-            else:
-                return
+        result = self._parse_llm_json(llm_response, "clear_check")
+        if result is None:
+            return
         
-        if result.get("cleared") == "是":
-            game_state["has_cleared"] = True
-            game_state["clear_time"] = datetime.now().isoformat()
+        async def apply() -> None:
+            # 检查在后台进行，等待LLM期间游戏可能已经结束或被替换
+            if game_states.get(group_id) is not game_state or not game_state.get("game_active", False) or game_state.get("has_cleared", False):
+                return
+            
+            game_state["clear_progress"] = self._merge_clear_progress(progress, result, evaluated)
+            
+            if result.get("cleared") == "是":
+                game_state["has_cleared"] = True
+                game_state["clear_time"] = datetime.now().isoformat()
+            # 每次合并后都保存，重启后仍能从进度记录继续增量检查
             self._save_game_state(group_id)
             
-            reply_text = (
-                f"**恭喜！你已达成通关条件！**\n\n"
-                f"{result.get('reason', '')}\n\n"
-                f"- 使用 `/rg 继续` 继续探索完美结局\n"
-                f"- 使用 `/rg 结束` 结束游戏并查看结局"
-            )
-            await self.send_text(reply_text)
+            if game_state.get("has_cleared", False):
+                reply_text = (
+                    f"**恭喜！你已达成通关条件！**\n\n"
+                    f"{result.get('reason', '')}\n\n"
+                    f"- 使用 `/rg 继续` 继续探索完美结局\n"
+                    f"- 使用 `/rg 结束` 结束游戏并查看结局"
+                )
+                await self.send_text(reply_text)
+        
+        # 结果通过群组命令队列写入，不会与正在执行的命令交错修改游戏状态
+        await command_executor.run(group_id, apply)
+
+    @staticmethod
+    def _history_count(player_data: dict, key: str) -> int:
+        """玩家累计记录过的推理或行动条数，旧存档没有计数时使用历史记录的长度"""
+        return player_data.get(f"{key}_count", len(player_data.get(f"{key}_history", [])))
+
+    def _append_history(self, player_data: dict, key: str, entry: str) -> None:
+        """追加推理或行动记录并增加累计条数；回合模式替换行动时记录会被删除，累计条数只增不减"""
+        player_data[f"{key}_count"] = self._history_count(player_data, key) + 1
+        player_data.setdefault(f"{key}_history", []).append(entry)
+
+    def _history_since(self, player_data: dict, key: str, mark: int) -> list:
+        """累计条数达到mark之后新增的记录；中间有记录被删除时宁可多返回已评估的记录，也不会漏掉新记录"""
+        history = player_data.get(f"{key}_history", [])
+        new_count = min(max(self._history_count(player_data, key) - mark, 0), len(history))
+        return history[len(history) - new_count:]
+
+    def _merge_clear_progress(self, progress: dict, result: dict, evaluated: dict) -> dict:
+        """把一次通关判定的结果合并进进度记录，已经满足的子目标不会被改回未满足"""
+        met_goals = {goal["goal"] for goal in progress["sub_goals"] if goal.get("met") == "是"}
+        sub_goals = []
+        for goal in result.get("sub_goals", []):
+            if not isinstance(goal, dict) or not goal.get("goal"):
+                continue
+            met = "是" if goal.get("met") == "是" or goal["goal"] in met_goals else "否"
+            sub_goals.append({"goal": str(goal["goal"]), "met": met, "evidence": str(goal.get("evidence", ""))})
+        return {
+            "sub_goals": sub_goals or progress["sub_goals"],
+            "summary": str(result.get("progress_summary", "")) or progress["summary"],
+            "evaluated": evaluated
+        }
 
-    async def _continue_to_perfect(self, group_id: str, api_url: str, api_key: str, model: str, temperature: float) -> Tuple[bool, Optional[str], bool]:
+    @traced("handler:continue_to_perfect")
+    async def _continue_to_perfect(self, group_id: str, api_url: str, api_key: str, model_list: list, current_model_index: int, temperature: float) -> Tuple[bool, Optional[str], bool]:
         """继续探索完美结局"""
         game_state = game_states.get(group_id, {})
         
@@ -4086,29 +7126,15 @@ class RuleHorrorCommand(BaseCommand):
 请仅返回JSON，不要包含任何其他文字。**重要：不要使用任何emoji表情符号。**
         """
 
-        llm_response = await self._call_llm_api(prompt, api_url, api_key, model, temperature)
+        llm_response = await self._call_llm_api(prompt, api_url, api_key, model_list, current_model_index, temperature, call_site="ending")
         if not llm_response:
             await self.send_text("调用LLM API失败，请稍后再试。")
             return False, "LLM API调用失败", True
 
-        try:
-            result = json.loads(llm_response)
-        except json.JSONDecodeError as e:
-            print(f"[规则怪谈] JSON解析失败: {e}")
-            print(f"[规则怪谈] 尝试提取JSON部分...")
-            
-            json_match = re.search(r'\{[\s\S]*\}', llm_response)
-            if json_match:
-                try:
-                    result = json.loads(json_match.group())
-                    print(f"[规则怪谈] 成功提取JSON")
-                except json.JSONDecodeError as e2:
-                    print(f"[规则怪谈] 提取JSON后仍然解析失败: {e2}")
-                    await self.send_text("判定完美结局失败，返回格式不正确。")
-                    return False, "JSON解析失败", True
-            else:
-                await self.send_text("判定完美结局失败，返回格式不正确。")
-                return False, "JSON解析失败", True
+        result = self._parse_llm_json(llm_response, "ending")
+        if result is None:
+            await self.send_text("判定完美结局失败，返回格式不正确。")
+            return False, "JSON解析失败", True
 
         if not isinstance(result, dict):
             print(f"[规则怪谈] result不是字典类型: {type(result)}, 内容: {result}")
@@ -4116,6 +7142,7 @@ class RuleHorrorCommand(BaseCommand):
             return False, "JSON解析失败", True
 
         game_state["game_active"] = False
+        self._cancel_background_tasks(group_id)
         self._save_game_state(group_id)
         
         if result.get("perfect") == "是":
@@ -4174,7 +7201,7 @@ class RuleHorrorCommand(BaseCommand):
                     print(f"[规则怪谈] 删除行动结果长图失败: {str(e)}")
             
             plot_image_path = game_state.get("plot_image_path")
-            if plot_image_path and os.path.exists(plot_image_path):
+            if plot_image_path and os.path.exists(plot_image_path) and not self._is_shared_image(plot_image_path):
                 try:
                     os.remove(plot_image_path)
                     print(f"[规则怪谈] 已删除剧情导入长图：{plot_image_path}")
@@ -4182,7 +7209,7 @@ class RuleHorrorCommand(BaseCommand):
                     print(f"[规则怪谈] 删除剧情导入长图失败: {str(e)}")
             
             rules_image_path = game_state.get("rules_image_path")
-            if rules_image_path and os.path.exists(rules_image_path):
+            if rules_image_path and os.path.exists(rules_image_path) and not self._is_shared_image(rules_image_path):
                 try:
                     os.remove(rules_image_path)
                     print(f"[规则怪谈] 已删除规则长图：{rules_image_path}")
@@ -4190,7 +7217,7 @@ class RuleHorrorCommand(BaseCommand):
                     print(f"[规则怪谈] 删除规则长图失败: {str(e)}")
             
             scene_structure_image_path = game_state.get("scene_structure_image_path")
-            if scene_structure_image_path and os.path.exists(scene_structure_image_path):
+            if scene_structure_image_path and os.path.exists(scene_structure_image_path) and not self._is_shared_image(scene_structure_image_path):
                 try:
                     os.remove(scene_structure_image_path)
                     print(f"[规则怪谈] 已删除场景结构长图：{scene_structure_image_path}")
@@ -4198,7 +7225,7 @@ class RuleHorrorCommand(BaseCommand):
                     print(f"[规则怪谈] 删除场景结构长图失败: {str(e)}")
             
             plot_image_path = game_state.get("plot_image_path")
-            if plot_image_path and os.path.exists(plot_image_path):
+            if plot_image_path and os.path.exists(plot_image_path) and not self._is_shared_image(plot_image_path):
                 try:
                     os.remove(plot_image_path)
                     print(f"[规则怪谈] 已删除剧情导入长图：{plot_image_path}")
@@ -4244,6 +7271,7 @@ class RuleHorrorCommand(BaseCommand):
         await self.send_text(reply_text)
         return True, "已检查完美结局", True
 
+    @traced("render:plot")
     def _generate_plot_image(self, scene_name, background, player_identity, core_symbols=None, output_path=None):
         """生成剧情导入长图（黑暗背景+鲜红字体）
         
@@ -4350,6 +7378,7 @@ class RuleHorrorCommand(BaseCommand):
         
         return output_path
 
+    @traced("render:scene_structure")
     def _generate_scene_structure_text_image(self, building_type, overall_layout, floors, connections, special_areas, output_path=None):
         """生成场景结构文字长图（白底黑字）
         
@@ -4507,7 +7536,7 @@ class RuleHorrorCommand(BaseCommand):
         
         return output_path
 
-    def _apply_sanity_distortion(self, img, draw, sanity, font_normal):
+    def _apply_sanity_distortion(self, img, draw, sanity, font_normal, rng=None):
         """应用理智崩坏时的视觉扭曲效果
         
         Args:
@@ -4515,10 +7544,12 @@ class RuleHorrorCommand(BaseCommand):
             draw: ImageDraw对象
             sanity: 理智值
             font_normal: 字体对象
+            rng: 随机数生成器，为None时使用全局随机数
         
         Returns:
             处理后的img和draw对象
         """
+        rng = rng or random
         if sanity >= 30 or sanity == 0:
             return img, draw
         
@@ -4536,41 +7567,43 @@ class RuleHorrorCommand(BaseCommand):
             insanity_level = (10 - sanity) / 10.0 * 0.33 + 0.67
         
         # 效果1：红色涂鸦遮盖
-        if random.random() < 0.3 * insanity_level:
-            num_scribbles = random.randint(1, 3)
+        if rng.random() < 0.3 * insanity_level:
+            num_scribbles = rng.randint(1, 3)
             for _ in range(num_scribbles):
-                x1 = random.randint(50, width - 50)
-                y1 = random.randint(100, height - 100)
-                x2 = x1 + random.randint(50, 150)
-                y2 = y1 + random.randint(10, 30)
+                x1 = rng.randint(50, width - 50)
+                y1 = rng.randint(100, height - 100)
+                x2 = x1 + rng.randint(50, 150)
+                y2 = y1 + rng.randint(10, 30)
                 alpha = int(100 * insanity_level)
                 draw.rectangle([x1, y1, x2, y2], fill=(255, 0, 0, alpha))
         
         # 效果2：红色斜线遮盖
-        if random.random() < 0.25 * insanity_level:
-            num_lines = random.randint(1, 2)
+        if rng.random() < 0.25 * insanity_level:
+            num_lines = rng.randint(1, 2)
             for _ in range(num_lines):
-                y = random.randint(150, height - 150)
+                y = rng.randint(150, height - 150)
                 draw.line([(50, y), (width - 50, y)], fill=(255, 0, 0), width=3)
         
         # 效果3：模糊效果
-        if random.random() < 0.2 * insanity_level:
+        if rng.random() < 0.2 * insanity_level:
             blur_radius = int(2 * insanity_level)
             img = img.filter(ImageFilter.GaussianBlur(radius=blur_radius))
             draw = ImageDraw.Draw(img)
         
         return img, draw
 
-    def _distort_text(self, text, sanity):
+    def _distort_text(self, text, sanity, rng=None):
         """对文本进行理智崩坏扭曲处理
         
         Args:
             text: 原始文本
             sanity: 理智值
+            rng: 随机数生成器，为None时使用全局随机数
         
         Returns:
             扭曲后的文本
         """
+        rng = rng or random
         if sanity >= 30 or sanity == 0:
             return text
         
@@ -4586,35 +7619,36 @@ class RuleHorrorCommand(BaseCommand):
             insanity_level = (10 - sanity) / 10.0 * 0.33 + 0.67
         
         # 效果1：插入乱码符号
-        if random.random() < 0.15 * insanity_level:
+        if rng.random() < 0.15 * insanity_level:
             symbols = ['#', '@', '$', '%', '^', '&', '*', '!', '?', '~']
-            num_insertions = random.randint(1, 2)
+            num_insertions = rng.randint(1, 2)
             text_list = list(text)
             for _ in range(num_insertions):
-                pos = random.randint(0, len(text_list))
-                text_list.insert(pos, random.choice(symbols))
+                pos = rng.randint(0, len(text_list))
+                text_list.insert(pos, rng.choice(symbols))
             text = ''.join(text_list)
         
         # 效果2：重复词语（针对中文）
-        if random.random() < 0.1 * insanity_level:
+        if rng.random() < 0.1 * insanity_level:
             words = re.findall(r'[\u4e00-\u9fff]+', text)
             if words:
-                word_to_repeat = random.choice(words)
+                word_to_repeat = rng.choice(words)
                 if len(word_to_repeat) >= 2:
-                    repeat_count = random.randint(2, 3)
+                    repeat_count = rng.randint(2, 3)
                     text = text.replace(word_to_repeat, word_to_repeat * repeat_count, 1)
         
         # 效果3：字符错位（随机交换相邻字符）
-        if random.random() < 0.1 * insanity_level:
+        if rng.random() < 0.1 * insanity_level:
             text_list = list(text)
-            for i in range(0, len(text_list) - 1, random.randint(5, 10)):
+            for i in range(0, len(text_list) - 1, rng.randint(5, 10)):
                 if i + 1 < len(text_list):
                     text_list[i], text_list[i + 1] = text_list[i + 1], text_list[i]
             text = ''.join(text_list)
         
         return text
 
-    def _generate_rules_image(self, rules_title, rules, win_condition, game_mode="单人", output_path=None, sanity=100):
+    @traced("render:rules")
+    def _generate_rules_image(self, rules_title, rules, win_condition, game_mode="单人", output_path=None, sanity=100, rng=None):
         """生成规则长图（黑暗背景+鲜红字体）
         
         Args:
@@ -4623,10 +7657,13 @@ class RuleHorrorCommand(BaseCommand):
             win_condition: 通关条件
             game_mode: 游戏模式（单人/多人）
             output_path: 输出图片路径，如果为None则自动生成
+            sanity: 理智值，低于30时对规则文字施加理智崩坏扭曲
+            rng: 随机数生成器，为None时使用全局随机数
         
         Returns:
             生成的图片路径
         """
+        rng = rng or random
         
         # 尝试加载中文字体
         try:
@@ -4731,10 +7768,10 @@ class RuleHorrorCommand(BaseCommand):
             
             # 对标题应用理智崩坏效果
             if sanity < 30:
-                rules_title = self._distort_text(rules_title, sanity)
+                rules_title = self._distort_text(rules_title, sanity, rng)
                 # 文字错位效果
-                offset_x = random.randint(-5, 5)
-                offset_y = random.randint(-3, 3)
+                offset_x = rng.randint(-5, 5)
+                offset_y = rng.randint(-3, 3)
                 draw.text((title_x + offset_x, margin + offset_y), rules_title, fill='#8B0000', font=font_title)
             else:
                 draw.text((title_x, margin), rules_title, fill='#8B0000', font=font_title)
@@ -4746,12 +7783,12 @@ class RuleHorrorCommand(BaseCommand):
             current_y = margin + 110
             for line in rule_lines:
                 # 对规则文本应用理智崩坏效果
-                distorted_line = self._distort_text(line, sanity)
+                distorted_line = self._distort_text(line, sanity, rng)
                 
                 # 文字错位效果
-                if sanity < 30 and random.random() < 0.3:
-                    offset_x = random.randint(-3, 3)
-                    offset_y = random.randint(-2, 2)
+                if sanity < 30 and rng.random() < 0.3:
+                    offset_x = rng.randint(-3, 3)
+                    offset_y = rng.randint(-2, 2)
                     draw.text((margin + offset_x, current_y + offset_y), distorted_line, fill='#FF0000', font=font_normal)
                 else:
                     draw.text((margin, current_y), distorted_line, fill='#FF0000', font=font_normal)
@@ -4763,19 +7800,19 @@ class RuleHorrorCommand(BaseCommand):
             current_y += section_height
             for line in goal_lines:
                 # 对通关条件文本应用理智崩坏效果
-                distorted_line = self._distort_text(line, sanity)
+                distorted_line = self._distort_text(line, sanity, rng)
                 
                 # 文字错位效果
-                if sanity < 30 and random.random() < 0.3:
-                    offset_x = random.randint(-3, 3)
-                    offset_y = random.randint(-2, 2)
+                if sanity < 30 and rng.random() < 0.3:
+                    offset_x = rng.randint(-3, 3)
+                    offset_y = rng.randint(-2, 2)
                     draw.text((margin + offset_x, current_y + offset_y), distorted_line, fill='#DC143C', font=font_subtitle)
                 else:
                     draw.text((margin, current_y), distorted_line, fill='#DC143C', font=font_subtitle)
                 current_y += line_height
         
         # 应用理智崩坏的视觉扭曲效果
-        img, draw = self._apply_sanity_distortion(img, draw, sanity, font_normal)
+        img, draw = self._apply_sanity_distortion(img, draw, sanity, font_normal, rng)
         
         # 生成输出路径
         if output_path is None:
@@ -4789,6 +7826,7 @@ class RuleHorrorCommand(BaseCommand):
         
         return output_path
 
+    @traced("render:multiplayer_start")
     def _generate_multiplayer_start_image(self, max_players=5, output_path=None):
         """生成多人模式游戏开始提示长图（黑暗背景+鲜红字体）
         
@@ -4866,6 +7904,7 @@ class RuleHorrorCommand(BaseCommand):
         
         return output_path
 
+    @traced("render:ending")
     def _generate_ending_image(self, ending, truth_revealed, win_condition_met, resolve_condition_met, survivors, hidden_truth, action_summary="", is_single_player=False, is_forced_end=False, reason="", output_path=None):
         """生成结局长图（黑暗背景+鲜红字体）
         
@@ -4967,10 +8006,11 @@ class RuleHorrorCommand(BaseCommand):
         
         return output_path
 
+    @traced("render:action_result")
     def _generate_action_result_image(self, user_name, action, is_dead, scene_description, action_feedback, 
                                        health, injury, fatigue, sanity, state, emotion, 
                                        fear_level, anxiety_level, stress_level, 
-                                       found_items, new_location, random_event, output_path=None):
+                                       found_items, new_location, random_event, output_path=None, rng=None):
         """生成行动结果长图（黑暗背景+鲜红字体）
         
         Args:
@@ -4992,10 +8032,12 @@ class RuleHorrorCommand(BaseCommand):
             new_location: 新位置
             random_event: 环境事件
             output_path: 输出图片路径，如果为None则自动生成
+            rng: 随机数生成器，为None时使用全局随机数
         
         Returns:
             生成的图片路径
         """
+        rng = rng or random
         
         try:
             font_title = ImageFont.truetype("msyh.ttc", 36)
@@ -5126,12 +8168,12 @@ class RuleHorrorCommand(BaseCommand):
         current_y = margin
         for line in content_lines:
             # 对文本应用理智崩坏效果
-            distorted_line = self._distort_text(line, sanity)
+            distorted_line = self._distort_text(line, sanity, rng)
             
             # 文字错位效果
-            if sanity < 30 and sanity > 0 and random.random() < 0.3:
-                offset_x = random.randint(-3, 3)
-                offset_y = random.randint(-2, 2)
+            if sanity < 30 and sanity > 0 and rng.random() < 0.3:
+                offset_x = rng.randint(-3, 3)
+                offset_y = rng.randint(-2, 2)
                 base_x = margin + offset_x
                 base_y = current_y + offset_y
             else:
@@ -5157,7 +8199,7 @@ class RuleHorrorCommand(BaseCommand):
             current_y += line_height
         
         # 应用理智崩坏的视觉扭曲效果
-        img, draw = self._apply_sanity_distortion(img, draw, sanity, font_normal)
+        img, draw = self._apply_sanity_distortion(img, draw, sanity, font_normal, rng)
         
         if output_path is None:
             os.makedirs(TEMP_IMAGES_DIR, exist_ok=True)
@@ -0,0 +1,13 @@
+"""测试共用的 pytest 夹具"""
+import pytest
+
+
+@pytest.fixture
+def data_dir(monkeypatch, tmp_path):
+    """把插件的存档目录和临时图片目录指向本次测试的临时目录"""
+    from fixtures import plugin
+
+    monkeypatch.setattr(plugin, "DATA_DIR", str(tmp_path))
+    monkeypatch.setattr(plugin, "TEMP_IMAGES_DIR", str(tmp_path / "img"))
+    (tmp_path / "img").mkdir()
+    return tmp_path
@@ -0,0 +1,269 @@
+"""故障注入压测：不改动插件代码，在真实的LLM请求流程和消息发送外层注入延迟尖峰、超时、截断的返回内容、
+非字典响应体、空 choices 以及图片发送失败，测量开局流程、行动流程和模型切换的表现
+
+LLM 请求在 aiohttp 会话层被替换，返回内容来自 CannedLLM，不发送任何网络请求。
+需要在 MaiBot 根目录执行（插件依赖 src.plugin_system）：
+    python plugins/<插件目录>/tests/fault_injection.py --runs 3 --actions 20 --timeout-rate 0.2 --truncate-rate 0.1 --image-fail-rate 0.3
+"""
+import argparse
+import asyncio
+import contextvars
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from typing import Optional
+
+sys.path.insert(0, os.getcwd())
+
+from fixtures import LLM_ARGS, CannedLLM, make_command, make_state, plugin, set_user  # noqa: E402
+
+# 三个模型用于观察模型切换：前一个模型失败时依次尝试下一个
+MODEL_LIST = ["model-a", "model-b", "model-c"]
+FAILOVER_LLM_ARGS = (LLM_ARGS[0], LLM_ARGS[1], MODEL_LIST, 0, LLM_ARGS[4])
+
+# 当前 _call_llm_api 调用的调用点和已发出的请求次数
+current_call = contextvars.ContextVar("fault_injection_call", default=None)
+
+
+class FaultyResponse:
+    """模拟 aiohttp 的响应：进入时注入延迟或超时，响应体按配置被篡改"""
+
+    def __init__(self, injector: "FaultInjector", payload: dict):
+        self.injector = injector
+        self.payload = payload
+        self.status = 200
+        self.headers = {"Content-Type": "application/json"}
+        self.data = None
+
+    async def __aenter__(self):
+        self.data = await self.injector.respond(self.payload)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    async def json(self):
+        return self.data
+
+    async def text(self):
+        return json.dumps(self.data, ensure_ascii=False)
+
+
+class FaultySession:
+    """替换 aiohttp.ClientSession，所有请求交给 FaultInjector 处理"""
+
+    def __init__(self, injector: "FaultInjector"):
+        self.injector = injector
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    def post(self, url, headers=None, json=None):
+        return FaultyResponse(self.injector, json)
+
+
+class FaultInjector:
+    """包在 _call_llm_api 和 send_text/send_image 外层的故障注入中间件，并统计LLM调用、模型切换和消息发送"""
+
+    def __init__(self, faults: dict, seed: int = 0, llm: Optional[CannedLLM] = None):
+        self.faults = faults
+        self.rng = random.Random(seed)
+        self.llm = llm or CannedLLM()
+        self.reset_stats()
+
+    def reset_stats(self) -> None:
+        self.injected = {}
+        self.llm_results = {"calls": 0, "failed": 0, "failovers": 0}
+        self.sends = {"text": 0, "image": 0, "image_failed": 0}
+
+    def _hit(self, key: str) -> bool:
+        rate = self.faults.get(key, 0.0)
+        return rate > 0 and self.rng.random() < rate
+
+    def _count(self, fault: str) -> None:
+        self.injected[fault] = self.injected.get(fault, 0) + 1
+
+    def session(self, *args, **kwargs) -> FaultySession:
+        """用于替换 aiohttp.ClientSession 的工厂"""
+        return FaultySession(self)
+
+    async def respond(self, payload: dict):
+        """处理一次模型请求：注入延迟和超时，返回可能被篡改的响应体"""
+        call = current_call.get() or {"site": "", "attempts": 0}
+        call["attempts"] += 1
+
+        latency_ms = self.faults.get("llm_latency_ms", 0)
+        if self._hit("llm_latency_spike_rate"):
+            latency_ms += self.faults.get("llm_latency_spike_ms", 0)
+            self._count("llm_latency_spike")
+        if latency_ms > 0:
+            await asyncio.sleep(latency_ms / 1000)
+        if payload.get("model") in self.faults.get("failing_models", ()) or self._hit("llm_timeout_rate"):
+            self._count("llm_timeout")
+            raise asyncio.TimeoutError("故障注入：LLM请求超时")
+
+        content = json.dumps(self.llm.respond(call["site"], payload["messages"][-1]["content"]), ensure_ascii=False)
+        data = {"choices": [{"message": {"content": content}}], "usage": {"prompt_tokens": 0, "completion_tokens": len(content)}, "model": payload.get("model")}
+        if self._hit("llm_non_dict_rate"):
+            self._count("llm_non_dict")
+            return [data]
+        if self._hit("llm_empty_choices_rate"):
+            self._count("llm_empty_choices")
+            return {**data, "choices": []}
+        if self._hit("llm_truncate_rate"):
+            self._count("llm_truncate")
+            data["choices"][0]["message"]["content"] = content[:len(content) // 2]
+        return data
+
+    def install(self, command) -> None:
+        """包装命令对象的 _call_llm_api、send_text 和 send_image"""
+        call_llm_api = command._call_llm_api
+        send_text = command.send_text
+        send_image = command.send_image
+
+        async def faulty_call_llm_api(prompt, *args, call_site="", **kwargs):
+            call = {"site": call_site, "attempts": 0}
+            token = current_call.set(call)
+            try:
+                content = await call_llm_api(prompt, *args, call_site=call_site, **kwargs)
+            finally:
+                current_call.reset(token)
+            self.llm_results["calls"] += 1
+            self.llm_results["failovers"] += max(call["attempts"] - 1, 0)
+            if not content:
+                self.llm_results["failed"] += 1
+            return content
+
+        async def send_latency():
+            latency_ms = self.faults.get("send_latency_ms", 0)
+            if latency_ms > 0:
+                await asyncio.sleep(latency_ms / 1000)
+
+        async def faulty_send_text(text, *args, **kwargs):
+            await send_latency()
+            self.sends["text"] += 1
+            return await send_text(text, *args, **kwargs)
+
+        async def faulty_send_image(image_base64, *args, **kwargs):
+            await send_latency()
+            self.sends["image"] += 1
+            if self._hit("image_send_fail_rate"):
+                self._count("image_send_fail")
+                self.sends["image_failed"] += 1
+                return False
+            return await send_image(image_base64, *args, **kwargs)
+
+        command._call_llm_api = faulty_call_llm_api
+        command.send_text = faulty_send_text
+        command.send_image = faulty_send_image
+
+    def format_report(self, pipeline: str, results: list) -> str:
+        """汇总一个流程的耗时、成功次数、LLM调用与模型切换以及注入的故障"""
+        elapsed_list = [result["elapsed"] for result in results]
+        success_count = sum(1 for result in results if result["success"])
+        lines = [f"{pipeline}：执行{len(results)}次，成功{success_count}次"]
+        if elapsed_list:
+            lines[0] += f"，平均{sum(elapsed_list) / len(elapsed_list):.2f}秒，最长{max(elapsed_list):.2f}秒"
+        lines.append(
+            f"  LLM调用{self.llm_results['calls']}次，失败{self.llm_results['failed']}次，"
+            f"模型切换{self.llm_results['failovers']}次"
+        )
+        lines.append(f"  消息发送：文字{self.sends['text']}条，图片{self.sends['image']}张（失败{self.sends['image_failed']}张）")
+        lines.append(f"  已注入故障：{json.dumps(self.injected, ensure_ascii=False)}")
+        return "\n".join(lines)
+
+
+def make_faulty_command(injector: FaultInjector):
+    """构建保留真实LLM请求流程、外层包着故障注入的命令对象"""
+    command = make_command(None, {"telemetry.log_to_file": False, "clear_check.debounce_seconds": 0})
+    injector.install(command)
+    return command
+
+
+async def measure_start(command, runs: int, game_mode: str) -> list:
+    """测量分步生成剧本并开局的流程"""
+    results = []
+    for run in range(runs):
+        group_id = f"fault_start_{run}"
+        plugin.game_states.pop(group_id, None)
+        started = time.perf_counter()
+        success, _, _ = await command._run_generation(group_id, *FAILOVER_LLM_ARGS, game_mode)
+        results.append({"elapsed": time.perf_counter() - started, "success": success})
+        command._cancel_background_tasks(group_id)
+    return results
+
+
+async def measure_actions(command, actions: int) -> list:
+    """测量单人模式的行动流程"""
+    group_id = "fault_action"
+    plugin.game_states[group_id] = make_state("early")
+    user_id, player = next(iter(plugin.game_states[group_id]["players"].items()))
+    set_user(command, user_id, player["name"])
+    action_texts = ["我沿着中央楼梯走到二楼走廊", "我翻看护士站桌上的值班记录", "我在挂号处的抽屉里找找有没有钥匙"]
+    results = []
+    for n in range(actions):
+        player["is_alive"] = True
+        started = time.perf_counter()
+        success, _, _ = await command._record_action(group_id, action_texts[n % len(action_texts)], *FAILOVER_LLM_ARGS)
+        results.append({"elapsed": time.perf_counter() - started, "success": success})
+    command._cancel_background_tasks(group_id)
+    return results
+
+
+async def run(args) -> None:
+    data_dir = tempfile.mkdtemp(prefix="rule_horror_faults_")
+    plugin.DATA_DIR = data_dir
+    plugin.TEMP_IMAGES_DIR = os.path.join(data_dir, "temp_images")
+    os.makedirs(plugin.TEMP_IMAGES_DIR, exist_ok=True)
+
+    faults = {
+        "llm_latency_ms": args.latency_ms,
+        "llm_latency_spike_rate": args.spike_rate,
+        "llm_latency_spike_ms": args.spike_ms,
+        "llm_timeout_rate": args.timeout_rate,
+        "llm_truncate_rate": args.truncate_rate,
+        "llm_non_dict_rate": args.non_dict_rate,
+        "llm_empty_choices_rate": args.empty_choices_rate,
+        "send_latency_ms": args.send_latency_ms,
+        "image_send_fail_rate": args.image_fail_rate,
+        "failing_models": args.failing_models,
+    }
+    injector = FaultInjector(faults, seed=args.seed)
+    plugin.aiohttp.ClientSession = injector.session
+    command = make_faulty_command(injector)
+
+    start_results = await measure_start(command, args.runs, args.mode)
+    print(injector.format_report("开局流程", start_results))
+
+    injector.reset_stats()
+    action_results = await measure_actions(command, args.actions)
+    print(injector.format_report("行动流程", action_results))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="规则怪谈插件故障注入压测")
+    parser.add_argument("--runs", type=int, default=3, help="开局流程的执行次数")
+    parser.add_argument("--actions", type=int, default=20, help="行动流程的执行次数")
+    parser.add_argument("--mode", default="单人", choices=["单人", "多人"], help="开局的游戏模式")
+    parser.add_argument("--seed", type=int, default=0, help="故障注入的随机种子")
+    parser.add_argument("--latency-ms", type=int, default=0, help="每次LLM请求的固定延迟（毫秒）")
+    parser.add_argument("--spike-rate", type=float, default=0.0, help="LLM请求出现延迟尖峰的概率")
+    parser.add_argument("--spike-ms", type=int, default=0, help="延迟尖峰的额外延迟（毫秒）")
+    parser.add_argument("--timeout-rate", type=float, default=0.0, help="LLM请求超时的概率")
+    parser.add_argument("--truncate-rate", type=float, default=0.0, help="返回内容被截断一半的概率")
+    parser.add_argument("--non-dict-rate", type=float, default=0.0, help="返回非字典响应体的概率")
+    parser.add_argument("--empty-choices-rate", type=float, default=0.0, help="返回空 choices 的概率")
+    parser.add_argument("--send-latency-ms", type=int, default=0, help="每次发送消息前的延迟（毫秒）")
+    parser.add_argument("--image-fail-rate", type=float, default=0.0, help="图片发送失败的概率")
+    parser.add_argument("--failing-models", nargs="*", default=[], choices=MODEL_LIST, help="总是超时的模型，用于观察模型切换")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,232 @@
+"""测试与压测脚本共用的夹具：加载插件、构建各阶段的游戏状态和不依赖 MaiBot 消息管线的命令对象
+
+插件依赖 src.plugin_system，需要在 MaiBot 根目录下导入
+"""
+import importlib.util
+import json
+import re
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+PLUGIN_DIR = Path(__file__).resolve().parent.parent
+
+
+def load_plugin():
+    spec = importlib.util.spec_from_file_location("rule_horror_plugin", PLUGIN_DIR / "plugin.py")
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+plugin = load_plugin()
+
+LLM_ARGS = ("http://127.0.0.1:9/v1/chat/completions", "key", ["model"], 0, 0.8)
+
+STEP1 = {
+    "scene": "午夜十三号病院",
+    "background": "一座早已停业的精神病院在每天午夜重新开门，进入的人会收到一张写满规则的值班表。" * 2,
+    "player_identity": "新来的夜班护工",
+    "core_symbols": ["停摆的挂钟", "绿色灯光", "没有名字的病历"],
+}
+STEP2 = {
+    "building_type": "医院",
+    "overall_layout": "回字形四层建筑，中央是天井",
+    "floors": [
+        {"floor": "一楼", "areas": ["大厅", "挂号处", "急诊室", "药房"]},
+        {"floor": "二楼", "areas": ["走廊", "护士站", "201病房", "202病房"]},
+        {"floor": "三楼", "areas": ["走廊", "院长办公室", "档案室"]},
+        {"floor": "地下一层", "areas": ["太平间", "锅炉房"]},
+    ],
+    "connections": ["中央楼梯", "货运电梯"],
+    "special_areas": ["天台", "禁闭室"],
+}
+STEP3 = {
+    "rules_title": "夜班护工守则",
+    "rules": [
+        "只有看到绿色灯光时才能进入走廊。",
+        "不要吃任何人给你的食物。",
+        "听到敲门声时不要开门，无论门外的人说什么。",
+        "照镜子不要超过三秒。",
+        "凌晨三点之前必须回到护士站。",
+        "院长办公室的门永远是锁着的，如果它开着，请立即离开。",
+        "不要回应叫你名字的声音。",
+        "病人数量比床位多时，请数一数自己的影子。",
+    ],
+    "win_condition": "在天亮前找到没有名字的病历，并把它交给护士站的值班护士。",
+    "resolve_condition": "在锅炉房烧掉所有值班表，让病院不再在午夜开门。",
+    "hidden_truth": "病院在二十年前的大火中烧毁，值班表是死去的护士长留下的，遵守规则的人会被留下成为新的护工。" * 2,
+    "death_triggers": [
+        "在没有绿色灯光时进入走廊",
+        "吃下别人给的食物",
+        "听到敲门声后开门",
+        "照镜子超过三秒",
+        "凌晨三点后仍不在护士站",
+    ],
+}
+
+# 各阶段：玩家数、每名玩家的行动和推理条数、环境记忆条数
+STAGES = {
+    "early": {"players": 1, "actions": 0, "reasoning": 0, "memory": 0},
+    "mid": {"players": 3, "actions": 10, "reasoning": 4, "memory": 12},
+    "late": {"players": 5, "actions": 40, "reasoning": 15, "memory": 60},
+}
+
+
+def _make_player(index: int, stage: dict) -> dict:
+    return {
+        "name": f"玩家{index}",
+        "reasoning_history": [f"第{i}条推理：绿色灯光可能与值班表上的时间有关，护士长似乎一直在看着我们" for i in range(stage["reasoning"])],
+        "action_history": [f"第{i}次行动：沿着走廊走到护士站，翻看桌上的值班记录" for i in range(stage["actions"])],
+        "is_alive": True,
+        "current_identity": STEP1["player_identity"],
+        "personal_rules": list(STEP3["rules"]),
+        "physical_status": {"health": 80, "injury": "轻伤", "fatigue": "轻微"},
+        "mental_status": {"sanity": 65, "state": "紧张", "emotion": "焦虑"},
+        "psychological_pressure": {"fear_level": 40, "anxiety_level": 35, "stress_level": 30},
+        "inventory": [f"物品{i}" for i in range(min(stage["actions"], 8))],
+        "location": "护士站" if stage["actions"] else "入口",
+    }
+
+
+def make_state(stage_name: str) -> dict:
+    """构建指定阶段的游戏状态"""
+    stage = STAGES[stage_name]
+    memory = stage["memory"]
+    state = {
+        **STEP1,
+        **STEP2,
+        **STEP3,
+        "hints_used": 0,
+        "max_hints": 3,
+        "game_active": True,
+        "max_players": 5 if stage["players"] > 1 else 1,
+        "game_mode": "多人" if stage["players"] > 1 else "单人",
+        "players": {f"u{i}": _make_player(i, stage) for i in range(1, stage["players"] + 1)},
+        "time_system": {"current_time": "深夜", "elapsed_minutes": stage["actions"] * 10, "time_description": "午夜时分，周围一片死寂"},
+        "environment": {"lighting": "昏暗", "temperature": "寒冷", "sounds": ["寂静", "滴水声"], "smells": ["霉味"], "atmosphere": "压抑"},
+        "random_events": [],
+        "available_items": [],
+        "environmental_events": [],
+        "rule_mutations": [{"time": i * 30, "old_rules": STEP3["rules"][:2], "new_rules": ["新的规则"], "reason": "发现了关键物品"} for i in range(memory // 20)],
+        "sanity_break": False,
+        "last_mutation_time": 0,
+        "identity_changes": [],
+        "environment_memory": {
+            "visited_locations": [{"location": f"地点{i}", "first_visit_time": i, "last_visit_time": i, "visit_count": 1} for i in range(memory)],
+            "interacted_objects": [{"object": f"物品{i}", "first_interaction_time": i, "last_interaction_time": i, "interaction_count": 1} for i in range(memory)],
+            "time_based_events": [{"time": i, "time_of_day": "深夜", "time_description": "走廊尽头的灯闪了一下", "location": "走廊", "action": "观察"} for i in range(memory)],
+            "discovered_secrets": [],
+        },
+        "rule_network": {
+            "truth_elements": ["二十年前的大火", "护士长", "值班表"],
+            "rule_truth_mappings": [{"rule": rule, "truth": "与大火有关"} for rule in STEP3["rules"]],
+            "rule_dependencies": [],
+            "discovered_truths": [],
+        },
+        "collaborative_events": [],
+        "action_image_paths": [],
+        "rng_seed": f"seed-{stage_name}",
+        "rng_counter": 0,
+    }
+    return state
+
+
+def set_user(command, user_id: str, user_name: str) -> None:
+    """切换发出命令的玩家"""
+    command.chat_stream = SimpleNamespace(user_info=SimpleNamespace(user_id=user_id, user_name=user_name))
+
+
+def make_command(llm, config: dict, user_id: str = "u1", user_name: str = "玩家1"):
+    """构建不经过 MaiBot 消息管线的命令对象：LLM 调用交给 llm（为 None 时保留真实的请求流程），发送消息和存档均为空操作"""
+    command = plugin.RuleHorrorCommand.__new__(plugin.RuleHorrorCommand)
+    settings = {
+        "llm.api_url": LLM_ARGS[0],
+        "llm.api_key": LLM_ARGS[1],
+        "llm.model_list": LLM_ARGS[2],
+        "llm.current_model_index": LLM_ARGS[3],
+        "llm.temperature": LLM_ARGS[4],
+        **config,
+    }
+    command.get_config = lambda key, default=None: settings.get(key, default)
+    command.update_config = settings.__setitem__
+    if llm is not None:
+        command._call_llm_api = llm
+    set_user(command, user_id, user_name)
+
+    async def send(*args, **kwargs):
+        return True
+
+    command.send_text = send
+    command.send_image = send
+    command._save_game_state = lambda *args, **kwargs: None
+    return command
+
+
+class CannedLLM:
+    """替换 _call_llm_api，按调用点返回固定的合法 JSON，并统计各调用点的调用次数"""
+
+    def __init__(self, world_dead_id: int = 0, world_witness_id: int = 0):
+        self.calls = {}
+        self.judge_count = 0
+        # 权威判定中判定死亡和目击行动的玩家编号，0表示没有
+        self.world_dead_id = world_dead_id
+        self.world_witness_id = world_witness_id
+
+    def judge(self) -> dict:
+        self.judge_count += 1
+        areas = [area for floor in STEP2["floors"] for area in floor["areas"]]
+        return {
+            "is_dead": "否",
+            "scene_description": "走廊尽头的灯闪了一下，值班表上的字迹似乎变了。",
+            "physical_status": {"health": 80, "injury": "轻伤", "fatigue": "轻微"},
+            "mental_status": {"sanity": 70, "state": "紧张", "emotion": "焦虑"},
+            "psychological_pressure": {"fear_level": 30, "anxiety_level": 25, "stress_level": 20},
+            "found_items": [f"线索{self.judge_count % 7}"],
+            "item_details": {},
+            "action_feedback": "心跳加速",
+            "new_location": areas[self.judge_count % len(areas)],
+        }
+
+    def world(self, prompt: str) -> dict:
+        """按权威判定提示词中列出的存活玩家逐个给出结果，每位玩家都带有物品，用于检查物品只归行动玩家"""
+        players = []
+        for index in map(int, re.findall(r"^\[(\d+)\] [^：\n]*：位置 ", prompt, re.M)):
+            outcome = self.judge()
+            outcome.pop("scene_description")
+            outcome.pop("action_feedback")
+            players.append({
+                **outcome,
+                "id": index,
+                "is_dead": "是" if index == self.world_dead_id else "否",
+                "witnessed": "是" if index == self.world_witness_id else "否",
+                "found_items": [f"世界物品{index}"],
+            })
+        return {"summary": "病房的门被推开，走廊里的灯灭了一瞬。", "players": players, "found_items": ["顶层物品"], "item_details": {}}
+
+    def respond(self, call_site: str, prompt: str = ""):
+        if call_site in ("judge_single", "judge_multi", "judge_fast"):
+            return self.judge()
+        if call_site == "judge_world":
+            return self.world(prompt)
+        return {
+            "step1": STEP1,
+            "step2": STEP2,
+            "step3": STEP3,
+            "rule_network": {
+                "truth_elements": [{"id": "truth_1", "description": "护士长死于大火", "source": "值班表"}],
+                "rule_truth_mappings": [{"rule_index": 0, "truth_element_id": "truth_1", "relationship_type": "警告", "explanation": "绿色灯光是护士长的信号"}],
+                "rule_dependencies": [],
+                "inference_chains": [],
+            },
+            "identity": {"identity_changed": "否", "new_identity": "", "reason": "无"},
+            "mutation_eval": {"should_mutate": "否", "reason": "无", "mutation_type": ""},
+            "collab": {"collaborative_rule_triggered": "否"},
+            "clear_check": {"cleared": "否", "reason": "未达成", "condition_met": "否"},
+            "judge_perspective": {"scene_description": "你看见门缝里透出绿色的光。", "action_feedback": "手心出汗"},
+        }.get(call_site, {})
+
+    async def __call__(self, prompt, *args, call_site="", **kwargs):
+        self.calls[call_site] = self.calls.get(call_site, 0) + 1
+        return json.dumps(self.respond(call_site, prompt), ensure_ascii=False)
@@ -0,0 +1,108 @@
+"""长时间运行压测：在多个群组中模拟数千次行动，按结构报告游戏状态相对开局的增长
+
+LLM 调用由 CannedLLM 代替，行动结果长图替换为同一张占位图片，不发送任何网络请求。
+需要在 MaiBot 根目录执行（插件依赖 src.plugin_system）：
+    python plugins/<插件目录>/tests/soak_state_footprint.py --groups 20 --actions 5000 --sample-every 500 --tracemalloc
+"""
+import argparse
+import asyncio
+import contextlib
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.getcwd())
+
+from fixtures import LLM_ARGS, CannedLLM, make_command, make_state, plugin, set_user  # noqa: E402
+
+ACTIONS = [
+    "我沿着中央楼梯走到二楼走廊",
+    "我翻看护士站桌上的值班记录",
+    "我在挂号处的抽屉里找找有没有钥匙",
+    "我站在走廊里数一数自己的影子",
+    "我走进档案室查看没有名字的病历",
+    "我去锅炉房看看里面有什么",
+]
+
+
+def build_groups(count: int) -> list:
+    """创建测试群组：偶数群组为单人模式，奇数群组为三人的多人模式"""
+    group_ids = []
+    for index in range(count):
+        group_id = f"soak_{index}"
+        state = make_state("early" if index % 2 == 0 else "mid")
+        for player in state["players"].values():
+            player["action_history"] = []
+            player["reasoning_history"] = []
+        state["rng_seed"] = f"soak-seed-{index}"
+        plugin.game_states[group_id] = state
+        group_ids.append(group_id)
+    return group_ids
+
+
+def patch_for_soak(command, image_dir: str) -> None:
+    """去掉与状态增长无关的耗时：消息之间的节奏等待和长图渲染"""
+    real_sleep = asyncio.sleep
+
+    async def no_pacing(delay, result=None):
+        return await real_sleep(0, result)
+
+    plugin.asyncio.sleep = no_pacing
+
+    placeholder = os.path.join(image_dir, "placeholder.png")
+    with open(placeholder, "wb") as f:
+        f.write(b"\x89PNG\r\n\x1a\n")
+    command._generate_action_result_image = lambda *args, **kwargs: placeholder
+
+
+async def soak(args) -> None:
+    llm = CannedLLM()
+    command = make_command(llm, {"clear_check.debounce_seconds": 0})
+    image_dir = tempfile.mkdtemp(prefix="rule_horror_soak_")
+    patch_for_soak(command, image_dir)
+    group_ids = build_groups(args.groups)
+    sampler = plugin.StateFootprintSampler()
+    sampler.sample(group_ids, use_tracemalloc=args.tracemalloc)
+
+    started = time.perf_counter()
+    with open(os.devnull, "w", encoding="utf-8") as devnull:
+        for n in range(args.actions):
+            group_id = group_ids[n % len(group_ids)]
+            players = plugin.game_states[group_id]["players"]
+            living = [user_id for user_id, player in players.items() if player["is_alive"]]
+            if not living:
+                continue
+            user_id = living[(n // len(group_ids)) % len(living)]
+            set_user(command, user_id, players[user_id]["name"])
+            with contextlib.redirect_stdout(devnull):
+                await command._record_action(group_id, ACTIONS[n % len(ACTIONS)], *LLM_ARGS)
+
+            sampler.action_count = n + 1
+            if sampler.action_count % args.sample_every == 0:
+                sample = sampler.sample(group_ids, use_tracemalloc=args.tracemalloc)
+                print(plugin.StateFootprintSampler.format_report(sample))
+
+        pending = [entry["task"] for entry in plugin.clear_checks.values() if entry.get("task")]
+        with contextlib.redirect_stdout(devnull):
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    elapsed = time.perf_counter() - started
+    print(f"共 {args.actions} 次行动，{len(group_ids)} 个群组，耗时 {elapsed:.1f} 秒")
+    print("LLM 调用次数：" + "，".join(f"{site}={count}" for site, count in sorted(llm.calls.items())))
+    final = sampler.samples[-1]
+    per_action = {name: growth["bytes"] / max(args.actions, 1) for name, growth in final["growth"].items()}
+    print("每次行动的平均增长（字节）：" + "，".join(f"{name}={size:.0f}" for name, size in per_action.items()))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="规则怪谈插件游戏状态增长压测")
+    parser.add_argument("--groups", type=int, default=20, help="并行游戏的群组数")
+    parser.add_argument("--actions", type=int, default=5000, help="所有群组合计的行动次数")
+    parser.add_argument("--sample-every", type=int, default=500, help="每隔多少次行动采样一次")
+    parser.add_argument("--tracemalloc", action="store_true", help="采样时输出 tracemalloc 增长最多的分配位置")
+    asyncio.run(soak(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
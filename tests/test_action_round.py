@@ -0,0 +1,41 @@
+"""回合模式的回归检查：整回合的权威判定失败时只报告一次，不再逐个行动重新判定"""
+import asyncio
+
+import pytest
+
+pytest.importorskip("src.plugin_system")
+
+from fixtures import LLM_ARGS, make_command, make_state, plugin  # noqa: E402
+
+
+def test_failed_round_is_reported_once(monkeypatch, data_dir):
+    calls = []
+
+    async def failing_llm(prompt, *args, call_site="", **kwargs):
+        calls.append(call_site)
+        return ""
+
+    command = make_command(failing_llm, {"multiplayer.round_mode": True, "clear_check.debounce_seconds": 0})
+    sent = []
+
+    async def send_text(text, *args, **kwargs):
+        sent.append(text)
+        return True
+
+    command.send_text = send_text
+    group_id = "round_group"
+    game_state = make_state("mid")
+    monkeypatch.setitem(plugin.game_states, group_id, game_state)
+    actions = {uid: (player["name"], f"{player['name']}推开201病房的门") for uid, player in game_state["players"].items()}
+    monkeypatch.setitem(plugin.action_rounds, group_id, {"actions": actions, "timer": None})
+
+    async def drive():
+        await command._resolve_action_round(group_id, *LLM_ARGS)
+        command._cancel_background_tasks(group_id)
+
+    asyncio.run(drive())
+
+    assert calls.count("judge_world") == 1
+    assert "judge_multi" not in calls
+    assert len(sent) == 1
+    assert "判定失败" in sent[0]
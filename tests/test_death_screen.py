@@ -0,0 +1,40 @@
+"""死亡条件预筛的回归检查：明显触犯条件的行动必须命中，只是查看背包、前往别处的行动不能因单字动词误命中"""
+import pytest
+
+pytest.importorskip("src.plugin_system")
+
+from fixtures import make_state, plugin  # noqa: E402
+
+INDEX = plugin.DeathTriggerIndex.build(make_state("early"))
+
+
+def matched_texts(action: str, location: str = "护士站") -> set:
+    return {match["text"] for match in plugin.DeathTriggerIndex.match(INDEX, action, location)}
+
+
+@pytest.mark.parametrize("action, location, expected", [
+    ("我吃了一口面包", "护士站", "吃下别人给的食物"),
+    ("我打开门", "201病房", "听到敲门声后开门"),
+    ("我照了一下镜子", "护士站", "照镜子超过三秒"),
+    ("我大声回答那个叫我名字的声音", "护士站", "不要回应叫你名字的声音。"),
+    ("我走进走廊", "大厅", "在没有绿色灯光时进入走廊"),
+])
+def test_violations_are_screened(action, location, expected):
+    assert expected in matched_texts(action, location)
+
+
+@pytest.mark.parametrize("action", [
+    "我看看背包里的钥匙能不能用",
+    "我去挂号处看看",
+    "我环顾四周",
+    "我看着远处",
+])
+def test_single_character_verbs_do_not_match(action):
+    assert matched_texts(action) == set()
+
+
+def test_objects_are_noun_heads():
+    objects = {entry["text"]: entry["objects"] for entry in INDEX["entries"]}
+    assert objects["吃下别人给的食物"] == ["食物"]
+    assert objects["照镜子超过三秒"] == ["镜子"]
+    assert objects["听到敲门声后开门"] == ["敲门声", "门"]
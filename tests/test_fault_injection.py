@@ -0,0 +1,65 @@
+"""服务异常时的回归检查：模型切换、生成进度保留和行动流程在异常响应下不中断"""
+import asyncio
+import json
+
+import pytest
+
+pytest.importorskip("src.plugin_system")
+
+from fault_injection import FAILOVER_LLM_ARGS, FaultInjector, make_faulty_command  # noqa: E402
+from fixtures import STEP1, make_state, plugin  # noqa: E402
+
+
+@pytest.fixture
+def faulty(monkeypatch, data_dir):
+    """返回按给定故障构建命令对象的函数，aiohttp 会话替换为注入故障的假会话"""
+
+    def build(faults: dict):
+        injector = FaultInjector(faults)
+        monkeypatch.setattr(plugin.aiohttp, "ClientSession", injector.session)
+        return injector, make_faulty_command(injector)
+
+    return build
+
+
+def test_failover_skips_timed_out_model(faulty):
+    injector, command = faulty({"failing_models": ["model-a"]})
+    content = asyncio.run(command._call_llm_api("prompt", *FAILOVER_LLM_ARGS, call_site="step1"))
+
+    assert json.loads(content)["scene"] == STEP1["scene"]
+    assert injector.llm_results == {"calls": 1, "failed": 0, "failovers": 1}
+    assert command.get_config("llm.current_model_index") == 1
+
+
+def test_truncated_generation_keeps_checkpoint(faulty, monkeypatch):
+    injector, command = faulty({"llm_truncate_rate": 1.0})
+    group_id = "fault_truncate"
+    monkeypatch.setitem(plugin.game_states, group_id, {})
+    success, reason, _ = asyncio.run(command._run_generation(group_id, *FAILOVER_LLM_ARGS, "单人"))
+
+    assert not success
+    assert reason == "JSON解析失败"
+    checkpoint = plugin.game_states[group_id]["generation"]
+    assert "step1" not in checkpoint
+    assert checkpoint["attempts"]["step1"] == injector.injected["llm_truncate"]
+
+
+def test_action_pipeline_survives_bad_responses(faulty, monkeypatch):
+    injector, command = faulty({"llm_non_dict_rate": 1.0, "image_send_fail_rate": 1.0})
+    group_id = "fault_action"
+    game_state = make_state("early")
+    monkeypatch.setitem(plugin.game_states, group_id, game_state)
+
+    async def drive():
+        result = await command._record_action(group_id, "我翻看护士站桌上的值班记录", *FAILOVER_LLM_ARGS)
+        command._cancel_background_tasks(group_id)
+        return result
+
+    success, _, _ = asyncio.run(drive())
+
+    player = game_state["players"]["u1"]
+    assert success
+    assert player["is_alive"]
+    assert player["action_history"][-1] == "我翻看护士站桌上的值班记录"
+    assert injector.llm_results["failed"] >= 1
+    assert injector.injected["llm_non_dict"] == injector.llm_results["failed"] * len(FAILOVER_LLM_ARGS[2])
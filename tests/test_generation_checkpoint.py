@@ -0,0 +1,29 @@
+"""生成进度恢复的回归检查"""
+import asyncio
+
+import pytest
+
+pytest.importorskip("src.plugin_system")
+
+from fixtures import LLM_ARGS, STEP1, STEP2, STEP3, CannedLLM, make_command, plugin  # noqa: E402
+
+
+def test_complete_checkpoint_launches_without_llm_calls(monkeypatch, data_dir):
+    llm = CannedLLM()
+    command = make_command(llm, {})
+    group_id = "resume_group"
+    monkeypatch.setitem(plugin.game_states, group_id, {})
+    checkpoint = {"game_mode": "单人", "timings": {}, "attempts": {}, "step1": STEP1, "step2": STEP2, "step3": STEP3}
+
+    async def drive():
+        result = await command._run_generation(group_id, *LLM_ARGS, "单人", checkpoint)
+        command._cancel_background_tasks(group_id)
+        return result
+
+    success, _, _ = asyncio.run(drive())
+
+    game_state = plugin.game_states[group_id]
+    assert success
+    assert game_state["game_active"]
+    assert game_state["rules"] == STEP3["rules"]
+    assert not {"step1", "step2", "step3"} & set(llm.calls)
@@ -0,0 +1,60 @@
+"""行动意图识别的回归检查：只在本地回答关于玩家自己的查询，真正的行动和涉及场景条件、物品、地点的查询交给裁判"""
+import asyncio
+
+import pytest
+
+pytest.importorskip("src.plugin_system")
+
+from fixtures import LLM_ARGS, CannedLLM, make_command, make_state, plugin  # noqa: E402
+
+CLASSIFIER = plugin.ActionIntentClassifier()
+
+
+@pytest.mark.parametrize("action, expected", [
+    ("检查背包", "inventory"),
+    ("打开背包", "inventory"),
+    ("我身上有什么", "inventory"),
+    ("查看我的状态", "status"),
+    ("看看自己的伤势", "status"),
+    ("看看四周", "map"),
+    ("我现在在哪", "map"),
+])
+def test_own_queries_are_answered_locally(action, expected):
+    assert CLASSIFIER.classify(action, 2.5) == expected
+
+
+@pytest.mark.parametrize("action", [
+    "我检查一下门口的状态",
+    "我看看背包里的钥匙能不能用",
+    "我环顾四周，寻找出口",
+    "我推开门走进走廊",
+    "我拿起地上的钥匙",
+    "看看四周有没有人",
+])
+def test_actions_go_to_adjudication(action):
+    assert CLASSIFIER.classify(action, 2.5) == "action"
+
+
+@pytest.mark.parametrize("action, judged", [
+    ("看看镜子里我的状态", True),
+    ("看看四周有没有人", True),
+    ("看看二楼走廊的地图", True),
+    ("查看我的状态", False),
+    ("检查背包", False),
+])
+def test_scene_related_queries_are_judged(monkeypatch, data_dir, action, judged):
+    llm = CannedLLM()
+    command = make_command(llm, {"intent.enabled": True})
+    group_id = "intent_group"
+    game_state = make_state("early")
+    monkeypatch.setitem(plugin.game_states, group_id, game_state)
+
+    async def drive():
+        result = await command._record_action(group_id, action, *LLM_ARGS)
+        command._cancel_background_tasks(group_id)
+        return result
+
+    _, reason, _ = asyncio.run(drive())
+
+    assert ("judge_single" in llm.calls) == judged
+    assert (reason == "已回答查询") != judged
@@ -0,0 +1,60 @@
+"""地点图的回归检查：不同楼层的同名区域是不同的地点，新位置只对应到场景结构中的地点，存档不保存最短路径表"""
+import json
+
+import pytest
+
+pytest.importorskip("src.plugin_system")
+
+from fixtures import make_command, make_state, plugin  # noqa: E402
+
+LocationGraph = plugin.LocationGraph
+
+
+@pytest.fixture
+def state():
+    state = make_state("early")
+    state["location_graph"] = LocationGraph.build(state)
+    return state
+
+
+def test_same_named_areas_on_different_floors_are_separate(state):
+    graph = state["location_graph"]
+    assert {"二楼走廊", "三楼走廊"} <= set(graph["nodes"])
+    assert "走廊" not in graph["nodes"]
+    assert LocationGraph.path(graph, "二楼走廊", "三楼走廊") == ["二楼走廊", "二楼", "中央楼梯", "三楼", "三楼走廊"]
+
+
+@pytest.mark.parametrize("action, current, expected", [
+    ("我去二楼走廊", "一楼大厅", "二楼走廊"),
+    ("我去三楼的走廊", "一楼大厅", "三楼走廊"),
+    ("我去走廊看看", "二楼护士站", "二楼走廊"),
+    ("我从二楼走廊去档案室", "二楼走廊", "三楼档案室"),
+])
+def test_find_destination(state, action, current, expected):
+    assert LocationGraph.find_destination(state["location_graph"], action, current) == expected
+
+
+@pytest.mark.parametrize("name, near, expected", [
+    ("二楼走廊尽头", "", "二楼走廊"),
+    ("走廊", "三楼档案室", "三楼走廊"),
+    ("走廊", "", None),
+    ("大厅", "", "一楼大厅"),
+])
+def test_normalize(state, name, near, expected):
+    assert LocationGraph.normalize(state["location_graph"], name, near) == expected
+
+
+def test_unknown_location_keeps_previous(state):
+    command = make_command(None, {})
+    player = state["players"]["u1"]
+    player["location"] = "二楼护士站"
+    assert command._resolve_new_location(state, player, "地下密室") == "二楼护士站"
+    assert "地下密室" not in state["location_graph"]["nodes"]
+    assert command._resolve_new_location(state, player, "走廊") == "二楼走廊"
+
+
+def test_saved_graph_has_no_route_tables(state):
+    saved = json.loads(json.dumps(state["location_graph"], ensure_ascii=False))
+    assert set(saved) == {"signature", "nodes", "edges"}
+    plugin.location_routes.clear()
+    assert LocationGraph.path(saved, "入口", "天台") == ["入口", "一楼", "中央楼梯", "天台"]
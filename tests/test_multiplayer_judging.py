@@ -0,0 +1,59 @@
+"""多人模式两级判定的回归检查：一次权威判定决定所有玩家的结果，只为行动、目击和死亡的玩家生成视角描述，物品只归行动玩家"""
+import asyncio
+
+import pytest
+
+pytest.importorskip("src.plugin_system")
+
+from fixtures import LLM_ARGS, CannedLLM, make_command, make_state, plugin  # noqa: E402
+
+
+def test_world_result_judges_once_and_describes_only_involved_players():
+    llm = CannedLLM(world_dead_id=5, world_witness_id=2)
+    command = make_command(llm, {})
+    game_state = make_state("late")
+    inventories = {pid: list(player["inventory"]) for pid, player in game_state["players"].items()}
+
+    results = asyncio.run(command._judge_world_result(game_state, [("u1", "玩家1", "推开201病房的门")], None, "", *LLM_ARGS))
+    results = dict(results)
+
+    assert llm.calls.get("judge_world") == 1
+    assert llm.calls.get("judge_perspective") == 3
+    assert "judge_multi" not in llm.calls
+    assert list(results) == ["u1", "u2", "u3", "u4", "u5"]
+    for pid in ("u1", "u2", "u5"):
+        assert results[pid]["scene_description"] == "你看见门缝里透出绿色的光。"
+        assert results[pid]["action_feedback"] == "手心出汗"
+    for pid in ("u3", "u4"):
+        assert results[pid]["scene_description"] != "你看见门缝里透出绿色的光。"
+        assert "玩家1" in results[pid]["scene_description"]
+        assert results[pid]["action_feedback"] == ""
+    assert results["u1"]["found_items"] == ["世界物品1"]
+    assert all(results[pid]["found_items"] == [] for pid in ("u2", "u3", "u4", "u5"))
+    assert results["u5"]["is_dead"] == "是"
+    assert all(results[pid]["is_dead"] == "否" for pid in ("u1", "u2", "u3", "u4"))
+    assert {pid: player["inventory"] for pid, player in game_state["players"].items()} == inventories
+
+
+def test_world_items_are_applied_only_to_the_actor(monkeypatch, data_dir):
+    llm = CannedLLM(world_dead_id=5, world_witness_id=2)
+    command = make_command(llm, {})
+    group_id = "two_tier_group"
+    game_state = make_state("late")
+    inventories = {pid: list(player["inventory"]) for pid, player in game_state["players"].items()}
+    monkeypatch.setitem(plugin.game_states, group_id, game_state)
+
+    async def drive():
+        await command._process_multiplayer_action(group_id, "u1", "玩家1", "推开201病房的门", *LLM_ARGS, False, None)
+        command._cancel_background_tasks(group_id)
+
+    asyncio.run(drive())
+
+    players = game_state["players"]
+    assert llm.calls.get("judge_world") == 1
+    assert llm.calls.get("judge_perspective") == 3
+    assert "judge_multi" not in llm.calls
+    assert "世界物品1" in players["u1"]["inventory"]
+    assert all(players[pid]["inventory"] == inventories[pid] for pid in ("u2", "u3", "u4", "u5"))
+    assert players["u5"]["is_alive"] is False
+    assert all(players[pid]["is_alive"] for pid in ("u1", "u2", "u3", "u4"))
@@ -0,0 +1,92 @@
+"""提示词长度回归检查：用前期、中期、后期的游戏状态构建各调用点的提示词，超出 PROMPT_BUDGETS 时失败
+
+需要在 MaiBot 环境中运行（插件依赖 src.plugin_system），在 MaiBot 根目录执行：
+    python -m pytest plugins/<插件目录>/tests -q
+"""
+import asyncio
+import json
+
+import pytest
+
+pytest.importorskip("src.plugin_system")
+
+from fixtures import LLM_ARGS, STAGES, STEP1, STEP2, make_command, make_state, plugin  # noqa: E402
+
+GROUP_ID = "budget_group"
+
+
+class PromptRecorder:
+    """替换 _call_llm_api，记录每个调用点的提示词并返回空内容，使调用方在构建提示词后直接结束"""
+
+    def __init__(self):
+        self.prompts = []
+
+    async def __call__(self, prompt, *args, call_site="", **kwargs):
+        self.prompts.append((call_site, prompt))
+        return ""
+
+
+def collect_prompts(stage_name: str, monkeypatch) -> list:
+    """在指定阶段的状态上构建各调用点的提示词"""
+    recorder = PromptRecorder()
+    command = make_command(recorder, {"death_screen.enabled": True, "multiplayer.adjudication": "per_player"})
+    game_state = make_state(stage_name)
+    monkeypatch.setitem(plugin.game_states, GROUP_ID, game_state)
+    players = game_state["players"]
+    user_id = next(iter(players))
+    player_data = players[user_id]
+    action = "我沿着中央楼梯走到二楼走廊，推开201病房的门"
+
+    prompts = [
+        ("step1", command._build_step1_prompt()),
+        ("step2", command._build_step2_prompt(STEP1)),
+        ("step3", command._build_step3_prompt(STEP1, STEP2, game_state["game_mode"])),
+        ("combined", command._build_combined_prompt(game_state["game_mode"])),
+        ("judge_fast", command._build_fast_judge_prompt(game_state, player_data, action)),
+    ]
+    actions = [(pid, data["name"], action) for pid, data in players.items()]
+    world_prompt = command._build_world_result_prompt(game_state, list(players), actions, "走廊的灯全部熄灭", "")
+    prompts.append(("judge_world", world_prompt))
+    world_result = {
+        "is_dead": "否",
+        "physical_status": player_data["physical_status"],
+        "mental_status": player_data["mental_status"],
+        "psychological_pressure": player_data["psychological_pressure"],
+        "new_location": "二楼走廊",
+        "found_items": ["泛黄的病历单"],
+        "item_details": {},
+    }
+    prompts.append(("judge_perspective", command._build_perspective_prompt(game_state, player_data, world_result, command._format_round_actions(actions, user_id), "走廊尽头的门被推开了", None)))
+
+    async def drive():
+        if game_state["game_mode"] == "单人":
+            await command._process_single_player_action(GROUP_ID, user_id, player_data["name"], action, *LLM_ARGS, False, None)
+        else:
+            await command._process_multiplayer_action(GROUP_ID, user_id, player_data["name"], action, *LLM_ARGS, False, None)
+            await command._check_collaborative_rules(GROUP_ID, *LLM_ARGS, game_state["time_system"]["elapsed_minutes"])
+        await command._check_clear_condition(GROUP_ID, *LLM_ARGS)
+        await command._trigger_rule_mutation(GROUP_ID, *LLM_ARGS, game_state["time_system"]["elapsed_minutes"])
+        await command._detect_identity_change(GROUP_ID, user_id, action, "走廊里有人叫你的名字。", *LLM_ARGS)
+        await command._generate_identity_specific_rules(GROUP_ID, "值班护士长", *LLM_ARGS)
+
+    asyncio.run(drive())
+    return prompts + recorder.prompts
+
+
+@pytest.mark.parametrize("stage_name", list(STAGES))
+def test_prompts_stay_within_budget(stage_name, monkeypatch, data_dir):
+    prompts = collect_prompts(stage_name, monkeypatch)
+    sites = {site for site, _ in prompts}
+    assert {"judge_fast", "judge_world", "judge_perspective", "mutation_eval", "identity", "identity_rules"} <= sites
+    if stage_name == "early":
+        assert "judge_single" in sites
+    else:
+        assert {"judge_multi", "clear_check"} <= sites
+
+    over_budget = []
+    for site, prompt in prompts:
+        budget = plugin.PROMPT_BUDGETS.get(site)
+        assert budget is not None, f"调用点 {site} 没有提示词预算"
+        if len(prompt) > budget:
+            over_budget.append(f"{site}: {len(prompt)} > {budget}")
+    assert not over_budget, json.dumps(over_budget, ensure_ascii=False)
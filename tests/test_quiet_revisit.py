@@ -0,0 +1,61 @@
+"""单纯重返已描述过的地点时的回归检查：直接使用缓存描述，不构建判定提示词、不调用LLM，也不把缓存描述写回变化记录；
+行动中还有其他内容或可能触犯规则时必须交给裁判"""
+import asyncio
+
+import pytest
+
+pytest.importorskip("src.plugin_system")
+
+from fixtures import LLM_ARGS, CannedLLM, make_command, make_state, plugin  # noqa: E402
+
+CACHE = {
+    "一楼挂号处": {"description": "挂号窗口的玻璃上积满灰尘。", "time": 0, "changes": [{"time": 10, "change": "窗口后的椅子转了过来。"}]},
+    "二楼走廊": {"description": "走廊两侧的病房门都关着。", "time": 0, "changes": []},
+}
+
+
+def make_revisit_state() -> dict:
+    game_state = make_state("early")
+    game_state["players"]["u1"]["location"] = "一楼大厅"
+    game_state["location_cache"] = {name: dict(entry, changes=list(entry["changes"])) for name, entry in CACHE.items()}
+    return game_state
+
+
+def test_quiet_revisit_uses_cache_only(monkeypatch, data_dir):
+    llm = CannedLLM()
+    command = make_command(llm, {"location.skip_quiet_revisits": True})
+
+    def no_prompt(*args, **kwargs):
+        raise AssertionError("重返地点时不应构建判定提示词")
+
+    command._build_single_judge_prompt = no_prompt
+    group_id = "quiet_revisit"
+    game_state = make_revisit_state()
+    monkeypatch.setitem(plugin.game_states, group_id, game_state)
+
+    async def drive():
+        await command._process_single_player_action(group_id, "u1", "玩家1", "我回到一楼挂号处", *LLM_ARGS, False, None)
+        command._cancel_background_tasks(group_id)
+
+    asyncio.run(drive())
+
+    assert game_state["players"]["u1"]["location"] == "一楼挂号处"
+    assert llm.calls == {}
+    assert game_state["location_cache"]["一楼挂号处"]["changes"] == CACHE["一楼挂号处"]["changes"]
+
+
+@pytest.mark.parametrize("action", [
+    "回到二楼走廊吃药",
+    "回到二楼走廊，跳楼",
+    "回到一楼挂号处吃药",
+    "回到一楼挂号处，跳楼",
+    "我回到二楼走廊",
+])
+def test_actions_beyond_returning_are_judged(action):
+    command = make_command(None, {"location.skip_quiet_revisits": True})
+    game_state = make_revisit_state()
+    player = game_state["players"]["u1"]
+    target = command._get_revisit_target(game_state, player, action)
+
+    assert target in CACHE
+    assert command._quiet_revisit_result(game_state, player, action, target) is None
@@ -0,0 +1,35 @@
+"""状态规范化的回归检查：裁判返回的字段缺失、为空或无法识别时沿用玩家之前的值"""
+import pytest
+
+pytest.importorskip("src.plugin_system")
+
+from fixtures import plugin  # noqa: E402
+
+Dynamics = plugin.StatusDynamics
+PREVIOUS_PHYSICAL = {"health": 42, "injury": "重伤", "fatigue": "严重"}
+PREVIOUS_MENTAL = {"sanity": 35, "state": "恐惧", "emotion": "绝望"}
+PREVIOUS_PRESSURE = {"fear_level": 70, "anxiety_level": 60, "stress_level": 50}
+
+
+@pytest.mark.parametrize("bad", [None, "", "未知", True])
+def test_bad_values_keep_previous(bad):
+    physical = Dynamics.normalize_physical({"health": bad, "injury": bad, "fatigue": bad}, PREVIOUS_PHYSICAL)
+    mental = Dynamics.normalize_mental({"sanity": bad, "state": bad, "emotion": bad}, PREVIOUS_MENTAL)
+    pressure = Dynamics.normalize_pressure({"fear_level": bad, "anxiety_level": bad, "stress_level": bad}, PREVIOUS_PRESSURE)
+
+    assert physical == PREVIOUS_PHYSICAL
+    assert mental["sanity"] == 35
+    assert pressure == PREVIOUS_PRESSURE
+
+
+def test_valid_values_are_clamped_integers():
+    physical = Dynamics.normalize_physical({"health": "80/100", "injury": "轻伤", "fatigue": "轻微"}, PREVIOUS_PHYSICAL)
+    mental = Dynamics.normalize_mental({"sanity": 130}, PREVIOUS_MENTAL)
+
+    assert physical == {"health": 80, "injury": "轻伤", "fatigue": "轻微"}
+    assert mental["sanity"] == 100
+
+
+def test_missing_previous_uses_defaults():
+    assert Dynamics.normalize_physical({}, {}) == {"health": 100, "injury": "无", "fatigue": "无"}
+    assert Dynamics.normalize_pressure(None, {}) == {"fear_level": 0, "anxiety_level": 0, "stress_level": 0}